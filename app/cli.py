@@ -0,0 +1,144 @@
+"""
+This module contains the management commands of the application.
+
+Schema changes, the initial data and maintenance jobs run as explicit
+commands, so that workers only connect to the database when they start.
+Run them from the project root, e.g.:
+
+    python -m app.cli migrate
+    python -m app.cli seed
+    python -m app.cli generate --users 100000 --tweets 1000000
+    python -m app.cli gc-media --dry-run
+"""
+
+import asyncio
+from dataclasses import asdict
+from functools import wraps
+from typing import Any, Awaitable, Callable
+
+import click
+
+from app.db.counters import repair_counters
+from app.db.db_settings import db_session
+from app.db.migrations import run_migrations
+from app.routes.crud.generate_data import GenerationParams, generate_data
+from app.routes.crud.insert_data import create_tables, insert_data
+from app.services.media.gc import media_sweeper
+
+
+def run_async(command: Callable[..., Awaitable[Any]]) -> Callable[..., Any]:
+    """
+    Run a coroutine function as a command and close the connections after it.
+
+    :param command: The coroutine function of the command
+    :return: A function running it in a new event loop
+    """
+
+    @wraps(command)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        async def main():
+            try:
+                return await command(*args, **kwargs)
+            finally:
+                await db_session.dispose()
+
+        return asyncio.run(main())
+
+    return wrapper
+
+
+@click.group()
+def cli() -> None:
+    """Manage the database and the media of the application."""
+
+
+@cli.command()
+@run_async
+async def migrate() -> None:
+    """Create missing tables and apply pending migrations."""
+    await create_tables()
+    versions = await run_migrations(db_session.engine)
+    click.echo(f"Applied migrations: {', '.join(map(str, versions)) or 'none'}")
+
+
+@cli.command()
+@run_async
+async def seed() -> None:
+    """Insert the initial data into an empty database."""
+    async with db_session.async_session() as session:
+        await insert_data(session)
+    click.echo("Database seeded")
+
+
+@cli.command()
+@click.option("--users", default=1000, show_default=True, help="Number of users.")
+@click.option("--tweets", default=10000, show_default=True, help="Number of tweets.")
+@click.option(
+    "--follows-per-user",
+    default=20.0,
+    show_default=True,
+    help="Mean number of follows.",
+)
+@click.option(
+    "--likes-per-tweet", default=5.0, show_default=True, help="Mean number of likes."
+)
+@click.option(
+    "--image-share",
+    default=0.2,
+    show_default=True,
+    help="Share of tweets with an image.",
+)
+@click.option("--seed", "seed_value", default=0, show_default=True, help="Random seed.")
+@click.option("--batch-size", default=5000, show_default=True, help="Rows per insert.")
+@run_async
+async def generate(
+    users: int,
+    tweets: int,
+    follows_per_user: float,
+    likes_per_tweet: float,
+    image_share: float,
+    seed_value: int,
+    batch_size: int,
+) -> None:
+    """Generate synthetic users, follows, tweets, likes and images."""
+    params = GenerationParams(
+        users=users,
+        tweets=tweets,
+        follows_per_user=follows_per_user,
+        likes_per_tweet=likes_per_tweet,
+        image_share=image_share,
+        seed=seed_value,
+        batch_size=batch_size,
+    )
+    async with db_session.async_session() as session:
+        inserted = await generate_data(session, params)
+    for table_name, count in inserted.items():
+        click.echo(f"{table_name}: {count}")
+
+
+@cli.command("repair-counters")
+@run_async
+async def repair_counters_command() -> None:
+    """Recompute the like and follow counters."""
+    async with db_session.async_session() as session:
+        fixed = await repair_counters(session)
+    click.echo(f"Fixed rows: {fixed}")
+
+
+@cli.command("gc-media")
+@click.option(
+    "--dry-run", is_flag=True, help="Count the files instead of deleting them."
+)
+@run_async
+async def gc_media(dry_run: bool) -> None:
+    """Delete orphaned images and unreferenced media files."""
+    result = await media_sweeper.sweep(dry_run=dry_run)
+    if not result.runs:
+        click.echo("Another process is sweeping, try again later.")
+        return
+    for name, value in asdict(result).items():
+        click.echo(f"{name}: {value}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,8 +1,20 @@
 """This module contains the Base model for all tables in the database."""
 
+from datetime import datetime, timezone
+
 from sqlalchemy import Column, DateTime, Integer
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy.sql import func
+
+
+def utc_now() -> datetime:
+    """
+    Return the current UTC time as a naive datetime.
+
+    Timestamps are generated on the application side so that they keep
+    microsecond precision on every backend and round-trip unchanged
+    through pagination cursors.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
 class Base(DeclarativeBase):
@@ -15,5 +27,5 @@ class BaseModel(Base):
     __abstract__ = True
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    created_at = Column(DateTime, default=func.now())
-    update_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    created_at = Column(DateTime, default=utc_now)
+    update_at = Column(DateTime, default=utc_now, onupdate=utc_now)
@@ -0,0 +1,146 @@
+"""
+This module contains the denormalized counters.
+
+'Tweet.like_count', 'User.followers_count' and 'User.following_count'
+are shifted in the transactions of the like and follow operations.
+The repair job recomputes them from the likes and follows tables,
+e.g. after a bulk import.
+"""
+
+from typing import Optional
+
+from sqlalchemy import Update, case, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import Follow, Like, Tweet, User
+
+REPAIR_BATCH_SIZE = 10000
+
+
+def shift_like_count(tweet_id: int, delta: int) -> Update:
+    """
+    Build a statement changing the number of likes of a tweet.
+
+    :param tweet_id: The ID of the tweet
+    :param delta: 1 for a new like, -1 for a removed one
+    :return: An 'Update' statement
+    """
+    return (
+        update(Tweet)
+        .where(Tweet.id == tweet_id)
+        .values(like_count=Tweet.like_count + delta)
+    )
+
+
+def shift_follow_counts(follower_id: int, followed_id: int, delta: int) -> Update:
+    """
+    Build a single statement changing the follow counters of both users.
+
+    :param follower_id: The ID of the follower
+    :param followed_id: The ID of the followed user
+    :param delta: 1 for a new follow, -1 for a removed one
+    :return: An 'Update' statement
+    """
+    following_delta = case((User.id == follower_id, delta), else_=0)
+    followers_delta = case((User.id == followed_id, delta), else_=0)
+    return (
+        update(User)
+        .where(User.id.in_((follower_id, followed_id)))
+        .values(
+            following_count=User.following_count + following_delta,
+            followers_count=User.followers_count + followers_delta,
+        )
+        .execution_options(synchronize_session="fetch")
+    )
+
+
+def tweet_counters_repair(
+    first_id: Optional[int] = None, last_id: Optional[int] = None
+) -> Update:
+    """
+    Build a statement fixing 'like_count' of the tweets in the ID range.
+
+    Only rows with a wrong value are updated.
+
+    :param first_id: First ID of the range (optional)
+    :param last_id: Last ID of the range (optional)
+    :return: An 'Update' statement
+    """
+    like_count = (
+        select(func.count(Like.id))
+        .where(Like.tweet_id == Tweet.id)
+        .correlate(Tweet)
+        .scalar_subquery()
+    )
+    query = update(Tweet).where(Tweet.like_count != like_count)
+    if first_id is not None and last_id is not None:
+        query = query.where(Tweet.id.between(first_id, last_id))
+    return query.values(like_count=like_count).execution_options(
+        synchronize_session=False
+    )
+
+
+def user_counters_repair(
+    first_id: Optional[int] = None, last_id: Optional[int] = None
+) -> Update:
+    """
+    Build a statement fixing the follow counters of the users in the ID range.
+
+    Only rows with a wrong value are updated.
+
+    :param first_id: First ID of the range (optional)
+    :param last_id: Last ID of the range (optional)
+    :return: An 'Update' statement
+    """
+    followers_count = (
+        select(func.count(Follow.id))
+        .where(Follow.followed_id == User.id)
+        .correlate(User)
+        .scalar_subquery()
+    )
+    following_count = (
+        select(func.count(Follow.id))
+        .where(Follow.follower_id == User.id)
+        .correlate(User)
+        .scalar_subquery()
+    )
+    query = update(User).where(
+        or_(
+            User.followers_count != followers_count,
+            User.following_count != following_count,
+        ),
+    )
+    if first_id is not None and last_id is not None:
+        query = query.where(User.id.between(first_id, last_id))
+    return query.values(
+        followers_count=followers_count,
+        following_count=following_count,
+    ).execution_options(synchronize_session=False)
+
+
+async def repair_counters(
+    session: AsyncSession, batch_size: int = REPAIR_BATCH_SIZE
+) -> int:
+    """
+    Recompute the counters of all tweets and users.
+
+    Rows are processed in ID ranges, every range is committed separately
+    to keep transactions short on large tables.
+
+    :param session: The database session used for the query
+    :param batch_size: Number of IDs in one range
+    :return: Number of fixed rows
+    """
+    fixed = 0
+    for model, build_repair in (
+        (Tweet, tweet_counters_repair),
+        (User, user_counters_repair),
+    ):
+        max_id = (await session.execute(select(func.max(model.id)))).scalar() or 0
+        for first_id in range(1, max_id + 1, batch_size):
+            res = await session.execute(
+                build_repair(first_id, first_id + batch_size - 1)
+            )
+            await session.commit()
+            fixed += res.rowcount
+    return fixed
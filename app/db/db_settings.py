@@ -1,11 +1,98 @@
 """This module contains database settings."""
 
-import os
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Union
 
-from dotenv import load_dotenv
+from fastapi import Request
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from sqlalchemy import URL, make_url, text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
+from app.db.pool import InstrumentedPool
+from app.db.query_stats import instrument_engine
+from app.db.routing import Replica, ReplicaRouter
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+
+
+class DatabaseConfig(BaseSettings):
+    """
+    Database connection and pool configuration.
+
+    Values are read from 'DB_' prefixed environment variables or the .env file.
+    With several uvicorn workers, every worker opens up to
+    'pool_size' + 'max_overflow' connections.
+    """
+
+    model_config = SettingsConfigDict(env_prefix="DB_", env_file=".env", extra="ignore")
+
+    user: str = "postgres"
+    password: str = ""
+    name: str = "postgres"
+    host: str = "localhost"
+    port: int = 5432
+
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30.0
+    pool_recycle: int = 1800
+    pool_pre_ping: bool = True
+    # Compiled SQL statements cached by SQLAlchemy per engine.
+    query_cache_size: int = 500
+    # Prepared statements cached by asyncpg per connection, 0 for PgBouncer.
+    statement_cache_size: int = 100
+    echo: bool = False
+
+    # Streaming replicas, e.g. DB_REPLICA_URLS='["postgresql+asyncpg://..."]'
+    replica_urls: List[str] = []
+    # Seconds a replica which failed to connect is skipped.
+    replica_cooldown: float = 30.0
+    # Seconds the reads of a user go to the primary after the user's write.
+    read_your_writes_window: float = 5.0
+
+    @property
+    def url(self) -> URL:
+        """Return the URL of the Postgres database."""
+        return URL.create(
+            drivername="postgresql+asyncpg",
+            username=self.user,
+            password=self.password,
+            host=self.host,
+            port=self.port,
+            database=self.name,
+            query={"prepared_statement_cache_size": str(self.statement_cache_size)},
+        )
+
+    def engine_options(self, url: URL) -> Dict[str, Any]:
+        """
+        Return keyword arguments of 'create_async_engine' for the URL.
+
+        SQLite uses its own pools, so the pool settings are left out.
+
+        :param url: URL of the database
+        :return: A dictionary of engine options
+        """
+        options: Dict[str, Any] = {
+            "echo": self.echo,
+            "query_cache_size": self.query_cache_size,
+        }
+        if url.get_backend_name() == "sqlite":
+            return options
+        return {
+            **options,
+            "poolclass": InstrumentedPool,
+            "pool_size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "pool_timeout": self.pool_timeout,
+            "pool_recycle": self.pool_recycle,
+            "pool_pre_ping": self.pool_pre_ping,
+        }
+
 
 class DBSettings:
     """
@@ -15,32 +102,106 @@ class DBSettings:
     and session management for asynchronous interactions with the database.
     """
 
-    def __init__(self, url):
-        self.engine = create_async_engine(url=url, echo=True)
-        self.async_session = sessionmaker(
-            bind=self.engine,
-            class_=AsyncSession,
-            expire_on_commit=False,
+    def __init__(
+        self,
+        config: Optional[DatabaseConfig] = None,
+        url: Optional[Union[str, URL]] = None,
+    ):
+        self.config = config or DatabaseConfig()
+        engine_url = make_url(url) if url is not None else self.config.url
+        self.engine = self._create_engine(engine_url)
+        self.async_session = self._create_session_factory(self.engine)
+
+        replicas = []
+        for replica_url in self.config.replica_urls:
+            replica_engine = self._create_engine(make_url(replica_url))
+            replicas.append(
+                Replica(replica_engine, self._create_session_factory(replica_engine))
+            )
+        self.router = ReplicaRouter(
+            replicas=replicas,
+            cooldown=self.config.replica_cooldown,
+            read_your_writes_window=self.config.read_your_writes_window,
         )
 
-    async def get_session(self):
-        """Yield a new asynchronous session."""
+    def _create_engine(self, url: URL):
+        """Create an engine of the URL with the configured options."""
+        engine = create_async_engine(url, **self.config.engine_options(url))
+        instrument_engine(engine)
+        return engine
+
+    @staticmethod
+    def _create_session_factory(engine):
+        """Create a factory of sessions bound to the engine."""
+        return sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def get_session(self, request: Request):
+        """
+        Yield a new asynchronous session of the primary database.
+
+        Requests which may write send the user's reads to the primary
+        for the read-your-writes window.
+        """
+        api_key = request.headers.get("api-key")
+        if api_key and request.method not in SAFE_METHODS:
+            self.router.record_write(api_key)
         async with self.async_session() as session:
             yield session
 
+    async def get_read_session(self, request: Request):
+        """
+        Yield a new asynchronous session for read-only queries.
+
+        The session is bound to a healthy replica, or to the primary when
+        there are no replicas, all of them are down, or the user has just
+        written.
+        """
+        for replica in self.router.candidates(request.headers.get("api-key")):
+            async with replica.session_factory() as session:
+                try:
+                    await session.connection()
+                except (DBAPIError, OSError):
+                    logger.warning(
+                        "Replica %s is unavailable", replica.engine.url, exc_info=True
+                    )
+                    self.router.mark_unhealthy(replica)
+                    continue
+                yield session
+                return
+
+        async with self.async_session() as session:
+            yield session
+
+    async def warm_up(self) -> None:
+        """
+        Open the connections of the pool before the first request.
+
+        SQLite databases are only checked with a single connection.
+        """
+        count = 1 if self.engine.dialect.name == "sqlite" else self.config.pool_size
+
+        async def ping():
+            async with self.engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
 
-load_dotenv()
+        await asyncio.gather(*(ping() for _ in range(count)))
 
+    async def dispose(self) -> None:
+        """Close the connections of the primary and the replicas."""
+        await self.engine.dispose()
+        for replica in self.router.replicas:
+            await replica.engine.dispose()
 
-db_user = os.getenv("DB_USER")
-db_password = os.getenv("DB_PASSWORD")
-db_name = os.getenv("DB_NAME")
-db_host = os.getenv("DB_HOST")
-db_port = os.getenv("DB_PORT")
+    def pool_stats(self) -> Dict[str, Union[int, float]]:
+        """
+        Return checkout and wait metrics of the connection pool.
 
+        :return: A dictionary of metric names and values, empty for other pools
+        """
+        pool = self.engine.pool
+        if isinstance(pool, InstrumentedPool):
+            return pool.snapshot()
+        return {}
 
-db_creds = f"{db_user}:{db_password}"
-db_location = f"{db_host}:{db_port}"
-db_url = f"postgresql+asyncpg://{db_creds}@{db_location}/{db_name}"
 
-db_session = DBSettings(url=db_url)
+db_session = DBSettings()
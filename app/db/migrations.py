@@ -0,0 +1,238 @@
+"""
+This module contains migrations of the database schema.
+
+'create_all' creates missing tables only, so changes of existing tables are
+applied by the migrations below. Every migration runs once, the applied
+versions are recorded in the 'schema_migrations' table. Migrations are plain
+SQL frozen at the time they were written, later changes of the models do not
+change what an old migration does.
+"""
+
+from typing import Callable, List, NamedTuple, Sequence
+
+from sqlalchemy import (
+    Column,
+    Connection,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    insert,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.db.base_model import utc_now
+
+# Arbitrary key of the Postgres advisory lock held while migrating,
+# so that concurrently started workers apply migrations one at a time.
+MIGRATION_LOCK_KEY = 7_301_542
+
+migrations_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    migrations_metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("description", String(255), nullable=False),
+    Column("applied_at", DateTime, default=utc_now),
+)
+
+
+class Migration(NamedTuple):
+    """A schema change applied in one transaction."""
+
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+def _add_columns(
+    connection: Connection, table_name: str, columns: Sequence[str]
+) -> None:
+    """
+    Add columns to a table, skipping existing ones.
+
+    :param connection: The database connection used for the DDL
+    :param table_name: Name of the table
+    :param columns: Column definitions, each starting with the column name
+    """
+    existing = {
+        column["name"] for column in inspect(connection).get_columns(table_name)
+    }
+    for column_ddl in columns:
+        if column_ddl.split()[0] not in existing:
+            connection.execute(
+                text(f"ALTER TABLE {table_name} ADD COLUMN {column_ddl}")
+            )
+
+
+def _execute(connection: Connection, statements: Sequence[str]) -> None:
+    """
+    Run SQL statements one by one.
+
+    :param connection: The database connection used for the statements
+    :param statements: SQL of the statements
+    """
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+def _delete_duplicates(
+    connection: Connection, table_name: str, columns: Sequence[str]
+) -> None:
+    """
+    Keep only the oldest row of every group of duplicated rows.
+
+    :param connection: The database connection used for the query
+    :param table_name: Name of the table
+    :param columns: Columns which have to be unique together
+    """
+    connection.execute(
+        text(
+            f"DELETE FROM {table_name} WHERE id NOT IN "
+            f"(SELECT MIN(id) FROM {table_name} GROUP BY {', '.join(columns)})"
+        )
+    )
+
+
+def _add_lookup_indexes(connection: Connection) -> None:
+    """Index the columns of authorization, like, follow and timeline lookups."""
+    _delete_duplicates(connection, "likes", ("user_id", "tweet_id"))
+    _delete_duplicates(connection, "follows", ("follower_id", "followed_id"))
+    _delete_duplicates(connection, "timeline_entries", ("user_id", "tweet_id"))
+    _execute(
+        connection,
+        (
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_users_api_key ON users (api_key)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_follows_follower_followed "
+            "ON follows (follower_id, followed_id)",
+            "CREATE INDEX IF NOT EXISTS ix_follows_followed_follower "
+            "ON follows (followed_id, follower_id)",
+            "CREATE INDEX IF NOT EXISTS ix_tweets_created_at_id "
+            "ON tweets (created_at, id)",
+            "CREATE INDEX IF NOT EXISTS ix_tweets_user_created_at_id "
+            "ON tweets (user_id, created_at, id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_likes_user_tweet "
+            "ON likes (user_id, tweet_id)",
+            "CREATE INDEX IF NOT EXISTS ix_likes_tweet_id ON likes (tweet_id)",
+            "CREATE INDEX IF NOT EXISTS ix_images_tweet_id ON images (tweet_id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_timeline_entries_user_tweet "
+            "ON timeline_entries (user_id, tweet_id)",
+        ),
+    )
+
+
+def _add_counters(connection: Connection) -> None:
+    """Add the denormalized like and follow counters and compute them."""
+    _add_columns(connection, "tweets", ("like_count INTEGER DEFAULT '0' NOT NULL",))
+    _add_columns(
+        connection,
+        "users",
+        (
+            "followers_count INTEGER DEFAULT '0' NOT NULL",
+            "following_count INTEGER DEFAULT '0' NOT NULL",
+        ),
+    )
+    _execute(
+        connection,
+        (
+            "UPDATE tweets SET like_count = "
+            "(SELECT COUNT(likes.id) FROM likes WHERE likes.tweet_id = tweets.id)",
+            "UPDATE users SET "
+            "followers_count = (SELECT COUNT(follows.id) FROM follows "
+            "WHERE follows.followed_id = users.id), "
+            "following_count = (SELECT COUNT(follows.id) FROM follows "
+            "WHERE follows.follower_id = users.id)",
+        ),
+    )
+
+
+def _add_image_variants(connection: Connection) -> None:
+    """Add the paths of resized image variants."""
+    _add_columns(
+        connection,
+        "images",
+        ("thumbnail_path VARCHAR(255)", "medium_path VARCHAR(255)"),
+    )
+
+
+def _add_image_content_hash(connection: Connection) -> None:
+    """Add the content hash of images, which deduplicates their files."""
+    _add_columns(connection, "images", ("content_hash VARCHAR(64)",))
+    _execute(
+        connection,
+        (
+            "CREATE INDEX IF NOT EXISTS ix_images_content_hash "
+            "ON images (content_hash)",
+        ),
+    )
+
+
+def _add_fanout_marks(connection: Connection) -> None:
+    """Mark the tweets pushed into timelines, earlier ones are pulled."""
+    _add_columns(connection, "tweets", ("fanned_out BOOLEAN DEFAULT false NOT NULL",))
+    _execute(
+        connection,
+        (
+            "CREATE INDEX IF NOT EXISTS ix_tweets_pulled_user_created_at_id "
+            "ON tweets (user_id, created_at, id) WHERE NOT fanned_out",
+        ),
+    )
+
+
+MIGRATIONS = (
+    Migration(
+        1, "Add indexes and unique constraints of lookup columns", _add_lookup_indexes
+    ),
+    Migration(2, "Add like and follow counters", _add_counters),
+    Migration(3, "Add image variants", _add_image_variants),
+    Migration(4, "Add content hash of images", _add_image_content_hash),
+    Migration(5, "Add fan-out marks of tweets", _add_fanout_marks),
+)
+
+
+def _apply_pending(connection: Connection) -> List[int]:
+    """
+    Apply the migrations missing in 'schema_migrations'.
+
+    :param connection: The database connection used for the migrations
+    :return: Versions of the applied migrations
+    """
+    if connection.dialect.name == "postgresql":
+        connection.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY}
+        )
+
+    schema_migrations.create(connection, checkfirst=True)
+    applied = set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+    versions = []
+    for migration in MIGRATIONS:
+        if migration.version in applied:
+            continue
+        migration.upgrade(connection)
+        connection.execute(
+            insert(schema_migrations).values(
+                version=migration.version,
+                description=migration.description,
+            ),
+        )
+        versions.append(migration.version)
+    return versions
+
+
+async def run_migrations(engine: AsyncEngine) -> List[int]:
+    """
+    Bring the schema of an existing database up to date.
+
+    Tables must already exist, see 'create_tables'.
+
+    :param engine: Engine of the database
+    :return: Versions of the applied migrations
+    """
+    async with engine.begin() as conn:
+        return await conn.run_sync(_apply_pending)
@@ -1,12 +1,22 @@
 """This module contains ORM models of database."""
 
-from sqlalchemy import ForeignKey, Integer, String
+from sqlalchemy import (
+    Boolean,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    false,
+    text,
+)
 from sqlalchemy.orm import mapped_column, relationship
 
 from app.db.base_model import BaseModel
 
 MAX_NAME_LENGTH = 50
 MAX_IMAGE_PATH_LENGTH = 255
+SHA256_HEX_LENGTH = 64
 
 
 class Follow(BaseModel):
@@ -17,6 +27,12 @@ class Follow(BaseModel):
     """
 
     __tablename__ = "follows"
+    __table_args__ = (
+        Index(
+            "uq_follows_follower_followed", "follower_id", "followed_id", unique=True
+        ),
+        Index("ix_follows_followed_follower", "followed_id", "follower_id"),
+    )
 
     follower_id = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     followed_id = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
@@ -26,13 +42,21 @@ class User(BaseModel):
     """
     Model representing a user in the database.
 
-    A user can follow other users and be followed.
+    A user can follow other users and be followed. The numbers of followers
+    and followed users are kept up to date by the follow operations.
     """
 
     __tablename__ = "users"
+    __table_args__ = (Index("uq_users_api_key", "api_key", unique=True),)
 
     name = mapped_column(String(MAX_NAME_LENGTH), nullable=False)
     api_key = mapped_column(String(100))
+    followers_count = mapped_column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
+    following_count = mapped_column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
     tweets = relationship("Tweet", backref="user", cascade="all, delete-orphan")
     likes = relationship("Like", backref="user", cascade="all, delete-orphan")
 
@@ -59,13 +83,32 @@ class Tweet(BaseModel):
     """
     Model representing a tweet created by a user.
 
-    A tweet can have multiple likes and images.
+    A tweet can have multiple likes and images. The number of likes is kept
+    up to date by the like operations. Tweets pushed into the timelines of
+    the followers are marked by the fan-out worker, the others are pulled
+    by the readers.
     """
 
     __tablename__ = "tweets"
+    __table_args__ = (
+        Index("ix_tweets_created_at_id", "created_at", "id"),
+        Index("ix_tweets_user_created_at_id", "user_id", "created_at", "id"),
+        Index(
+            "ix_tweets_pulled_user_created_at_id",
+            "user_id",
+            "created_at",
+            "id",
+            postgresql_where=text("NOT fanned_out"),
+            sqlite_where=text("NOT fanned_out"),
+        ),
+    )
 
     tweet_text = mapped_column(String(100))
     user_id = mapped_column(Integer, ForeignKey("users.id"))
+    like_count = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    fanned_out = mapped_column(
+        Boolean, nullable=False, default=False, server_default=false()
+    )
     likes = relationship("Like", backref="tweet", cascade="all, delete-orphan")
     images = relationship("Image", backref="tweet", cascade="all, delete-orphan")
 
@@ -74,15 +117,71 @@ class Like(BaseModel):
     """Model representing a like on a tweet by a user."""
 
     __tablename__ = "likes"
+    __table_args__ = (
+        Index("uq_likes_user_tweet", "user_id", "tweet_id", unique=True),
+        Index("ix_likes_tweet_id", "tweet_id"),
+    )
 
     user_id = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     tweet_id = mapped_column(Integer, ForeignKey("tweets.id", ondelete="CASCADE"))
 
 
 class Image(BaseModel):
-    """Model representing an image associated with a tweet."""
+    """
+    Model representing an image associated with a tweet.
+
+    Files are stored under the SHA-256 of their content and shared by
+    the images with the same content. Resized variants are stored next
+    to the original, when the image could be processed.
+    """
 
     __tablename__ = "images"
+    __table_args__ = (
+        Index("ix_images_tweet_id", "tweet_id"),
+        Index("ix_images_content_hash", "content_hash"),
+    )
 
     tweet_id = mapped_column(ForeignKey("tweets.id", ondelete="CASCADE"))
     path = mapped_column(String(MAX_IMAGE_PATH_LENGTH))
+    thumbnail_path = mapped_column(String(MAX_IMAGE_PATH_LENGTH), nullable=True)
+    medium_path = mapped_column(String(MAX_IMAGE_PATH_LENGTH), nullable=True)
+    content_hash = mapped_column(String(SHA256_HEX_LENGTH), nullable=True)
+
+
+class MediaDeletion(BaseModel):
+    """
+    Model representing a media file whose image rows were deleted.
+
+    The media sweeper deletes the file unless another image still refers
+    to it, then removes the record.
+    """
+
+    __tablename__ = "media_deletions"
+
+    path = mapped_column(String(MAX_IMAGE_PATH_LENGTH), nullable=False)
+
+
+class TimelineEntry(BaseModel):
+    """
+    Model representing a tweet materialized in a user's timeline.
+
+    Entries are written by the fan-out worker when a tweet is created,
+    so the timeline is read by a single range scan over the index.
+    """
+
+    __tablename__ = "timeline_entries"
+    __table_args__ = (
+        Index(
+            "ix_timeline_entries_user_position",
+            "user_id",
+            "tweet_created_at",
+            "tweet_id",
+        ),
+        Index("ix_timeline_entries_tweet_id", "tweet_id"),
+        Index("uq_timeline_entries_user_tweet", "user_id", "tweet_id", unique=True),
+    )
+
+    user_id = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    tweet_id = mapped_column(Integer, ForeignKey("tweets.id", ondelete="CASCADE"))
+    author_id = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    tweet_created_at = mapped_column(DateTime)
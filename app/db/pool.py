@@ -0,0 +1,66 @@
+"""
+This module contains the instrumented connection pool.
+
+The pool counts checkouts and measures how long requests wait for a free
+connection, so the pool can be sized for several workers sharing one database.
+"""
+
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, Union
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+@dataclass
+class PoolStats:
+    """Counters of connection checkouts."""
+
+    checkouts: int = 0
+    timeouts: int = 0
+    wait_seconds_total: float = 0.0
+    wait_seconds_max: float = 0.0
+
+    def record(self, wait_seconds: float) -> None:
+        """
+        Account a checkout.
+
+        :param wait_seconds: Time spent waiting for the connection
+        """
+        self.checkouts += 1
+        self.wait_seconds_total += wait_seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool of asyncio drivers which records checkout wait times."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        """Take a connection from the queue, timing the wait."""
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.timeouts += 1
+            raise
+        self.stats.record(time.perf_counter() - started)
+        return connection
+
+    def snapshot(self) -> Dict[str, Union[int, float]]:
+        """
+        Return the current state of the pool together with its counters.
+
+        :return: A dictionary of metric names and values
+        """
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "overflow": max(self.overflow(), 0),
+            "idle": self.checkedin(),
+            **asdict(self.stats),
+        }
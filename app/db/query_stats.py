@@ -0,0 +1,236 @@
+"""
+This module contains per-request statistics of SQL statements.
+
+Engine events count the statements, the time spent in the database and the
+rows of every tracked block, usually one request. Rows fetched from a result
+are counted by a wrapper of the DB-API cursor, rows changed by a statement
+without a result come from the cursor rowcount. Statements repeated many
+times within a request, e.g. a lazy load in a loop, are logged as a possible
+N+1 query. With QUERY_DEBUG set, the statistics are also sent as response headers.
+Long-lived streams are not tracked, their statements are not of one request.
+"""
+
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStatsConfig(BaseSettings):
+    """
+    Query statistics configuration.
+
+    Values are read from 'QUERY_' prefixed environment variables or the .env file.
+    """
+
+    model_config = SettingsConfigDict(
+        env_prefix="QUERY_", env_file=".env", extra="ignore"
+    )
+
+    # Send the statistics as response headers.
+    debug: bool = False
+    n_plus_one_threshold: int = 5
+    exclude_prefixes: List[str] = ["/api/stream"]
+
+
+query_stats_config = QueryStatsConfig()
+
+
+@dataclass
+class QueryStats:
+    """Statements executed within a tracked block."""
+
+    statements: int = 0
+    db_seconds: float = 0.0
+    rows: int = 0
+    by_sql: Counter = field(default_factory=Counter)
+
+    def record(self, statement: str, seconds: float) -> None:
+        """
+        Account an executed statement.
+
+        :param statement: SQL of the statement
+        :param seconds: Execution time
+        """
+        self.statements += 1
+        self.db_seconds += seconds
+        self.by_sql[statement] += 1
+
+    def record_rows(self, rows: int) -> None:
+        """
+        Account rows fetched from or changed by a statement.
+
+        :param rows: Number of rows
+        """
+        self.rows += rows
+
+    def most_repeated(self) -> Tuple[str, int]:
+        """
+        Return the statement executed most often.
+
+        :return: Tuple (str, int). SQL of the statement and its number of executions
+        """
+        if not self.by_sql:
+            return "", 0
+        return self.by_sql.most_common(1)[0]
+
+    def headers(self) -> Dict[str, str]:
+        """
+        Build the debug headers of a response.
+
+        :return: A dictionary of headers
+        """
+        return {
+            "X-DB-Queries": str(self.statements),
+            "X-DB-Time-Ms": f"{self.db_seconds * 1000:.2f}",
+            "X-DB-Rows": str(self.rows),
+        }
+
+
+_active: ContextVar[Tuple[QueryStats, ...]] = ContextVar("query_stats", default=())
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """
+    Collect the statistics of statements executed within the block.
+
+    Blocks may be nested, a statement is accounted in each of them.
+
+    :return: The statistics, filled while the block runs
+    """
+    stats = QueryStats()
+    token = _active.set((*_active.get(), stats))
+    try:
+        yield stats
+    finally:
+        _active.reset(token)
+
+
+class _CountingCursor:
+    """DB-API cursor counting the fetched rows in the tracked blocks."""
+
+    def __init__(self, cursor: Any, active: Tuple[QueryStats, ...]):
+        self._cursor = cursor
+        self._active = active
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def _count(self, rows: int) -> None:
+        for stats in self._active:
+            stats.record_rows(rows)
+
+    def fetchone(self) -> Optional[Any]:
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._count(1)
+        return row
+
+    def fetchmany(self, *args: Any, **kwargs: Any) -> List[Any]:
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self) -> List[Any]:
+        rows = self._cursor.fetchall()
+        self._count(len(rows))
+        return rows
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    """Remember the start of the statement."""
+    if _active.get():
+        context.query_started = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    """Account the statement in the active blocks."""
+    active = _active.get()
+    if not active:
+        return
+    started = getattr(context, "query_started", None)
+    seconds = time.perf_counter() - started if started else 0.0
+    for stats in active:
+        stats.record(statement, seconds)
+
+    if cursor.description is None:
+        for stats in active:
+            stats.record_rows(max(cursor.rowcount, 0))
+    elif context is not None and context.cursor is cursor:
+        # The result of the statement fetches its rows from the context cursor.
+        context.cursor = _CountingCursor(cursor, active)
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """
+    Account the statements of an engine in the active blocks.
+
+    :param engine: Engine to instrument
+    """
+    if not event.contains(engine.sync_engine, "after_cursor_execute", _after_execute):
+        event.listen(engine.sync_engine, "before_cursor_execute", _before_execute)
+        event.listen(engine.sync_engine, "after_cursor_execute", _after_execute)
+
+
+def report_n_plus_one(
+    stats: QueryStats,
+    path: str,
+    threshold: int = query_stats_config.n_plus_one_threshold,
+) -> None:
+    """
+    Log a statement repeated within a request.
+
+    :param stats: Statistics of the request
+    :param path: Path of the request
+    :param threshold: Number of executions reported
+    """
+    statement, count = stats.most_repeated()
+    if count >= threshold:
+        logger.warning(
+            "Possible N+1 query in %s, executed %d times: %s", path, count, statement
+        )
+
+
+class QueryStatsMiddleware:
+    """ASGI middleware tracking the statements of every HTTP request."""
+
+    def __init__(self, app, config: QueryStatsConfig = query_stats_config):
+        self.app = app
+        self.config = config
+
+    def _tracked(self, scope) -> bool:
+        """Tell whether the statements of the request are tracked."""
+        if scope["type"] != "http":
+            return False
+        return not scope["path"].startswith(tuple(self.config.exclude_prefixes))
+
+    async def __call__(self, scope, receive, send):
+        if not self._tracked(scope):
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries() as stats:
+
+            async def send_with_stats(message):
+                if message["type"] == "http.response.start" and self.config.debug:
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        *[
+                            (name.lower().encode(), value.encode())
+                            for name, value in stats.headers().items()
+                        ],
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_with_stats)
+        report_n_plus_one(stats, scope["path"], self.config.n_plus_one_threshold)
@@ -0,0 +1,85 @@
+"""
+This module contains routing of read-only sessions to replicas.
+
+Reads are spread over the replicas round-robin. A replica which fails to
+connect is skipped for a cooldown period. Users who have just written are
+served by the primary for a short window, so they read their own writes
+despite the replication lag.
+"""
+
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from app.services.cache import TTLCache
+
+RECENT_WRITERS_CACHE_SIZE = 100000
+
+
+@dataclass
+class Replica:
+    """A read-only copy of the database."""
+
+    engine: AsyncEngine
+    session_factory: Callable[[], AsyncSession]
+    unhealthy_until: float = 0.0
+
+
+class ReplicaRouter:
+    """
+    Chooses the replicas serving a read.
+
+    Recent writers are remembered by the process, so with several workers
+    a read landing on another worker may still be served by a replica.
+    """
+
+    def __init__(
+        self,
+        replicas: List[Replica],
+        cooldown: float,
+        read_your_writes_window: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.replicas = replicas
+        self.cooldown = cooldown
+        self._clock = clock
+        self._next = 0
+        self._recent_writers: TTLCache[str, bool] = TTLCache(
+            max_size=RECENT_WRITERS_CACHE_SIZE,
+            ttl=read_your_writes_window,
+            clock=clock,
+        )
+
+    def record_write(self, api_key: str) -> None:
+        """
+        Route reads of the user to the primary for the read-your-writes window.
+
+        :param api_key: User API key
+        """
+        self._recent_writers.set(api_key, True)
+
+    def candidates(self, api_key: Optional[str] = None) -> List[Replica]:
+        """
+        Return the healthy replicas in the order they should be tried.
+
+        :param api_key: User API key of the request (optional)
+        :return: A list of replicas, empty when the primary has to serve the read
+        """
+        if not self.replicas or (api_key and self._recent_writers.get(api_key)):
+            return []
+
+        start = self._next % len(self.replicas)
+        self._next = start + 1
+        now = self._clock()
+        ordered = self.replicas[start:] + self.replicas[:start]
+        return [replica for replica in ordered if replica.unhealthy_until <= now]
+
+    def mark_unhealthy(self, replica: Replica) -> None:
+        """
+        Skip a replica until the cooldown has passed.
+
+        :param replica: The replica which failed
+        """
+        replica.unhealthy_until = self._clock() + self.cooldown
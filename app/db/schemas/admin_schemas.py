@@ -0,0 +1,27 @@
+"""This module contains the Admin Schemas."""
+
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class ProfilerUpdate(BaseModel):
+    """Schema for changing the profiler settings, omitted fields are kept."""
+
+    enabled: Optional[bool] = Field(default=None, description="Profile requests")
+    slow_ms: Optional[float] = Field(
+        default=None, ge=0, description="Requests taking longer are written"
+    )
+    sample_rate: Optional[float] = Field(
+        default=None, ge=0, le=1, description="Share of other requests written"
+    )
+
+
+class ProfilerOut(BaseModel):
+    """Schema of the profiler settings and the stored profiles."""
+
+    result: bool = Field(default=True)
+    enabled: bool
+    slow_ms: float
+    sample_rate: float
+    profiles: List[str] = Field(..., description="Stored profiles, the oldest first")
@@ -0,0 +1,11 @@
+"""This module contains the Stream Schemas."""
+
+from pydantic import BaseModel, Field
+
+
+class StreamTokenOut(BaseModel):
+    """Schema of a token opening an event stream."""
+
+    result: bool = Field(default=True)
+    token: str = Field(..., description="Token passed as the 'token' query parameter")
+    expires_in: float = Field(..., description="Seconds the token opens a stream")
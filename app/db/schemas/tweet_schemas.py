@@ -1,5 +1,7 @@
 """This module contains the Tweet, Image and Like Schemas."""
 
+from datetime import datetime
+from enum import Enum
 from typing import List, Optional
 
 from pydantic import BaseModel, Field
@@ -34,8 +36,12 @@ class TweetBase(BaseModel):
     id: int = Field(default=1, description="Tweet ID")
     content: str = Field(default="Some text", description="Tweet text")
     attachments: List[str]
+    thumbnails: List[str] = Field(
+        default=[], description="Small versions of the attachments for the timeline"
+    )
     author: UserBase
     likes: List[LikeSchema]
+    like_count: int = Field(default=0, description="Number of likes")
 
 
 class TweetOut(BaseModel):
@@ -43,6 +49,26 @@ class TweetOut(BaseModel):
 
     result: bool
     tweets: List[TweetBase]
+    next_cursor: Optional[str] = Field(
+        default=None,
+        description="Opaque cursor of the next page, null when there are no more tweets",
+    )
+
+
+class FeedMode(str, Enum):
+    """Which tweets are included in the feed and how they are ordered."""
+
+    ALL = "all"
+    HOME = "home"
+    FOLLOWING = "following"
+
+
+class TweetCursor(BaseModel):
+    """Position of a tweet in the feed, used for keyset pagination."""
+
+    likes: Optional[int] = None
+    created_at: datetime
+    id: int
 
 
 class TweetCreateSchema(BaseModel):
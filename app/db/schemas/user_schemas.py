@@ -23,6 +23,8 @@ class UserSchema(UserBase):
 
     followers: List[UserBase] = Field(..., description="List of user's subscribers")
     following: List[UserBase] = Field(..., description="List of user subscriptions")
+    followers_count: int = Field(default=0, description="Number of user's subscribers")
+    following_count: int = Field(default=0, description="Number of user subscriptions")
 
 
 class UserOut(BaseModel):
@@ -0,0 +1,105 @@
+"""
+This module contains single round trip write statements.
+
+Postgres and SQLite run them as 'INSERT ... ON CONFLICT DO NOTHING RETURNING'
+and 'DELETE ... RETURNING'. Other dialects fall back to a lookup followed
+by the write.
+"""
+
+from typing import Any, Dict, Optional, Sequence, Type
+
+from sqlalchemy import ColumnElement, delete, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.base_model import BaseModel
+
+DIALECT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+async def insert_ignoring_conflicts(
+    session: AsyncSession,
+    model: Type[BaseModel],
+    **values: Any,
+) -> Optional[int]:
+    """
+    Insert a row unless it violates a unique constraint.
+
+    Foreign key violations are not ignored and raise 'IntegrityError'.
+
+    :param session: The database session used for the query
+    :param model: Model of the table
+    :param values: Column values of the row
+    :return: ID of the new row or None, when such a row already exists
+    """
+    dialect_insert = DIALECT_INSERTS.get(session.bind.dialect.name)
+    if dialect_insert is not None:
+        query = (
+            dialect_insert(model)
+            .values(**values)
+            .on_conflict_do_nothing()
+            .returning(model.id)
+        )
+        return (await session.execute(query)).scalar_one_or_none()
+
+    existing = await session.execute(select(model.id).filter_by(**values).limit(1))
+    if existing.first() is not None:
+        return None
+    res = await session.execute(insert(model).values(**values))
+    return res.inserted_primary_key[0]
+
+
+async def insert_many_ignoring_conflicts(
+    session: AsyncSession,
+    model: Type[BaseModel],
+    rows: Sequence[Dict[str, Any]],
+) -> None:
+    """
+    Insert rows, skipping those which violate a unique constraint.
+
+    Other dialects insert the rows not found by a lookup, so a concurrent
+    insert of the same row may still raise 'IntegrityError' there.
+
+    :param session: The database session used for the query
+    :param model: Model of the table
+    :param rows: Column values of the rows, all with the same columns
+    """
+    if not rows:
+        return
+    dialect_insert = DIALECT_INSERTS.get(session.bind.dialect.name)
+    if dialect_insert is not None:
+        await session.execute(dialect_insert(model).on_conflict_do_nothing(), rows)
+        return
+
+    for values in rows:
+        existing = await session.execute(select(model.id).filter_by(**values).limit(1))
+        if existing.first() is None:
+            await session.execute(insert(model).values(**values))
+
+
+async def delete_returning_id(
+    session: AsyncSession,
+    model: Type[BaseModel],
+    *criteria: ColumnElement[bool],
+) -> Optional[int]:
+    """
+    Delete a single row matching the criteria.
+
+    :param session: The database session used for the query
+    :param model: Model of the table
+    :param criteria: Conditions identifying the row
+    :return: ID of the deleted row or None, when there was no such row
+    """
+    if session.bind.dialect.delete_returning:
+        query = delete(model).where(*criteria).returning(model.id)
+        return (await session.execute(query)).scalars().first()
+
+    row_id = (
+        await session.execute(select(model.id).where(*criteria).limit(1))
+    ).scalar()
+    if row_id is not None:
+        await session.execute(delete(model).where(model.id == row_id))
+    return row_id
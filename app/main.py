@@ -5,28 +5,54 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 
 from app.db.db_settings import db_session
+from app.db.query_stats import QueryStatsMiddleware
+from app.routes import api_admin as aa
 from app.routes import api_medias as am
+from app.routes import api_metrics as amt
+from app.routes import api_stream as asr
 from app.routes import api_tweets as at
 from app.routes import api_users as au
-from app.routes.crud.insert_data import create_tables, insert_data
+from app.services.events import event_bus
+from app.services.media.gc import media_sweeper
+from app.services.media.processing import image_processor
+from app.services.media.uploads import UploadLimitMiddleware
+from app.services.metrics import MetricsMiddleware
+from app.services.profiler import ProfilerMiddleware, profiler
+from app.services.timeline import timeline_fanout
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
-    Initialize the database and creates tables at the start.
+    Warm up the connection pool and start the background workers.
 
-    Cleans up resources and disposes of the database connection at the end.
+    The schema and the initial data are managed by the commands in 'app.cli',
+    so starting a worker does not change the database. The event bus, the
+    timeline fan-out worker, the media sweeper, the image processing pool and
+    the profiler are stopped and the database connections are closed at the end.
     """
-    await create_tables()
-    async with db_session.async_session() as session:
-        await insert_data(session)
+    await db_session.warm_up()
+    await event_bus.start()
+    await timeline_fanout.start()
+    await media_sweeper.start()
     yield
-    await db_session.engine.dispose()
+    await media_sweeper.stop()
+    await timeline_fanout.stop()
+    await event_bus.stop()
+    image_processor.shutdown()
+    profiler.stop()
+    await db_session.dispose()
 
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(UploadLimitMiddleware)
+app.add_middleware(ProfilerMiddleware)
+app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(au.users_routes)
 app.include_router(at.tweets_routes)
 app.include_router(am.medias_routes)
+app.include_router(asr.stream_routes)
+app.include_router(amt.metrics_routes)
+app.include_router(aa.admin_routes)
@@ -0,0 +1,137 @@
+"""This module contains API-functions for administration."""
+
+import hmac
+from typing import Annotated, Any, Dict
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Path
+from fastapi.responses import FileResponse
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from starlette.status import (
+    HTTP_400_BAD_REQUEST,
+    HTTP_403_FORBIDDEN,
+    HTTP_404_NOT_FOUND,
+)
+
+from app.db.schemas.admin_schemas import ProfilerOut, ProfilerUpdate
+from app.db.schemas.error_schemas import ErrorOut
+from app.services.profiler import profiler
+
+
+class AdminConfig(BaseSettings):
+    """
+    Admin API configuration.
+
+    Values are read from 'ADMIN_' prefixed environment variables or the .env file.
+    """
+
+    model_config = SettingsConfigDict(
+        env_prefix="ADMIN_", env_file=".env", extra="ignore"
+    )
+
+    # The admin API is disabled while no key is set.
+    api_key: str = ""
+
+
+admin_config = AdminConfig()
+
+
+def check_admin_key(
+    admin_key: Annotated[str, Header(description="Admin API key")],
+) -> None:
+    """
+    Check the admin API key.
+
+    :param admin_key: Admin API key
+    :return: None
+    """
+    api_key = admin_config.api_key
+    if not api_key or not hmac.compare_digest(admin_key.encode(), api_key.encode()):
+        raise HTTPException(
+            status_code=HTTP_403_FORBIDDEN,
+            detail={
+                "result": False,
+                "error_type": HTTP_403_FORBIDDEN,
+                "error_message": "Invalid admin key",
+            },
+        )
+
+
+admin_routes = APIRouter(
+    prefix="/api/admin",
+    tags=["Administration"],
+    dependencies=[Depends(check_admin_key)],
+)
+
+
+def _profiler_state() -> Dict[str, Any]:
+    """Return the profiler settings and the stored profiles."""
+    config = profiler.config
+    return {
+        "result": True,
+        "enabled": config.enabled,
+        "slow_ms": config.slow_ms,
+        "sample_rate": config.sample_rate,
+        "profiles": profiler.profiles(),
+    }
+
+
+@admin_routes.get(
+    "/profiler",
+    response_model=ProfilerOut,
+    responses={403: {"model": ErrorOut}},
+    summary="Get the profiler settings",
+    description="Returns the settings of the request profiler and the stored profiles",
+)
+async def get_profiler() -> Dict[str, Any]:
+    """Get the profiler settings."""
+    return _profiler_state()
+
+
+@admin_routes.patch(
+    "/profiler",
+    response_model=ProfilerOut,
+    responses={400: {"model": ErrorOut}, 403: {"model": ErrorOut}},
+    summary="Change the profiler settings",
+    description="Enables or disables the request profiler and changes its thresholds",
+)
+async def update_profiler(settings: ProfilerUpdate) -> Dict[str, Any]:
+    """Change the profiler settings of this worker."""
+    values = settings.model_dump(exclude_none=True)
+    if values.pop("enabled", None) and not profiler.enable():
+        raise HTTPException(
+            status_code=HTTP_400_BAD_REQUEST,
+            detail={
+                "result": False,
+                "error_type": HTTP_400_BAD_REQUEST,
+                "error_message": "Profiling is not supported by this Python version",
+            },
+        )
+    if settings.enabled is False:
+        profiler.config.enabled = False
+    for name, value in values.items():
+        setattr(profiler.config, name, value)
+    return _profiler_state()
+
+
+@admin_routes.get(
+    "/profiler/profiles/{name}",
+    response_class=FileResponse,
+    responses={403: {"model": ErrorOut}, 404: {"model": ErrorOut}},
+    summary="Download a profile",
+    description="Returns the folded stacks of a profiled request",
+)
+async def get_profile(
+    name: Annotated[str, Path(..., description="File name of the profile")],
+) -> FileResponse:
+    """Download a stored profile."""
+    path = profiler.profile_path(name)
+    if path is None:
+        raise HTTPException(
+            status_code=HTTP_404_NOT_FOUND,
+            detail={
+                "result": False,
+                "error_type": HTTP_404_NOT_FOUND,
+                "error_message": "Profile not found",
+            },
+        )
+    return FileResponse(path, media_type="text/plain", filename=name)
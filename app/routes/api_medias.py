@@ -9,6 +9,7 @@ from app.db.db_settings import db_session
 from app.db.schemas.error_schemas import ErrorOut
 from app.db.schemas.tweet_schemas import ImageSchema
 from app.routes.crud.crud_images import upload_image
+from app.routes.crud.crud_users import get_user_identity
 
 medias_routes = APIRouter(prefix="/api/medias", tags=["Operation with medias"])
 
@@ -17,6 +18,7 @@ medias_routes = APIRouter(prefix="/api/medias", tags=["Operation with medias"])
     "",
     response_model=ImageSchema,
     responses={
+        404: {"model": ErrorOut},
         500: {"model": ErrorOut},
     },
     summary="Upload medias",
@@ -28,5 +30,6 @@ async def upload_media(
     session: Annotated[AsyncSession, Depends(db_session.get_session)],
 ) -> Dict[str, Any]:
     """Upload a media file to the server and return its ID."""
+    await get_user_identity(session=session, api_key=api_key)
     result, image_id = await upload_image(session=session, file=file)
     return {"result": result, "media_id": image_id}
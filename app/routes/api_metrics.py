@@ -0,0 +1,81 @@
+"""
+This module contains the API-function for metrics of the application.
+
+The endpoint is served only with METRICS_ENABLED set. nginx does not proxy
+it, so it is reachable on the port of the application only.
+"""
+
+from typing import Iterable
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from starlette.status import HTTP_404_NOT_FOUND
+
+from app.db.db_settings import db_session
+from app.services.cache import identity_cache
+from app.services.events import event_bus
+from app.services.feed_cache import feed_cache
+from app.services.media.gc import media_sweeper
+from app.services.metrics import Sample, metrics_config, registry
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Counters of the connection pool, the other values are its current state.
+POOL_COUNTERS = frozenset(("checkouts", "timeouts", "wait_seconds_total"))
+
+metrics_routes = APIRouter(tags=["Metrics"])
+
+
+def collect_pool() -> Iterable[Sample]:
+    """Read the state and the checkout counters of the connection pool."""
+    for name, value in db_session.pool_stats().items():
+        documentation = f"Connection pool {name.replace('_', ' ')}."
+        if name in POOL_COUNTERS:
+            name = name.replace("_total", "")
+            yield f"db_pool_{name}_total", "counter", documentation, {}, value
+        else:
+            yield f"db_pool_{name}", "gauge", documentation, {}, value
+
+
+def collect_caches() -> Iterable[Sample]:
+    """Read the hits, misses and hit ratios of the caches."""
+    for cache_name, cache in (("feed", feed_cache), ("identity", identity_cache)):
+        labels = {"cache": cache_name}
+        lookups = cache.hits + cache.misses
+        ratio = cache.hits / lookups if lookups else 0
+        yield "cache_hits_total", "counter", "Cache hits.", labels, cache.hits
+        yield "cache_misses_total", "counter", "Cache misses.", labels, cache.misses
+        yield "cache_hit_ratio", "gauge", "Share of cache hits.", labels, ratio
+
+
+def collect_background() -> Iterable[Sample]:
+    """Read the counters of the media sweeper and the open event streams."""
+    for name, value in media_sweeper.metrics().items():
+        documentation = f"Media sweeper {name.replace('_', ' ')}."
+        yield f"media_sweeper_{name}_total", "counter", documentation, {}, value
+    streams = len(event_bus.subscriptions)
+    yield "event_subscriptions", "gauge", "Open event streams.", {}, streams
+
+
+registry.add_collector(collect_pool)
+registry.add_collector(collect_caches)
+registry.add_collector(collect_background)
+
+
+@metrics_routes.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    include_in_schema=False,
+)
+async def get_metrics() -> PlainTextResponse:
+    """Return the metrics of this worker in the Prometheus text format."""
+    if not metrics_config.enabled:
+        raise HTTPException(
+            status_code=HTTP_404_NOT_FOUND,
+            detail={
+                "result": False,
+                "error_type": HTTP_404_NOT_FOUND,
+                "error_message": "Metrics are disabled",
+            },
+        )
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
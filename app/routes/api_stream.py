@@ -0,0 +1,197 @@
+"""
+This module contains API-functions for realtime updates.
+
+EventSource cannot send headers, so a browser first trades its API key for a
+short-lived stream token and passes the token in the query string. The API key
+itself never appears in URLs and access logs. A token is signed with the
+user's API key, so any worker can check it and a new key revokes it.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import time
+from typing import Annotated, Any, AsyncIterator, Dict, Iterable, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.status import HTTP_403_FORBIDDEN
+
+from app.db.db_settings import db_session
+from app.db.schemas.error_schemas import ErrorOut
+from app.db.schemas.stream_schemas import StreamTokenOut
+from app.routes.crud.crud_users import (
+    get_followed_ids,
+    get_user_basic,
+    get_user_identity,
+)
+from app.services.events import event_bus
+
+# Milliseconds an EventSource waits before reconnecting.
+STREAM_RETRY = 3000
+
+
+class StreamConfig(BaseSettings):
+    """
+    Event stream configuration.
+
+    Values are read from 'STREAM_' prefixed environment variables or the .env file.
+    """
+
+    model_config = SettingsConfigDict(
+        env_prefix="STREAM_", env_file=".env", extra="ignore"
+    )
+
+    # Seconds without events before a keepalive comment is sent.
+    keepalive: float = 15.0
+    # Seconds a stream token can be used to open a stream.
+    token_ttl: float = 60.0
+
+
+stream_config = StreamConfig()
+stream_routes = APIRouter(prefix="/api/stream", tags=["Realtime updates"])
+
+
+def _sign(api_key: str, payload: str) -> str:
+    """Return the signature of a token payload."""
+    return hmac.new(api_key.encode(), payload.encode(), hashlib.sha256).hexdigest()
+
+
+def create_stream_token(user_id: int, api_key: str, ttl: float) -> str:
+    """
+    Create a token opening the streams of a user.
+
+    :param user_id: The ID of the user
+    :param api_key: API key of the user, signing the token
+    :param ttl: Seconds the token is valid
+    :return: The token
+    """
+    payload = f"{user_id}.{int(time.time() + ttl)}"
+    return f"{payload}.{_sign(api_key, payload)}"
+
+
+def _invalid_token() -> HTTPException:
+    """Return the error of a missing, expired or forged token."""
+    return HTTPException(
+        status_code=HTTP_403_FORBIDDEN,
+        detail={
+            "result": False,
+            "error_type": HTTP_403_FORBIDDEN,
+            "error_message": "Invalid stream token",
+        },
+    )
+
+
+async def verify_stream_token(session: AsyncSession, token: str) -> int:
+    """
+    Check a stream token.
+
+    :param session: The database session used for the query
+    :param token: The token
+    :return: The ID of the user
+    :raises HTTPException: When the token is malformed, expired or forged
+    """
+    try:
+        user_id, expires, signature = token.split(".")
+        user_id, expires = int(user_id), int(expires)
+    except ValueError:
+        raise _invalid_token()
+    if expires < time.time():
+        raise _invalid_token()
+    user = await get_user_basic(session, user_id)
+    if not hmac.compare_digest(signature, _sign(user.api_key, f"{user_id}.{expires}")):
+        raise _invalid_token()
+    return user_id
+
+
+async def event_stream(user_id: int, author_ids: Iterable[int]) -> AsyncIterator[bytes]:
+    """
+    Subscribe to the events of the authors and encode them as Server-Sent Events.
+
+    A comment is sent when there were no events for a while, so proxies keep
+    the connection open and a disconnected client is noticed. An 'overflow'
+    event tells a client which did not keep up to reload the feed.
+
+    :param user_id: The ID of the user
+    :param author_ids: IDs of the users the user follows
+    :return: An iterator of encoded events
+    """
+    subscription = event_bus.subscribe(user_id, author_ids)
+    try:
+        yield f"retry: {STREAM_RETRY}\n\n".encode()
+        while True:
+            try:
+                event = await subscription.get(timeout=stream_config.keepalive)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if event is None:
+                if subscription.overflowed:
+                    yield b"event: overflow\ndata: {}\n\n"
+                return
+            yield b"event: %s\ndata: %s\n\n" % (event.type.encode(), event.to_json())
+    finally:
+        event_bus.unsubscribe(subscription)
+
+
+@stream_routes.post(
+    "/token",
+    response_model=StreamTokenOut,
+    responses={404: {"model": ErrorOut}, 500: {"model": ErrorOut}},
+    summary="Create a stream token",
+    description="Short-lived token opening the user's event streams",
+)
+async def create_token(
+    api_key: Annotated[str, Header(description="User API key")],
+    session: Annotated[AsyncSession, Depends(db_session.get_read_session)],
+) -> Dict[str, Any]:
+    """Create a stream token."""
+    user = await get_user_identity(session=session, api_key=api_key)
+    ttl = stream_config.token_ttl
+    return {
+        "result": True,
+        "token": create_stream_token(user.id, api_key, ttl),
+        "expires_in": ttl,
+    }
+
+
+@stream_routes.get(
+    "",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {"text/event-stream": {}}},
+        403: {"model": ErrorOut},
+        404: {"model": ErrorOut},
+        500: {"model": ErrorOut},
+    },
+    summary="Stream tweet events",
+    description=(
+        "Server-Sent Events of created and deleted tweets and changed likes "
+        "of the followed users and the user's own tweets. EventSource cannot "
+        "send headers, so browsers pass a token from /api/stream/token instead "
+        "of the API key"
+    ),
+)
+async def stream_events(
+    session: Annotated[AsyncSession, Depends(db_session.get_read_session)],
+    api_key: Annotated[Optional[str], Header(description="User API key")] = None,
+    token: Annotated[Optional[str], Query(description="Stream token")] = None,
+) -> StreamingResponse:
+    """Stream tweet events."""
+    if api_key is not None:
+        user_id = (await get_user_identity(session=session, api_key=api_key)).id
+    elif token is not None:
+        user_id = await verify_stream_token(session, token)
+    else:
+        raise _invalid_token()
+    author_ids = await get_followed_ids(session, user_id)
+    # The stream must not hold a database connection while it is open.
+    await session.close()
+
+    return StreamingResponse(
+        event_stream(user_id, author_ids),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,22 +1,39 @@
 """This module contains API-functions for tweet and like."""
 
-from typing import Annotated, Any, Dict
+from typing import Annotated, Any, Dict, List, Optional
 
-from fastapi import APIRouter, Depends, Header, Path
+import orjson
+from fastapi import APIRouter, Depends, Header, Path, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db.db_settings import db_session
 from app.db.schemas.error_schemas import ErrorOut
-from app.db.schemas.tweet_schemas import TweetCreate, TweetCreateSchema, TweetOut
+from app.db.schemas.tweet_schemas import (
+    FeedMode,
+    TweetCreate,
+    TweetCreateSchema,
+    TweetOut,
+)
 from app.db.schemas.user_schemas import ResponseSchema
+from app.routes.conditional import (
+    etag_headers,
+    etag_matches,
+    make_etag,
+    not_modified,
+)
 from app.routes.crud.crud_tweets import (
     add_like_to_tweet,
     create_tweet,
     delete_like_from_tweet,
     delete_tweet_db,
     get_all_tweets,
+    get_all_tweets_version,
+    get_following_tweets,
+    get_home_tweets,
 )
-from app.routes.crud.crud_users import get_user
+from app.routes.crud.crud_users import get_user_identity
+from app.routes.crud.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.services.feed_cache import feed_cache
 
 tweets_routes = APIRouter(prefix="/api/tweets", tags=["Operation with tweets"])
 
@@ -29,29 +46,90 @@ tweets_routes = APIRouter(prefix="/api/tweets", tags=["Operation with tweets"])
         500: {"model": ErrorOut},
     },
     summary="Get all tweets",
-    description="Endpoint for getting all tweets",
+    description=(
+        "Endpoint for getting a page of tweets. The 'all' feed contains every tweet, "
+        "newest first. The 'home' feed contains tweets of the followed users and "
+        "the user's own tweets, most liked first. The 'following' feed contains "
+        "the same tweets, newest first"
+    ),
 )
 async def list_all_tweets(
     api_key: Annotated[str, Header(description="User API key")],
-    session: Annotated[AsyncSession, Depends(db_session.get_session)],
-) -> Dict[str, Any]:
-    """Get all tweets."""
-    await get_user(session=session, api_key_or_id=api_key)
-    tweets = await get_all_tweets(session)
-
-    result = []
-    for tweet in tweets:
-        result.append(
-            {
-                "id": tweet.id,
-                "content": tweet.tweet_text,
-                "attachments": [image.path for image in tweet.images],
-                "author": {"id": tweet.user.id, "name": tweet.user.name},
-                "likes": [{"user_id": like.user_id} for like in tweet.likes],
-            },
+    session: Annotated[AsyncSession, Depends(db_session.get_read_session)],
+    limit: Annotated[
+        int,
+        Query(ge=1, le=MAX_PAGE_SIZE, description="Maximum number of tweets"),
+    ] = DEFAULT_PAGE_SIZE,
+    before: Annotated[
+        Optional[str],
+        Query(description="Cursor to get tweets older than it"),
+    ] = None,
+    after: Annotated[
+        Optional[str],
+        Query(description="Cursor to get tweets newer than it"),
+    ] = None,
+    feed: Annotated[FeedMode, Query(description="Feed to read")] = FeedMode.ALL,
+    if_none_match: Annotated[
+        Optional[str],
+        Header(description="ETag of the page the client already has"),
+    ] = None,
+) -> Response:
+    """Get a page of tweets."""
+    user = await get_user_identity(session=session, api_key=api_key)
+    if feed is FeedMode.HOME:
+        tweets, next_cursor = await get_home_tweets(
+            session,
+            user_id=user.id,
+            limit=limit,
+            before=before,
+            after=after,
         )
+    elif feed is FeedMode.FOLLOWING:
+        tweets, next_cursor = await get_following_tweets(
+            session,
+            user_id=user.id,
+            limit=limit,
+            before=before,
+            after=after,
+        )
+    else:
+        # The 'all' feed is the same for every user. Its pages are cached
+        # under their version stamp, so the body always matches the ETag,
+        # also in a worker whose cache missed a write.
+        etag = make_etag(
+            await get_all_tweets_version(
+                session, limit=limit, before=before, after=after
+            )
+        )
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
+        async def load_page() -> bytes:
+            page = await get_all_tweets(
+                session, limit=limit, before=before, after=after
+            )
+            return _encode_page(*page)
+
+        body = await feed_cache.get_or_load(
+            f"{limit}:{before or ''}:{after or ''}:{etag}", load_page
+        )
+        return Response(body, media_type="application/json", headers=etag_headers(etag))
+
+    return Response(_encode_page(tweets, next_cursor), media_type="application/json")
+
+
+def _encode_page(tweets: List[Dict[str, Any]], next_cursor: Optional[str]) -> bytes:
+    """
+    Encode a page of the feed.
+
+    The items are built in the format of 'TweetOut' already, so they are
+    encoded directly instead of being validated against the response model.
 
-    return {"result": True, "tweets": result}
+    :param tweets: Feed items of the page
+    :param next_cursor: Cursor of the next page
+    :return: JSON of the response body
+    """
+    return orjson.dumps({"result": True, "tweets": tweets, "next_cursor": next_cursor})
 
 
 @tweets_routes.post(
@@ -71,7 +149,7 @@ async def like_tweet(
     session: Annotated[AsyncSession, Depends(db_session.get_session)],
 ) -> Dict[str, bool]:
     """Add a like to a tweet."""
-    user = await get_user(session=session, api_key_or_id=api_key)
+    user = await get_user_identity(session=session, api_key=api_key)
 
     result = await add_like_to_tweet(
         session=session,
@@ -98,7 +176,7 @@ async def delete_like(
     session: Annotated[AsyncSession, Depends(db_session.get_session)],
 ) -> Dict[str, bool]:
     """Remove a like from a tweet."""
-    user = await get_user(session=session, api_key_or_id=api_key)
+    user = await get_user_identity(session=session, api_key=api_key)
 
     result = await delete_like_from_tweet(
         session=session,
@@ -125,7 +203,7 @@ async def create_tweet_route(
     session: Annotated[AsyncSession, Depends(db_session.get_session)],
 ) -> Dict[str, Any]:
     """Create a tweet."""
-    user = await get_user(session=session, api_key_or_id=api_key)
+    user = await get_user_identity(session=session, api_key=api_key)
 
     result, tweet_id = await create_tweet(
         session=session,
@@ -153,7 +231,7 @@ async def delete_tweet(
     session: Annotated[AsyncSession, Depends(db_session.get_session)],
 ) -> Dict[str, bool]:
     """Delete a tweet."""
-    user = await get_user(session=session, api_key_or_id=api_key)
+    user = await get_user_identity(session=session, api_key=api_key)
 
     result = await delete_tweet_db(
         session=session,
@@ -1,14 +1,26 @@
 """This module contains API-functions for user."""
 
-from typing import Annotated, Any, Dict
+from typing import Annotated, Any, Dict, Optional
 
-from fastapi import APIRouter, Depends, Header, Path
+from fastapi import APIRouter, Depends, Header, Path, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db.db_settings import db_session
 from app.db.schemas.error_schemas import ErrorOut
 from app.db.schemas.user_schemas import ResponseSchema, UserOut
-from app.routes.crud.crud_users import follow_user_by_id, get_user, unfollow_user_by_id
+from app.routes.conditional import (
+    etag_headers,
+    etag_matches,
+    make_etag,
+    not_modified,
+)
+from app.routes.crud.crud_users import (
+    follow_user_by_id,
+    get_user,
+    get_user_identity,
+    get_user_version,
+    unfollow_user_by_id,
+)
 
 users_routes = APIRouter(prefix="/api/users", tags=["Operation with users"])
 
@@ -26,9 +38,21 @@ users_routes = APIRouter(prefix="/api/users", tags=["Operation with users"])
 )
 async def get_user_me(
     api_key: Annotated[str, Header(description="User API key")],
-    session: Annotated[AsyncSession, Depends(db_session.get_session)],
-) -> Dict[str, Any]:
+    session: Annotated[AsyncSession, Depends(db_session.get_read_session)],
+    response: Response,
+    if_none_match: Annotated[
+        Optional[str],
+        Header(description="ETag of the profile the client already has"),
+    ] = None,
+) -> Any:
     """Get user by API key."""
+    version = await get_user_version(session=session, api_key_or_id=api_key)
+    if version:
+        etag = make_etag(version)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        response.headers.update(etag_headers(etag))
+
     user = await get_user(session=session, api_key_or_id=api_key)
     return {
         "result": True,
@@ -41,6 +65,8 @@ async def get_user_me(
             "following": [
                 {"id": user.id, "name": user.name} for user in user.following
             ],
+            "followers_count": user.followers_count,
+            "following_count": user.following_count,
         },
     }
 
@@ -57,10 +83,22 @@ async def get_user_me(
     description="Returns a dictionary containing the user's data",
 )
 async def get_user_with_id(
-    session: Annotated[AsyncSession, Depends(db_session.get_session)],
+    session: Annotated[AsyncSession, Depends(db_session.get_read_session)],
     user_id: Annotated[int, Path(..., description="User ID")],
-) -> Dict[str, Any]:
+    response: Response,
+    if_none_match: Annotated[
+        Optional[str],
+        Header(description="ETag of the profile the client already has"),
+    ] = None,
+) -> Any:
     """Get user for his ID."""
+    version = await get_user_version(session=session, api_key_or_id=user_id)
+    if version:
+        etag = make_etag(version)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        response.headers.update(etag_headers(etag))
+
     user = await get_user(session=session, api_key_or_id=user_id)
 
     return {
@@ -74,6 +112,8 @@ async def get_user_with_id(
             "following": [
                 {"id": user.id, "name": user.name} for user in user.following
             ],
+            "followers_count": user.followers_count,
+            "following_count": user.following_count,
         },
     }
 
@@ -95,7 +135,7 @@ async def follow_user(
     user_id: Annotated[int, Path(..., description="User ID to follow")],
 ) -> Dict[str, bool]:
     """Follow a user by their ID."""
-    follower = await get_user(session=session, api_key_or_id=api_key)
+    follower = await get_user_identity(session=session, api_key=api_key)
 
     result = await follow_user_by_id(
         session=session,
@@ -123,8 +163,7 @@ async def unfollow_user(
     user_id: Annotated[int, Path(..., description="User ID to unfollow")],
 ) -> Dict[str, bool]:
     """Unfollow a user by their ID."""
-    follower = await get_user(session=session, api_key_or_id=api_key)
-    await get_user(session=session, api_key_or_id=user_id)
+    follower = await get_user_identity(session=session, api_key=api_key)
 
     result = await unfollow_user_by_id(
         session=session,
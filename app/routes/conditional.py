@@ -0,0 +1,63 @@
+"""
+This module contains support of conditional GET requests.
+
+Responses carry a strong ETag computed from a cheap version stamp of their
+content. A request whose 'If-None-Match' header matches it is answered with
+304 Not Modified before the content is queried and encoded.
+"""
+
+import hashlib
+from typing import Any, Dict, Optional
+
+from fastapi import Response
+from starlette.status import HTTP_304_NOT_MODIFIED
+
+# Clients keep the response but revalidate it on every use.
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*stamp: Any) -> str:
+    """
+    Build a strong ETag of a version stamp.
+
+    :param stamp: Values which change whenever the content changes
+    :return: A quoted entity tag
+    """
+    digest = hashlib.sha256(repr(stamp).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_headers(etag: str) -> Dict[str, str]:
+    """
+    Build the caching headers of a response.
+
+    :param etag: Entity tag of the response
+    :return: A dictionary of headers
+    """
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check whether the client already has the current content.
+
+    Tags are compared weakly, as RFC 9110 requires for 'If-None-Match'.
+
+    :param if_none_match: Value of the 'If-None-Match' header (optional)
+    :param etag: Current entity tag
+    :return: Bool
+    """
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags
+
+
+def not_modified(etag: str) -> Response:
+    """
+    Build the response telling the client to use its copy.
+
+    :param etag: Current entity tag
+    :return: A response without a body
+    """
+    return Response(status_code=HTTP_304_NOT_MODIFIED, headers=etag_headers(etag))
@@ -1,44 +1,138 @@
 """This module contains CRUD-function for upload image into database."""
 
+import logging
 import os
-import uuid
-from typing import Tuple
+import time
+from typing import List, Optional, Tuple
 
 from fastapi import HTTPException, UploadFile
+from sqlalchemy import Row, select
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR
 
-from app.db.models import Image
+from app.db.models import Image, MediaDeletion
+from app.services.media.config import media_config
+from app.services.media.gc import lock_contents
+from app.services.media.processing import image_processor
+from app.services.media.storage import media_storage
+from app.services.media.uploads import ReceivedUpload, receive_upload, safe_extension
+from app.services.metrics import upload_bytes, upload_duration
 
-IMAGE_UPLOAD_DIR = "/home/static/images"
+logger = logging.getLogger(__name__)
+
+
+async def _find_image_by_content(session: AsyncSession, sha256: str) -> Optional[Row]:
+    """
+    Find the files of an image with the same content.
+
+    :param session: The database session used for the query
+    :param sha256: Hex SHA-256 of the content
+    :return: Row (path, thumbnail_path, medium_path, content_hash) or None
+    """
+    query = (
+        select(Image.path, Image.thumbnail_path, Image.medium_path, Image.content_hash)
+        .where(Image.content_hash == sha256)
+        .limit(1)
+    )
+    return (await session.execute(query)).first()
+
+
+async def _store_new_content(
+    upload: ReceivedUpload, extension: str, stored_keys: List[str]
+) -> Image:
+    """
+    Create the variants of new content and hand the files to the storage.
+
+    :param upload: The received upload
+    :param extension: Extension of the file with the dot
+    :param stored_keys: List receiving the keys of the stored files
+    :return: A new image which is not added to the session
+    """
+    key = media_config.content_key(upload.sha256, extension)
+    variants = await image_processor.create_variants(upload.path)
+    for variant_path in variants.values():
+        upload.attach(variant_path)
+
+    await media_storage.store(upload.path, key)
+    stored_keys.append(key)
+    variant_keys = {}
+    for name, variant_path in variants.items():
+        variant_key = (
+            f"{os.path.splitext(key)[0]}_{name}{os.path.splitext(variant_path)[1]}"
+        )
+        await media_storage.store(variant_path, variant_key)
+        stored_keys.append(variant_key)
+        variant_keys[name] = variant_key
+
+    image = Image(path=media_storage.url(key), content_hash=upload.sha256)
+    if variant_keys:
+        image.thumbnail_path = media_storage.url(variant_keys["thumbnail"])
+        image.medium_path = media_storage.url(variant_keys["medium"])
+    return image
+
+
+async def _record_unused_files(session: AsyncSession, stored_keys: List[str]) -> None:
+    """
+    Hand the files of a failed upload to the media sweeper.
+
+    The files are not deleted here: a concurrent upload of the same content
+    may already refer to them. The sweeper deletes them only when no image
+    does.
+
+    :param session: The database session used for the query
+    :param stored_keys: Keys of the stored files
+    """
+    try:
+        await session.rollback()
+        session.add_all(
+            MediaDeletion(path=media_storage.url(key)) for key in stored_keys
+        )
+        await session.commit()
+    except SQLAlchemyError:
+        logger.exception("Cannot record unused media files %s", stored_keys)
 
 
 async def upload_image(session: AsyncSession, file: UploadFile) -> Tuple[bool, int]:
     """
     Upload an image file to the server.
 
-    Saves it in the specified directory,
-    and stores the image's path in the database.
+    Streams it to a temporary file, creates its resized variants, stores
+    the files under the hash of the content and their paths in the database.
+    Content which is already stored is shared with the existing images
+    instead of being stored again. The content is locked against the media
+    sweeper until the image is committed. When the upload fails after storing
+    new files, they are recorded for the media sweeper.
 
     :param session: The database session used for the query
     :param file: The file objects of type 'UploadFile' containing the image to be uploaded
     :return: Tuple (bool, int). The tuple returns a bool and the image ID on a successful request
     """
+    stored_keys: List[str] = []
+    committed = False
+    started = time.perf_counter()
     try:
-        filename = f"{uuid.uuid4().hex}_{file.filename}"
-        file_path = os.path.join(IMAGE_UPLOAD_DIR, filename)
-
-        os.makedirs(IMAGE_UPLOAD_DIR, exist_ok=True)
-
-        with open(file_path, "wb") as fil:
-            content = await file.read()
-            fil.write(content)
-
-        public_path = f"images/{filename}"
-        image = Image(path=public_path)
-        session.add(image)
-        await session.commit()
+        async with receive_upload(file, media_config) as upload:
+            # The sweeper does not delete files of the content until the
+            # image referring to them is committed.
+            async with lock_contents(session, [upload.sha256]):
+                known = await _find_image_by_content(session, upload.sha256)
+                if known is None:
+                    image = await _store_new_content(
+                        upload, safe_extension(file.filename), stored_keys
+                    )
+                else:
+                    image = Image(
+                        path=known.path,
+                        thumbnail_path=known.thumbnail_path,
+                        medium_path=known.medium_path,
+                        content_hash=known.content_hash,
+                    )
+                session.add(image)
+                await session.commit()
+                committed = True
+        upload_bytes.observe(upload.size)
+        upload_duration.observe(time.perf_counter() - started)
         return True, int(image.id)
     except SQLAlchemyError:
         raise HTTPException(
@@ -49,3 +143,6 @@ async def upload_image(session: AsyncSession, file: UploadFile) -> Tuple[bool, i
                 "error_message": "Database error",
             },
         )
+    finally:
+        if stored_keys and not committed:
+            await _record_unused_files(session, stored_keys)
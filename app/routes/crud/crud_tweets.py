@@ -1,12 +1,24 @@
 """This module contains CRUD-function for tweet and like."""
 
-from typing import List, Optional, Sequence, Tuple
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 from fastapi import HTTPException
-from sqlalchemy import select
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import (
+    JSON,
+    Row,
+    Select,
+    func,
+    literal_column,
+    or_,
+    select,
+    type_coerce,
+)
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm import aliased
 from starlette.status import (
     HTTP_400_BAD_REQUEST,
     HTTP_403_FORBIDDEN,
@@ -14,24 +26,271 @@ from starlette.status import (
     HTTP_500_INTERNAL_SERVER_ERROR,
 )
 
-from app.db.models import Image, Like, Tweet, User
+from app.db.counters import shift_like_count
+from app.db.models import Follow, Image, Like, Tweet, User
+from app.db.schemas.tweet_schemas import TweetCursor
+from app.db.statements import delete_returning_id, insert_ignoring_conflicts
+from app.routes.crud.pagination import (
+    DEFAULT_PAGE_SIZE,
+    apply_keyset,
+    encode_cursor,
+    invalid_cursor_error,
+    parse_page_cursors,
+)
+from app.services.events import (
+    LIKE_CHANGED,
+    TWEET_CREATED,
+    TWEET_DELETED,
+    Event,
+    event_bus,
+)
+from app.services.feed_cache import feed_cache
+from app.services.media.gc import record_deleted_media
+from app.services.timeline import pulled_tweets, timeline_fanout
+
+FeedItem = Dict[str, Any]
+
+
+JSON_AGGREGATES = {
+    "postgresql": (func.json_agg, func.json_build_object),
+    "sqlite": (func.json_group_array, func.json_object),
+}
+# Images are shown as their variants, the original when there are none.
+ATTACHMENT_PATH = func.coalesce(Image.medium_path, Image.path)
+THUMBNAIL_PATH = func.coalesce(Image.thumbnail_path, Image.medium_path, Image.path)
+
+
+def _feed_query(dialect_name: str) -> Select:
+    """
+    Select the tweets shown in the feed as flat rows with their authors.
+
+    Where the dialect has JSON aggregates, likes, attachments and thumbnails
+    are selected as JSON arrays by correlated subqueries of the same statement.
+
+    :param dialect_name: Name of the database dialect
+    :return: A 'Select' statement
+    """
+    query = select(
+        Tweet.id,
+        Tweet.tweet_text,
+        Tweet.like_count,
+        Tweet.created_at,
+        User.id.label("author_id"),
+        User.name.label("author_name"),
+    ).join(User, User.id == Tweet.user_id)
+    aggregates = JSON_AGGREGATES.get(dialect_name)
+    if aggregates is None:
+        return query
+
+    json_array, json_object = aggregates
+    liker = aliased(User)
+    like = json_object(
+        literal_column("'user_id'"),
+        Like.user_id,
+        literal_column("'name'"),
+        liker.name,
+    )
+    attachment = ATTACHMENT_PATH
+    thumbnail = THUMBNAIL_PATH
+    if dialect_name == "postgresql":
+        like = aggregate_order_by(like, Like.id)
+        attachment = aggregate_order_by(attachment, Image.id)
+        thumbnail = aggregate_order_by(thumbnail, Image.id)
+
+    likes = (
+        select(type_coerce(json_array(like), JSON))
+        .join(liker, liker.id == Like.user_id)
+        .where(Like.tweet_id == Tweet.id)
+        .scalar_subquery()
+    )
+    attachments = select(type_coerce(json_array(attachment), JSON)).where(
+        Image.tweet_id == Tweet.id
+    )
+    thumbnails = select(type_coerce(json_array(thumbnail), JSON)).where(
+        Image.tweet_id == Tweet.id
+    )
+    return query.add_columns(
+        likes.label("likes"),
+        attachments.scalar_subquery().label("attachments"),
+        thumbnails.scalar_subquery().label("thumbnails"),
+    )
+
+
+def _feed_item(
+    row: Row,
+    likes: List[Dict[str, Any]],
+    attachments: List[str],
+    thumbnails: List[str],
+) -> FeedItem:
+    """
+    Build the feed item of a tweet row.
+
+    :param row: Row selected by '_feed_query'
+    :param likes: Likes of the tweet
+    :param attachments: Paths of the tweet images
+    :param thumbnails: Paths of the thumbnails of the tweet images
+    :return: A dictionary in the format of 'TweetBase'
+    """
+    return {
+        "id": row.id,
+        "content": row.tweet_text,
+        "attachments": attachments,
+        "thumbnails": thumbnails,
+        "author": {"id": row.author_id, "name": row.author_name},
+        "likes": likes,
+        "like_count": row.like_count,
+    }
 
 
-async def get_all_tweets(session: AsyncSession) -> Sequence[Tweet]:
+async def _feed_items(session: AsyncSession, rows: Sequence[Row]) -> List[FeedItem]:
     """
-    Query the database to get all tweets.
+    Build the feed items of the tweet rows.
+
+    Rows with aggregated likes and images are used as they are. Otherwise
+    likes and images of all tweets are read by one flat query each, without
+    loading ORM objects.
+
+    :param session: The database session used for the query
+    :param rows: Rows selected by '_feed_query'
+    :return: A list of dictionaries in the format of 'TweetBase'
+    """
+    if not rows:
+        return []
+    if "likes" in rows[0]._fields:
+        # Postgres aggregates no rows to NULL, SQLite to an empty array.
+        return [
+            _feed_item(
+                row, row.likes or [], row.attachments or [], row.thumbnails or []
+            )
+            for row in rows
+        ]
+
+    tweet_ids = [row.id for row in rows]
+    likes: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+    attachments: Dict[int, List[str]] = defaultdict(list)
+    thumbnails: Dict[int, List[str]] = defaultdict(list)
+    like_rows = await session.execute(
+        select(Like.tweet_id, Like.user_id, User.name)
+        .join(User, User.id == Like.user_id)
+        .where(Like.tweet_id.in_(tweet_ids))
+        .order_by(Like.id),
+    )
+    for tweet_id, user_id, name in like_rows:
+        likes[tweet_id].append({"user_id": user_id, "name": name})
+
+    image_rows = await session.execute(
+        select(Image.tweet_id, ATTACHMENT_PATH, THUMBNAIL_PATH)
+        .where(Image.tweet_id.in_(tweet_ids))
+        .order_by(Image.id),
+    )
+    for tweet_id, path, thumbnail_path in image_rows:
+        attachments[tweet_id].append(path)
+        thumbnails[tweet_id].append(thumbnail_path)
+
+    return [
+        _feed_item(row, likes[row.id], attachments[row.id], thumbnails[row.id])
+        for row in rows
+    ]
+
+
+async def _fetch_page(
+    session: AsyncSession,
+    query: Select,
+    newer: bool,
+    limit: int,
+) -> Tuple[List[FeedItem], Optional[Row]]:
+    """
+    Execute a query prepared by 'apply_keyset' and cut one page out of it.
 
     :param session: The database session used for the query
-    :return: A list of 'Tweet' objects
+    :param query: The paginated query based on '_feed_query'
+    :param newer: Whether the rows were read in ascending order
+    :param limit: Page size
+    :return: Tuple (list, Row). Feed items of the page and the row to build the next cursor from
     """
     try:
-        query = select(Tweet).options(
-            joinedload(Tweet.user).load_only(User.id, User.name),
-            selectinload(Tweet.likes),
-            selectinload(Tweet.images),
-        )
         res = await session.execute(query)
-        return res.scalars().all()
+        rows = list(res.all())
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        last = rows[-1] if has_more else None
+        if newer:
+            rows.reverse()
+        return await _feed_items(session, rows), last
+    except SQLAlchemyError:
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail={
+                "result": False,
+                "error_type": HTTP_500_INTERNAL_SERVER_ERROR,
+                "error_message": "Database error",
+            },
+        )
+
+
+async def get_all_tweets(
+    session: AsyncSession,
+    limit: int = DEFAULT_PAGE_SIZE,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+) -> Tuple[List[FeedItem], Optional[str]]:
+    """
+    Query the database to get one page of tweets, newest first.
+
+    Tweets are paginated by the keyset (created_at, id), so the cost of a page
+    does not depend on how deep into the feed it is.
+
+    :param session: The database session used for the query
+    :param limit: Maximum number of tweets on the page
+    :param before: Cursor to read tweets older than it (optional)
+    :param after: Cursor to read tweets newer than it (optional)
+    :return: Tuple (list, str). Feed items and the cursor of the next page
+    """
+    cursor, newer = parse_page_cursors(before, after)
+    query = apply_keyset(
+        _feed_query(session.bind.dialect.name),
+        columns=(Tweet.created_at, Tweet.id),
+        cursor_values=(cursor.created_at, cursor.id) if cursor else None,
+        newer=newer,
+        limit=limit,
+    )
+    tweets, last = await _fetch_page(session, query, newer=newer, limit=limit)
+
+    next_cursor = None
+    if last:
+        next_cursor = encode_cursor(TweetCursor(created_at=last.created_at, id=last.id))
+    return tweets, next_cursor
+
+
+async def get_all_tweets_version(
+    session: AsyncSession,
+    limit: int = DEFAULT_PAGE_SIZE,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+) -> List[Tuple[Any, ...]]:
+    """
+    Query the version stamp of a page of tweets, newest first.
+
+    Only the keys of the page rows are read, without joins and aggregates.
+    New and deleted tweets change the IDs, likes change the update time
+    and the counter of a tweet.
+
+    :param session: The database session used for the query
+    :param limit: Maximum number of tweets on the page
+    :param before: Cursor to read tweets older than it (optional)
+    :param after: Cursor to read tweets newer than it (optional)
+    :return: A list of tuples (id, update_at, like_count), including the first row of the next page
+    """
+    cursor, newer = parse_page_cursors(before, after)
+    query = apply_keyset(
+        select(Tweet.id, Tweet.update_at, Tweet.like_count),
+        columns=(Tweet.created_at, Tweet.id),
+        cursor_values=(cursor.created_at, cursor.id) if cursor else None,
+        newer=newer,
+        limit=limit,
+    )
+    try:
+        return [tuple(row) for row in await session.execute(query)]
     except SQLAlchemyError:
         raise HTTPException(
             status_code=HTTP_500_INTERNAL_SERVER_ERROR,
@@ -43,30 +302,207 @@ async def get_all_tweets(session: AsyncSession) -> Sequence[Tweet]:
         )
 
 
+async def get_home_tweets(
+    session: AsyncSession,
+    user_id: int,
+    limit: int = DEFAULT_PAGE_SIZE,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+) -> Tuple[List[FeedItem], Optional[str]]:
+    """
+    Query the database to get one page of the user's home timeline.
+
+    The timeline contains tweets of the users the user follows and their own
+    tweets, ordered by the denormalized number of likes. Like rows are loaded
+    only for the tweets of the page.
+
+    :param session: The database session used for the query
+    :param user_id: The ID of the user whose timeline is requested
+    :param limit: Maximum number of tweets on the page
+    :param before: Cursor to read tweets ranked lower than it (optional)
+    :param after: Cursor to read tweets ranked higher than it (optional)
+    :return: Tuple (list, str). Feed items and the cursor of the next page
+    """
+    cursor, newer = parse_page_cursors(before, after)
+    if cursor and cursor.likes is None:
+        raise invalid_cursor_error()
+
+    followed_ids = select(Follow.followed_id).where(Follow.follower_id == user_id)
+    query = _feed_query(session.bind.dialect.name).where(
+        or_(Tweet.user_id == user_id, Tweet.user_id.in_(followed_ids)),
+    )
+    query = apply_keyset(
+        query,
+        columns=(Tweet.like_count, Tweet.created_at, Tweet.id),
+        cursor_values=(cursor.likes, cursor.created_at, cursor.id) if cursor else None,
+        newer=newer,
+        limit=limit,
+    )
+    tweets, last = await _fetch_page(session, query, newer=newer, limit=limit)
+
+    next_cursor = None
+    if last:
+        next_cursor = encode_cursor(
+            TweetCursor(likes=last.like_count, created_at=last.created_at, id=last.id),
+        )
+    return tweets, next_cursor
+
+
+async def get_following_tweets(
+    session: AsyncSession,
+    user_id: int,
+    limit: int = DEFAULT_PAGE_SIZE,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+) -> Tuple[List[FeedItem], Optional[str]]:
+    """
+    Query the database to get one page of the user's following timeline.
+
+    The timeline contains tweets of the users the user follows and their own
+    tweets, newest first. With fan-out enabled it is read from the materialized
+    timeline, merged with the tweets of the followed celebrities.
+
+    :param session: The database session used for the query
+    :param user_id: The ID of the user whose timeline is requested
+    :param limit: Maximum number of tweets on the page
+    :param before: Cursor to read tweets older than it (optional)
+    :param after: Cursor to read tweets newer than it (optional)
+    :return: Tuple (list, str). Feed items and the cursor of the next page
+    """
+    cursor, newer = parse_page_cursors(before, after)
+    if not timeline_fanout.enabled:
+        followed_ids = select(Follow.followed_id).where(Follow.follower_id == user_id)
+        query = _feed_query(session.bind.dialect.name).where(
+            or_(Tweet.user_id == user_id, Tweet.user_id.in_(followed_ids)),
+        )
+        query = apply_keyset(
+            query,
+            columns=(Tweet.created_at, Tweet.id),
+            cursor_values=(cursor.created_at, cursor.id) if cursor else None,
+            newer=newer,
+            limit=limit,
+        )
+        tweets, last = await _fetch_page(session, query, newer=newer, limit=limit)
+        if not last:
+            return tweets, None
+        return tweets, encode_cursor(
+            TweetCursor(created_at=last.created_at, id=last.id)
+        )
+
+    try:
+        positions = await _read_materialized_timeline(
+            session,
+            user_id=user_id,
+            cursor=cursor,
+            newer=newer,
+            limit=limit,
+        )
+        page = positions[:limit]
+        if newer:
+            page.reverse()
+        query = _feed_query(session.bind.dialect.name).where(
+            Tweet.id.in_([tweet_id for _, tweet_id in page])
+        )
+        loaded = {row.id: row for row in (await session.execute(query)).all()}
+        tweets = await _feed_items(
+            session,
+            [loaded[tweet_id] for _, tweet_id in page if tweet_id in loaded],
+        )
+    except SQLAlchemyError:
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail={
+                "result": False,
+                "error_type": HTTP_500_INTERNAL_SERVER_ERROR,
+                "error_message": "Database error",
+            },
+        )
+
+    next_cursor = None
+    if len(positions) > limit:
+        created_at, tweet_id = page[0] if newer else page[-1]
+        next_cursor = encode_cursor(TweetCursor(created_at=created_at, id=tweet_id))
+    return tweets, next_cursor
+
+
+async def _read_materialized_timeline(
+    session: AsyncSession,
+    user_id: int,
+    cursor: Optional[TweetCursor],
+    newer: bool,
+    limit: int,
+) -> List[Tuple[datetime, int]]:
+    """
+    Read positions of the timeline tweets from the fan-out store.
+
+    Tweets of the user and the tweets which were not fanned out are pulled
+    from the tweets table and merged in. Entries of deleted tweets left in
+    the store, e.g. in the memory of another worker, are skipped and more
+    entries are read in their place.
+
+    :param session: The database session used for the query
+    :param user_id: The ID of the timeline owner
+    :param cursor: Position to read from (optional)
+    :param newer: Read tweets newer than the cursor instead of older ones
+    :param limit: Page size
+    :return: Up to limit + 1 (created_at, id) pairs in reading order
+    """
+    positions = set()
+    store_cursor = cursor
+    while len(positions) <= limit:
+        items = await timeline_fanout.store.read(
+            session,
+            user_id=user_id,
+            cursor=store_cursor,
+            newer=newer,
+            limit=limit + 1,
+        )
+        if not items:
+            break
+        query = select(Tweet.id).where(Tweet.id.in_([item.tweet_id for item in items]))
+        existing = set((await session.execute(query)).scalars())
+        positions.update(
+            (item.created_at, item.tweet_id)
+            for item in items
+            if item.tweet_id in existing
+        )
+        if len(items) <= limit:
+            break
+        store_cursor = TweetCursor(
+            created_at=items[-1].created_at, id=items[-1].tweet_id
+        )
+
+    query = apply_keyset(
+        select(Tweet.created_at, Tweet.id).where(pulled_tweets(user_id)),
+        columns=(Tweet.created_at, Tweet.id),
+        cursor_values=(cursor.created_at, cursor.id) if cursor else None,
+        newer=newer,
+        limit=limit,
+    )
+    positions.update(tuple(row) for row in (await session.execute(query)).all())
+    return sorted(positions, reverse=not newer)[: limit + 1]
+
+
 async def add_like_to_tweet(session: AsyncSession, tweet_id: int, user_id: int) -> bool:
     """
     Add a like to a user's tweet.
 
+    The like is inserted by a single statement, a repeated like is ignored
+    by the unique constraint and a missing tweet violates the foreign key.
+
     :param session: The database session used for the query
     :param tweet_id: The ID of the tweet to which the like will be added
     :param user_id: The ID of the user who is adding the like
     :return: Bool
     """
     try:
-        tweet = await session.get(Tweet, tweet_id)
-        if not tweet:
-            raise HTTPException(
-                status_code=HTTP_404_NOT_FOUND,
-                detail={
-                    "result": False,
-                    "error_type": HTTP_404_NOT_FOUND,
-                    "error_message": f"Tweet with id {tweet_id} not found",
-                },
-            )
-
-        query = select(Like).where(Like.user_id == user_id, Like.tweet_id == tweet_id)
-        result = await session.execute(query)
-        if result.scalar():
+        like_id = await insert_ignoring_conflicts(
+            session,
+            Like,
+            user_id=user_id,
+            tweet_id=tweet_id,
+        )
+        if like_id is None:
             raise HTTPException(
                 status_code=HTTP_400_BAD_REQUEST,
                 detail={
@@ -76,11 +512,17 @@ async def add_like_to_tweet(session: AsyncSession, tweet_id: int, user_id: int)
                 },
             )
 
-        like = Like(user_id=user_id, tweet_id=tweet_id)
-        session.add(like)
+        author_id, like_count = await _shift_like_count(session, tweet_id, 1)
         await session.commit()
+        await feed_cache.invalidate()
+        await event_bus.publish(
+            Event(LIKE_CHANGED, tweet_id, author_id, user_id, like_count),
+        )
         return True
 
+    except IntegrityError:
+        await session.rollback()
+        raise _tweet_not_found_error(tweet_id)
     except SQLAlchemyError:
         raise HTTPException(
             status_code=HTTP_500_INTERNAL_SERVER_ERROR,
@@ -100,27 +542,24 @@ async def delete_like_from_tweet(
     """
     Delete a like from a tweet.
 
+    The tweet is looked up only when there was no like to delete,
+    to tell a missing tweet from a missing like.
+
     :param session: The database session used for the query
     :param tweet_id: The ID of the tweet from which the like will be removed
     :param user_id: The ID of the user who is removing the like
     :return: Bool
     """
     try:
-        tweet = await session.get(Tweet, tweet_id)
-        if not tweet:
-            raise HTTPException(
-                status_code=HTTP_404_NOT_FOUND,
-                detail={
-                    "result": False,
-                    "error_type": HTTP_404_NOT_FOUND,
-                    "error_message": f"Tweet with id {tweet_id} not found",
-                },
-            )
-
-        query = select(Like).where(Like.user_id == user_id, Like.tweet_id == tweet_id)
-        result = await session.execute(query)
-        like = result.scalar_one_or_none()
-        if not like:
+        like_id = await delete_returning_id(
+            session,
+            Like,
+            Like.user_id == user_id,
+            Like.tweet_id == tweet_id,
+        )
+        if like_id is None:
+            if not await session.get(Tweet, tweet_id):
+                raise _tweet_not_found_error(tweet_id)
             raise HTTPException(
                 status_code=HTTP_404_NOT_FOUND,
                 detail={
@@ -130,8 +569,12 @@ async def delete_like_from_tweet(
                 },
             )
 
-        await session.delete(like)
+        author_id, like_count = await _shift_like_count(session, tweet_id, -1)
         await session.commit()
+        await feed_cache.invalidate()
+        await event_bus.publish(
+            Event(LIKE_CHANGED, tweet_id, author_id, user_id, like_count),
+        )
         return True
 
     except SQLAlchemyError:
@@ -145,6 +588,41 @@ async def delete_like_from_tweet(
         )
 
 
+async def _shift_like_count(
+    session: AsyncSession, tweet_id: int, delta: int
+) -> Tuple[int, int]:
+    """
+    Change the number of likes of a tweet.
+
+    :param session: The database session used for the query
+    :param tweet_id: The ID of the tweet
+    :param delta: 1 for a new like, -1 for a removed one
+    :return: Tuple (int, int). The ID of the author and the new number of likes
+    """
+    query = shift_like_count(tweet_id, delta)
+    if session.bind.dialect.update_returning:
+        res = await session.execute(query.returning(Tweet.user_id, Tweet.like_count))
+    else:
+        await session.execute(query)
+        res = await session.execute(
+            select(Tweet.user_id, Tweet.like_count).where(Tweet.id == tweet_id),
+        )
+    author_id, like_count = res.one()
+    return author_id, like_count
+
+
+def _tweet_not_found_error(tweet_id: int) -> HTTPException:
+    """Build the error returned when a tweet does not exist."""
+    return HTTPException(
+        status_code=HTTP_404_NOT_FOUND,
+        detail={
+            "result": False,
+            "error_type": HTTP_404_NOT_FOUND,
+            "error_message": f"Tweet with id {tweet_id} not found",
+        },
+    )
+
+
 async def create_tweet(
     session: AsyncSession,
     user_id: int,
@@ -173,6 +651,13 @@ async def create_tweet(
                 image.tweet_id = tweet.id
 
         await session.commit()
+        await feed_cache.invalidate()
+        await event_bus.publish(Event(TWEET_CREATED, tweet.id, user_id))
+        await timeline_fanout.submit(
+            tweet_id=tweet.id,
+            author_id=user_id,
+            created_at=tweet.created_at,
+        )
         return True, int(tweet.id)
 
     except SQLAlchemyError:
@@ -220,8 +705,12 @@ async def delete_tweet_db(session: AsyncSession, tweet_id, user_id: int) -> bool
                 },
             )
 
+        await timeline_fanout.store.remove_tweet(session, tweet_id)
+        await session.execute(record_deleted_media(Image.tweet_id == tweet_id))
         await session.delete(tweet)
         await session.commit()
+        await feed_cache.invalidate()
+        await event_bus.publish(Event(TWEET_DELETED, tweet_id, user_id))
         return True
     except SQLAlchemyError:
         raise HTTPException(
@@ -1,27 +1,159 @@
 """This module contains CRUD-function for user."""
 
-from typing import Optional, Union
+from typing import Any, List, Optional, Tuple, Union
 
 from fastapi import HTTPException
 from sqlalchemy import Column, select
-from sqlalchemy.exc import NoResultFound, SQLAlchemyError
+from sqlalchemy.exc import IntegrityError, NoResultFound, SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import InstrumentedAttribute, joinedload
+from sqlalchemy.orm import InstrumentedAttribute, joinedload, raiseload
+from sqlalchemy.orm.interfaces import ORMOption
 from starlette.status import (
     HTTP_400_BAD_REQUEST,
     HTTP_404_NOT_FOUND,
     HTTP_500_INTERNAL_SERVER_ERROR,
 )
 
+from app.db.counters import shift_follow_counts
 from app.db.models import Follow, User
+from app.db.statements import delete_returning_id, insert_ignoring_conflicts
+from app.services.cache import UserIdentity, identity_cache
+from app.services.events import USER_FOLLOWED, USER_UNFOLLOWED, Event, event_bus
+from app.services.timeline import timeline_fanout
 
 
 async def get_user(session: AsyncSession, api_key_or_id: Union[str, int]) -> User:
     """
     Fetch a user from the database using their API key or user ID.
 
+    Followers and followed users are loaded with the user.
+
+    :param session: The database session used for the query
+    :param api_key_or_id: API key or the user ID
+    :return: A 'User' object
+    """
+    return await _fetch_user(
+        session,
+        api_key_or_id,
+        joinedload(User.followers).load_only(User.id, User.name),
+        joinedload(User.following).load_only(User.id, User.name),
+    )
+
+
+async def get_user_basic(session: AsyncSession, api_key_or_id: Union[str, int]) -> User:
+    """
+    Fetch a user without their followers and followed users.
+
+    :param session: The database session used for the query
+    :param api_key_or_id: API key or the user ID
+    :return: A 'User' object, its follow relationships must not be accessed
+    """
+    return await _fetch_user(
+        session,
+        api_key_or_id,
+        raiseload(User.followers),
+        raiseload(User.following),
+    )
+
+
+async def get_user_version(
+    session: AsyncSession, api_key_or_id: Union[str, int]
+) -> Optional[Tuple[Any, ...]]:
+    """
+    Query the version stamp of a user's profile.
+
+    Follows change the counters and the update time of both users.
+
+    :param session: The database session used for the query
+    :param api_key_or_id: API key or the user ID
+    :return: Tuple (id, update_at, followers_count, following_count) or None, when the user does not exist
+    """
+    param = User.id if isinstance(api_key_or_id, int) else User.api_key
+    query = select(
+        User.id, User.update_at, User.followers_count, User.following_count
+    ).where(param == api_key_or_id)
+    try:
+        row = (await session.execute(query)).first()
+    except SQLAlchemyError:
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail={
+                "result": False,
+                "error_type": HTTP_500_INTERNAL_SERVER_ERROR,
+                "error_message": "Database error",
+            },
+        )
+    return tuple(row) if row else None
+
+
+async def get_user_identity(session: AsyncSession, api_key: str) -> UserIdentity:
+    """
+    Resolve an API key to the user's ID and name.
+
+    The result is cached in the process, so most requests are authorized
+    without a query.
+
+    :param session: The database session used for the query
+    :param api_key: User API key
+    :return: A 'UserIdentity' object
+    """
+    identity = identity_cache.get(api_key)
+    if identity is not None:
+        return identity
+
+    try:
+        query = select(User.id, User.name).where(User.api_key == api_key)
+        row = (await session.execute(query)).one()
+    except NoResultFound:
+        raise _user_not_found_error(api_key)
+    except SQLAlchemyError:
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail={
+                "result": False,
+                "error_type": HTTP_500_INTERNAL_SERVER_ERROR,
+                "error_message": "Database error",
+            },
+        )
+
+    identity = UserIdentity(id=row.id, name=row.name)
+    identity_cache.set(api_key, identity)
+    return identity
+
+
+async def get_followed_ids(session: AsyncSession, user_id: int) -> List[int]:
+    """
+    Query the IDs of the users a user follows.
+
+    :param session: The database session used for the query
+    :param user_id: The ID of the follower
+    :return: A list of user IDs
+    """
+    query = select(Follow.followed_id).where(Follow.follower_id == user_id)
+    try:
+        return list((await session.execute(query)).scalars())
+    except SQLAlchemyError:
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail={
+                "result": False,
+                "error_type": HTTP_500_INTERNAL_SERVER_ERROR,
+                "error_message": "Database error",
+            },
+        )
+
+
+async def _fetch_user(
+    session: AsyncSession,
+    api_key_or_id: Union[str, int],
+    *options: ORMOption,
+) -> User:
+    """
+    Fetch a user by API key or ID with the given loader options.
+
     :param session: The database session used for the query
     :param api_key_or_id: API key or the user ID
+    :param options: Loader options of the query
     :return: A 'User' object
     """
     param_type = Union[InstrumentedAttribute[int], Column[int]]
@@ -31,26 +163,12 @@ async def get_user(session: AsyncSession, api_key_or_id: Union[str, int]) -> Use
             param = User.id
         else:
             param = User.api_key
-        query = (
-            select(User)
-            .where(param == api_key_or_id)
-            .options(
-                joinedload(User.followers).load_only(User.id, User.name),
-                joinedload(User.following).load_only(User.id, User.name),
-            )
-        )
+        query = select(User).where(param == api_key_or_id).options(*options)
         res = await session.execute(query)
 
         return res.unique().scalars().one()
     except NoResultFound:
-        raise HTTPException(
-            status_code=HTTP_404_NOT_FOUND,
-            detail={
-                "result": False,
-                "error_type": HTTP_404_NOT_FOUND,
-                "error_message": f"Not found user with api-key/id: {api_key_or_id}",
-            },
-        )
+        raise _user_not_found_error(api_key_or_id)
     except SQLAlchemyError:
         raise HTTPException(
             status_code=HTTP_500_INTERNAL_SERVER_ERROR,
@@ -62,6 +180,18 @@ async def get_user(session: AsyncSession, api_key_or_id: Union[str, int]) -> Use
         )
 
 
+def _user_not_found_error(api_key_or_id: Union[str, int]) -> HTTPException:
+    """Build the error returned when a user does not exist."""
+    return HTTPException(
+        status_code=HTTP_404_NOT_FOUND,
+        detail={
+            "result": False,
+            "error_type": HTTP_404_NOT_FOUND,
+            "error_message": f"Not found user with api-key/id: {api_key_or_id}",
+        },
+    )
+
+
 async def follow_user_by_id(
     session: AsyncSession,
     follower_id: int,
@@ -70,6 +200,12 @@ async def follow_user_by_id(
     """
     Allow a user to follow another user by their user ID.
 
+    The follow is inserted by a single statement, a repeated follow is ignored
+    by the unique constraint and a missing user violates the foreign key.
+    With fan-out enabled, the latest fanned out tweets of the followed user
+    are pushed into the follower's timeline. The follow is published, so
+    the follower's open streams get the followed user's events.
+
     :param session: The database session used for the query
     :param follower_id: The ID of the user who wants to follow another user
     :param followed_id: The ID of the user to be followed
@@ -85,23 +221,13 @@ async def follow_user_by_id(
             },
         )
     try:
-        followed = await session.get(User, followed_id)
-        if not followed:
-            raise HTTPException(
-                status_code=HTTP_404_NOT_FOUND,
-                detail={
-                    "result": False,
-                    "error_type": HTTP_404_NOT_FOUND,
-                    "error_message": f"User with id {followed_id} to follow not found",
-                },
-            )
-
-        query = select(Follow).where(
-            Follow.follower_id == follower_id,
-            Follow.followed_id == followed_id,
+        follow_id = await insert_ignoring_conflicts(
+            session,
+            Follow,
+            follower_id=follower_id,
+            followed_id=followed_id,
         )
-        result = await session.execute(query)
-        if result.scalar():
+        if follow_id is None:
             raise HTTPException(
                 status_code=HTTP_400_BAD_REQUEST,
                 detail={
@@ -111,11 +237,21 @@ async def follow_user_by_id(
                 },
             )
 
-        follow = Follow(follower_id=follower_id, followed_id=followed_id)
-        session.add(follow)
-
+        await session.execute(shift_follow_counts(follower_id, followed_id, 1))
+        await timeline_fanout.backfill(session, follower_id, followed_id)
         await session.commit()
+        await event_bus.publish(Event(USER_FOLLOWED, None, followed_id, follower_id))
         return True
+    except IntegrityError:
+        await session.rollback()
+        raise HTTPException(
+            status_code=HTTP_404_NOT_FOUND,
+            detail={
+                "result": False,
+                "error_type": HTTP_404_NOT_FOUND,
+                "error_message": f"User with id {followed_id} to follow not found",
+            },
+        )
     except SQLAlchemyError:
         raise HTTPException(
             status_code=HTTP_500_INTERNAL_SERVER_ERROR,
@@ -135,6 +271,10 @@ async def unfollow_user_by_id(
     """
     Allow a user to unfollow another user by their user ID.
 
+    The user to unfollow is looked up only when there was no follow to delete,
+    to tell a missing user from a missing follow. The unfollow is published,
+    so the follower's open streams stop getting the user's events.
+
     :param session: The database session used for the query
     :param follower_id: The ID of the user who wants to unfollow another user
     :param followed_id: The ID of the user to be unfollowed
@@ -151,14 +291,14 @@ async def unfollow_user_by_id(
         )
 
     try:
-        query = select(Follow).where(
+        follow_id = await delete_returning_id(
+            session,
+            Follow,
             Follow.follower_id == follower_id,
             Follow.followed_id == followed_id,
         )
-        result = await session.execute(query)
-        follow = result.scalar_one_or_none()
-
-        if not follow:
+        if follow_id is None:
+            await get_user_basic(session, followed_id)
             raise HTTPException(
                 status_code=HTTP_400_BAD_REQUEST,
                 detail={
@@ -167,8 +307,14 @@ async def unfollow_user_by_id(
                     "error_message": "Not following this user",
                 },
             )
-        await session.delete(follow)
+        await session.execute(shift_follow_counts(follower_id, followed_id, -1))
+        await timeline_fanout.store.remove_author(
+            session,
+            user_id=follower_id,
+            author_id=followed_id,
+        )
         await session.commit()
+        await event_bus.publish(Event(USER_UNFOLLOWED, None, followed_id, follower_id))
         return True
     except SQLAlchemyError:
         raise HTTPException(
@@ -0,0 +1,299 @@
+"""
+This module contains the generator of synthetic data for load testing.
+
+Users, follows, tweets, likes and images are generated from a seed, so the
+same parameters always produce the same data. Followers, authors of tweets
+and likes follow a power law: a few users are followed by many and write
+most of the tweets, like celebrities do.
+
+Users and tweets get explicit IDs from a range reserved before writing,
+so the rows of concurrent writers never take them. The other rows get
+their IDs from the database. Rows are written in batches, by COPY on
+Postgres and by batched inserts elsewhere. The counters are recomputed
+at the end. With fan-out to the SQL timeline store enabled, the generated
+tweets are fanned out to the timelines of the followers as well.
+"""
+
+import itertools
+import random
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Dict, Iterator, List, Sequence, Tuple, Type
+
+from sqlalchemy import DateTime, func, insert, literal, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.base_model import BaseModel, utc_now
+from app.db.counters import repair_counters
+from app.db.models import Follow, Image, Like, TimelineEntry, Tweet, User
+from app.routes.crud.insert_data import IMAGE_DATA
+from app.services.timeline import SQLTimelineStore, timeline_fanout
+
+Record = Tuple[Any, ...]
+
+
+@dataclass
+class GenerationParams:
+    """Size and shape of the generated data."""
+
+    users: int = 1000
+    tweets: int = 10000
+    follows_per_user: float = 20
+    likes_per_tweet: float = 5
+    image_share: float = 0.2
+    # Exponent of the Zipf distribution of the users' popularity.
+    popularity_exponent: float = 1.1
+    # Tweets are spread over this many days before now.
+    days: int = 365
+    seed: int = 0
+    batch_size: int = 5000
+
+
+class DataGenerator:
+    """Generates the rows of one run."""
+
+    def __init__(self, params: GenerationParams, first_ids: Dict[str, int]):
+        self.params = params
+        self.rng = random.Random(params.seed)
+        self.now = utc_now()
+        self.user_ids = range(first_ids["users"], first_ids["users"] + params.users)
+        self.tweet_ids = range(first_ids["tweets"], first_ids["tweets"] + params.tweets)
+
+        ranked = list(self.user_ids)
+        self.rng.shuffle(ranked)
+        self._ranked_users = ranked
+        self._popularity = list(
+            itertools.accumulate(
+                1 / rank**params.popularity_exponent
+                for rank in range(1, len(ranked) + 1)
+            ),
+        )
+
+    def popular_users(self, count: int) -> List[int]:
+        """
+        Draw users by their popularity.
+
+        :param count: Number of users to draw, with repetitions
+        :return: A list of user IDs
+        """
+        return self.rng.choices(
+            self._ranked_users, cum_weights=self._popularity, k=count
+        )
+
+    def amount(self, mean: float, limit: int) -> int:
+        """
+        Draw an exponentially distributed number.
+
+        :param mean: Mean of the distribution
+        :param limit: Maximum value
+        :return: The number
+        """
+        if mean <= 0:
+            return 0
+        return min(int(self.rng.expovariate(1 / mean)), limit)
+
+    def users(self) -> Iterator[Record]:
+        """Generate rows (id, name, api_key, created_at, update_at) of users."""
+        for user_id in self.user_ids:
+            created_at = self.now - timedelta(days=self.params.days)
+            yield user_id, f"User {user_id}", f"gen-{user_id}", created_at, created_at
+
+    def follows(self) -> Iterator[Record]:
+        """Generate rows (follower_id, followed_id, created_at, update_at) of follows."""
+        for follower_id in self.user_ids:
+            count = self.amount(self.params.follows_per_user, len(self.user_ids) - 1)
+            followed = set()
+            # Popular users are drawn repeatedly, the attempts are limited.
+            for followed_id in self.popular_users(count * 3):
+                if len(followed) == count:
+                    break
+                if followed_id != follower_id and followed_id not in followed:
+                    followed.add(followed_id)
+                    yield follower_id, followed_id, self.now, self.now
+
+    def tweets(self) -> Iterator[Record]:
+        """Generate rows (id, tweet_text, user_id, created_at, update_at) of tweets."""
+        step = timedelta(days=self.params.days) / max(len(self.tweet_ids), 1)
+        start = self.now - timedelta(days=self.params.days)
+        authors = self.popular_users(len(self.tweet_ids))
+        for position, (tweet_id, author_id) in enumerate(zip(self.tweet_ids, authors)):
+            created_at = start + step * position
+            yield tweet_id, f"Tweet {tweet_id}", author_id, created_at, created_at
+
+    def likes(self) -> Iterator[Record]:
+        """Generate rows (user_id, tweet_id, created_at, update_at) of likes."""
+        for tweet_id in self.tweet_ids:
+            count = self.amount(self.params.likes_per_tweet, len(self.user_ids))
+            for user_id in self.rng.sample(self.user_ids, count):
+                yield user_id, tweet_id, self.now, self.now
+
+    def images(self) -> Iterator[Record]:
+        """Generate rows (tweet_id, path, created_at, update_at) of images."""
+        paths = [image["path"] for image in IMAGE_DATA]
+        for tweet_id in self.tweet_ids:
+            if self.rng.random() < self.params.image_share:
+                yield tweet_id, self.rng.choice(paths), self.now, self.now
+
+
+TABLES: Sequence[Tuple[Type[BaseModel], str, Sequence[str]]] = (
+    (User, "users", ("id", "name", "api_key", "created_at", "update_at")),
+    (Follow, "follows", ("follower_id", "followed_id", "created_at", "update_at")),
+    (Tweet, "tweets", ("id", "tweet_text", "user_id", "created_at", "update_at")),
+    (Like, "likes", ("user_id", "tweet_id", "created_at", "update_at")),
+    (Image, "images", ("tweet_id", "path", "created_at", "update_at")),
+)
+
+
+def _batches(records: Iterator[Record], size: int) -> Iterator[List[Record]]:
+    """Split the records into lists of the size."""
+    while True:
+        batch = list(itertools.islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+
+async def _write_batch(
+    session: AsyncSession,
+    model: Type[BaseModel],
+    columns: Sequence[str],
+    batch: List[Record],
+) -> None:
+    """Write a batch of records by COPY on Postgres or a batched insert."""
+    if session.bind.dialect.name == "postgresql":
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            model.__tablename__, records=batch, columns=list(columns)
+        )
+    else:
+        await session.execute(
+            insert(model.__table__),
+            [dict(zip(columns, record)) for record in batch],
+        )
+
+
+async def _reserve_ids(
+    session: AsyncSession, model: Type[BaseModel], count: int
+) -> int:
+    """
+    Reserve a range of IDs of a table for rows inserted with explicit IDs.
+
+    On Postgres the table is locked against inserts while the sequence is
+    moved past the range, so concurrent inserts take IDs after it.
+
+    :param session: The database session used for the query
+    :param model: Model of the table
+    :param count: Number of IDs
+    :return: The first ID of the range
+    """
+    table_name = model.__tablename__
+    max_id = select(func.coalesce(func.max(model.id), 0) + 1).scalar_subquery()
+    if session.bind.dialect.name == "postgresql" and count:
+        sequence = f"pg_get_serial_sequence('{table_name}', 'id')"
+        await session.execute(text(f"LOCK TABLE {table_name} IN EXCLUSIVE MODE"))
+        # Earlier rows may have been inserted with IDs the sequence skipped.
+        first_id = await session.scalar(
+            select(func.greatest(text(f"nextval({sequence})"), max_id))
+        )
+        await session.execute(
+            text(f"SELECT setval({sequence}, :last_id)"),
+            {"last_id": first_id + count - 1},
+        )
+    else:
+        first_id = await session.scalar(select(max_id))
+    await session.commit()
+    return first_id
+
+
+async def _fan_out_tweets(
+    session: AsyncSession, first_id: int, last_id: int, batch_size: int
+) -> int:
+    """
+    Push the generated tweets into the timelines of the followers.
+
+    Tweets of celebrities are left to be pulled by the readers, like the
+    fan-out worker does.
+
+    :param session: The database session used for the query
+    :param first_id: ID of the first generated tweet
+    :param last_id: ID of the last generated tweet
+    :param batch_size: Number of tweets fanned out in one transaction
+    :return: Number of inserted timeline entries
+    """
+    now = literal(utc_now(), DateTime)
+    regular_authors = select(User.id).where(
+        User.followers_count <= timeline_fanout.follower_threshold
+    )
+    inserted = 0
+    for batch_first_id in range(first_id, last_id + 1, batch_size):
+        tweet_ids = Tweet.id.between(batch_first_id, batch_first_id + batch_size - 1)
+        entries = (
+            select(
+                Follow.follower_id, Tweet.id, Tweet.user_id, Tweet.created_at, now, now
+            )
+            .join(Follow, Follow.followed_id == Tweet.user_id)
+            .where(tweet_ids, Tweet.user_id.in_(regular_authors))
+        )
+        res = await session.execute(
+            insert(TimelineEntry).from_select(
+                [
+                    "user_id",
+                    "tweet_id",
+                    "author_id",
+                    "tweet_created_at",
+                    "created_at",
+                    "update_at",
+                ],
+                entries,
+            ),
+        )
+        await session.execute(
+            update(Tweet)
+            .where(tweet_ids, Tweet.user_id.in_(regular_authors))
+            .values(fanned_out=True)
+        )
+        await session.commit()
+        inserted += res.rowcount
+    return inserted
+
+
+async def generate_data(
+    session: AsyncSession, params: GenerationParams
+) -> Dict[str, int]:
+    """
+    Generate users, follows, tweets, likes and images.
+
+    Every batch is committed separately, so millions of rows are written
+    with bounded memory and short transactions.
+
+    :param session: The database session used for the query
+    :param params: Size and shape of the data
+    :return: A dictionary of table names and numbers of inserted rows
+    """
+    first_ids = {
+        "users": await _reserve_ids(session, User, params.users),
+        "tweets": await _reserve_ids(session, Tweet, params.tweets),
+    }
+    generator = DataGenerator(params, first_ids)
+
+    inserted = {}
+    for model, table_name, columns in TABLES:
+        inserted[table_name] = 0
+        records = getattr(generator, table_name)()
+        for batch in _batches(records, params.batch_size):
+            await _write_batch(session, model, columns, batch)
+            await session.commit()
+            inserted[table_name] += len(batch)
+
+    await repair_counters(session)
+
+    # The memory store lives in the processes of the workers.
+    if timeline_fanout.enabled and isinstance(timeline_fanout.store, SQLTimelineStore):
+        inserted["timeline_entries"] = await _fan_out_tweets(
+            session,
+            first_id=first_ids["tweets"],
+            last_id=first_ids["tweets"] + params.tweets - 1,
+            batch_size=params.batch_size,
+        )
+    return inserted
@@ -1,8 +1,9 @@
 """This module contains functions, which insert test data in the database."""
 
-from sqlalchemy import select
+from sqlalchemy import exists, select
 
 from app.db.base_model import Base
+from app.db.counters import repair_counters
 from app.db.db_settings import db_session
 from app.db.models import Follow, Image, Like, Tweet, User
 
@@ -79,9 +80,8 @@ async def insert_images(session):
 
 
 async def insert_data(session):
-    """Insert test data in the database."""
-    existing_users = (await session.execute(select(User))).scalars().all()
-    if existing_users:
+    """Insert test data in the database, unless it already has users."""
+    if await session.scalar(select(exists().select_from(User))):
         return
 
     await insert_users(session)
@@ -89,3 +89,4 @@ async def insert_data(session):
     await insert_follows(session)
     await insert_likes(session)
     await insert_images(session)
+    await repair_counters(session)
@@ -0,0 +1,107 @@
+"""This module contains helpers for keyset (cursor-based) pagination."""
+
+import base64
+from typing import Any, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import Select, tuple_
+from starlette.status import HTTP_400_BAD_REQUEST
+
+from app.db.schemas.tweet_schemas import TweetCursor
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(cursor: TweetCursor) -> str:
+    """
+    Encode a feed position into an opaque URL-safe token.
+
+    :param cursor: Position of the last tweet on the page
+    :return: Base64 token without padding
+    """
+    raw = cursor.model_dump_json().encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> TweetCursor:
+    """
+    Decode a token produced by 'encode_cursor'.
+
+    :param token: Opaque cursor received from the client
+    :return: A 'TweetCursor' object
+    """
+    padding = "=" * (-len(token) % 4)
+    try:
+        raw = base64.urlsafe_b64decode(token + padding)
+        return TweetCursor.model_validate_json(raw)
+    except ValueError:
+        raise invalid_cursor_error()
+
+
+def invalid_cursor_error() -> HTTPException:
+    """Build the error returned for a malformed or foreign cursor."""
+    return HTTPException(
+        status_code=HTTP_400_BAD_REQUEST,
+        detail={
+            "result": False,
+            "error_type": HTTP_400_BAD_REQUEST,
+            "error_message": "Invalid cursor",
+        },
+    )
+
+
+def parse_page_cursors(
+    before: Optional[str],
+    after: Optional[str],
+) -> Tuple[Optional[TweetCursor], bool]:
+    """
+    Decode the 'before'/'after' pair of query parameters.
+
+    :param before: Cursor to read tweets older than it (optional)
+    :param after: Cursor to read tweets newer than it (optional)
+    :return: Tuple (TweetCursor, bool). The decoded cursor and whether newer tweets are requested
+    """
+    if before and after:
+        raise HTTPException(
+            status_code=HTTP_400_BAD_REQUEST,
+            detail={
+                "result": False,
+                "error_type": HTTP_400_BAD_REQUEST,
+                "error_message": "Use either 'before' or 'after' cursor, not both",
+            },
+        )
+
+    token = before or after
+    cursor = decode_cursor(token) if token else None
+    return cursor, after is not None
+
+
+def apply_keyset(
+    query: Select,
+    columns: Sequence[Any],
+    cursor_values: Optional[Sequence[Any]],
+    newer: bool,
+    limit: int,
+) -> Select:
+    """
+    Restrict and order a query for one page of keyset pagination.
+
+    The page is read newest-first by default. With 'newer' set, rows
+    following the cursor are read in ascending order, so the caller has
+    to reverse them. One extra row is requested to detect the next page.
+
+    :param query: The query to paginate
+    :param columns: Sort key columns, the last one must be unique
+    :param cursor_values: Values of the sort key at the cursor (optional)
+    :param newer: Read rows newer than the cursor instead of older ones
+    :param limit: Page size
+    :return: The paginated query
+    """
+    if cursor_values is not None:
+        key = tuple_(*columns)
+        bound = tuple_(*cursor_values)
+        query = query.where(key > bound if newer else key < bound)
+
+    order = [column.asc() if newer else column.desc() for column in columns]
+    return query.order_by(*order).limit(limit + 1)
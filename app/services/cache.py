@@ -0,0 +1,169 @@
+"""This module contains bounded in-process caches."""
+
+import time
+from collections import OrderedDict
+from typing import (
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+KeyT = TypeVar("KeyT", bound=Hashable)
+ValueT = TypeVar("ValueT")
+
+
+class TTLCache(Generic[KeyT, ValueT]):
+    """
+    Least-recently-used cache with a time to live for every entry.
+
+    The cache is not shared between processes, so entries of other workers
+    can only be invalidated by their TTL.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries: "OrderedDict[KeyT, Tuple[float, ValueT]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: KeyT) -> Optional[ValueT]:
+        """
+        Return the cached value, if it is present and not expired.
+
+        :param key: Cache key
+        :return: The value or None
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= self._clock():
+            if entry is not None:
+                self.pop(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: KeyT, value: ValueT) -> None:
+        """
+        Store a value, evicting the least recently used entry when full.
+
+        :param key: Cache key
+        :param value: Value to store
+        """
+        self.pop(key)
+        self._entries[key] = (self._clock() + self.ttl, value)
+        while len(self._entries) > self.max_size:
+            evicted, (_, evicted_value) = self._entries.popitem(last=False)
+            self._on_evict(evicted, evicted_value)
+
+    def pop(self, key: KeyT) -> Optional[ValueT]:
+        """
+        Remove an entry.
+
+        :param key: Cache key
+        :return: The removed value or None
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self._on_evict(key, entry[1])
+        return entry[1]
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        self._entries.clear()
+
+    def _on_evict(self, key: KeyT, value: ValueT) -> None:
+        """Hook called when an entry leaves the cache."""
+
+
+class UserIdentity(NamedTuple):
+    """The part of a user needed to authorize a request."""
+
+    id: int
+    name: str
+
+
+class IdentityCache(TTLCache[str, UserIdentity]):
+    """Cache of API key to user identity, which can be invalidated by user ID."""
+
+    def __init__(
+        self, max_size: int, ttl: float, clock: Callable[[], float] = time.monotonic
+    ):
+        super().__init__(max_size=max_size, ttl=ttl, clock=clock)
+        self._keys_by_user: Dict[int, Set[str]] = {}
+
+    def set(self, key: str, value: UserIdentity) -> None:
+        """Store the identity and remember its key for 'invalidate_user'."""
+        super().set(key, value)
+        self._keys_by_user.setdefault(value.id, set()).add(key)
+
+    def invalidate(self, api_key: str) -> None:
+        """
+        Forget the identity of an API key.
+
+        :param api_key: User API key
+        """
+        self.pop(api_key)
+
+    def invalidate_user(self, user_id: int) -> None:
+        """
+        Forget every API key of a user.
+
+        :param user_id: The ID of the user
+        """
+        for api_key in list(self._keys_by_user.get(user_id, ())):
+            self.pop(api_key)
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        super().clear()
+        self._keys_by_user.clear()
+
+    def _on_evict(self, key: str, value: UserIdentity) -> None:
+        """Drop the evicted key from the reverse index."""
+        api_keys = self._keys_by_user.get(value.id, set())
+        api_keys.discard(key)
+        if not api_keys:
+            self._keys_by_user.pop(value.id, None)
+
+
+class IdentityCacheConfig(BaseSettings):
+    """
+    Identity cache configuration.
+
+    Values are read from 'IDENTITY_CACHE_' prefixed environment variables or the .env file.
+    """
+
+    model_config = SettingsConfigDict(
+        env_prefix="IDENTITY_CACHE_", env_file=".env", extra="ignore"
+    )
+
+    size: int = 10000
+    # Seconds a revoked API key may still be accepted by other workers.
+    ttl: float = 60.0
+
+
+identity_cache_config = IdentityCacheConfig()
+identity_cache = IdentityCache(
+    max_size=identity_cache_config.size, ttl=identity_cache_config.ttl
+)
@@ -0,0 +1,367 @@
+"""
+This module contains the event bus of realtime updates.
+
+CRUD functions publish committed changes of tweets and likes. The bus hands
+every event to the subscriptions of the connected followers of its author.
+Follows and unfollows are published too, they change the authors of the
+follower's subscriptions. With the Postgres backend, events are sent through
+LISTEN/NOTIFY and reach the subscriptions of every worker.
+
+Each subscription has a bounded queue. Publishing never waits for readers:
+a subscription whose queue is full is closed, and its client reconnects
+and reloads the feed.
+"""
+
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Iterable, Optional, Set
+
+import asyncpg
+import orjson
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from sqlalchemy.engine import URL
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.db.db_settings import db_session
+
+logger = logging.getLogger(__name__)
+
+LISTEN_RECONNECT_DELAY = 5
+PUBLISH_ERRORS = (
+    OSError,
+    SQLAlchemyError,
+    asyncpg.PostgresError,
+    asyncpg.InterfaceError,
+)
+
+TWEET_CREATED = "tweet_created"
+TWEET_DELETED = "tweet_deleted"
+LIKE_CHANGED = "like_changed"
+# Events of follows carry the follower as the user and no tweet.
+USER_FOLLOWED = "user_followed"
+USER_UNFOLLOWED = "user_unfollowed"
+
+
+class EventsConfig(BaseSettings):
+    """
+    Event bus configuration.
+
+    Values are read from 'EVENTS_' prefixed environment variables or the .env file.
+    """
+
+    model_config = SettingsConfigDict(
+        env_prefix="EVENTS_", env_file=".env", extra="ignore"
+    )
+
+    # local or postgres
+    backend: str = "local"
+    channel: str = "tweet_events"
+    queue_size: int = 100
+
+
+@dataclass(frozen=True)
+class Event:
+    """A committed change of a tweet or a follow."""
+
+    type: str
+    tweet_id: Optional[int]
+    author_id: int
+    user_id: Optional[int] = None
+    like_count: Optional[int] = None
+
+    def to_json(self) -> bytes:
+        """
+        Encode the event.
+
+        :return: JSON of the event
+        """
+        return orjson.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, payload: str) -> "Event":
+        """
+        Decode an event encoded by 'to_json'.
+
+        :param payload: JSON of the event
+        :return: The event
+        """
+        return cls(**orjson.loads(payload))
+
+
+class Subscription:
+    """Events for one connection, limited to the authors the user follows."""
+
+    def __init__(self, user_id: int, author_ids: Iterable[int], max_size: int):
+        self.user_id = user_id
+        self.author_ids = set(author_ids) | {user_id}
+        self.overflowed = False
+        self._queue: "asyncio.Queue[Optional[Event]]" = asyncio.Queue(maxsize=max_size)
+
+    def offer(self, event: Event) -> None:
+        """
+        Queue an event without waiting.
+
+        A full queue closes the subscription.
+
+        :param event: The event
+        """
+        if self.overflowed:
+            return
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            self.close()
+
+    def close(self) -> None:
+        """Make 'get' return None once the queued events are read."""
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+    async def get(self, timeout: float) -> Optional[Event]:
+        """
+        Wait for the next event.
+
+        :param timeout: Seconds to wait
+        :return: The event or None, when the subscription is closed
+        :raises asyncio.TimeoutError: When no event arrives in time
+        """
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+
+class EventBackend(ABC):
+    """Transport of events between the workers."""
+
+    @abstractmethod
+    async def start(self, dispatch: Callable[[Event], None]) -> None:
+        """
+        Start receiving events.
+
+        :param dispatch: Function handing a received event to the subscriptions
+        """
+
+    @abstractmethod
+    async def stop(self) -> None:
+        """Stop receiving events."""
+
+    @abstractmethod
+    async def publish(self, event: Event) -> None:
+        """
+        Send an event to every worker.
+
+        :param event: The event
+        """
+
+
+class LocalEventBackend(EventBackend):
+    """Events delivered only within the process."""
+
+    def __init__(self):
+        self._dispatch: Optional[Callable[[Event], None]] = None
+
+    async def start(self, dispatch):
+        self._dispatch = dispatch
+
+    async def stop(self):
+        self._dispatch = None
+
+    async def publish(self, event):
+        if self._dispatch is not None:
+            self._dispatch(event)
+
+
+class PostgresEventBackend(EventBackend):
+    """
+    Events sent through Postgres LISTEN/NOTIFY.
+
+    Notifications are sent and received on two dedicated connections, so
+    publishing does not take a connection of the engine's pool. Both are
+    reopened when they are lost.
+    """
+
+    def __init__(self, engine: AsyncEngine, channel: str):
+        self.engine = engine
+        self.channel = channel
+        self._dispatch: Optional[Callable[[Event], None]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._publisher: Optional[asyncpg.Connection] = None
+        # A connection runs one query at a time.
+        self._publish_lock = asyncio.Lock()
+
+    @property
+    def dsn(self) -> str:
+        """Return the engine URL in the form accepted by asyncpg."""
+        url: URL = self.engine.url.set(drivername="postgresql", query={})
+        return url.render_as_string(hide_password=False)
+
+    async def start(self, dispatch):
+        self._dispatch = dispatch
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        async with self._publish_lock:
+            await self._close_publisher()
+
+    async def publish(self, event):
+        async with self._publish_lock:
+            if self._publisher is None or self._publisher.is_closed():
+                self._publisher = await asyncpg.connect(self.dsn)
+            try:
+                await self._publisher.execute(
+                    "SELECT pg_notify($1, $2)", self.channel, event.to_json().decode()
+                )
+            except PUBLISH_ERRORS:
+                # The next event opens a new connection.
+                await self._close_publisher()
+                raise
+
+    async def _close_publisher(self) -> None:
+        """Close the publishing connection."""
+        publisher, self._publisher = self._publisher, None
+        if publisher is not None and not publisher.is_closed():
+            await publisher.close()
+
+    async def _listen(self) -> None:
+        """Keep a listening connection open."""
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                lost = asyncio.Event()
+                connection.add_termination_listener(lambda _: lost.set())
+                await connection.add_listener(self.channel, self._receive)
+                await lost.wait()
+                logger.warning("Lost the connection listening to %s", self.channel)
+            except (OSError, asyncpg.PostgresError):
+                logger.exception("Cannot listen to %s", self.channel)
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            await asyncio.sleep(LISTEN_RECONNECT_DELAY)
+
+    def _receive(self, connection, pid, channel, payload) -> None:
+        """Dispatch a notification."""
+        if self._dispatch is not None:
+            self._dispatch(Event.from_json(payload))
+
+
+class EventBus:
+    """Publishes events and hands them to the matching subscriptions."""
+
+    def __init__(self, backend: EventBackend, queue_size: int):
+        self.backend = backend
+        self.queue_size = queue_size
+        self._by_author: Dict[int, Set[Subscription]] = {}
+        self._by_user: Dict[int, Set[Subscription]] = {}
+
+    @property
+    def subscriptions(self) -> Set[Subscription]:
+        """Return every open subscription."""
+        return set().union(*self._by_author.values())
+
+    async def start(self) -> None:
+        """Start receiving events from the backend."""
+        await self.backend.start(self.dispatch)
+
+    async def stop(self) -> None:
+        """Stop receiving events and close every subscription."""
+        await self.backend.stop()
+        for subscription in self.subscriptions:
+            self.unsubscribe(subscription)
+            subscription.close()
+
+    async def publish(self, event: Event) -> None:
+        """
+        Publish a committed change.
+
+        A failing backend is logged, readers then miss the event.
+
+        :param event: The event
+        """
+        try:
+            await self.backend.publish(event)
+        except PUBLISH_ERRORS:
+            logger.exception("Cannot publish event %s", event)
+
+    def subscribe(self, user_id: int, author_ids: Iterable[int]) -> Subscription:
+        """
+        Open a subscription of a user.
+
+        :param user_id: The ID of the user
+        :param author_ids: IDs of the users the user follows
+        :return: A subscription, which must be passed to 'unsubscribe'
+        """
+        subscription = Subscription(user_id, author_ids, self.queue_size)
+        self._by_user.setdefault(user_id, set()).add(subscription)
+        for author_id in subscription.author_ids:
+            self._by_author.setdefault(author_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """
+        Close a subscription.
+
+        :param subscription: The subscription
+        """
+        _discard(self._by_user, subscription.user_id, subscription)
+        for author_id in subscription.author_ids:
+            _discard(self._by_author, author_id, subscription)
+
+    def dispatch(self, event: Event) -> None:
+        """
+        Queue an event for the subscriptions following its author.
+
+        Follow events change the authors of the follower's subscriptions.
+
+        :param event: The event
+        """
+        if event.type in (USER_FOLLOWED, USER_UNFOLLOWED):
+            self._change_follow(event)
+            return
+        for subscription in list(self._by_author.get(event.author_id, ())):
+            subscription.offer(event)
+            if subscription.overflowed:
+                self.unsubscribe(subscription)
+
+    def _change_follow(self, event: Event) -> None:
+        """Add or remove the followed author of the follower's subscriptions."""
+        author_id = event.author_id
+        for subscription in self._by_user.get(event.user_id, ()):
+            if author_id == subscription.user_id:
+                continue
+            if event.type == USER_FOLLOWED:
+                subscription.author_ids.add(author_id)
+                self._by_author.setdefault(author_id, set()).add(subscription)
+            else:
+                subscription.author_ids.discard(author_id)
+                _discard(self._by_author, author_id, subscription)
+
+
+def _discard(
+    index: Dict[int, Set[Subscription]], key: int, subscription: Subscription
+) -> None:
+    """Remove a subscription from an index, dropping the emptied key."""
+    subscriptions = index.get(key, set())
+    subscriptions.discard(subscription)
+    if not subscriptions:
+        index.pop(key, None)
+
+
+def _create_backend(config: EventsConfig) -> EventBackend:
+    """Create the backend selected by the configuration."""
+    if config.backend == "postgres":
+        return PostgresEventBackend(db_session.engine, config.channel)
+    return LocalEventBackend()
+
+
+events_config = EventsConfig()
+event_bus = EventBus(_create_backend(events_config), events_config.queue_size)
@@ -0,0 +1,219 @@
+"""
+This module contains the cache of the global tweet feed.
+
+The 'all' feed is the same for every user, so its pages are cached as
+encoded response bodies, keyed by the page parameters and the version stamp
+of the page. Every write which changes the feed, a tweet or a like, moves
+the cache to a new generation, and pages of older generations are never
+read again. Pages read from a lagging replica may stay cached for one TTL
+at most.
+
+The in-process backend is invalidated only in its own worker, other workers
+do not read their stale pages because the version stamp has changed. The
+Redis backend shares the pages and the generation between all workers.
+"""
+
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Optional
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+from app.services.cache import TTLCache
+
+try:
+    from redis import asyncio as aioredis
+    from redis.exceptions import RedisError
+
+    # Errors of cache operations, after which the feed is read from the database.
+    CACHE_ERRORS = (OSError, RedisError)
+except ImportError:  # pragma: no cover - redis is optional
+    aioredis = None
+    CACHE_ERRORS = (OSError,)
+
+logger = logging.getLogger(__name__)
+
+
+class FeedCacheConfig(BaseSettings):
+    """
+    Feed cache configuration.
+
+    Values are read from 'FEED_CACHE_' prefixed environment variables or the .env file.
+    """
+
+    model_config = SettingsConfigDict(
+        env_prefix="FEED_CACHE_", env_file=".env", extra="ignore"
+    )
+
+    enabled: bool = True
+    # memory or redis
+    backend: str = "memory"
+    redis_url: str = "redis://localhost:6379/0"
+    # Pages kept by the in-process backend.
+    size: int = 1000
+    # Seconds a page is cached, which bounds the staleness of replica reads.
+    ttl: float = 30.0
+
+
+class FeedCacheBackend(ABC):
+    """Storage of encoded feed pages."""
+
+    @abstractmethod
+    async def generation(self) -> int:
+        """
+        Return the current generation of the cache.
+
+        :return: Generation number
+        """
+
+    @abstractmethod
+    async def next_generation(self) -> None:
+        """Move to a new generation, which has no pages yet."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        """
+        Return a cached page.
+
+        :param key: Key of the page including the generation
+        :return: The encoded page or None
+        """
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes) -> None:
+        """
+        Store a page for the TTL.
+
+        :param key: Key of the page including the generation
+        :param value: The encoded page
+        """
+
+
+class MemoryFeedBackend(FeedCacheBackend):
+    """Pages in a bounded cache of the process."""
+
+    def __init__(
+        self, max_size: int, ttl: float, clock: Callable[[], float] = time.monotonic
+    ):
+        self.pages: TTLCache[str, bytes] = TTLCache(
+            max_size=max_size, ttl=ttl, clock=clock
+        )
+        self._generation = 0
+
+    async def generation(self):
+        return self._generation
+
+    async def next_generation(self):
+        self._generation += 1
+        self.pages.clear()
+
+    async def get(self, key):
+        return self.pages.get(key)
+
+    async def set(self, key, value):
+        self.pages.set(key, value)
+
+
+class RedisFeedBackend(FeedCacheBackend):
+    """
+    Pages in Redis or a server compatible with it.
+
+    Pages expire by the TTL, old generations are not deleted explicitly.
+    """
+
+    def __init__(self, client, ttl: float, prefix: str = "feed"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, ttl: float) -> "RedisFeedBackend":
+        """
+        Connect to the server of the URL.
+
+        :param url: Redis URL
+        :param ttl: Time to live of the pages in seconds
+        :return: A backend
+        """
+        if aioredis is None:
+            raise RuntimeError("Redis feed cache requires the 'redis' package")
+        return cls(aioredis.from_url(url), ttl=ttl)
+
+    async def generation(self):
+        value = await self.client.get(f"{self.prefix}:generation")
+        return int(value or 0)
+
+    async def next_generation(self):
+        await self.client.incr(f"{self.prefix}:generation")
+
+    async def get(self, key):
+        return await self.client.get(f"{self.prefix}:{key}")
+
+    async def set(self, key, value):
+        await self.client.set(f"{self.prefix}:{key}", value, px=int(self.ttl * 1000))
+
+
+class FeedCache:
+    """Read-through cache of feed pages."""
+
+    def __init__(self, backend: FeedCacheBackend, enabled: bool = True):
+        self.backend = backend
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_load(
+        self, page_key: str, load: Callable[[], Awaitable[bytes]]
+    ) -> bytes:
+        """
+        Return a cached page or load and cache it.
+
+        A failing backend is logged and the page is loaded without caching.
+
+        :param page_key: Key of the page parameters
+        :param load: Coroutine function loading the encoded page
+        :return: The encoded page
+        """
+        if not self.enabled:
+            return await load()
+
+        try:
+            key = f"{await self.backend.generation()}:{page_key}"
+            page = await self.backend.get(key)
+        except CACHE_ERRORS:
+            logger.exception("Cannot read the feed cache")
+            return await load()
+        if page is not None:
+            self.hits += 1
+            return page
+
+        self.misses += 1
+        page = await load()
+        try:
+            await self.backend.set(key, page)
+        except CACHE_ERRORS:
+            logger.exception("Cannot write the feed cache")
+        return page
+
+    async def invalidate(self) -> None:
+        """Drop every cached page after a write to the feed."""
+        if not self.enabled:
+            return
+        try:
+            await self.backend.next_generation()
+        except CACHE_ERRORS:
+            logger.exception("Cannot invalidate the feed cache")
+
+
+def _create_backend(config: FeedCacheConfig) -> FeedCacheBackend:
+    """Create the backend selected by the configuration."""
+    if config.backend == "redis":
+        return RedisFeedBackend.from_url(config.redis_url, ttl=config.ttl)
+    return MemoryFeedBackend(max_size=config.size, ttl=config.ttl)
+
+
+feed_cache_config = FeedCacheConfig()
+feed_cache = FeedCache(
+    _create_backend(feed_cache_config), enabled=feed_cache_config.enabled
+)
@@ -0,0 +1,76 @@
+"""This module contains media settings."""
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+MEGABYTE = 1024 * 1024
+
+
+class MediaConfig(BaseSettings):
+    """
+    Media upload configuration.
+
+    Values are read from 'MEDIA_' prefixed environment variables or the .env file.
+    """
+
+    model_config = SettingsConfigDict(
+        env_prefix="MEDIA_", env_file=".env", extra="ignore"
+    )
+
+    # local or s3
+    storage_backend: str = "local"
+    # Directory of the local backend, served by nginx under 'public_prefix'.
+    upload_dir: str = "/home/static/images"
+    public_prefix: str = "images"
+    # Directory of uploads being received, the upload directory by default.
+    # Must be on the same filesystem as the upload directory for the local backend.
+    incoming_dir: str = ""
+    # Matches 'client_max_body_size' of /api/medias in nginx.conf.
+    max_upload_size: int = 10 * MEGABYTE
+    chunk_size: int = 256 * 1024
+
+    # Resized variants created when Pillow is installed.
+    processing_enabled: bool = True
+    processing_workers: int = 2
+    thumbnail_size: int = 320
+    medium_size: int = 1280
+    # webp, avif (needs a Pillow build with AVIF support) or jpeg.
+    variant_format: str = "webp"
+    variant_quality: int = 80
+
+    s3_bucket: str = ""
+    s3_key_prefix: str = "images"
+    # Endpoint of an S3-compatible service such as MinIO.
+    s3_endpoint_url: str = ""
+    s3_region: str = ""
+    s3_access_key_id: str = ""
+    s3_secret_access_key: str = ""
+    s3_multipart_threshold: int = 8 * MEGABYTE
+    s3_multipart_chunk_size: int = 8 * MEGABYTE
+
+    # Seconds between runs of the media sweeper, 0 disables it.
+    gc_interval: float = 3600.0
+    # Seconds after which an image not attached to a tweet is deleted.
+    gc_orphan_ttl: float = 24 * 3600.0
+    gc_batch_size: int = 500
+
+    @property
+    def receive_dir(self) -> str:
+        """Return the directory of uploads being received."""
+        return self.incoming_dir or self.upload_dir
+
+    @staticmethod
+    def content_key(sha256: str, extension: str) -> str:
+        """
+        Return the content-addressed storage key of a file.
+
+        Files are sharded by the first two bytes of the hash,
+        e.g. 'ab/cd/abcd...ef.jpg'.
+
+        :param sha256: Hex SHA-256 of the file content
+        :param extension: Extension of the file with the dot
+        :return: The key
+        """
+        return f"{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}"
+
+
+media_config = MediaConfig()
@@ -0,0 +1,348 @@
+"""
+This module contains garbage collection of media.
+
+Images uploaded but never attached to a tweet are deleted after a TTL.
+Files of deleted images are recorded in 'media_deletions' and deleted from
+the storage, unless another image with the same content still refers to
+them. Both passes run in batches, either periodically in the background or
+once from the command line. On Postgres a sweep holds an advisory lock, so
+of the workers sweeping periodically only one runs at a time.
+
+Uploads reusing or storing a content and the sweeper deleting its files hold
+the lock of the content. The sweeper checks the references of a file again
+under the lock, so it never deletes a file which a concurrent upload refers to.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from contextlib import AsyncExitStack, asynccontextmanager, nullcontext
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional
+from weakref import WeakValueDictionary
+
+from sqlalchemy import (
+    ColumnElement,
+    Insert,
+    Row,
+    delete,
+    insert,
+    select,
+    text,
+    union,
+    union_all,
+)
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.base_model import utc_now
+from app.db.db_settings import db_session
+from app.db.models import Image, MediaDeletion
+from app.services.media.config import MediaConfig, media_config
+from app.services.media.storage import STORAGE_ERRORS, MediaStorage, media_storage
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key of the Postgres advisory lock held while sweeping,
+# so that the sweepers of concurrently running workers do not overlap.
+SWEEP_LOCK_KEY = 7_301_543
+# Class of the Postgres advisory locks of contents, keyed by their hash.
+CONTENT_LOCK_CLASS = 7_301_544
+
+# Locks of contents held in this process, on databases without advisory locks.
+_content_locks: "WeakValueDictionary[str, asyncio.Lock]" = WeakValueDictionary()
+
+
+def content_name(key: str) -> str:
+    """
+    Return the name of the content of a stored file.
+
+    Variants share the name of their original, e.g. the name of
+    'ab/cd/abcd...ef_medium.webp' is 'abcd...ef'.
+
+    :param key: Key of the file
+    :return: The content hash for files stored by uploads
+    """
+    return os.path.basename(key).split(".", 1)[0].split("_", 1)[0]
+
+
+def _content_lock_key(name: str) -> int:
+    """Return the advisory lock key of a content, a signed 32-bit integer."""
+    digest = hashlib.sha256(name.encode()).digest()
+    return int.from_bytes(digest[:4], "big", signed=True)
+
+
+@asynccontextmanager
+async def lock_contents(
+    session: AsyncSession, names: Iterable[str]
+) -> AsyncIterator[None]:
+    """
+    Hold the locks of contents while their files are stored or deleted.
+
+    On Postgres these are transaction-level advisory locks, released when the
+    transaction of the session ends, so the block has to commit or roll back.
+    Other databases are locked within the process only.
+
+    :param session: The database session used for the query
+    :param names: Names of the contents, see 'content_name'
+    """
+    if session.bind.dialect.name == "postgresql":
+        query = text("SELECT pg_advisory_xact_lock(:lock_class, :key)")
+        # Locks are taken in one order, so concurrent batches cannot deadlock.
+        for key in sorted({_content_lock_key(name) for name in names}):
+            await session.execute(query, {"lock_class": CONTENT_LOCK_CLASS, "key": key})
+        yield
+        return
+
+    locks = [
+        _content_locks.setdefault(name, asyncio.Lock()) for name in sorted(set(names))
+    ]
+    async with AsyncExitStack() as stack:
+        for lock in locks:
+            await stack.enter_async_context(lock)
+        yield
+
+
+def record_deleted_media(*criteria: ColumnElement[bool]) -> Insert:
+    """
+    Build a statement recording the files of images which are about to be deleted.
+
+    :param criteria: Conditions selecting the images
+    :return: An 'Insert' statement
+    """
+    paths = union_all(
+        *[
+            select(column.label("path")).where(*criteria, column.is_not(None))
+            for column in (Image.path, Image.thumbnail_path, Image.medium_path)
+        ],
+    )
+    return insert(MediaDeletion).from_select(["path"], select(paths.subquery().c.path))
+
+
+@dataclass
+class SweepStats:
+    """Counters of the media sweeper."""
+
+    runs: int = 0
+    orphaned_images: int = 0
+    deleted_files: int = 0
+    kept_files: int = 0
+    failed_files: int = 0
+
+    def add(self, other: "SweepStats") -> None:
+        """
+        Add the counters of another run.
+
+        :param other: Counters of the run
+        """
+        for name, value in asdict(other).items():
+            setattr(self, name, getattr(self, name) + value)
+
+
+class MediaSweeper:
+    """Deletes orphaned images and the files of deleted images."""
+
+    def __init__(
+        self,
+        storage: MediaStorage,
+        session_factory: Callable[[], AsyncSession],
+        config: MediaConfig,
+    ):
+        self.storage = storage
+        self.session_factory = session_factory
+        self.config = config
+        self.stats = SweepStats()
+        self._task: Optional[asyncio.Task] = None
+
+    def metrics(self) -> Dict[str, int]:
+        """
+        Return the counters of all runs since the start of the process.
+
+        :return: A dictionary of metric names and values
+        """
+        return asdict(self.stats)
+
+    async def start(self) -> None:
+        """Start the periodic sweeps if they are enabled."""
+        if self.config.gc_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the periodic sweeps."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def sweep(self, dry_run: bool = False) -> SweepStats:
+        """
+        Run both passes once.
+
+        A dry run only counts the orphaned images and the files which would
+        be deleted now, without changing anything. A sweep is skipped while
+        another process sweeps.
+
+        :param dry_run: Count instead of deleting
+        :return: Counters of the run, without runs when it was skipped
+        """
+        result = SweepStats(runs=1)
+        async with self.session_factory() as lock_session:
+            if not dry_run and not await self._try_lock(lock_session):
+                logger.info("Media sweep skipped, another process is sweeping")
+                return SweepStats()
+            try:
+                async with self.session_factory() as session:
+                    await self._sweep_orphans(session, result, dry_run)
+                    await self._sweep_files(session, result, dry_run)
+            finally:
+                if not dry_run:
+                    await self._unlock(lock_session)
+        if not dry_run:
+            self.stats.add(result)
+        return result
+
+    @staticmethod
+    async def _try_lock(session: AsyncSession) -> bool:
+        """
+        Take the sweep lock for the connection of the session.
+
+        The lock is held until '_unlock', across the commits of the batches
+        made in another session. Other databases are not locked.
+
+        :param session: Session kept open for the duration of the sweep
+        :return: True when the lock was taken
+        """
+        if session.bind.dialect.name != "postgresql":
+            return True
+        query = text("SELECT pg_try_advisory_lock(:key)")
+        return bool(await session.scalar(query, {"key": SWEEP_LOCK_KEY}))
+
+    @staticmethod
+    async def _unlock(session: AsyncSession) -> None:
+        """Release the sweep lock taken by '_try_lock'."""
+        if session.bind.dialect.name == "postgresql":
+            query = text("SELECT pg_advisory_unlock(:key)")
+            await session.execute(query, {"key": SWEEP_LOCK_KEY})
+
+    async def _run(self) -> None:
+        """Sweep after every interval."""
+        while True:
+            await asyncio.sleep(self.config.gc_interval)
+            try:
+                result = await self.sweep()
+            except SQLAlchemyError:
+                logger.exception("Media sweep failed")
+                continue
+            logger.info("Media sweep finished: %s", asdict(result))
+
+    async def _sweep_orphans(
+        self, session: AsyncSession, result: SweepStats, dry_run: bool
+    ) -> None:
+        """Delete images not attached to a tweet within the TTL."""
+        deadline = utc_now() - timedelta(seconds=self.config.gc_orphan_ttl)
+        last_id = 0
+        while True:
+            query = (
+                select(Image.id)
+                .where(
+                    Image.tweet_id.is_(None),
+                    Image.created_at < deadline,
+                    Image.id > last_id,
+                )
+                .order_by(Image.id)
+                .limit(self.config.gc_batch_size)
+            )
+            image_ids = (await session.execute(query)).scalars().all()
+            if not image_ids:
+                return
+            last_id = image_ids[-1]
+            result.orphaned_images += len(image_ids)
+            if dry_run:
+                continue
+
+            # A tweet may have attached an image since it was selected.
+            orphaned = (Image.id.in_(image_ids), Image.tweet_id.is_(None))
+            await session.execute(record_deleted_media(*orphaned))
+            await session.execute(delete(Image).where(*orphaned))
+            await session.commit()
+
+    async def _referenced_paths(
+        self, session: AsyncSession, paths: List[str]
+    ) -> List[str]:
+        """Return the paths which images still refer to."""
+        query = union(
+            *[
+                select(column).where(column.in_(paths))
+                for column in (Image.path, Image.thumbnail_path, Image.medium_path)
+            ],
+        )
+        return list((await session.execute(query)).scalars())
+
+    async def _sweep_files(
+        self, session: AsyncSession, result: SweepStats, dry_run: bool
+    ) -> None:
+        """Delete recorded files which no image refers to."""
+        last_id = 0
+        while True:
+            query = (
+                select(MediaDeletion.id, MediaDeletion.path)
+                .where(MediaDeletion.id > last_id)
+                .order_by(MediaDeletion.id)
+                .limit(self.config.gc_batch_size)
+            )
+            deletions = (await session.execute(query)).all()
+            if not deletions:
+                return
+            last_id = deletions[-1].id
+            names = [content_name(row.path) for row in deletions]
+            async with nullcontext() if dry_run else lock_contents(session, names):
+                await self._delete_unreferenced(session, deletions, result, dry_run)
+
+    async def _delete_unreferenced(
+        self,
+        session: AsyncSession,
+        deletions: List[Row],
+        result: SweepStats,
+        dry_run: bool,
+    ) -> None:
+        """Delete the files of a batch which no image refers to, under their locks."""
+        referenced = set(
+            await self._referenced_paths(session, [row.path for row in deletions])
+        )
+
+        done_ids = []
+        for deletion_id, path in deletions:
+            key = self.storage.key_from_url(path)
+            if path in referenced or key is None:
+                result.kept_files += 1
+            elif not dry_run and not await self._delete_file(key):
+                result.failed_files += 1
+                continue
+            else:
+                result.deleted_files += 1
+            done_ids.append(deletion_id)
+
+        if not dry_run:
+            await session.execute(
+                delete(MediaDeletion).where(MediaDeletion.id.in_(done_ids))
+            )
+            await session.commit()
+
+    async def _delete_file(self, key: str) -> bool:
+        """Delete a file, keeping its record for the next run on failure."""
+        try:
+            await self.storage.delete(key)
+        except STORAGE_ERRORS:
+            logger.exception("Cannot delete media file %s", key)
+            return False
+        return True
+
+
+media_sweeper = MediaSweeper(
+    storage=media_storage,
+    session_factory=db_session.async_session,
+    config=media_config,
+)
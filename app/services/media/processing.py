@@ -0,0 +1,317 @@
+"""
+This module contains the image processing pipeline.
+
+Uploaded images are decoded and resized in a process pool, so CPU-bound work
+does not block the event loop. Every image gets a thumbnail for the timeline
+cards and a medium variant, both encoded without EXIF metadata. The metadata
+of the original is stripped too, since it is served when there are no
+variants. JPEG and PNG originals keep their pixel data as it is, only the
+metadata segments are dropped, other formats are re-encoded. Without Pillow
+installed the originals are served as they are.
+"""
+
+import asyncio
+import logging
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.services.media.config import MediaConfig, media_config
+
+try:
+    from PIL import Image as PILImage
+    from PIL import ImageOps
+except ImportError:  # pragma: no cover - Pillow is optional
+    PILImage = None
+
+logger = logging.getLogger(__name__)
+
+FORMAT_EXTENSIONS = {"WEBP": "webp", "AVIF": "avif", "JPEG": "jpg", "PNG": "png"}
+FALLBACK_FORMAT = "JPEG"
+# Keys of 'Image.info' holding metadata, e.g. GPS coordinates in EXIF.
+METADATA_KEYS = ("exif", "xmp", "XML:com.adobe.xmp", "comment", "photoshop")
+# Quality of re-encoded lossy originals.
+ORIGINAL_QUALITY = 95
+ORIENTATION_TAG = 0x0112
+
+# JPEG segments of EXIF and XMP (APP1), IPTC (APP13) and comments (COM).
+JPEG_METADATA_MARKERS = frozenset((0xE1, 0xED, 0xFE))
+# JPEG markers without a length: TEM, RST0-RST7 and SOI.
+JPEG_STANDALONE_MARKERS = frozenset((0x01, *range(0xD0, 0xD9)))
+JPEG_SOS = 0xDA
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_METADATA_CHUNKS = frozenset((b"eXIf", b"tEXt", b"zTXt", b"iTXt", b"tIME"))
+
+
+def _output_format(requested: str) -> str:
+    """Return the requested format if Pillow can write it, JPEG otherwise."""
+    PILImage.init()
+    output_format = requested.upper()
+    if output_format not in PILImage.SAVE or output_format not in FORMAT_EXTENSIONS:
+        return FALLBACK_FORMAT
+    return output_format
+
+
+def _orientation_segment(orientation: int) -> bytes:
+    """Encode a JPEG APP1 segment holding only the EXIF orientation."""
+    exif = PILImage.Exif()
+    exif[ORIENTATION_TAG] = orientation
+    data = exif.tobytes()
+    return b"\xff\xe1" + struct.pack(">H", len(data) + 2) + data
+
+
+def _strip_jpeg(data: bytes, orientation: int) -> Optional[bytes]:
+    """
+    Drop the metadata segments of a JPEG file, keeping the compressed image.
+
+    The orientation is kept in a minimal EXIF segment, so the image is shown
+    the same way without being rotated and re-encoded.
+
+    :param data: Content of the file
+    :param orientation: EXIF orientation of the image
+    :return: The stripped content, or None when the file is not understood
+    """
+    if not data.startswith(b"\xff\xd8"):
+        return None
+    segments = [data[:2]]
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker.
+            position += 1
+            continue
+        if marker == JPEG_SOS:
+            if orientation != 1:
+                # JFIF requires its APP0 segment right after SOI.
+                index = 2 if data[3] == 0xE0 else 1
+                segments.insert(index, _orientation_segment(orientation))
+            segments.append(data[position:])
+            return b"".join(segments)
+        end = position + 2
+        if marker not in JPEG_STANDALONE_MARKERS:
+            end += struct.unpack_from(">H", data, end)[0]
+        if marker not in JPEG_METADATA_MARKERS:
+            segments.append(data[position:end])
+        position = end
+    return None
+
+
+def _strip_png(data: bytes, orientation: int) -> Optional[bytes]:
+    """
+    Drop the metadata chunks of a PNG file, keeping the image data.
+
+    :param data: Content of the file
+    :param orientation: EXIF orientation of the image
+    :return: The stripped content, or None when the image has to be rotated
+    """
+    if orientation != 1 or not data.startswith(PNG_SIGNATURE):
+        return None
+    chunks = [PNG_SIGNATURE]
+    position = len(PNG_SIGNATURE)
+    while position + 8 <= len(data):
+        length, chunk_type = struct.unpack_from(">I4s", data, position)
+        end = position + 12 + length
+        if chunk_type not in PNG_METADATA_CHUNKS:
+            chunks.append(data[position:end])
+        position = end
+    return b"".join(chunks)
+
+
+# Functions stripping metadata without decoding the image, by format.
+METADATA_STRIPPERS: Dict[str, Callable[[bytes, int], Optional[bytes]]] = {
+    "JPEG": _strip_jpeg,
+    "PNG": _strip_png,
+}
+
+
+def _reencode_without_metadata(source_path: str) -> None:
+    """
+    Re-encode an image in place without its metadata.
+
+    The image is rotated according to its EXIF orientation first, the color
+    profile is kept.
+
+    :param source_path: Path of the image
+    """
+    with PILImage.open(source_path) as original:
+        image_format = original.format
+        icc_profile = original.info.get("icc_profile")
+        image = ImageOps.exif_transpose(original)
+        image.info = {}
+        options = {"quality": ORIGINAL_QUALITY} if image_format != "PNG" else {}
+        if icc_profile:
+            options["icc_profile"] = icc_profile
+        image.save(f"{source_path}.part", format=image_format, **options)
+    os.replace(f"{source_path}.part", source_path)
+
+
+def strip_metadata(source_path: str) -> bool:
+    """
+    Remove the metadata of an image in place.
+
+    JPEG and PNG files are rewritten without their metadata segments, other
+    formats and files which are not understood are re-encoded. Images without
+    metadata other than the orientation are left as they are.
+
+    :param source_path: Path of the image
+    :return: Whether the image was changed
+    """
+    with PILImage.open(source_path) as original:
+        exif = original.getexif()
+        # The orientation alone is kept by the stripped files.
+        if set(exif) <= {ORIENTATION_TAG} and not any(
+            key in original.info for key in METADATA_KEYS if key != "exif"
+        ):
+            return False
+        image_format = original.format
+        orientation = exif.get(ORIENTATION_TAG, 1)
+
+    strip = METADATA_STRIPPERS.get(image_format)
+    if strip is not None:
+        with open(source_path, "rb") as file:
+            stripped = strip(file.read(), orientation)
+        if stripped is not None:
+            with open(f"{source_path}.part", "wb") as file:
+                file.write(stripped)
+            os.replace(f"{source_path}.part", source_path)
+            return True
+    _reencode_without_metadata(source_path)
+    return True
+
+
+def make_variants(
+    source_path: str,
+    sizes: Dict[str, int],
+    requested_format: str,
+    quality: int,
+) -> Dict[str, str]:
+    """
+    Write resized copies of an image next to it.
+
+    Runs in a worker process. Variants are rotated according to the EXIF
+    orientation and saved without metadata.
+
+    :param source_path: Path of the original image
+    :param sizes: Maximum side in pixels by variant name
+    :param requested_format: Image format of the variants, e.g. 'webp'
+    :param quality: Encoder quality of the variants
+    :return: Paths of the variants by variant name
+    """
+    output_format = _output_format(requested_format)
+    stem = os.path.splitext(source_path)[0]
+    variants: Dict[str, str] = {}
+    try:
+        with PILImage.open(source_path) as original:
+            image = ImageOps.exif_transpose(original)
+            if output_format == "JPEG" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            for name, size in sizes.items():
+                variant = image.copy()
+                variant.thumbnail((size, size))
+                path = f"{stem}_{name}.{FORMAT_EXTENSIONS[output_format]}"
+                variant.save(f"{path}.part", format=output_format, quality=quality)
+                os.replace(f"{path}.part", path)
+                variants[name] = path
+    except BaseException:
+        for path in variants.values():
+            os.remove(path)
+        raise
+    return variants
+
+
+def process_image(
+    source_path: str,
+    sizes: Dict[str, int],
+    requested_format: str,
+    quality: int,
+) -> Dict[str, str]:
+    """
+    Strip the metadata of an original image and write its variants.
+
+    Runs in a worker process.
+
+    :param source_path: Path of the original image
+    :param sizes: Maximum side in pixels by variant name
+    :param requested_format: Image format of the variants, e.g. 'webp'
+    :param quality: Encoder quality of the variants
+    :return: Paths of the variants by variant name
+    """
+    strip_metadata(source_path)
+    return make_variants(source_path, sizes, requested_format, quality)
+
+
+class ImageProcessor:
+    """Creates image variants in a lazily started process pool."""
+
+    def __init__(self, config: MediaConfig):
+        self.config = config
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def enabled(self) -> bool:
+        """Whether variants are created."""
+        return PILImage is not None and self.config.processing_enabled
+
+    async def create_variants(self, source_path: str) -> Dict[str, str]:
+        """
+        Strip the metadata of an image and create its thumbnail and medium variants.
+
+        Files which cannot be decoded get no variants. When a worker process
+        dies, e.g. killed for its memory, the pool is replaced, the image gets
+        no variants and its metadata is stripped in a thread.
+
+        :param source_path: Path of the original image
+        :return: Paths of the variants by variant name
+        """
+        if not self.enabled:
+            return {}
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.config.processing_workers
+            )
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self._executor,
+                process_image,
+                source_path,
+                {
+                    "thumbnail": self.config.thumbnail_size,
+                    "medium": self.config.medium_size,
+                },
+                self.config.variant_format,
+                self.config.variant_quality,
+            )
+        except (OSError, ValueError, PILImage.DecompressionBombError):
+            logger.warning("Cannot create variants of %s", source_path, exc_info=True)
+            return {}
+        except BrokenProcessPool:
+            logger.exception("Image processing pool is broken, replacing it")
+            self.shutdown(wait=False)
+
+        try:
+            await run_in_threadpool(strip_metadata, source_path)
+        except (OSError, ValueError, PILImage.DecompressionBombError):
+            logger.warning("Cannot strip metadata of %s", source_path, exc_info=True)
+        return {}
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop the worker processes.
+
+        :param wait: Wait for the running tasks to finish
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+image_processor = ImageProcessor(media_config)
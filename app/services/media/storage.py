@@ -0,0 +1,203 @@
+"""
+This module contains storage backends of media files.
+
+Files are received and processed in a local directory, then handed over to
+the backend under a key such as 'ab/cd/<sha256>.jpg'. The local backend moves
+them into the directory served by nginx, the S3 backend uploads them to a
+bucket shared by all app nodes.
+"""
+
+import mimetypes
+import os
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.services.media.config import MediaConfig, media_config
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    # Errors of storage operations which may succeed when retried.
+    STORAGE_ERRORS = (OSError, BotoCoreError, ClientError)
+except ImportError:  # pragma: no cover - boto3 is optional
+    boto3 = None
+    STORAGE_ERRORS = (OSError,)
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class MediaStorage(ABC):
+    """Storage of media files addressed by keys."""
+
+    def __init__(self, config: MediaConfig):
+        self.config = config
+
+    @abstractmethod
+    async def store(self, local_path: str, key: str) -> None:
+        """
+        Store a local file under the key.
+
+        The local file may be moved away by the backend.
+
+        :param local_path: Path of the file to store
+        :param key: Key of the stored file
+        """
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        """
+        Check whether a file is stored under the key.
+
+        :param key: Key of the file
+        :return: Bool
+        """
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """
+        Delete the file stored under the key, if there is one.
+
+        :param key: Key of the file
+        """
+
+    def url(self, key: str) -> str:
+        """
+        Return the URL path of a stored file.
+
+        :param key: Key of the file
+        :return: The key under the public prefix
+        """
+        return f"{self.config.public_prefix}/{key}"
+
+    def key_from_url(self, url: str) -> Optional[str]:
+        """
+        Return the key of a stored file from its URL path.
+
+        :param url: URL path returned by 'url'
+        :return: The key or None for URLs outside the storage
+        """
+        prefix = f"{self.config.public_prefix}/"
+        if not url.startswith(prefix):
+            return None
+        return url.removeprefix(prefix)
+
+
+def _move_file(source: str, destination: str) -> None:
+    """Atomically move a file, creating the destination directory."""
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    os.replace(source, destination)
+
+
+def _remove_file(path: str) -> None:
+    """Remove a file, ignoring a missing one."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class LocalDiskStorage(MediaStorage):
+    """Files in the upload directory, which must be shared by all app nodes."""
+
+    def _path(self, key: str) -> str:
+        """Return the path of the key in the upload directory."""
+        return os.path.join(self.config.upload_dir, *key.split("/"))
+
+    async def store(self, local_path, key):
+        """Move the file into place by an atomic rename."""
+        await run_in_threadpool(_move_file, local_path, self._path(key))
+
+    async def exists(self, key):
+        """Check the file in the upload directory."""
+        return await run_in_threadpool(os.path.exists, self._path(key))
+
+    async def delete(self, key):
+        """Remove the file from the upload directory."""
+        await run_in_threadpool(_remove_file, self._path(key))
+
+
+class S3Storage(MediaStorage):
+    """
+    Files in an S3-compatible bucket, e.g. AWS S3 or MinIO.
+
+    Files larger than the multipart threshold are uploaded in parts.
+    'public_prefix' should point at the bucket or the CDN in front of it.
+    """
+
+    def __init__(self, config: MediaConfig):
+        if boto3 is None:
+            raise RuntimeError("S3 media storage requires the 'boto3' package")
+        super().__init__(config)
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=config.s3_endpoint_url or None,
+            region_name=config.s3_region or None,
+            aws_access_key_id=config.s3_access_key_id or None,
+            aws_secret_access_key=config.s3_secret_access_key or None,
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=config.s3_multipart_threshold,
+            multipart_chunksize=config.s3_multipart_chunk_size,
+        )
+
+    def _object_key(self, key: str) -> str:
+        """Return the key of the object in the bucket."""
+        if not self.config.s3_key_prefix:
+            return key
+        return f"{self.config.s3_key_prefix}/{key}"
+
+    async def store(self, local_path, key):
+        """Upload the file, in parts when it is large."""
+        content_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+        await run_in_threadpool(
+            self.client.upload_file,
+            local_path,
+            self.config.s3_bucket,
+            self._object_key(key),
+            ExtraArgs={
+                "ContentType": content_type,
+                "CacheControl": IMMUTABLE_CACHE_CONTROL,
+            },
+            Config=self.transfer_config,
+        )
+
+    async def exists(self, key):
+        """Check the object with a HEAD request."""
+        try:
+            await run_in_threadpool(
+                self.client.head_object,
+                Bucket=self.config.s3_bucket,
+                Key=self._object_key(key),
+            )
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
+            raise
+        return True
+
+    async def delete(self, key):
+        """Delete the object."""
+        await run_in_threadpool(
+            self.client.delete_object,
+            Bucket=self.config.s3_bucket,
+            Key=self._object_key(key),
+        )
+
+
+def create_storage(config: MediaConfig) -> MediaStorage:
+    """
+    Create the backend selected by the 'storage_backend' setting.
+
+    :param config: Media configuration
+    :return: A media storage
+    """
+    if config.storage_backend == "s3":
+        return S3Storage(config)
+    return LocalDiskStorage(config)
+
+
+media_storage = create_storage(media_config)
@@ -0,0 +1,190 @@
+"""
+This module contains streaming of uploaded files to disk.
+
+The upload is copied in chunks to a temporary file, with the blocking file
+operations running in the thread pool, and hashed on the way. The temporary
+file and the files derived from it are removed when the request is done,
+unless a storage backend has moved them away.
+
+Starlette spools the multipart body before the endpoint runs, so bodies over
+the size limit are rejected by a middleware while they are received.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, BinaryIO, List, Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.status import HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+from app.services.media.config import MediaConfig, media_config
+
+TEMP_SUFFIX = ".part"
+EXTENSION_PATTERN = re.compile(r"^\.[a-z0-9]{1,10}$")
+# Room for the boundaries and part headers of a multipart body.
+MULTIPART_OVERHEAD = 16 * 1024
+
+
+def _too_large_error(max_size: int) -> HTTPException:
+    """Build the error of an upload exceeding the size limit."""
+    return HTTPException(
+        status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail={
+            "result": False,
+            "error_type": HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            "error_message": f"File is larger than {max_size} bytes",
+        },
+    )
+
+
+def safe_extension(filename: Optional[str]) -> str:
+    """
+    Return the lowercase extension of a client filename, if it is harmless.
+
+    :param filename: Filename sent by the client (optional)
+    :return: The extension with the dot or an empty string
+    """
+    extension = os.path.splitext(os.path.basename(filename or ""))[1].lower()
+    return extension if EXTENSION_PATTERN.match(extension) else ""
+
+
+def _remove_file(path: str) -> None:
+    """Remove a file, ignoring a missing one."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _open_temp_file(directory: str) -> BinaryIO:
+    """Create the directory and an empty temporary file in it."""
+    os.makedirs(directory, exist_ok=True)
+    return tempfile.NamedTemporaryFile(dir=directory, suffix=TEMP_SUFFIX, delete=False)
+
+
+class ReceivedUpload:
+    """An uploaded file written to a temporary file, with the files derived from it."""
+
+    def __init__(self, path: str, size: int = 0, sha256: str = ""):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.derived_paths: List[str] = []
+
+    def attach(self, path: str) -> None:
+        """
+        Remove a file created from the upload together with it.
+
+        :param path: Path of the derived file
+        """
+        self.derived_paths.append(path)
+
+    async def discard(self) -> None:
+        """Remove the temporary file and the derived files."""
+        for path in (self.path, *self.derived_paths):
+            await run_in_threadpool(_remove_file, path)
+
+
+async def _write_chunks(
+    file: UploadFile,
+    temp_file: BinaryIO,
+    upload: ReceivedUpload,
+    config: MediaConfig,
+) -> None:
+    """
+    Copy the upload to the temporary file chunk by chunk.
+
+    :param file: The uploaded file
+    :param temp_file: The open temporary file
+    :param upload: The received upload, whose size and hash are set
+    :param config: Media configuration
+    """
+    digest = hashlib.sha256()
+    while True:
+        chunk = await file.read(config.chunk_size)
+        if not chunk:
+            break
+        upload.size += len(chunk)
+        if upload.size > config.max_upload_size:
+            raise _too_large_error(config.max_upload_size)
+        digest.update(chunk)
+        await run_in_threadpool(temp_file.write, chunk)
+    upload.sha256 = digest.hexdigest()
+
+
+@asynccontextmanager
+async def receive_upload(
+    file: UploadFile, config: MediaConfig
+) -> AsyncIterator[ReceivedUpload]:
+    """
+    Stream an upload to a temporary file within the size limit, computing
+    its SHA-256.
+
+    The temporary files are removed when the block exits.
+
+    :param file: The uploaded file
+    :param config: Media configuration
+    :return: The received upload
+    """
+    if file.size is not None and file.size > config.max_upload_size:
+        raise _too_large_error(config.max_upload_size)
+
+    temp_file = await run_in_threadpool(_open_temp_file, config.receive_dir)
+    upload = ReceivedUpload(path=temp_file.name)
+    try:
+        try:
+            await _write_chunks(file, temp_file, upload, config)
+        finally:
+            await run_in_threadpool(temp_file.close)
+        yield upload
+    finally:
+        await upload.discard()
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware rejecting upload bodies over the size limit.
+
+    A declared Content-Length over the limit is rejected before the body is
+    read, a body without it is counted while the endpoint receives it.
+    """
+
+    def __init__(
+        self, app, path: str = "/api/medias", config: MediaConfig = media_config
+    ):
+        self.app = app
+        self.path = path
+        self.config = config
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        max_size = self.config.max_upload_size
+        max_body_size = max_size + MULTIPART_OVERHEAD
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > max_body_size:
+            error = _too_large_error(max_size)
+            response = JSONResponse({"detail": error.detail}, error.status_code)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body_size:
+                    # Raised through the body parsing of the endpoint.
+                    raise _too_large_error(max_size)
+            return message
+
+        await self.app(scope, receive_limited, send)
@@ -0,0 +1,283 @@
+"""
+This module contains the metrics of the application in the Prometheus format.
+
+Counters and histograms are plain dictionaries keyed by label values, updated
+in place on the event loop, so recording a request costs a few dictionary
+operations. Gauges of other components, e.g. the connection pool and the
+caches, are read from collector functions when the metrics are scraped.
+
+The metrics are kept per process. Behind several workers a scrape reaches
+one of them, so every worker has to be scraped as a separate target, e.g.
+on its own port, and the series summed up in Prometheus.
+"""
+
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+Labels = Tuple[str, ...]
+# A collected sample: metric name, type, help, label names and values.
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1024, 16384, 131072, 524288, 1048576, 4194304, 16777216)
+
+
+class MetricsConfig(BaseSettings):
+    """
+    Metrics configuration.
+
+    Values are read from 'METRICS_' prefixed environment variables or the .env file.
+    """
+
+    model_config = SettingsConfigDict(
+        env_prefix="METRICS_", env_file=".env", extra="ignore"
+    )
+
+    # Serve the metrics endpoint, the metrics are recorded either way.
+    enabled: bool = False
+    # Long-lived streams are not requests of a measurable latency.
+    exclude_prefixes: List[str] = ["/api/stream"]
+
+
+metrics_config = MetricsConfig()
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """Format label names and values, escaping the values."""
+    if not names:
+        return ""
+    pairs = (
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in zip(names, values)
+    )
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value, integers without a fraction."""
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def _format_bound(bound) -> str:
+    """Format the upper bound of a bucket."""
+    return bound if isinstance(bound, str) else _format_value(bound)
+
+
+class Counter:
+    """A monotonically increasing value per label values."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values: Dict[Labels, float] = {} if self.labels else {(): 0}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        """
+        Increase the value of the label values.
+
+        :param label_values: Values of the labels, in the order of their names
+        :param amount: Increment
+        """
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        """Yield the lines of the samples."""
+        for label_values, value in self.values.items():
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}{labels} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    """A value per label values which goes up and down."""
+
+    kind = "gauge"
+
+    def dec(self, *label_values: str, amount: float = 1) -> None:
+        """
+        Decrease the value of the label values.
+
+        :param label_values: Values of the labels, in the order of their names
+        :param amount: Decrement
+        """
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram:
+    """Observations counted in cumulative buckets per label values."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Per label values: counts of the buckets and +Inf, then the sum.
+        self.values: Dict[Labels, List[float]] = {}
+        if not self.labels:
+            self.values[()] = [0] * (len(self.buckets) + 2)
+
+    def observe(self, value: float, *label_values: str) -> None:
+        """
+        Count an observation.
+
+        :param value: The observed value
+        :param label_values: Values of the labels, in the order of their names
+        """
+        counts = self.values.get(label_values)
+        if counts is None:
+            counts = self.values[label_values] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self) -> Iterable[str]:
+        """Yield the lines of the buckets, the sum and the count."""
+        names = (*self.labels, "le")
+        for label_values, counts in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = _format_labels(names, (*label_values, _format_bound(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {_format_value(counts[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsRegistry:
+    """Metrics of the process and collectors of other components."""
+
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+        self.collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def register(self, metric):
+        """
+        Add a metric to the registry.
+
+        :param metric: A counter, gauge or histogram
+        :return: The metric
+        """
+        self.metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        """
+        Add a function returning samples read at every scrape.
+
+        :param collector: Function returning samples
+        """
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        """
+        Render all metrics in the Prometheus text format.
+
+        :return: The text of the metrics
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+
+        # Samples of a metric family have to follow each other, collectors
+        # may yield them interleaved with other families.
+        families: Dict[str, List[str]] = {}
+        for collector in self.collectors:
+            for name, kind, documentation, labels, value in collector():
+                family = families.get(name)
+                if family is None:
+                    family = families[name] = [
+                        f"# HELP {name} {documentation}",
+                        f"# TYPE {name} {kind}",
+                    ]
+                label_text = _format_labels(tuple(labels), tuple(labels.values()))
+                family.append(f"{name}{label_text} {_format_value(value)}")
+        for family in families.values():
+            lines.extend(family)
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_requests = registry.register(
+    Counter(
+        "http_requests_total",
+        "HTTP requests by route and status code.",
+        ("method", "route", "status"),
+    )
+)
+http_request_duration = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Latency of HTTP requests by route.",
+        ("method", "route"),
+    )
+)
+http_requests_in_flight = registry.register(
+    Gauge("http_requests_in_flight", "HTTP requests being handled.")
+)
+upload_bytes = registry.register(
+    Histogram("upload_size_bytes", "Size of uploaded media.", buckets=SIZE_BUCKETS)
+)
+upload_duration = registry.register(
+    Histogram("upload_duration_seconds", "Time of receiving and storing uploads.")
+)
+
+
+def route_template(scope) -> str:
+    """Return the path template of the matched route, not the requested path."""
+    route = scope.get("route")
+    return getattr(route, "path_format", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the count, latency and status of HTTP requests."""
+
+    def __init__(self, app, config: MetricsConfig = metrics_config):
+        self.app = app
+        self.config = config
+
+    def _measured(self, scope) -> bool:
+        """Tell whether the request is recorded."""
+        if scope["type"] != "http":
+            return False
+        return not scope["path"].startswith(tuple(self.config.exclude_prefixes))
+
+    async def __call__(self, scope, receive, send):
+        if not self._measured(scope):
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight.dec()
+            method, route = scope["method"], route_template(scope)
+            http_request_duration.observe(time.perf_counter() - started, method, route)
+            http_requests.inc(method, route, str(status))
@@ -0,0 +1,316 @@
+"""
+This module contains the sampling profiler of slow requests.
+
+While the profiler is enabled, a thread samples the stacks of the requests
+in flight at a fixed interval. A request running on the event loop is
+sampled from the stack of the loop thread, a request waiting for I/O from
+the chain of coroutines it awaits, so the database and the network show up
+next to ORM hydration, validation and encoding.
+
+Requests slower than the threshold, and a random share of the others, are
+written to the profile directory in the folded format read by flamegraph.pl
+and speedscope. The directory is a ring buffer of the latest profiles.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from starlette.concurrency import run_in_threadpool
+
+from app.services.metrics import route_template
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SUFFIX = ".folded"
+# Frames of a request waiting for I/O are put under this frame.
+AWAIT_FRAME = "[await]"
+
+
+class ProfilerConfig(BaseSettings):
+    """
+    Sampling profiler configuration.
+
+    Values are read from 'PROFILER_' prefixed environment variables or the .env
+    file, and can be changed at runtime through the admin API.
+    """
+
+    model_config = SettingsConfigDict(
+        env_prefix="PROFILER_", env_file=".env", extra="ignore"
+    )
+
+    enabled: bool = False
+    # Requests taking longer are always written.
+    slow_ms: float = 500.0
+    # Share of the other requests which is written too.
+    sample_rate: float = 0.0
+    interval_ms: float = 5.0
+    profile_dir: str = "/tmp/profiles"
+    max_profiles: int = Field(default=200, ge=1)
+    # Long-lived streams and the service endpoints are not profiled.
+    exclude_prefixes: List[str] = ["/api/stream", "/api/admin", "/metrics"]
+
+
+def _frame_name(frame) -> str:
+    """Name a frame by its function, module file and first line."""
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+def _thread_stack(frame) -> Tuple[str, ...]:
+    """Return the names of the frames of a thread, the outermost first."""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return tuple(reversed(names))
+
+
+def _await_stack(task: asyncio.Task) -> Tuple[str, ...]:
+    """Return the names of the coroutines a suspended task awaits."""
+    names = [AWAIT_FRAME]
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(
+            awaitable, "gi_frame", None
+        )
+        if frame is None:
+            break
+        names.append(_frame_name(frame))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(
+            awaitable, "gi_yieldfrom", None
+        )
+    return tuple(names)
+
+
+def sampling_supported() -> bool:
+    """
+    Tell whether the running task of a loop can be read from another thread.
+
+    asyncio.current_task() may only be called on the loop thread, the sampler
+    reads the private mapping of running tasks, which not every Python has.
+
+    :return: True when requests can be profiled
+    """
+    return isinstance(getattr(asyncio.tasks, "_current_tasks", None), dict)
+
+
+def _current_task(loop: asyncio.AbstractEventLoop) -> Optional[asyncio.Task]:
+    """Return the task running on the loop, read from another thread."""
+    return getattr(asyncio.tasks, "_current_tasks", {}).get(loop)
+
+
+class ProfiledRequest:
+    """Samples of a request in flight."""
+
+    def __init__(self, task: asyncio.Task, sampled: bool):
+        self.task = task
+        self.sampled = sampled
+        self.stacks: Counter = Counter()
+
+
+class SamplingProfiler:
+    """Samples the requests in flight and writes the profiles of slow ones."""
+
+    def __init__(self, config: ProfilerConfig):
+        self.config = config
+        if config.enabled and not self.enable():
+            config.enabled = False
+        self.written = 0
+        self._requests: Dict[asyncio.Task, ProfiledRequest] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        # Guards the samples of a request against its removal.
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def enable(self) -> bool:
+        """
+        Enable profiling, unless this Python does not allow sampling.
+
+        :return: True when the profiler is enabled
+        """
+        if not sampling_supported():
+            logger.warning("Profiler is not supported by this Python version")
+            return False
+        self.config.enabled = True
+        return True
+
+    def stop(self, timeout: float = 1.0) -> None:
+        """
+        Stop the sampling thread.
+
+        The next profiled request starts it again.
+
+        :param timeout: Seconds to wait for the thread
+        """
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopped.set()
+        self._wake.set()
+        thread.join(timeout)
+        self._thread = None
+
+    def begin(self) -> Optional[ProfiledRequest]:
+        """
+        Start sampling the current task.
+
+        :return: The profiled request, or None when the profiler is disabled
+        """
+        if not self.config.enabled:
+            return None
+        task = asyncio.current_task()
+        if task is None or task in self._requests:
+            return None
+
+        self._loop = task.get_loop()
+        self._loop_thread_id = threading.get_ident()
+        request = ProfiledRequest(
+            task, sampled=random.random() < self.config.sample_rate
+        )
+        self._requests[task] = request
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="request-profiler", daemon=True
+            )
+            self._thread.start()
+        self._wake.set()
+        return request
+
+    async def end(self, request: ProfiledRequest, seconds: float, label: str) -> None:
+        """
+        Stop sampling a request and write its profile if it is kept.
+
+        :param request: The profiled request
+        :param seconds: Duration of the request
+        :param label: Method and route of the request, part of the file name
+        """
+        with self._lock:
+            self._requests.pop(request.task, None)
+        slow = seconds * 1000 >= self.config.slow_ms
+        if not request.stacks or not (slow or request.sampled):
+            return
+        try:
+            await run_in_threadpool(self._write, request.stacks, seconds, label)
+        except OSError:
+            logger.warning("Failed to write a profile", exc_info=True)
+
+    def profiles(self) -> List[str]:
+        """
+        Return the names of the stored profiles, the oldest first.
+
+        :return: A list of file names
+        """
+        try:
+            names = os.listdir(self.config.profile_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if name.endswith(PROFILE_SUFFIX))
+
+    def profile_path(self, name: str) -> Optional[str]:
+        """
+        Return the path of a stored profile.
+
+        :param name: File name of the profile
+        :return: The path, or None when there is no such profile
+        """
+        if name not in self.profiles():
+            return None
+        return os.path.join(self.config.profile_dir, name)
+
+    def _write(self, stacks: Counter, seconds: float, label: str) -> None:
+        """Write the folded stacks and drop the oldest profiles over the limit."""
+        os.makedirs(self.config.profile_dir, exist_ok=True)
+        safe_label = re.sub(r"[^A-Za-z0-9]+", "_", label).strip("_")
+        name = f"{time.time_ns()}_{int(seconds * 1000)}ms_{safe_label}{PROFILE_SUFFIX}"
+        path = os.path.join(self.config.profile_dir, name)
+        with open(f"{path}.part", "w") as file:
+            for stack, count in stacks.items():
+                file.write(f"{';'.join(stack)} {count}\n")
+        os.replace(f"{path}.part", path)
+        self.written += 1
+
+        for old_name in self.profiles()[: -self.config.max_profiles or None]:
+            try:
+                os.remove(os.path.join(self.config.profile_dir, old_name))
+            except FileNotFoundError:
+                pass
+
+    def _run(self) -> None:
+        """Sample the requests in flight, sleeping while there are none."""
+        while True:
+            self._wake.clear()
+            if self._stopped.is_set():
+                return
+            if not self._requests:
+                self._wake.wait()
+                continue
+            time.sleep(self.config.interval_ms / 1000)
+            self._sample()
+
+    def _sample(self) -> None:
+        """Account the current stack of every request in flight."""
+        requests = list(self._requests.values())
+        if not requests:
+            return
+        running = _current_task(self._loop)
+        loop_frame = sys._current_frames().get(self._loop_thread_id)
+        for request in requests:
+            try:
+                if request.task is running and loop_frame is not None:
+                    stack = _thread_stack(loop_frame)
+                else:
+                    stack = _await_stack(request.task)
+            except (AttributeError, RuntimeError):
+                # The coroutine finished while it was walked.
+                continue
+            with self._lock:
+                if request.task in self._requests:
+                    request.stacks[stack] += 1
+
+
+profiler = SamplingProfiler(ProfilerConfig())
+
+
+class ProfilerMiddleware:
+    """ASGI middleware profiling HTTP requests while the profiler is enabled."""
+
+    def __init__(self, app, sampling_profiler: SamplingProfiler = profiler):
+        self.app = app
+        self.profiler = sampling_profiler
+
+    def _profiled(self, scope) -> bool:
+        """Tell whether the request is profiled."""
+        config = self.profiler.config
+        if scope["type"] != "http" or not config.enabled:
+            return False
+        return not scope["path"].startswith(tuple(config.exclude_prefixes))
+
+    async def __call__(self, scope, receive, send):
+        if not self._profiled(scope):
+            await self.app(scope, receive, send)
+            return
+
+        request = self.profiler.begin()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if request is not None:
+                label = f"{scope['method']} {route_template(scope)}"
+                await self.profiler.end(request, time.perf_counter() - started, label)
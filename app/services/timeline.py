@@ -0,0 +1,341 @@
+"""
+This module contains the fan-out-on-write pipeline for the following timeline.
+
+When a tweet is created, a background worker pushes it into the timelines of
+the author's followers and marks it as fanned out. Tweets of authors with more
+followers than the threshold are not fanned out, they are pulled by the readers
+instead. The decision is kept with every tweet, so tweets stay in the timelines
+when the author crosses the threshold later. A new follower receives the latest
+fanned out tweets of the followed author.
+
+Timelines are stored in the database. A tweet marked as fanned out is no
+longer pulled by the readers, so its timeline entries have to outlive the
+process and be shared by every worker.
+"""
+
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from sqlalchemy import ColumnElement, and_, delete, or_, select, tuple_, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.db_settings import db_session
+from app.db.models import Follow, TimelineEntry, Tweet, User
+from app.db.schemas.tweet_schemas import TweetCursor
+from app.db.statements import insert_many_ignoring_conflicts
+
+logger = logging.getLogger(__name__)
+
+FANOUT_QUEUE_SIZE = 10000
+DEFAULT_BACKFILL_LENGTH = 800
+
+
+class TimelineConfig(BaseSettings):
+    """
+    Following timeline configuration.
+
+    Values are read from 'TIMELINE_' prefixed environment variables or the .env file.
+    """
+
+    model_config = SettingsConfigDict(
+        env_prefix="TIMELINE_", env_file=".env", extra="ignore"
+    )
+
+    fanout_enabled: bool = False
+    fanout_follower_threshold: int = 10000
+    # Latest fanned out tweets of an author pushed to a new follower.
+    backfill_length: int = DEFAULT_BACKFILL_LENGTH
+
+
+class TimelineItem(NamedTuple):
+    """A tweet in a materialized timeline."""
+
+    created_at: datetime
+    tweet_id: int
+    author_id: int
+
+
+class TimelineStore(ABC):
+    """Storage of materialized per-user timelines."""
+
+    @abstractmethod
+    async def push(
+        self,
+        session: AsyncSession,
+        item: TimelineItem,
+        user_ids: Sequence[int],
+    ) -> None:
+        """
+        Add a tweet to the timelines of the users.
+
+        :param session: The database session used for the query
+        :param item: The tweet to add
+        :param user_ids: IDs of the users whose timelines receive the tweet
+        """
+
+    @abstractmethod
+    async def backfill(
+        self,
+        session: AsyncSession,
+        user_id: int,
+        items: Sequence[TimelineItem],
+    ) -> None:
+        """
+        Add tweets to the timeline of one user.
+
+        Tweets already in the timeline are skipped.
+
+        :param session: The database session used for the query
+        :param user_id: The ID of the timeline owner
+        :param items: The tweets to add
+        """
+
+    @abstractmethod
+    async def read(
+        self,
+        session: AsyncSession,
+        user_id: int,
+        cursor: Optional[TweetCursor],
+        newer: bool,
+        limit: int,
+    ) -> List[TimelineItem]:
+        """
+        Read a range of the user's timeline.
+
+        Items are returned newest first, or oldest first when reading newer
+        items than the cursor.
+
+        :param session: The database session used for the query
+        :param user_id: The ID of the timeline owner
+        :param cursor: Position to read from (optional)
+        :param newer: Read items newer than the cursor instead of older ones
+        :param limit: Maximum number of items
+        :return: A list of 'TimelineItem' objects
+        """
+
+    @abstractmethod
+    async def remove_tweet(self, session: AsyncSession, tweet_id: int) -> None:
+        """
+        Remove a tweet from every timeline.
+
+        :param session: The database session used for the query
+        :param tweet_id: The ID of the deleted tweet
+        """
+
+    @abstractmethod
+    async def remove_author(
+        self,
+        session: AsyncSession,
+        user_id: int,
+        author_id: int,
+    ) -> None:
+        """
+        Remove tweets of an author from the user's timeline.
+
+        :param session: The database session used for the query
+        :param user_id: The ID of the timeline owner
+        :param author_id: The ID of the unfollowed author
+        """
+
+
+def _entry(user_id: int, item: TimelineItem) -> Dict[str, object]:
+    """Return the column values of the timeline entry of a tweet."""
+    return {
+        "user_id": user_id,
+        "tweet_id": item.tweet_id,
+        "author_id": item.author_id,
+        "tweet_created_at": item.created_at,
+    }
+
+
+class SQLTimelineStore(TimelineStore):
+    """Timelines stored in the 'timeline_entries' table, shared by all workers."""
+
+    async def push(self, session, item, user_ids):
+        """Insert one entry per user, skipping entries written by a backfill."""
+        entries = [_entry(user_id, item) for user_id in user_ids]
+        await insert_many_ignoring_conflicts(session, TimelineEntry, entries)
+
+    async def backfill(self, session, user_id, items):
+        """Insert one entry per tweet, skipping entries written by the worker."""
+        entries = [_entry(user_id, item) for item in items]
+        await insert_many_ignoring_conflicts(session, TimelineEntry, entries)
+
+    async def read(self, session, user_id, cursor, newer, limit):
+        """Read entries with a range scan over the timeline index."""
+        position = tuple_(TimelineEntry.tweet_created_at, TimelineEntry.tweet_id)
+        query = select(
+            TimelineEntry.tweet_created_at,
+            TimelineEntry.tweet_id,
+            TimelineEntry.author_id,
+        ).where(TimelineEntry.user_id == user_id)
+        if cursor:
+            bound = tuple_(cursor.created_at, cursor.id)
+            query = query.where(position > bound if newer else position < bound)
+
+        order = [
+            column.asc() if newer else column.desc()
+            for column in (TimelineEntry.tweet_created_at, TimelineEntry.tweet_id)
+        ]
+        res = await session.execute(query.order_by(*order).limit(limit))
+        return [TimelineItem(*row) for row in res.all()]
+
+    async def remove_tweet(self, session, tweet_id):
+        """Delete entries of the tweet."""
+        await session.execute(
+            delete(TimelineEntry).where(TimelineEntry.tweet_id == tweet_id)
+        )
+
+    async def remove_author(self, session, user_id, author_id):
+        """Delete entries of the author in the user's timeline."""
+        await session.execute(
+            delete(TimelineEntry).where(
+                TimelineEntry.user_id == user_id,
+                TimelineEntry.author_id == author_id,
+            ),
+        )
+
+
+class FanoutWorker:
+    """Background task which pushes new tweets into the followers' timelines."""
+
+    def __init__(
+        self,
+        store: TimelineStore,
+        session_factory: Callable[[], AsyncSession],
+        follower_threshold: int,
+        enabled: bool,
+        backfill_length: int = DEFAULT_BACKFILL_LENGTH,
+    ):
+        self.store = store
+        self.session_factory = session_factory
+        self.follower_threshold = follower_threshold
+        self.enabled = enabled
+        self.backfill_length = backfill_length
+        self._queue: "asyncio.Queue[TimelineItem]" = asyncio.Queue(
+            maxsize=FANOUT_QUEUE_SIZE
+        )
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Start the worker task if fan-out is enabled."""
+        if self.enabled and self._task is None:
+            self._queue = asyncio.Queue(maxsize=FANOUT_QUEUE_SIZE)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Process the queued tweets and stop the worker task."""
+        if self._task is None:
+            return
+        await self.drain()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def drain(self) -> None:
+        """Wait until every queued tweet is fanned out."""
+        await self._queue.join()
+
+    async def submit(self, tweet_id: int, author_id: int, created_at: datetime) -> None:
+        """
+        Queue a committed tweet for fan-out.
+
+        Waits for a free slot when the queue is full, which slows writers
+        down instead of losing timeline entries.
+
+        :param tweet_id: The ID of the new tweet
+        :param author_id: The ID of the author
+        :param created_at: Creation time of the tweet
+        """
+        if self._task is None:
+            return
+        await self._queue.put(TimelineItem(created_at, tweet_id, author_id))
+
+    async def _run(self) -> None:
+        """Fan out queued tweets one by one."""
+        while True:
+            item = await self._queue.get()
+            try:
+                await self._fan_out(item)
+            except SQLAlchemyError:
+                logger.exception("Fan-out of tweet %s failed", item.tweet_id)
+            finally:
+                self._queue.task_done()
+
+    async def _fan_out(self, item: TimelineItem) -> None:
+        """Push the tweet to every follower unless the author is a celebrity."""
+        async with self.session_factory() as session:
+            followers_count = await session.scalar(
+                select(User.followers_count).where(User.id == item.author_id),
+            )
+            if followers_count is None or followers_count > self.follower_threshold:
+                return
+            res = await session.execute(
+                update(Tweet).where(Tweet.id == item.tweet_id).values(fanned_out=True)
+            )
+            if not res.rowcount:
+                # The tweet was deleted before its turn.
+                return
+            query = select(Follow.follower_id).where(
+                Follow.followed_id == item.author_id
+            )
+            follower_ids = (await session.execute(query)).scalars().all()
+            await self.store.push(session, item, follower_ids)
+            await session.commit()
+
+    async def backfill(
+        self, session: AsyncSession, follower_id: int, followed_id: int
+    ) -> None:
+        """
+        Push the latest fanned out tweets of a followed user to the follower.
+
+        Runs in the transaction of the follow. Tweets which were not fanned out
+        are pulled by the reader and are not pushed.
+
+        :param session: The database session used for the query
+        :param follower_id: The ID of the new follower
+        :param followed_id: The ID of the followed user
+        """
+        if not self.enabled:
+            return
+        query = (
+            select(Tweet.created_at, Tweet.id, Tweet.user_id)
+            .where(Tweet.user_id == followed_id, Tweet.fanned_out.is_(True))
+            .order_by(Tweet.created_at.desc(), Tweet.id.desc())
+            .limit(self.backfill_length)
+        )
+        items = [TimelineItem(*row) for row in (await session.execute(query)).all()]
+        await self.store.backfill(session, follower_id, items)
+
+
+def pulled_tweets(user_id: int) -> ColumnElement[bool]:
+    """
+    Build the condition of the tweets a reader pulls into the timeline.
+
+    These are the reader's own tweets and the tweets of the followed users
+    which were not fanned out, e.g. tweets of celebrities and tweets still
+    queued for fan-out.
+
+    :param user_id: The ID of the reader
+    :return: A condition on the tweets table
+    """
+    followed_ids = select(Follow.followed_id).where(Follow.follower_id == user_id)
+    return or_(
+        Tweet.user_id == user_id,
+        and_(Tweet.user_id.in_(followed_ids), Tweet.fanned_out.is_(False)),
+    )
+
+
+timeline_config = TimelineConfig()
+timeline_fanout = FanoutWorker(
+    store=SQLTimelineStore(),
+    session_factory=db_session.async_session,
+    follower_threshold=timeline_config.fanout_follower_threshold,
+    enabled=timeline_config.fanout_enabled,
+    backfill_length=timeline_config.backfill_length,
+)
@@ -0,0 +1,379 @@
+"""
+End-to-end benchmark of the API routes.
+
+Every scenario sends requests to one route at a fixed concurrency and
+reports p50/p95/p99 latency, throughput, errors and SQL queries per request.
+Results are written as JSON, and a previous result can be compared against.
+
+By default the application runs in-process over ASGI against a temporary
+SQLite database seeded with one of the dataset presets. '--database-url'
+seeds another database, e.g. an empty Postgres one. '--url' benchmarks a
+running server instead, whose database was seeded beforehand with
+'python -m app.cli generate' using the same dataset; queries are not
+counted then. Run from the repository root:
+
+    python -m benchmarks.api_bench --dataset small --concurrency 16
+    python -m benchmarks.api_bench --compare benchmarks/results/<previous>.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import struct
+import subprocess
+import tempfile
+import time
+import zlib
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.db.base_model import Base
+from app.db.db_settings import DBSettings, db_session
+from app.db.migrations import run_migrations
+from app.main import app
+from app.routes.crud.generate_data import GenerationParams, generate_data
+from app.routes.crud.insert_data import insert_data
+from app.services.feed_cache import feed_cache
+from app.services.media.config import media_config
+
+DATASETS = {
+    "small": GenerationParams(users=1000, tweets=10000),
+    "medium": GenerationParams(users=10000, tweets=100000),
+    "large": GenerationParams(users=100000, tweets=1000000),
+}
+# Users seeded by 'insert_data' before the generated ones.
+SEEDED_USERS = 3
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+Request = Tuple[str, str, Dict[str, Any]]
+
+
+@dataclass
+class ScenarioResult:
+    """Measurements of one scenario."""
+
+    requests: int
+    errors: int
+    seconds: float
+    throughput: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    queries_per_request: Optional[float] = None
+    status_codes: Dict[str, int] = field(default_factory=dict)
+
+
+class QueryCounter:
+    """Counts the statements executed by an engine."""
+
+    def __init__(self, engine: AsyncEngine):
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args: Any) -> None:
+        self.count += 1
+
+
+class Scenarios:
+    """Builds the requests of every scenario from random users and tweets."""
+
+    def __init__(self, params: GenerationParams, rng: random.Random):
+        self.rng = rng
+        self.user_ids = range(SEEDED_USERS + 1, SEEDED_USERS + params.users + 1)
+        self.tweet_count = params.tweets
+
+    def api_key(self, user_id: int) -> Dict[str, str]:
+        """Return the header of a generated user."""
+        return {"api-key": f"gen-{user_id}"}
+
+    def user(self) -> int:
+        """Return a random generated user."""
+        return self.rng.choice(self.user_ids)
+
+    def reading(self) -> Dict[str, Callable[[], Request]]:
+        """Return the scenarios which do not change data."""
+        return {
+            "feed_all": lambda: self._get("/api/tweets", {"limit": 20}),
+            "feed_home": lambda: self._get("/api/tweets", {"feed": "home"}),
+            "feed_following": lambda: self._get("/api/tweets", {"feed": "following"}),
+            "users_me": lambda: self._get("/api/users/me"),
+            "user_by_id": lambda: self._get(f"/api/users/{self.user()}"),
+        }
+
+    def pairs(self, count: int, targets: int) -> List[Tuple[int, int]]:
+        """
+        Draw distinct pairs of a generated user and a target ID.
+
+        :param count: Number of pairs
+        :param targets: Number of targets, numbered from 1
+        :return: A list of tuples (user ID, target ID)
+        """
+        pairs = set()
+        while len(pairs) < count:
+            pairs.add((self.user(), self.rng.randint(1, targets)))
+        return list(pairs)
+
+    def writing(self, count: int) -> Dict[str, List[Request]]:
+        """
+        Return the scenarios which change data, in the order to run them.
+
+        Likes and follows are removed again by the following scenario.
+
+        :param count: Number of requests per scenario
+        :return: A dictionary of scenario names and their requests
+        """
+        likes = self.pairs(count, self.tweet_count)
+        follows = [
+            (user_id, SEEDED_USERS + target)
+            for user_id, target in self.pairs(count, len(self.user_ids))
+            if user_id != SEEDED_USERS + target
+        ]
+        return {
+            "like": [self._post(f"/api/tweets/{t}/likes", u) for u, t in likes],
+            "unlike": [self._delete(f"/api/tweets/{t}/likes", u) for u, t in likes],
+            "follow": [self._post(f"/api/users/{f}/follow", u) for u, f in follows],
+            "unfollow": [self._delete(f"/api/users/{f}/follow", u) for u, f in follows],
+            "create_tweet": [
+                self._post("/api/tweets", self.user(), json={"tweet_data": "Bench"})
+                for _ in range(count)
+            ],
+            "upload_media": [
+                self._post(
+                    "/api/medias",
+                    self.user(),
+                    files={"file": ("bench.png", io.BytesIO(self._png()), "image/png")},
+                )
+                for _ in range(count)
+            ],
+        }
+
+    def _png(self) -> bytes:
+        """Return an image with unique content."""
+        return tiny_png(self.rng.randbytes(8).hex().encode())
+
+    def _get(self, path: str, params: Optional[Dict[str, Any]] = None) -> Request:
+        return "GET", path, {"params": params, "headers": self.api_key(self.user())}
+
+    def _post(self, path: str, user_id: int, **kwargs: Any) -> Request:
+        return "POST", path, {"headers": self.api_key(user_id), **kwargs}
+
+    def _delete(self, path: str, user_id: int) -> Request:
+        return "DELETE", path, {"headers": self.api_key(user_id)}
+
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    """Encode a chunk of a PNG file."""
+    crc = zlib.crc32(kind + data)
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
+
+
+def tiny_png(text: bytes) -> bytes:
+    """Build a 1x1 PNG with a text chunk, which makes its content unique."""
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)
+    chunks = [
+        png_chunk(b"IHDR", header),
+        png_chunk(b"tEXt", b"Comment\x00" + text),
+        png_chunk(b"IDAT", zlib.compress(b"\x00\xff\x00\x00")),
+        png_chunk(b"IEND", b""),
+    ]
+    return b"".join([b"\x89PNG\r\n\x1a\n", *chunks])
+
+
+def percentile(latencies: List[float], share: float) -> float:
+    """Return the percentile of sorted latencies in milliseconds."""
+    index = min(int(len(latencies) * share), len(latencies) - 1)
+    return round(latencies[index] * 1000, 3)
+
+
+async def run_scenario(
+    client: AsyncClient,
+    requests: List[Request],
+    concurrency: int,
+    counter: Optional[QueryCounter],
+) -> ScenarioResult:
+    """
+    Send the requests by concurrent workers.
+
+    :param client: Client of the application
+    :param requests: Tuples (method, path, keyword arguments of 'request')
+    :param concurrency: Number of requests in flight
+    :param counter: Query counter of the database (optional)
+    :return: Measurements of the scenario
+    """
+    latencies: List[float] = []
+    status_codes: Dict[str, int] = {}
+    pending = iter(requests)
+    queries_before = counter.count if counter else 0
+
+    async def worker():
+        for method, path, kwargs in pending:
+            started = time.perf_counter()
+            response = await client.request(method, path, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            code = str(response.status_code)
+            status_codes[code] = status_codes.get(code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - started
+
+    latencies.sort()
+    errors = sum(count for code, count in status_codes.items() if int(code) >= 400)
+    queries = None
+    if counter is not None:
+        queries = round((counter.count - queries_before) / len(requests), 2)
+    return ScenarioResult(
+        requests=len(requests),
+        errors=errors,
+        seconds=round(seconds, 3),
+        throughput=round(len(requests) / seconds, 1),
+        p50_ms=percentile(latencies, 0.5),
+        p95_ms=percentile(latencies, 0.95),
+        p99_ms=percentile(latencies, 0.99),
+        queries_per_request=queries,
+        status_codes=status_codes,
+    )
+
+
+async def seed(settings: DBSettings, params: GenerationParams) -> None:
+    """Create the schema and fill the database with the dataset."""
+    async with settings.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await run_migrations(settings.engine)
+    async with settings.async_session() as session:
+        await insert_data(session)
+        await generate_data(session, params)
+
+
+def print_table(results: Dict[str, ScenarioResult]) -> None:
+    """Print the measurements of every scenario."""
+    columns = ("p50_ms", "p95_ms", "p99_ms", "throughput", "errors")
+    print(f"{'scenario':16}" + "".join(f"{column:>12}" for column in columns), end="")
+    print(f"{'queries':>12}")
+    for name, result in results.items():
+        values = asdict(result)
+        queries = result.queries_per_request
+        print(
+            f"{name:16}" + "".join(f"{values[column]:>12}" for column in columns),
+            end="",
+        )
+        print(f"{'-' if queries is None else queries:>12}")
+
+
+def current_commit() -> Optional[str]:
+    """Return the checked out commit, if the benchmark runs in a git checkout."""
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+
+def compare(results: Dict[str, Any], previous_path: str) -> None:
+    """Print the change of latency and throughput against a previous run."""
+    with open(previous_path) as file:
+        previous = json.load(file)["results"]
+    print(f"\nCompared with {previous_path}:")
+    for name, result in results.items():
+        before = previous.get(name)
+        if before is None:
+            continue
+        changes = [
+            f"{key} {(result[key] - before[key]) / before[key] * 100:+.1f}%"
+            for key in ("p50_ms", "p95_ms", "p99_ms", "throughput")
+            if before[key]
+        ]
+        print(f"{name:16} {'  '.join(changes)}")
+
+
+async def main(args: argparse.Namespace) -> None:
+    """Seed the dataset, run every scenario and store the results."""
+    params = GenerationParams(**{**asdict(DATASETS[args.dataset]), "seed": args.seed})
+    feed_cache.enabled = not args.no_feed_cache
+    counter = None
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.url:
+            client = AsyncClient(base_url=args.url, timeout=60)
+        else:
+            url = args.database_url or f"sqlite+aiosqlite:///{workdir}/bench.db"
+            settings = DBSettings(url=url)
+            await seed(settings, params)
+            counter = QueryCounter(settings.engine)
+            app.dependency_overrides[db_session.get_session] = settings.get_session
+            app.dependency_overrides[db_session.get_read_session] = (
+                settings.get_read_session
+            )
+            media_config.upload_dir = os.path.join(workdir, "images")
+            client = AsyncClient(
+                transport=ASGITransport(app=app), base_url="http://bench", timeout=60
+            )
+
+        scenarios = Scenarios(params, random.Random(args.seed))
+        results = {}
+        async with client:
+            for name, build in scenarios.reading().items():
+                requests = [build() for _ in range(args.requests)]
+                results[name] = await run_scenario(
+                    client, requests, args.concurrency, counter
+                )
+            for name, requests in scenarios.writing(args.requests).items():
+                results[name] = await run_scenario(
+                    client, requests, args.concurrency, counter
+                )
+
+        if not args.url:
+            await settings.dispose()
+
+    print_table(results)
+
+    commit = current_commit()
+    report = {
+        "commit": commit,
+        "time": datetime.now(timezone.utc).isoformat(),
+        "target": args.url or "asgi",
+        "dataset": args.dataset,
+        "params": asdict(params),
+        "concurrency": args.concurrency,
+        "feed_cache": feed_cache.enabled,
+        "results": {name: asdict(result) for name, result in results.items()},
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{commit or 'local'}-{args.dataset}-c{args.concurrency}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(report["results"], args.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dataset", choices=sorted(DATASETS), default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--requests", type=int, default=500, help="Requests per scenario"
+    )
+    parser.add_argument("--url", help="Base URL of a running server")
+    parser.add_argument("--database-url", help="Database to seed instead of SQLite")
+    parser.add_argument("--no-feed-cache", action="store_true")
+    parser.add_argument("--output", help="Path of the JSON results")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    asyncio.run(main(parser.parse_args()))
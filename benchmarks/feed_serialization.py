@@ -0,0 +1,187 @@
+"""
+Benchmark of the tweet feed serialization.
+
+Compares requests per second of a feed page served the previous way (ORM
+objects with eager loaded relationships, nested dicts validated against
+'TweetOut' and encoded by the standard json encoder) with GET /api/tweets,
+which reads flat rows and encodes them with orjson.
+
+The application is called in-process over ASGI against an in-memory SQLite
+database, so the numbers show the CPU cost per request rather than network
+or Postgres latency. Run from the repository root:
+
+    python -m benchmarks.feed_serialization --tweets 2000 --likes 20 --limit 100
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from typing import Annotated, Any, Dict
+
+from fastapi import APIRouter, Depends, FastAPI, Header
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import joinedload, selectinload, sessionmaker
+
+from app.db.base_model import Base, utc_now
+from app.db.db_settings import db_session
+from app.db.models import Image, Like, Tweet, User
+from app.db.schemas.tweet_schemas import TweetOut
+from app.routes.api_tweets import tweets_routes
+from app.routes.crud.crud_users import get_user_identity
+from app.services.feed_cache import feed_cache
+
+API_KEY = "user-0"
+
+engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+async_session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def get_session():
+    """Yield a session of the benchmark database."""
+    async with async_session() as session:
+        yield session
+
+
+legacy_routes = APIRouter()
+
+
+@legacy_routes.get("/legacy/tweets", response_model=TweetOut)
+async def legacy_feed(
+    api_key: Annotated[str, Header()],
+    session: Annotated[AsyncSession, Depends(get_session)],
+    limit: int = 20,
+) -> Dict[str, Any]:
+    """Serve the newest tweets the way the feed was served before."""
+    await get_user_identity(session=session, api_key=api_key)
+    query = (
+        select(Tweet)
+        .options(
+            joinedload(Tweet.user).load_only(User.id, User.name),
+            selectinload(Tweet.likes),
+            selectinload(Tweet.images),
+        )
+        .order_by(Tweet.created_at.desc(), Tweet.id.desc())
+        .limit(limit)
+    )
+    tweets = (await session.execute(query)).scalars().all()
+    return {
+        "result": True,
+        "tweets": [
+            {
+                "id": tweet.id,
+                "content": tweet.tweet_text,
+                "attachments": [
+                    image.medium_path or image.path for image in tweet.images
+                ],
+                "author": {"id": tweet.user.id, "name": tweet.user.name},
+                "likes": [{"user_id": like.user_id} for like in tweet.likes],
+                "like_count": tweet.like_count,
+            }
+            for tweet in tweets
+        ],
+        "next_cursor": None,
+    }
+
+
+async def seed(users: int, tweets: int, likes: int) -> None:
+    """Fill the database with random tweets, likes and images."""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    rng = random.Random(0)
+    now = utc_now()
+    async with async_session() as session:
+        await session.execute(
+            insert(User),
+            [{"name": f"User {i}", "api_key": f"user-{i}"} for i in range(users)],
+        )
+        await session.execute(
+            insert(Tweet),
+            [
+                {
+                    "tweet_text": f"Tweet {i}",
+                    "user_id": rng.randint(1, users),
+                    "like_count": min(likes, users),
+                    "created_at": now,
+                }
+                for i in range(tweets)
+            ],
+        )
+        await session.execute(
+            insert(Like),
+            [
+                {"tweet_id": tweet_id, "user_id": user_id}
+                for tweet_id in range(1, tweets + 1)
+                for user_id in rng.sample(range(1, users + 1), min(likes, users))
+            ],
+        )
+        await session.execute(
+            insert(Image),
+            [
+                {"tweet_id": tweet_id, "path": f"images/{tweet_id}.jpg"}
+                for tweet_id in range(1, tweets + 1, 3)
+            ],
+        )
+        await session.commit()
+
+
+async def measure(
+    client: AsyncClient, url: str, params: Dict[str, Any], requests: int
+) -> float:
+    """
+    Request the URL sequentially and return the number of requests per second.
+
+    :param client: Client of the benchmark application
+    :param url: URL of the feed
+    :param params: Query parameters
+    :param requests: Number of measured requests
+    :return: Requests per second
+    """
+    for _ in range(max(requests // 10, 1)):
+        response = await client.get(url, params=params)
+        response.raise_for_status()
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        await client.get(url, params=params)
+    return requests / (time.perf_counter() - started)
+
+
+async def main(args: argparse.Namespace) -> None:
+    """Seed the database and compare both feeds."""
+    await seed(users=args.users, tweets=args.tweets, likes=args.likes)
+
+    app = FastAPI()
+    app.include_router(tweets_routes)
+    app.include_router(legacy_routes)
+    app.dependency_overrides[db_session.get_read_session] = get_session
+    # Every request should build the page, not read it from the cache.
+    feed_cache.enabled = False
+
+    params = {"limit": args.limit}
+    async with AsyncClient(
+        transport=ASGITransport(app=app),
+        base_url="http://bench",
+        headers={"api-key": API_KEY},
+    ) as client:
+        before = await measure(client, "/legacy/tweets", params, args.requests)
+        after = await measure(client, "/api/tweets", params, args.requests)
+
+    print(f"{args.limit} tweets per page, {args.likes} likes per tweet")
+    print(f"before: {before:8.1f} requests/s  {1000 / before:6.2f} ms/request")
+    print(f"after:  {after:8.1f} requests/s  {1000 / after:6.2f} ms/request")
+    print(f"speedup: {after / before:.2f}x")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--tweets", type=int, default=2000)
+    parser.add_argument("--likes", type=int, default=20, help="Likes per tweet")
+    parser.add_argument("--limit", type=int, default=100, help="Tweets per page")
+    parser.add_argument("--requests", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
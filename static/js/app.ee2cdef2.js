@@ -1,2 +1,2 @@
-(function(e){function t(t){for(var c,r,o=t[0],u=t[1],s=t[2],l=0,b=[];l<o.length;l++)r=o[l],Object.prototype.hasOwnProperty.call(i,r)&&i[r]&&b.push(i[r][0]),i[r]=0;for(c in u)Object.prototype.hasOwnProperty.call(u,c)&&(e[c]=u[c]);d&&d(t);while(b.length)b.shift()();return a.push.apply(a,s||[]),n()}function n(){for(var e,t=0;t<a.length;t++){for(var n=a[t],c=!0,r=1;r<n.length;r++){var o=n[r];0!==i[o]&&(c=!1)}c&&(a.splice(t--,1),e=u(u.s=n[0]))}return e}var c={},r={app:0},i={app:0},a=[];function o(e){return u.p+"js/"+({}[e]||e)+"."+{"chunk-76301fe8":"cc56c3b1","chunk-10e0d5b4":"e80e67b6","chunk-732a3e8c":"57e36fb4","chunk-0420bcc4":"11441662","chunk-6f77c742":"f09861a7"}[e]+".js"}function u(t){if(c[t])return c[t].exports;var n=c[t]={i:t,l:!1,exports:{}};return e[t].call(n.exports,n,n.exports,u),n.l=!0,n.exports}u.e=function(e){var t=[],n={"chunk-10e0d5b4":1,"chunk-732a3e8c":1,"chunk-0420bcc4":1,"chunk-6f77c742":1};r[e]?t.push(r[e]):0!==r[e]&&n[e]&&t.push(r[e]=new Promise((function(t,n){for(var c="css/"+({}[e]||e)+"."+{"chunk-76301fe8":"31d6cfe0","chunk-10e0d5b4":"130d80ef","chunk-732a3e8c":"6334cd6b","chunk-0420bcc4":"d6bc3184","chunk-6f77c742":"8d9a3d9c"}[e]+".css",i=u.p+c,a=document.getElementsByTagName("link"),o=0;o<a.length;o++){var s=a[o],l=s.getAttribute("data-href")||s.getAttribute("href");if("stylesheet"===s.rel&&(l===c||l===i))return t()}var b=document.getElementsByTagName("style");for(o=0;o<b.length;o++){s=b[o],l=s.getAttribute("data-href");if(l===c||l===i)return t()}var d=document.createElement("link");d.rel="stylesheet",d.type="text/css",d.onload=t,d.onerror=function(t){var c=t&&t.target&&t.target.src||i,a=new Error("Loading CSS chunk "+e+" failed.\n("+c+")");a.code="CSS_CHUNK_LOAD_FAILED",a.request=c,delete r[e],d.parentNode.removeChild(d),n(a)},d.href=i;var p=document.getElementsByTagName("head")[0];p.appendChild(d)})).then((function(){r[e]=0})));var c=i[e];if(0!==c)if(c)t.push(c[2]);else{var a=new Promise((function(t,n){c=i[e]=[t,n]}));t.push(c[2]=a);var s,l=document.createElement("script");l.charset="utf-8",l.timeout=120,u.nc&&l.setAttribute("nonce",u.nc),l.src=o(e);var b=new Error;s=function(t){l.onerror=l.onload=null,clearTimeout(d);var n=i[e];if(0!==n){if(n){var c=t&&("load"===t.type?"missing":t.type),r=t&&t.target&&t.target.src;b.message="Loading chunk "+e+" failed.\n("+c+": "+r+")",b.name="ChunkLoadError",b.type=c,b.request=r,n[1](b)}i[e]=void 0}};var d=setTimeout((function(){s({type:"timeout",target:l})}),12e4);l.onerror=l.onload=s,document.head.appendChild(l)}return Promise.all(t)},u.m=e,u.c=c,u.d=function(e,t,n){u.o(e,t)||Object.defineProperty(e,t,{enumerable:!0,get:n})},u.r=function(e){"undefined"!==typeof Symbol&&Symbol.toStringTag&&Object.defineProperty(e,Symbol.toStringTag,{value:"Module"}),Object.defineProperty(e,"__esModule",{value:!0})},u.t=function(e,t){if(1&t&&(e=u(e)),8&t)return e;if(4&t&&"object"===typeof e&&e&&e.__esModule)return e;var n=Object.create(null);if(u.r(n),Object.defineProperty(n,"default",{enumerable:!0,value:e}),2&t&&"string"!=typeof e)for(var c in e)u.d(n,c,function(t){return e[t]}.bind(null,c));return n},u.n=function(e){var t=e&&e.__esModule?function(){return e["default"]}:function(){return e};return u.d(t,"a",t),t},u.o=function(e,t){return Object.prototype.hasOwnProperty.call(e,t)},u.p="/",u.oe=function(e){throw console.error(e),e};var s=window["webpackJsonp"]=window["webpackJsonp"]||[],l=s.push.bind(s);s.push=t,s=s.slice();for(var b=0;b<s.length;b++)t(s[b]);var d=l;a.push([0,"chunk-vendors"]),n()})({0:function(e,t,n){e.exports=n("56d7")},"0377":function(e,t,n){"use strict";n.d(t,"a",(function(){return r}));var c=[{id:1,name:"test",api_token:"test",followers:[{id:2}],following:[{id:2}]},{id:2,name:"test2",api_token:"test2",followers:[{id:1}],following:[{id:1}]}],r=(c[0],c[1],c[0].username,c[0].password,[{name:"#GoLang",tweetsCount:155614},{name:"#Python",tweetsCount:121353},{name:"#DevConf2022",tweetsCount:90420}])},"0a8a":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={xmlns:"http://www.w3.org/2000/svg",width:"24",height:"24",viewBox:"0 0 24 24"},i=Object(c["h"])("path",{d:"M23 20.168l-8.185-8.187 8.185-8.174-2.832-2.807-8.182 8.179-8.176-8.179-2.81 2.81 8.186 8.196-8.186 8.184 2.81 2.81 8.203-8.192 8.18 8.192z"},null,-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"0b2b":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-jwli3a r-4qtqp9 r-yyyyoo r-lwhw9o r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M21 7.337h-3.93l.372-4.272c.036-.412-.27-.775-.682-.812-.417-.03-.776.27-.812.683l-.383 4.4h-6.32l.37-4.27c.037-.413-.27-.776-.68-.813-.42-.03-.777.27-.813.683l-.382 4.4H3.782c-.414 0-.75.337-.75.75s.336.75.75.75H7.61l-.55 6.327H3c-.414 0-.75.336-.75.75s.336.75.75.75h3.93l-.372 4.272c-.036.412.27.775.682.812l.066.003c.385 0 .712-.295.746-.686l.383-4.4h6.32l-.37 4.27c-.036.413.27.776.682.813l.066.003c.385 0 .712-.295.746-.686l.382-4.4h3.957c.413 0 .75-.337.75-.75s-.337-.75-.75-.75H16.39l.55-6.327H21c.414 0 .75-.336.75-.75s-.336-.75-.75-.75zm-6.115 7.826h-6.32l.55-6.326h6.32l-.55 6.326z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"0eb3":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={xmlns:"http://www.w3.org/2000/svg",width:"24",height:"24",viewBox:"0 0 24 24"},i=Object(c["h"])("path",{d:"M18.363 8.464l1.433 1.431-12.67 12.669-7.125 1.436 1.439-7.127 12.665-12.668 1.431 1.431-12.255 12.224-.726 3.584 3.584-.723 12.224-12.257zm-.056-8.464l-2.815 2.817 5.691 5.692 2.817-2.821-5.693-5.688zm-12.318 18.718l11.313-11.316-.705-.707-11.313 11.314.705.709z"},null,-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"1f92":function(e,t,n){"use strict";n("e4a1")},2031:function(e,t,n){"use strict";n("2b5b")},"222d":function(e,t,n){"use strict";n("5f5b")},"25ac":function(e,t,n){},"2b57":function(e,t,n){var c={"./back":"d0e9","./back.vue":"d0e9","./bookmarks":"372e","./bookmarks.vue":"372e","./calendar":"a1f6","./calendar.vue":"a1f6","./close":"0a8a","./close.vue":"0a8a","./comment":"b7b3","./comment.vue":"b7b3","./editTweet":"e29c","./editTweet.vue":"e29c","./explore":"0b2b","./explore.vue":"0b2b","./gif":"ac39","./gif.vue":"ac39","./graph":"79f9","./graph.vue":"79f9","./hamburger":"f8b4","./hamburger.vue":"f8b4","./help":"7c33","./help.vue":"7c33","./home":"52d6","./home.vue":"52d6","./image":"d674","./image.vue":"d674","./left":"3bd9","./left.vue":"3bd9","./like":"e796","./like.vue":"e796","./link":"4731","./link.vue":"4731","./lists":"ca5e","./lists.vue":"ca5e","./messages":"59d3","./messages.vue":"59d3","./moments":"999a","./moments.vue":"999a","./more":"2fa1","./more.vue":"2fa1","./notifications":"63c6","./notifications.vue":"63c6","./pen":"0eb3","./pen.vue":"0eb3","./profile":"b904","./profile.vue":"b904","./retweet":"ab4d","./retweet.vue":"ab4d","./right":"3217","./right.vue":"3217","./schedule":"8a54","./schedule.vue":"8a54","./search":"50d1","./search.vue":"50d1","./settings":"cdbe","./settings.vue":"cdbe","./share":"8dfb","./share.vue":"8dfb","./smile":"af00","./smile.vue":"af00","./tick":"5c20","./tick.vue":"5c20","./topics":"c312","./topics.vue":"c312","./trash":"a5bc","./trash.vue":"a5bc","./twitter":"74a2","./twitter.vue":"74a2"};function r(e){var t=i(e);return n(t)}function i(e){if(!n.o(c,e)){var t=new Error("Cannot find module '"+e+"'");throw t.code="MODULE_NOT_FOUND",t}return c[e]}r.keys=function(){return Object.keys(c)},r.resolve=i,e.exports=r,r.id="2b57"},"2b5b":function(e,t,n){},"2d63":function(e,t,n){"use strict";n("6e60")},"2fa1":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-jwli3a r-4qtqp9 r-yyyyoo r-lwhw9o r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("circle",{cx:"17",cy:"12",r:"1.5"}),Object(c["h"])("circle",{cx:"12",cy:"12",r:"1.5"}),Object(c["h"])("circle",{cx:"7",cy:"12",r:"1.5"}),Object(c["h"])("path",{d:"M12 22.75C6.072 22.75 1.25 17.928 1.25 12S6.072 1.25 12 1.25 22.75 6.072 22.75 12 17.928 22.75 12 22.75zm0-20C6.9 2.75 2.75 6.9 2.75 12S6.9 21.25 12 21.25s9.25-4.15 9.25-9.25S17.1 2.75 12 2.75z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},3217:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={xmlns:"http://www.w3.org/2000/svg",width:"24",height:"24",viewBox:"0 0 24 24"},i=Object(c["h"])("path",{d:"M7.33 24l-2.83-2.829 9.339-9.175-9.339-9.167 2.83-2.829 12.17 11.996z"},null,-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"345e":function(e,t,n){"use strict";var c=n("7a23"),r={class:"add-tweet"},i={class:"add-tweet-profile"},a=["src"],o={class:"add-tweet-content"},u={class:"tweet-section"},s={key:0,class:"tweet-section-images"},l=["src"],b=["onClick"],d={class:"controls"},p={class:"controls-media"},h={class:"controls-submit"},f=["disabled"];function g(e,t,n,g,m,O){var j=Object(c["C"])("base-icon");return Object(c["u"])(),Object(c["g"])("div",r,[Object(c["h"])("div",i,[Object(c["h"])("img",{src:e.me.profile.pic},null,8,a)]),Object(c["h"])("div",o,[Object(c["h"])("div",u,[Object(c["K"])(Object(c["h"])("textarea",{"onUpdate:modelValue":t[0]||(t[0]=function(e){return g.tweetContent.text=e}),placeholder:"Что происходит?"},null,512),[[c["H"],g.tweetContent.text]]),g.tweetContent.imageList?(Object(c["u"])(),Object(c["g"])("div",s,[(Object(c["u"])(!0),Object(c["g"])(c["a"],null,Object(c["A"])(g.tweetContent.imageList,(function(e,t){return Object(c["u"])(),Object(c["g"])("div",{key:t,class:"image-container"},[Object(c["h"])("img",{src:e.url},null,8,l),Object(c["h"])("div",{class:"close-button",onClick:function(e){return g.deleteImage(t)}},[Object(c["k"])(j,{icon:"close"})],8,b)])})),128))])):Object(c["f"])("",!0)]),Object(c["h"])("div",d,[Object(c["h"])("div",p,[Object(c["h"])("div",{class:"controls-media-item",onClick:t[2]||(t[2]=function(t){return e.$refs.uploadImageInput.click()})},[Object(c["k"])(j,{icon:"image"}),Object(c["h"])("input",{ref:"uploadImageInput",type:"file",accept:"image/*",hidden:"",onChange:t[1]||(t[1]=function(){return g.showFiles&&g.showFiles.apply(g,arguments)})},null,544)])]),Object(c["h"])("div",h,[Object(c["h"])("button",{disabled:!g.hasTweetText(),onClick:t[3]||(t[3]=function(){return g.handleSubmit&&g.handleSubmit.apply(g,arguments)})}," Твитнуть ",8,f)])])])])}var m=n("5530"),O=n("3835"),j=n("1da1"),v=(n("96cf"),n("d3b7"),n("3ca3"),n("ddb0"),n("2b3d"),n("a434"),n("d81d"),n("159b"),n("8bac")),y=n("5502"),w=n("d4ec"),x=function e(t,n){Object(w["a"])(this,e),this.tweet_data=n.text,this.tweet_media_ids=[]},k=function e(t){Object(w["a"])(this,e),this.id=t.id,this.username=t.username,this.password=t.password,this.profile=t.profile,this.account=t.account,this.createdAt=(new Date).getTime()},C=n("7424"),M={name:"AddTweet",components:{BaseIcon:v["a"]},setup:function(e,t){var n=Object(c["z"])(o()),r=Object(y["d"])(),i=Object(c["m"])(),a=i.parent.appContext.config.globalProperties.$notification;function o(){return{text:"",imageList:[]}}function u(){return s.apply(this,arguments)}function s(){return s=Object(j["a"])(regeneratorRuntime.mark((function e(){var c,i,u,s,l;return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return c={text:n.value.text,photos:n.value.imageList},i=new x(new k(r.getters.getMe),c),e.prev=2,u=[],s=n.value.imageList.map((function(e){var t=new FormData;return t.append("file",e.file),Object(C["l"])(t)})),e.next=7,Promise.all(s);case 7:return l=e.sent,l.forEach((function(e){var t=e.data;return u.push(t.media_id)})),i.tweet_media_ids=u,e.next=12,Object(C["m"])(i);case 12:a({type:"info",message:"Твит отправлен!"}),e.next=18;break;case 15:e.prev=15,e.t0=e["catch"](2),a({type:"error",message:"Ошибка при отправке твита"});case 18:t.emit("submit-click"),n.value=o();case 20:case"end":return e.stop()}}),e,null,[[2,15]])}))),s.apply(this,arguments)}function l(){return n.value.text.length>0&&n.value.text}function b(e){var t=Object(O["a"])(e.target.files,1),c=t[0],r=URL.createObjectURL(c);n.value.imageList.push({url:r,file:c})}function d(e){n.value.imageList.splice(e,1)}return{tweetContent:n,handleSubmit:u,hasTweetText:l,showFiles:b,deleteImage:d}},computed:Object(m["a"])({},Object(y["b"])({me:"getMe"}))};n("b046");M.render=g;t["a"]=M},"372e":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-jwli3a r-4qtqp9 r-yyyyoo r-lwhw9o r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M19.9 23.5c-.157 0-.312-.05-.442-.144L12 17.928l-7.458 5.43c-.228.164-.53.19-.782.06-.25-.127-.41-.385-.41-.667V5.6c0-1.24 1.01-2.25 2.25-2.25h12.798c1.24 0 2.25 1.01 2.25 2.25v17.15c0 .282-.158.54-.41.668-.106.055-.223.082-.34.082zM12 16.25c.155 0 .31.048.44.144l6.71 4.883V5.6c0-.412-.337-.75-.75-.75H5.6c-.413 0-.75.338-.75.75v15.677l6.71-4.883c.13-.096.285-.144.44-.144z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"3bd9":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={xmlns:"http://www.w3.org/2000/svg",width:"24",height:"24",viewBox:"0 0 24 24"},i=Object(c["h"])("path",{d:"M16.67 0l2.83 2.829-9.339 9.175 9.339 9.167-2.83 2.829-12.17-11.996z"},null,-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"411d":function(e,t,n){"use strict";n("d077")},"417a":function(e,t,n){"use strict";n("25ac")},4360:function(e,t,n){"use strict";var c=n("5502"),r=n("1da1");n("96cf");function i(){return{id:"",username:"",password:"",profile:{pic:"",nickname:"",name:""}}}var a=n("7424"),o={setLoginInfo:function(e,t){var n=e.commit;n("setMe",t),n("setLoginStatus",!0)},setLogOut:function(e){var t=e.commit;t("setMe",i()),t("setLoginStatus",!1)},setMyInfo:function(e,t){return Object(r["a"])(regeneratorRuntime.mark((function n(){var c;return regeneratorRuntime.wrap((function(n){while(1)switch(n.prev=n.next){case 0:return c=e.commit,n.prev=1,n.next=4,Object(a["i"])(t);case 4:c("editProfileInfo",t),c("setEditProfileStatus",!1),n.next=11;break;case 8:n.prev=8,n.t0=n["catch"](1),console.log(n.t0);case 11:case"end":return n.stop()}}),n,null,[[1,8]])})))()},setLightbox:function(e,t){var n=e.commit;n("setLightboxState",!0),n("setLightboxImages",t)},closeLightbox:function(e){var t=e.commit;t("setLightboxState",!1),t("setLightboxImages",[])}},u={getMe:function(e){return e.me},getTweetPopupState:function(e){return e.isTweetPopupActive},getLoginStatus:function(e){return e.isLoggedIn},getLoadingStatus:function(e){return e.globalIsLoading},getActiveNotifications:function(e){return e.activeNotifications},getMyProfileId:function(e){return e.me.id},getEditProfileStatus:function(e){return e.editProfilePopup},getProfileTweetCount:function(e){return e.profileTweetCount},getLightboxState:function(e){return e.lightbox},getMobileMenuState:function(e){return e.isMobileMenuActive}},s=n("5530"),l=(n("4de4"),n("d81d"),n("b64b"),0),b={toggleTweetButton:function(e){e.isTweetPopupActive=!e.isTweetPopupActive},setLoadingStatus:function(e,t){e.globalIsLoading=t},setMe:function(e,t){e.me=t},setLoginStatus:function(e,t){e.isLoggedIn=t},addNotification:function(e,t){e.activeNotifications.push(Object(s["a"])(Object(s["a"])({},t),{},{index:l}))},deleteNotification:function(e,t){var n=e.activeNotifications;e.activeNotifications=n.filter((function(e){return e.index!=t}))},editProfileInfo:function(e,t){Object.keys(t).map((function(n){e.me.profile[n]=t[n]}))},setEditProfileStatus:function(e,t){e.editProfilePopup=t},setProfileTweetCount:function(e,t){e.profileTweetCount=t},setLightboxState:function(e,t){e.lightbox.state=t},setLightboxImages:function(e,t){e.lightbox.images=t},setMobileMenuState:function(e,t){e.isMobileMenuActive=t},setCurrentUserApiKey:function(e,t){e.currentUserApiKey=t},setIsPaginationEnabled:function(e,t){e.isPaginationEnabled=t},setPaginationLimit:function(e,t){e.paginationLimit=t}},d={me:i(),isTweetPopupActive:!1,isLoggedIn:!1,globalIsLoading:!1,activeNotifications:[],editProfilePopup:!1,profileTweetCount:0,lightbox:{state:!1,images:[]},isMobileMenuActive:!1,currentUserApiKey:"test",isPaginationEnabled:!1,paginationLimit:5};t["a"]=c["a"].createStore({state:d,mutations:b,getters:u,actions:o})},4731:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24","aria-hidden":"true",class:"r-111h2gw r-4qtqp9 r-yyyyoo r-1xvli5t r-1d4mawv r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M11.96 14.945c-.067 0-.136-.01-.203-.027-1.13-.318-2.097-.986-2.795-1.932-.832-1.125-1.176-2.508-.968-3.893s.942-2.605 2.068-3.438l3.53-2.608c2.322-1.716 5.61-1.224 7.33 1.1.83 1.127 1.175 2.51.967 3.895s-.943 2.605-2.07 3.438l-1.48 1.094c-.333.246-.804.175-1.05-.158-.246-.334-.176-.804.158-1.05l1.48-1.095c.803-.592 1.327-1.463 1.476-2.45.148-.988-.098-1.975-.69-2.778-1.225-1.656-3.572-2.01-5.23-.784l-3.53 2.608c-.802.593-1.326 1.464-1.475 2.45-.15.99.097 1.975.69 2.778.498.675 1.187 1.15 1.992 1.377.4.114.633.528.52.928-.092.33-.394.547-.722.547z"}),Object(c["h"])("path",{d:"M7.27 22.054c-1.61 0-3.197-.735-4.225-2.125-.832-1.127-1.176-2.51-.968-3.894s.943-2.605 2.07-3.438l1.478-1.094c.334-.245.805-.175 1.05.158s.177.804-.157 1.05l-1.48 1.095c-.803.593-1.326 1.464-1.475 2.45-.148.99.097 1.975.69 2.778 1.225 1.657 3.57 2.01 5.23.785l3.528-2.608c1.658-1.225 2.01-3.57.785-5.23-.498-.674-1.187-1.15-1.992-1.376-.4-.113-.633-.527-.52-.927.112-.4.528-.63.926-.522 1.13.318 2.096.986 2.794 1.932 1.717 2.324 1.224 5.612-1.1 7.33l-3.53 2.608c-.933.693-2.023 1.026-3.105 1.026z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"4f83":function(e,t,n){"use strict";n("5b0d")},"50d1":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24","aria-hidden":"true",class:"r-111h2gw r-4qtqp9 r-yyyyoo r-1xvli5t r-dnmrzs r-4wgw6l r-f727ji r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M21.53 20.47l-3.66-3.66C19.195 15.24 20 13.214 20 11c0-4.97-4.03-9-9-9s-9 4.03-9 9 4.03 9 9 9c2.215 0 4.24-.804 5.808-2.13l3.66 3.66c.147.146.34.22.53.22s.385-.073.53-.22c.295-.293.295-.767.002-1.06zM3.5 11c0-4.135 3.365-7.5 7.5-7.5s7.5 3.365 7.5 7.5-3.365 7.5-7.5 7.5-7.5-3.365-7.5-7.5z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"52d6":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M22.58 7.35L12.475 1.897c-.297-.16-.654-.16-.95 0L1.425 7.35c-.486.264-.667.87-.405 1.356.18.335.525.525.88.525.16 0 .324-.038.475-.12l.734-.396 1.59 11.25c.216 1.214 1.31 2.062 2.66 2.062h9.282c1.35 0 2.444-.848 2.662-2.088l1.588-11.225.737.398c.485.263 1.092.082 1.354-.404.263-.486.08-1.093-.404-1.355zM12 15.435c-1.795 0-3.25-1.455-3.25-3.25s1.455-3.25 3.25-3.25 3.25 1.455 3.25 3.25-1.455 3.25-3.25 3.25z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"56d7":function(e,t,n){"use strict";n.r(t);n("e260"),n("e6cf"),n("cca6"),n("a79d");var c=n("7a23");function r(e,t,n,r,i,a){var o=Object(c["C"])("DebugPanel"),u=Object(c["C"])("router-view"),s=Object(c["C"])("loading"),l=Object(c["C"])("notification");return Object(c["u"])(),Object(c["e"])(Object(c["D"])(e.getLoginStatus?"layout":"div"),null,{default:Object(c["J"])((function(){return[Object(c["k"])(o),Object(c["k"])(u),e.getLoadingStatus?(Object(c["u"])(),Object(c["e"])(s,{key:0})):Object(c["f"])("",!0),(Object(c["u"])(!0),Object(c["g"])(c["a"],null,Object(c["A"])(e.getActiveNotifications,(function(e,t){return Object(c["u"])(),Object(c["e"])(l,{key:t,index:t,data:e},null,8,["index","data"])})),128))]})),_:1})}var i=n("5530"),a=(n("f5df1"),n("b0c0"),{class:"layout"}),o={class:"layout-sidebar"},u={class:"layout-flow"},s={class:"page-header"},l={key:1,class:"profile-info"},b={key:2},d={class:"layout-for-you"},p={class:"layout-for-you-fixed"};function h(e,t,n,r,i,h){var f=Object(c["C"])("sidebar"),g=Object(c["C"])("base-icon"),m=Object(c["C"])("SearchBar"),O=Object(c["C"])("Trends"),j=Object(c["C"])("tweet-popup"),v=Object(c["C"])("Lightbox"),y=Object(c["C"])("BaseIcon");return Object(c["u"])(),Object(c["g"])("div",a,[Object(c["h"])("div",o,[Object(c["h"])("div",{class:Object(c["q"])(["layout-sidebar-fixed-container",{active:e.getMobileMenuState}])},[Object(c["k"])(f)],2)]),Object(c["h"])("div",u,[Object(c["h"])("div",s,["/"!=e.$route.path?(Object(c["u"])(),Object(c["g"])("div",{key:0,class:"back-button",onClick:t[0]||(t[0]=function(t){return e.$router.push("/")})},[Object(c["k"])(g,{icon:"back"})])):Object(c["f"])("",!0),"Profile"==e.$route.name?(Object(c["u"])(),Object(c["g"])("div",l,[Object(c["h"])("h2",null,Object(c["F"])(e.getMe.profile.name),1),Object(c["h"])("span",null,Object(c["F"])(e.getProfileTweetCount)+" твитов",1)])):(Object(c["u"])(),Object(c["g"])("h2",b,Object(c["F"])(e.$route.meta.label),1))]),Object(c["B"])(e.$slots,"default")]),Object(c["h"])("div",d,[Object(c["h"])("div",p,[Object(c["k"])(m),Object(c["k"])(O)])]),e.getTweetPopupState?(Object(c["u"])(),Object(c["e"])(j,{key:0})):Object(c["f"])("",!0),e.getLightboxState.state?(Object(c["u"])(),Object(c["e"])(v,{key:1,images:e.getLightboxState.images},null,8,["images"])):Object(c["f"])("",!0),Object(c["h"])("div",{class:"mobile-menu-toggler",onClick:t[1]||(t[1]=function(t){return e.$store.commit("setMobileMenuState",!e.getMobileMenuState)})},[Object(c["k"])(y,{icon:"hamburger"})])])}var f={class:"sidebar-nav"},g={class:"sidebar-logo"},m=Object(c["j"])(" Профиль "),O=Object(c["j"])(" Еще "),j={class:"icon"},v=Object(c["h"])("span",null,"Close",-1);function y(e,t,n,r,i,a){var o=Object(c["C"])("base-icon"),u=Object(c["C"])("router-link"),s=Object(c["C"])("sidebar-item"),l=Object(c["C"])("more-menu"),b=Object(c["C"])("profile-popup"),d=Object(c["C"])("BaseIcon");return Object(c["u"])(),Object(c["g"])("aside",null,[Object(c["h"])("div",f,[Object(c["h"])("div",g,[Object(c["k"])(u,{to:"/"},{default:Object(c["J"])((function(){return[Object(c["k"])(o,{icon:"twitter"})]})),_:1})]),(Object(c["u"])(!0),Object(c["g"])(c["a"],null,Object(c["A"])(e.ROUTES,(function(e,t){return Object(c["u"])(),Object(c["e"])(s,{key:t,icon:e.name.toLowerCase(),to:e.path,required:e.req},{default:Object(c["J"])((function(){return[Object(c["j"])(Object(c["F"])(e.label),1)]})),_:2},1032,["icon","to","required"])})),128)),Object(c["k"])(s,{icon:"profile",to:"/profile/".concat(e.me.id),required:""},{default:Object(c["J"])((function(){return[m]})),_:1},8,["to"]),Object(c["k"])(s,{icon:"more",onClick:a.toggleMenu},{default:Object(c["J"])((function(){return[O,e.isMenuOpened?(Object(c["u"])(),Object(c["e"])(l,{key:0})):Object(c["f"])("",!0)]})),_:1},8,["onClick"]),Object(c["h"])("div",{class:"sidebar-tweet-button",onClick:t[0]||(t[0]=function(t){return e.$store.commit("toggleTweetButton")})}," Твитнуть ")]),Object(c["k"])(b),Object(c["h"])("div",{class:"mobile-close-menu-button",onClick:t[1]||(t[1]=function(t){return e.$store.commit("setMobileMenuState",!1)})},[Object(c["h"])("div",j,[Object(c["k"])(d,{icon:"left"})]),v])])}var w={class:"sidebar-item"},x={class:"sidebar-item-logo"},k={class:"sidebar-item-content"};function C(e,t,n,r,i,a){var o=Object(c["C"])("base-icon");return Object(c["u"])(),Object(c["e"])(Object(c["D"])(n.required?"router-link":"div"),{to:n.required?n.to:""},{default:Object(c["J"])((function(){return[Object(c["h"])("div",w,[Object(c["h"])("div",x,[Object(c["k"])(o,{icon:n.icon,"icon-color":n.iconColor},null,8,["icon","icon-color"])]),Object(c["h"])("div",k,[Object(c["B"])(e.$slots,"default")])])]})),_:3},8,["to"])}var M=n("8bac"),z={name:"SidebarItem",components:{BaseIcon:M["a"]},props:{icon:{type:String,default:"more"},iconColor:{type:String,default:"#fff"},to:{type:String,default:""},required:{type:Boolean,default:!1}},methods:{isStringAndValid:function(e){return e&&"string"==typeof e&&e.length>0}}};n("411d");z.render=C;var q=z,L=[{name:"Home",path:"/",req:!0,label:"Главная"},{name:"Explore",path:"/explore",label:"Обзор"},{name:"Notifications",path:"/notifications",label:"Уведомления"},{name:"Messages",path:"/messages",label:"Сообщения"},{name:"Bookmarks",path:"/bookmarks",label:"Закладки"},{name:"Lists",path:"/lists",label:"Списки"}],S=[{name:"Topics",icon:"topics",label:"Темы"},{name:"Moments",icon:"moments",label:"Моменты"},{name:"Help Center",icon:"help",label:"Помощь"},{name:"Settings & privacy",icon:"settings",label:"Настройки"}],I={class:"sidebar-profile-wrapper"},P={class:"sidebar-profile-pic"},B=["src"],T={class:"sidebar-profile-items"},A={class:"profile-info"},H={class:"nickname"},R={class:"more"},V={key:0,class:"sidebar-profile-popup"},_={class:"popup-header"},F={class:"sidebar-profile-pic"},E=["src"],$={class:"sidebar-profile-items"},N={class:"profile-info"},K={class:"nickname"},U={class:"more"},D=Object(c["h"])("hr",{class:"popup-spacing"},null,-1),J={class:"popup-body"},W=Object(c["h"])("div",{class:"popup-body-item"},[Object(c["h"])("p",null,"Добавить существующую учетную запись")],-1),G=Object(c["h"])("hr",{class:"popup-spacing"},null,-1),Y=Object(c["j"])("Выйти из учетной записи ");function Q(e,t,n,r,i,a){var o=Object(c["C"])("base-icon");return Object(c["u"])(),Object(c["g"])("div",I,[Object(c["h"])("div",{class:"sidebar-profile",onClick:t[0]||(t[0]=function(){return a.toggleMenu&&a.toggleMenu.apply(a,arguments)})},[Object(c["h"])("div",P,[Object(c["h"])("img",{src:e.me.profile.pic},null,8,B)]),Object(c["h"])("div",T,[Object(c["h"])("div",A,[Object(c["h"])("p",null,Object(c["F"])(e.me.profile.name),1),Object(c["h"])("p",H,Object(c["F"])(e.me.profile.nickname),1)]),Object(c["h"])("div",R,[Object(c["k"])(o,{icon:"more"})])])]),e.isMenuOpened?(Object(c["u"])(),Object(c["g"])("div",V,[Object(c["h"])("div",_,[Object(c["h"])("div",F,[Object(c["h"])("img",{src:e.me.profile.pic},null,8,E)]),Object(c["h"])("div",$,[Object(c["h"])("div",N,[Object(c["h"])("p",null,Object(c["F"])(e.me.profile.name),1),Object(c["h"])("p",K,Object(c["F"])(e.me.profile.nickname),1)]),Object(c["h"])("div",U,[Object(c["k"])(o,{icon:"tick"})])])]),D,Object(c["h"])("div",J,[W,G,Object(c["h"])("div",{class:"popup-body-item",onClick:t[1]||(t[1]=function(){return a.handleLogOut&&a.handleLogOut.apply(a,arguments)})},[Object(c["h"])("p",null,[Y,Object(c["h"])("span",null,Object(c["F"])(e.me.profile.nickname),1)])])])])):Object(c["f"])("",!0)])}var X=n("5502"),Z={name:"ProfilePopup",components:{BaseIcon:M["a"]},data:function(){return{isMenuOpened:!1}},computed:Object(i["a"])({},Object(X["b"])({me:"getMe"})),methods:{toggleMenu:function(){this.isMenuOpened=!this.isMenuOpened},handleLogOut:function(){this.$store.dispatch("setLogOut"),this.$router.push("/login")}}};n("2031");Z.render=Q;var ee=Z,te={class:"more-menu"},ne={class:"icon"},ce={class:"content"};function re(e,t,n,r,i,a){var o=Object(c["C"])("base-icon");return Object(c["u"])(),Object(c["g"])("div",te,[(Object(c["u"])(!0),Object(c["g"])(c["a"],null,Object(c["A"])(e.moreMenuItems,(function(e){return Object(c["u"])(),Object(c["g"])("div",{key:e.name,class:"more-menu-item"},[Object(c["h"])("div",ne,[Object(c["k"])(o,{icon:e.icon},null,8,["icon"])]),Object(c["h"])("div",ce,Object(c["F"])(e.label),1)])})),128))])}var ie={name:"MoreMenu",components:{BaseIcon:M["a"]},data:function(){return{moreMenuItems:S}}};n("716d");ie.render=re;var ae=ie,oe={name:"Sidebar",components:{SidebarItem:q,BaseIcon:M["a"],MoreMenu:ae,ProfilePopup:ee},data:function(){return{ROUTES:L,isMenuOpened:!1}},computed:Object(i["a"])({},Object(X["b"])({me:"getMe"})),methods:{toggleMenu:function(){this.isMenuOpened=!this.isMenuOpened}}};n("b0cf");oe.render=y;var ue=oe,se={class:"trends"},le={class:"trends-wrapper"},be=Object(c["h"])("div",{class:"trends-header"},[Object(c["h"])("h3",null,"Тренды")],-1),de={key:0,class:"trends-body"};function pe(e,t,n,r,i,a){var o=Object(c["C"])("TrendsItem");return Object(c["u"])(),Object(c["g"])("div",se,[Object(c["h"])("div",le,[be,i.trends?(Object(c["u"])(),Object(c["g"])("div",de,[(Object(c["u"])(!0),Object(c["g"])(c["a"],null,Object(c["A"])(a.sortedTrends,(function(e,t){return Object(c["u"])(),Object(c["e"])(o,{key:t,data:e},null,8,["data"])})),128))])):Object(c["f"])("",!0)])])}var he=n("1da1"),fe=(n("96cf"),{class:"trends-item"});function ge(e,t,n,r,i,a){return Object(c["u"])(),Object(c["g"])("div",fe,[Object(c["h"])("h3",null,Object(c["F"])(n.data.name),1),Object(c["h"])("span",null,"Твитов: "+Object(c["F"])(a.normalizedTweetCount),1)])}n("d3b7"),n("25f0");var me={name:"TrendsItem",props:{data:{type:Object,default:function(){}}},computed:{normalizedTweetCount:function(){var e=this.data.tweetsCount.toString();return e.length>4?e.substring(0,e.length-3)+"K":e}}};n("fdec");me.render=ge;var Oe=me,je=n("0377"),ve={name:"Trends",components:{TrendsItem:Oe},data:function(){return{trends:[]}},computed:{sortedTrends:function(){var e=this.trends;return e.sort((function(e,t){return e.tweetsCount>t.tweetsCount?-1:1}),0),e}},mounted:function(){var e=this;return Object(he["a"])(regeneratorRuntime.mark((function t(){return regeneratorRuntime.wrap((function(t){while(1)switch(t.prev=t.next){case 0:e.trends=je["a"];case 1:case"end":return t.stop()}}),t)})))()}};n("417a");ve.render=pe;var ye=ve,we={class:"searchbar-wrapper"},xe={class:"searchbar-icon"},ke={class:"searchbar-input"};function Ce(e,t,n,r,i,a){var o=Object(c["C"])("BaseIcon");return Object(c["u"])(),Object(c["g"])("div",{class:Object(c["q"])(["searchbar",{focused:i.isFocused}])},[Object(c["h"])("div",we,[Object(c["h"])("div",xe,[Object(c["k"])(o,{icon:"search"})]),Object(c["h"])("div",ke,[Object(c["h"])("input",{type:"text",placeholder:"Поиск в Твиттере",onFocus:t[0]||(t[0]=function(){return a.toggleFocus&&a.toggleFocus.apply(a,arguments)}),onBlur:t[1]||(t[1]=function(){return a.toggleFocus&&a.toggleFocus.apply(a,arguments)})},null,32)])])],2)}var Me={name:"SearchBar",components:{BaseIcon:M["a"]},data:function(){return{isFocused:!1}},methods:{toggleFocus:function(){this.isFocused=!this.isFocused}}};n("1f92");Me.render=Ce;var ze=Me,qe={ref:"popup",class:"tweet-popup-wrapper"},Le={class:"tweet-popup-header"};function Se(e,t,n,r,i,a){var o=Object(c["C"])("base-icon"),u=Object(c["C"])("add-tweet");return Object(c["u"])(),Object(c["g"])("div",{ref:"popupWrapper",class:"tweet-popup",onClick:t[1]||(t[1]=function(){return a.handleClickOutside&&a.handleClickOutside.apply(a,arguments)})},[Object(c["h"])("div",qe,[Object(c["h"])("div",Le,[Object(c["h"])("div",{class:"close-button",onClick:t[0]||(t[0]=function(t){return e.$store.commit("toggleTweetButton")})},[Object(c["k"])(o,{icon:"close"})])]),Object(c["k"])(u,{onSubmitClick:a.handleSubmit},null,8,["onSubmitClick"])],512)],512)}var Ie=n("345e"),Pe={name:"TweetPopup",components:{AddTweet:Ie["a"],BaseIcon:M["a"]},methods:{handleClickOutside:function(e){var t={target:e.target,ref:this.$refs.popupWrapper};t.target===t.ref&&this.$store.commit("toggleTweetButton")},handleSubmit:function(){this.$store.commit("toggleTweetButton"),this.$store.commit("setMobileMenuState",!1)}}};n("8b36");Pe.render=Se;var Be=Pe,Te=(n("99af"),{class:"lightbox-wrapper"}),Ae={class:"lightbox-wrapper-item"},He=["src"],Re={key:0,class:"lightbox-controls"},Ve={key:1,class:"lightbox-current-image"};function _e(e,t,n,r,i,a){var o=Object(c["C"])("BaseIcon");return Object(c["u"])(),Object(c["g"])("div",{ref:"lightboxWrapper",class:"lightbox",onClick:t[3]||(t[3]=function(){return a.handleClickOutside&&a.handleClickOutside.apply(a,arguments)})},[Object(c["h"])("div",Te,[Object(c["h"])("div",Ae,[Object(c["h"])("img",{src:n.images[i.currentImage],alt:""},null,8,He)])]),Object(c["h"])("div",{class:"lightbox-close-icon",onClick:t[0]||(t[0]=function(t){return e.$store.dispatch("closeLightbox")})},[Object(c["k"])(o,{icon:"close"})]),a.hasMultipleImages?(Object(c["u"])(),Object(c["g"])("div",Re,[Object(c["h"])("div",{class:"lightbox-controls-left",onClick:t[1]||(t[1]=function(){return a.decreaseImageState&&a.decreaseImageState.apply(a,arguments)})},[Object(c["k"])(o,{icon:"left"})]),Object(c["h"])("div",{class:"lightbox-controls-right",onClick:t[2]||(t[2]=function(){return a.increaseImageState&&a.increaseImageState.apply(a,arguments)})},[Object(c["k"])(o,{icon:"right"})])])):Object(c["f"])("",!0),a.hasMultipleImages?(Object(c["u"])(),Object(c["g"])("div",Ve,Object(c["F"])("".concat(i.currentImage+1," / ").concat(n.images.length)),1)):Object(c["f"])("",!0)],512)}var Fe={name:"Lightbox",components:{BaseIcon:M["a"]},props:{images:{type:Array,default:function(){return[]}}},data:function(){return{currentImage:0}},computed:{hasMultipleImages:function(){return this.images.length>1}},methods:{increaseImageState:function(){if(this.currentImage==this.images.length-1)return this.currentImage=0;this.currentImage++},decreaseImageState:function(){if(0==this.currentImage)return this.currentImage=this.images.length-1;this.currentImage--},handleClickOutside:function(e){var t={target:e.target,ref:this.$refs.lightboxWrapper};t.target===t.ref&&this.$store.dispatch("closeLightbox")}}};n("4f83");Fe.render=_e;var Ee=Fe,$e={name:"Layout",components:{Sidebar:ue,TweetPopup:Be,BaseIcon:M["a"],Trends:ye,SearchBar:ze,Lightbox:Ee},computed:Object(i["a"])({},Object(X["b"])(["getMe","getTweetPopupState","getProfileTweetCount","getLightboxState","getMobileMenuState"]))};n("a144");$e.render=h;var Ne=$e,Ke={class:"loading-screen"},Ue={xmlns:"http://www.w3.org/2000/svg","xmlns:xlink":"http://www.w3.org/1999/xlink",style:{margin:"auto",background:"transparent none repeat scroll 0% 0%",display:"block","shape-rendering":"auto"},width:"50px",height:"50px",viewBox:"0 0 100 100",preserveAspectRatio:"xMidYMid"},De=Object(c["h"])("circle",{cx:"50",cy:"50",fill:"none",stroke:"#1da1f2","stroke-width":"10",r:"35","stroke-dasharray":"164.93361431346415 56.97787143782138"},[Object(c["h"])("animateTransform",{attributeName:"transform",type:"rotate",repeatCount:"indefinite",dur:"1s",values:"0 50 50;360 50 50",keyTimes:"0;1"})],-1),Je=[De];function We(e,t,n,r,i,a){return Object(c["u"])(),Object(c["g"])("div",Ke,[(Object(c["u"])(),Object(c["g"])("svg",Ue,Je))])}var Ge={name:"Loading"};n("222d");Ge.render=We;var Ye=Ge,Qe={class:"notification-wrapper"};function Xe(e,t,n,r,i,a){var o=Object(c["C"])("base-icon");return Object(c["u"])(),Object(c["e"])(c["b"],{name:"notification",mode:"in-out"},{default:Object(c["J"])((function(){return[e.isActive?(Object(c["u"])(),Object(c["g"])("div",{key:0,class:Object(c["q"])(["notification",n.data.type])},[Object(c["h"])("div",Qe,Object(c["F"])(n.data.message),1),Object(c["h"])("div",{class:"close-icon",onClick:t[0]||(t[0]=function(t){return e.isActive=!1})},[Object(c["k"])(o,{icon:"close"})])],2)):Object(c["f"])("",!0)]})),_:1})}n("a9e3");var Ze={name:"Notification",components:{BaseIcon:M["a"]},props:{data:{type:Object,default:function(){}},index:{type:Number,default:0}},data:function(){return{isActive:!1}},mounted:function(){var e=this;setTimeout((function(){return e.isActive=!0}),200),setTimeout((function(){return e.isActive=!1}),3e3),setTimeout((function(){return e.$store.commit("deleteNotification",e.index)}),3100)}};n("9ba7");Ze.render=Xe;var et=Ze,tt={key:0,class:"debug-panel"},nt={class:"debug-panel__current-key"},ct=Object(c["h"])("label",null,"api-key текущего пользователя:",-1),rt={class:"debug-panel__pagination"},it=["value"],at=Object(c["h"])("label",null,"Пагинация",-1),ot={key:0,class:"debug-panel__pagination"},ut=Object(c["h"])("label",null,"Лимит",-1),st=["value"];function lt(e,t,n,r,i,a){return i.isVisible?(Object(c["u"])(),Object(c["g"])("div",tt,[Object(c["h"])("div",nt,[ct,Object(c["h"])("label",null,Object(c["F"])(e.currentUserApiKey),1)]),Object(c["K"])(Object(c["h"])("input",{"onUpdate:modelValue":t[0]||(t[0]=function(e){return i.newApiKey=e}),type:"text"},null,512),[[c["H"],i.newApiKey]]),Object(c["h"])("button",{class:"debug-panel__set",onClick:t[1]||(t[1]=function(){return a.updateKey&&a.updateKey.apply(a,arguments)})}," Установить новый api-key "),Object(c["h"])("div",rt,[Object(c["h"])("input",{value:e.isPaginationEnabled,type:"checkbox",onInput:t[2]||(t[2]=function(){return a.onPaginationChange&&a.onPaginationChange.apply(a,arguments)})},null,40,it),at]),e.isPaginationEnabled?(Object(c["u"])(),Object(c["g"])("div",ot,[ut,Object(c["h"])("input",{value:e.paginationLimit,type:"text",onInput:t[3]||(t[3]=function(){return a.onPaginationLimitChange&&a.onPaginationLimitChange.apply(a,arguments)})},null,40,st)])):Object(c["f"])("",!0),Object(c["h"])("button",{class:"debug-panel__hide",onClick:t[4]||(t[4]=function(e){return i.isVisible=!1})}," Скрыть ")])):Object(c["f"])("",!0)}var bt={data:function(){return{isVisible:!0,newApiKey:""}},computed:Object(i["a"])({},Object(X["c"])(["currentUserApiKey","isPaginationEnabled","paginationLimit"])),methods:{updateKey:function(){this.$store.commit("setCurrentUserApiKey",this.newApiKey),this.$store.dispatch("setLogOut"),this.$router.push({path:"/login"})},onPaginationChange:function(){this.$store.commit("setIsPaginationEnabled",!this.isPaginationEnabled)},onPaginationLimitChange:function(e){this.$store.commit("setPaginationLimit",e.target.value)}}};n("be82");bt.render=lt;var dt=bt,pt={components:{Layout:Ne,Loading:Ye,Notification:et,DebugPanel:dt},data:function(){return{globalNotification:!1}},computed:Object(i["a"])({},Object(X["b"])(["getLoginStatus","getLoadingStatus","getActiveNotifications"]))};n("2d63");pt.render=r;var ht=pt,ft=(n("3ca3"),n("ddb0"),n("6c02")),gt=n("4360"),mt=[{path:"/",name:"Home",meta:{label:"Главная"},component:function(){return Promise.all([n.e("chunk-76301fe8"),n.e("chunk-732a3e8c"),n.e("chunk-0420bcc4")]).then(n.bind(null,"bb51"))}},{path:"/login",name:"Login",beforeEnter:jt,component:function(){return Promise.all([n.e("chunk-76301fe8"),n.e("chunk-10e0d5b4")]).then(n.bind(null,"a55b"))}},{path:"/profile/:profileId",name:"Profile",component:function(){return Promise.all([n.e("chunk-76301fe8"),n.e("chunk-732a3e8c"),n.e("chunk-6f77c742")]).then(n.bind(null,"c66d"))}}],Ot=Object(ft["a"])({history:Object(ft["b"])("/"),routes:mt});function jt(e,t,n){var c=gt["a"].getters.getLoginStatus;c?n(t):n()}Ot.beforeEach((function(e,t,n){gt["a"].commit("setMobileMenuState",!1);var c=gt["a"].getters.getLoginStatus;if(!1===c)"Login"!==e.name?n({path:"/login"}):n();else{var r,i,a;if("Home"===e.name&&"Profile"===(null===t||void 0===t||null===(r=t.redirectedFrom)||void 0===r?void 0:r.name))return void n({name:"Profile",params:{profileId:null===t||void 0===t||null===(i=t.redirectedFrom)||void 0===i||null===(a=i.params)||void 0===a?void 0:a.profileId}});n()}}));var vt=Ot;function yt(e){var t=e.type,n=e.message;gt["a"].commit("addNotification",{type:t,message:n})}var wt=n("6a29"),xt=(n("2116"),Object(c["d"])(ht).use(wt["a"]));xt.config.globalProperties.$notification=yt,xt.use(vt),xt.use(gt["a"]),xt.mount("#app")},"59d3":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-jwli3a r-4qtqp9 r-yyyyoo r-lwhw9o r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M19.25 3.018H4.75C3.233 3.018 2 4.252 2 5.77v12.495c0 1.518 1.233 2.753 2.75 2.753h14.5c1.517 0 2.75-1.235 2.75-2.753V5.77c0-1.518-1.233-2.752-2.75-2.752zm-14.5 1.5h14.5c.69 0 1.25.56 1.25 1.25v.714l-8.05 5.367c-.273.18-.626.182-.9-.002L3.5 6.482v-.714c0-.69.56-1.25 1.25-1.25zm14.5 14.998H4.75c-.69 0-1.25-.56-1.25-1.25V8.24l7.24 4.83c.383.256.822.384 1.26.384.44 0 .877-.128 1.26-.383l7.24-4.83v10.022c0 .69-.56 1.25-1.25 1.25z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"5b0d":function(e,t,n){},"5c20":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-13gxpu9 r-4qtqp9 r-yyyyoo r-1q142lx r-1xvli5t r-19u6a5r r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M9 20c-.264 0-.52-.104-.707-.293l-4.785-4.785c-.39-.39-.39-1.023 0-1.414s1.023-.39 1.414 0l3.946 3.945L18.075 4.41c.32-.45.94-.558 1.395-.24.45.318.56.942.24 1.394L9.817 19.577c-.17.24-.438.395-.732.42-.028.002-.057.003-.085.003z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"5f5b":function(e,t,n){},"63c6":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-jwli3a r-4qtqp9 r-yyyyoo r-lwhw9o r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M21.697 16.468c-.02-.016-2.14-1.64-2.103-6.03.02-2.532-.812-4.782-2.347-6.335C15.872 2.71 14.01 1.94 12.005 1.93h-.013c-2.004.01-3.866.78-5.242 2.174-1.534 1.553-2.368 3.802-2.346 6.334.037 4.33-2.02 5.967-2.102 6.03-.26.193-.366.53-.265.838.102.308.39.515.712.515h4.92c.102 2.31 1.997 4.16 4.33 4.16s4.226-1.85 4.327-4.16h4.922c.322 0 .61-.206.71-.514.103-.307-.003-.645-.263-.838zM12 20.478c-1.505 0-2.73-1.177-2.828-2.658h5.656c-.1 1.48-1.323 2.66-2.828 2.66zM4.38 16.32c.74-1.132 1.548-3.028 1.524-5.896-.018-2.16.644-3.982 1.913-5.267C8.91 4.05 10.397 3.437 12 3.43c1.603.008 3.087.62 4.18 1.728 1.27 1.285 1.933 3.106 1.915 5.267-.024 2.868.785 4.765 1.525 5.896H4.38z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"69b5":function(e,t,n){},"6e60":function(e,t,n){},"716d":function(e,t,n){"use strict";n("9689")},7424:function(e,t,n){"use strict";n.d(t,"h",(function(){return o})),n.d(t,"f",(function(){return s})),n.d(t,"c",(function(){return b})),n.d(t,"j",(function(){return p})),n.d(t,"d",(function(){return f})),n.d(t,"e",(function(){return m})),n.d(t,"m",(function(){return j})),n.d(t,"a",(function(){return y})),n.d(t,"k",(function(){return x})),n.d(t,"i",(function(){return C})),n.d(t,"l",(function(){return z})),n.d(t,"g",(function(){return L})),n.d(t,"b",(function(){return I}));var c=n("1da1"),r=(n("99af"),n("96cf"),n("bc3a")),i=n.n(r),a=(n("94db"),n("4360"));n("0377");function o(e,t){return u.apply(this,arguments)}function u(){return u=Object(c["a"])(regeneratorRuntime.mark((function e(t,n){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"get",path:"/api/users/me"}));case 1:case"end":return e.stop()}}),e)}))),u.apply(this,arguments)}function s(e){return l.apply(this,arguments)}function l(){return l=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"get",path:"/api/users/".concat(t)}));case 1:case"end":return e.stop()}}),e)}))),l.apply(this,arguments)}function b(e){return d.apply(this,arguments)}function d(){return d=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"post",path:"/api/users/".concat(t,"/follow")}));case 1:case"end":return e.stop()}}),e)}))),d.apply(this,arguments)}function p(e){return h.apply(this,arguments)}function h(){return h=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"delete",path:"/api/users/".concat(t,"/follow")}));case 1:case"end":return e.stop()}}),e)}))),h.apply(this,arguments)}function f(){return g.apply(this,arguments)}function g(){return g=Object(c["a"])(regeneratorRuntime.mark((function e(){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"get",path:"/api/tweets"}));case 1:case"end":return e.stop()}}),e)}))),g.apply(this,arguments)}function m(e,t){return O.apply(this,arguments)}function O(){return O=Object(c["a"])(regeneratorRuntime.mark((function e(t,n){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"get",path:"/api/tweets?offset=".concat(t,"&limit=").concat(n)}));case 1:case"end":return e.stop()}}),e)}))),O.apply(this,arguments)}function j(e){return v.apply(this,arguments)}function v(){return v=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"post",path:"/api/tweets",body:t}));case 1:case"end":return e.stop()}}),e)}))),v.apply(this,arguments)}function y(e){return w.apply(this,arguments)}function w(){return w=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"delete",path:"/api/tweets/".concat(t)}));case 1:case"end":return e.stop()}}),e)}))),w.apply(this,arguments)}function x(e){return k.apply(this,arguments)}function k(){return k=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"patch",path:"/tweets",body:t}));case 1:case"end":return e.stop()}}),e)}))),k.apply(this,arguments)}function C(e){return M.apply(this,arguments)}function M(){return M=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"put",path:"/me",body:t}));case 1:case"end":return e.stop()}}),e)}))),M.apply(this,arguments)}function z(e){return q.apply(this,arguments)}function q(){return q=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"post",path:"/api/medias",body:t}));case 1:case"end":return e.stop()}}),e)}))),q.apply(this,arguments)}function L(e){return S.apply(this,arguments)}function S(){return S=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"post",path:"/api/tweets/".concat(t,"/likes")}));case 1:case"end":return e.stop()}}),e)}))),S.apply(this,arguments)}function I(e){return P.apply(this,arguments)}function P(){return P=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"delete",path:"/api/tweets/".concat(t,"/likes")}));case 1:case"end":return e.stop()}}),e)}))),P.apply(this,arguments)}function B(e){return T.apply(this,arguments)}function T(){return T=Object(c["a"])(regeneratorRuntime.mark((function e(t){var n,c,r;return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:if(a["a"].commit("setLoadingStatus",!0),e.prev=1,i.a.defaults.baseURL="/",i.a.defaults.headers.common["api-key"]=null===(n=a["a"].state)||void 0===n?void 0:n.currentUserApiKey,!t.body){e.next=10;break}return e.next=7,i.a[t.type](t.path,t.body);case 7:return c=e.sent,a["a"].commit("setLoadingStatus",!1),e.abrupt("return",c);case 10:return e.next=12,i.a[t.type](t.path);case 12:return r=e.sent,a["a"].commit("setLoadingStatus",!1),e.abrupt("return",r);case 17:throw e.prev=17,e.t0=e["catch"](1),console.log(e.t0),a["a"].commit("setLoadingStatus",!1),new Error(e.t0);case 22:case"end":return e.stop()}}),e,null,[[1,17]])}))),T.apply(this,arguments)}},"74a2":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-jwli3a r-4qtqp9 r-yyyyoo r-16y2uox r-1q142lx r-8kz0gk r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1srniue"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M23.643 4.937c-.835.37-1.732.62-2.675.733.962-.576 1.7-1.49 2.048-2.578-.9.534-1.897.922-2.958 1.13-.85-.904-2.06-1.47-3.4-1.47-2.572 0-4.658 2.086-4.658 4.66 0 .364.042.718.12 1.06-3.873-.195-7.304-2.05-9.602-4.868-.4.69-.63 1.49-.63 2.342 0 1.616.823 3.043 2.072 3.878-.764-.025-1.482-.234-2.11-.583v.06c0 2.257 1.605 4.14 3.737 4.568-.392.106-.803.162-1.227.162-.3 0-.593-.028-.877-.082.593 1.85 2.313 3.198 4.352 3.234-1.595 1.25-3.604 1.995-5.786 1.995-.376 0-.747-.022-1.112-.065 2.062 1.323 4.51 2.093 7.14 2.093 8.57 0 13.255-7.098 13.255-13.254 0-.2-.005-.402-.014-.602.91-.658 1.7-1.477 2.323-2.41z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"79f9":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-13gxpu9 r-4qtqp9 r-yyyyoo r-1q142lx r-50lct3 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1srniue"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M20.222 9.16h-1.334c.015-.09.028-.182.028-.277V6.57c0-.98-.797-1.777-1.778-1.777H3.5V3.358c0-.414-.336-.75-.75-.75s-.75.336-.75.75V20.83c0 .415.336.75.75.75s.75-.335.75-.75v-1.434h10.556c.98 0 1.778-.797 1.778-1.777v-2.313c0-.095-.014-.187-.028-.278h4.417c.98 0 1.778-.798 1.778-1.778v-2.31c0-.983-.797-1.78-1.778-1.78zM17.14 6.293c.152 0 .277.124.277.277v2.31c0 .154-.125.28-.278.28H3.5V6.29h13.64zm-2.807 9.014v2.312c0 .153-.125.277-.278.277H3.5v-2.868h10.556c.153 0 .277.126.277.28zM20.5 13.25c0 .153-.125.277-.278.277H3.5V10.66h16.722c.153 0 .278.124.278.277v2.313z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"7c33":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-111h2gw r-4qtqp9 r-yyyyoo r-1q142lx r-1xvli5t r-1b7u577 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M12.025 22.75c-5.928 0-10.75-4.822-10.75-10.75S6.098 1.25 12.025 1.25 22.775 6.072 22.775 12s-4.822 10.75-10.75 10.75zm0-20c-5.1 0-9.25 4.15-9.25 9.25s4.15 9.25 9.25 9.25 9.25-4.15 9.25-9.25-4.15-9.25-9.25-9.25z"}),Object(c["h"])("path",{d:"M13.064 17.47c0-.616-.498-1.114-1.114-1.114-.616 0-1.114.498-1.114 1.114 0 .615.498 1.114 1.114 1.114.616 0 1.114-.5 1.114-1.114zm3.081-7.528c0-2.312-1.882-4.194-4.194-4.194-2.312 0-4.194 1.882-4.194 4.194 0 .414.336.75.75.75s.75-.336.75-.75c0-1.485 1.21-2.694 2.695-2.694 1.486 0 2.695 1.21 2.695 2.694 0 1.486-1.21 2.695-2.694 2.695-.413 0-.75.336-.75.75v1.137c0 .414.337.75.75.75s.75-.336.75-.75v-.463c1.955-.354 3.445-2.06 3.445-4.118z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"8a54":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-13gxpu9 r-4qtqp9 r-yyyyoo r-1q142lx r-50lct3 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1srniue"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M12 22.75C6.072 22.75 1.25 17.928 1.25 12S6.072 1.25 12 1.25 22.75 6.072 22.75 12 17.928 22.75 12 22.75zm0-20C6.9 2.75 2.75 6.9 2.75 12S6.9 21.25 12 21.25s9.25-4.15 9.25-9.25S17.1 2.75 12 2.75z"}),Object(c["h"])("path",{d:"M12 17.115c-1.892 0-3.633-.95-4.656-2.544-.224-.348-.123-.81.226-1.035.348-.226.812-.124 1.036.226.747 1.162 2.016 1.855 3.395 1.855s2.648-.693 3.396-1.854c.224-.35.688-.45 1.036-.225.35.224.45.688.226 1.036-1.025 1.594-2.766 2.545-4.658 2.545z"}),Object(c["h"])("circle",{cx:"14.738",cy:"9.458",r:"1.478"}),Object(c["h"])("circle",{cx:"9.262",cy:"9.458",r:"1.478"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"8b36":function(e,t,n){"use strict";n("69b5")},"8bac":function(e,t,n){"use strict";var c=n("7a23");function r(e,t,n,r,i,a){return Object(c["u"])(),Object(c["e"])(Object(c["D"])(a.iconComponent))}var i={name:"BaseIcon",props:{icon:{type:String,default:"home"}},computed:{iconComponent:function(){return n("2b57")("./".concat(this.icon)).default}}};i.render=r;t["a"]=i},"8dfb":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-4qtqp9 r-yyyyoo r-1xvli5t r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1hdv0qi"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M17.53 7.47l-5-5c-.293-.293-.768-.293-1.06 0l-5 5c-.294.293-.294.768 0 1.06s.767.294 1.06 0l3.72-3.72V15c0 .414.336.75.75.75s.75-.336.75-.75V4.81l3.72 3.72c.146.147.338.22.53.22s.384-.072.53-.22c.293-.293.293-.767 0-1.06z"}),Object(c["h"])("path",{d:"M19.708 21.944H4.292C3.028 21.944 2 20.916 2 19.652V14c0-.414.336-.75.75-.75s.75.336.75.75v5.652c0 .437.355.792.792.792h15.416c.437 0 .792-.355.792-.792V14c0-.414.336-.75.75-.75s.75.336.75.75v5.652c0 1.264-1.028 2.292-2.292 2.292z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},9689:function(e,t,n){},"999a":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-111h2gw r-4qtqp9 r-yyyyoo r-1q142lx r-1xvli5t r-1b7u577 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M8.98 22.698c-.103 0-.205-.02-.302-.063-.31-.135-.49-.46-.44-.794l1.228-8.527H6.542c-.22 0-.43-.098-.573-.266-.144-.17-.204-.393-.167-.61L7.49 2.5c.062-.36.373-.625.74-.625h6.81c.23 0 .447.105.59.285.142.18.194.415.14.64l-1.446 6.075H19c.29 0 .553.166.678.428.124.262.087.57-.096.796L9.562 22.42c-.146.18-.362.276-.583.276zM7.43 11.812h2.903c.218 0 .425.095.567.26.142.164.206.382.175.598l-.966 6.7 7.313-8.995h-4.05c-.228 0-.445-.105-.588-.285-.142-.18-.194-.415-.14-.64l1.446-6.075H8.864L7.43 11.812z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"9ba7":function(e,t,n){"use strict";n("e984")},a144:function(e,t,n){"use strict";n("db9f")},a1f6:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24","aria-hidden":"true",class:"r-111h2gw r-4qtqp9 r-yyyyoo r-1xvli5t r-1d4mawv r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["i"])('<g><path d="M19.708 2H4.292C3.028 2 2 3.028 2 4.292v15.416C2 20.972 3.028 22 4.292 22h15.416C20.972 22 22 20.972 22 19.708V4.292C22 3.028 20.972 2 19.708 2zm.792 17.708c0 .437-.355.792-.792.792H4.292c-.437 0-.792-.355-.792-.792V6.418c0-.437.354-.79.79-.792h15.42c.436 0 .79.355.79.79V19.71z"></path><circle cx="7.032" cy="8.75" r="1.285"></circle><circle cx="7.032" cy="13.156" r="1.285"></circle><circle cx="16.968" cy="8.75" r="1.285"></circle><circle cx="16.968" cy="13.156" r="1.285"></circle><circle cx="12" cy="8.75" r="1.285"></circle><circle cx="12" cy="13.156" r="1.285"></circle><circle cx="7.032" cy="17.486" r="1.285"></circle><circle cx="12" cy="17.486" r="1.285"></circle></g>',1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},a5bc:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24","aria-hidden":"true",class:"r-daml9f r-4qtqp9 r-yyyyoo r-1q142lx r-1xvli5t r-1b7u577 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M20.746 5.236h-3.75V4.25c0-1.24-1.01-2.25-2.25-2.25h-5.5c-1.24 0-2.25 1.01-2.25 2.25v.986h-3.75c-.414 0-.75.336-.75.75s.336.75.75.75h.368l1.583 13.262c.216 1.193 1.31 2.027 2.658 2.027h8.282c1.35 0 2.442-.834 2.664-2.072l1.577-13.217h.368c.414 0 .75-.336.75-.75s-.335-.75-.75-.75zM8.496 4.25c0-.413.337-.75.75-.75h5.5c.413 0 .75.337.75.75v.986h-7V4.25zm8.822 15.48c-.1.55-.664.795-1.18.795H7.854c-.517 0-1.083-.246-1.175-.75L5.126 6.735h13.74L17.32 19.732z"}),Object(c["h"])("path",{d:"M10 17.75c.414 0 .75-.336.75-.75v-7c0-.414-.336-.75-.75-.75s-.75.336-.75.75v7c0 .414.336.75.75.75zm4 0c.414 0 .75-.336.75-.75v-7c0-.414-.336-.75-.75-.75s-.75.336-.75.75v7c0 .414.336.75.75.75z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},ab4d:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-4qtqp9 r-yyyyoo r-1xvli5t r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1hdv0qi"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M23.77 15.67c-.292-.293-.767-.293-1.06 0l-2.22 2.22V7.65c0-2.068-1.683-3.75-3.75-3.75h-5.85c-.414 0-.75.336-.75.75s.336.75.75.75h5.85c1.24 0 2.25 1.01 2.25 2.25v10.24l-2.22-2.22c-.293-.293-.768-.293-1.06 0s-.294.768 0 1.06l3.5 3.5c.145.147.337.22.53.22s.383-.072.53-.22l3.5-3.5c.294-.292.294-.767 0-1.06zm-10.66 3.28H7.26c-1.24 0-2.25-1.01-2.25-2.25V6.46l2.22 2.22c.148.147.34.22.532.22s.384-.073.53-.22c.293-.293.293-.768 0-1.06l-3.5-3.5c-.293-.294-.768-.294-1.06 0l-3.5 3.5c-.294.292-.294.767 0 1.06s.767.293 1.06 0l2.22-2.22V16.7c0 2.068 1.683 3.75 3.75 3.75h5.85c.414 0 .75-.336.75-.75s-.337-.75-.75-.75z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},ac39:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-13gxpu9 r-4qtqp9 r-yyyyoo r-1q142lx r-50lct3 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1srniue"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M19 10.5V8.8h-4.4v6.4h1.7v-2h2v-1.7h-2v-1H19zm-7.3-1.7h1.7v6.4h-1.7V8.8zm-3.6 1.6c.4 0 .9.2 1.2.5l1.2-1C9.9 9.2 9 8.8 8.1 8.8c-1.8 0-3.2 1.4-3.2 3.2s1.4 3.2 3.2 3.2c1 0 1.8-.4 2.4-1.1v-2.5H7.7v1.2h1.2v.6c-.2.1-.5.2-.8.2-.9 0-1.6-.7-1.6-1.6 0-.8.7-1.6 1.6-1.6z"}),Object(c["h"])("path",{d:"M20.5 2.02h-17c-1.24 0-2.25 1.007-2.25 2.247v15.507c0 1.238 1.01 2.246 2.25 2.246h17c1.24 0 2.25-1.008 2.25-2.246V4.267c0-1.24-1.01-2.247-2.25-2.247zm.75 17.754c0 .41-.336.746-.75.746h-17c-.414 0-.75-.336-.75-.746V4.267c0-.412.336-.747.75-.747h17c.414 0 .75.335.75.747v15.507z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},af00:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-13gxpu9 r-4qtqp9 r-yyyyoo r-1q142lx r-50lct3 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1srniue"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M12 22.75C6.072 22.75 1.25 17.928 1.25 12S6.072 1.25 12 1.25 22.75 6.072 22.75 12 17.928 22.75 12 22.75zm0-20C6.9 2.75 2.75 6.9 2.75 12S6.9 21.25 12 21.25s9.25-4.15 9.25-9.25S17.1 2.75 12 2.75z"}),Object(c["h"])("path",{d:"M12 17.115c-1.892 0-3.633-.95-4.656-2.544-.224-.348-.123-.81.226-1.035.348-.226.812-.124 1.036.226.747 1.162 2.016 1.855 3.395 1.855s2.648-.693 3.396-1.854c.224-.35.688-.45 1.036-.225.35.224.45.688.226 1.036-1.025 1.594-2.766 2.545-4.658 2.545z"}),Object(c["h"])("circle",{cx:"14.738",cy:"9.458",r:"1.478"}),Object(c["h"])("circle",{cx:"9.262",cy:"9.458",r:"1.478"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},b046:function(e,t,n){"use strict";n("d9d3")},b0cf:function(e,t,n){"use strict";n("eaf9")},b7b3:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-4qtqp9 r-yyyyoo r-1xvli5t r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1hdv0qi"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M14.046 2.242l-4.148-.01h-.002c-4.374 0-7.8 3.427-7.8 7.802 0 4.098 3.186 7.206 7.465 7.37v3.828c0 .108.044.286.12.403.142.225.384.347.632.347.138 0 .277-.038.402-.118.264-.168 6.473-4.14 8.088-5.506 1.902-1.61 3.04-3.97 3.043-6.312v-.017c-.006-4.367-3.43-7.787-7.8-7.788zm3.787 12.972c-1.134.96-4.862 3.405-6.772 4.643V16.67c0-.414-.335-.75-.75-.75h-.396c-3.66 0-6.318-2.476-6.318-5.886 0-3.534 2.768-6.302 6.3-6.302l4.147.01h.002c3.532 0 6.3 2.766 6.302 6.296-.003 1.91-.942 3.844-2.514 5.176z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},b904:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-jwli3a r-4qtqp9 r-yyyyoo r-lwhw9o r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M12 11.816c1.355 0 2.872-.15 3.84-1.256.814-.93 1.078-2.368.806-4.392-.38-2.825-2.117-4.512-4.646-4.512S7.734 3.343 7.354 6.17c-.272 2.022-.008 3.46.806 4.39.968 1.107 2.485 1.256 3.84 1.256zM8.84 6.368c.162-1.2.787-3.212 3.16-3.212s2.998 2.013 3.16 3.212c.207 1.55.057 2.627-.45 3.205-.455.52-1.266.743-2.71.743s-2.255-.223-2.71-.743c-.507-.578-.657-1.656-.45-3.205zm11.44 12.868c-.877-3.526-4.282-5.99-8.28-5.99s-7.403 2.464-8.28 5.99c-.172.692-.028 1.4.395 1.94.408.52 1.04.82 1.733.82h12.304c.693 0 1.325-.3 1.733-.82.424-.54.567-1.247.394-1.94zm-1.576 1.016c-.126.16-.316.246-.552.246H5.848c-.235 0-.426-.085-.552-.246-.137-.174-.18-.412-.12-.654.71-2.855 3.517-4.85 6.824-4.85s6.114 1.994 6.824 4.85c.06.242.017.48-.12.654z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},be82:function(e,t,n){"use strict";n("ff65")},c312:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-111h2gw r-4qtqp9 r-yyyyoo r-1q142lx r-1xvli5t r-1b7u577 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M12.003 23.274c-.083 0-.167-.014-.248-.042-.3-.105-.502-.39-.502-.708v-4.14c-2.08-.172-4.013-1.066-5.506-2.56-3.45-3.45-3.45-9.062 0-12.51s9.062-3.45 12.512 0c3.096 3.097 3.45 8.07.82 11.565l-6.49 8.112c-.146.182-.363.282-.587.282zm0-21.05c-1.882 0-3.763.717-5.195 2.15-2.864 2.863-2.864 7.524 0 10.39 1.388 1.387 3.233 2.15 5.195 2.15.414 0 .75.337.75.75v2.72l5.142-6.425c2.17-2.885 1.876-7.014-.696-9.587-1.434-1.43-3.316-2.148-5.197-2.148z"}),Object(c["h"])("path",{d:"M15.55 8.7h-7.1c-.413 0-.75-.337-.75-.75s.337-.75.75-.75h7.1c.413 0 .75.335.75.75s-.337.75-.75.75zm-3.05 3.238H8.45c-.413 0-.75-.336-.75-.75s.337-.75.75-.75h4.05c.414 0 .75.336.75.75s-.336.75-.75.75z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},ca5e:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-jwli3a r-4qtqp9 r-yyyyoo r-lwhw9o r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M19.75 22H4.25C3.01 22 2 20.99 2 19.75V4.25C2 3.01 3.01 2 4.25 2h15.5C20.99 2 22 3.01 22 4.25v15.5c0 1.24-1.01 2.25-2.25 2.25zM4.25 3.5c-.414 0-.75.337-.75.75v15.5c0 .413.336.75.75.75h15.5c.414 0 .75-.337.75-.75V4.25c0-.413-.336-.75-.75-.75H4.25z"}),Object(c["h"])("path",{d:"M17 8.64H7c-.414 0-.75-.337-.75-.75s.336-.75.75-.75h10c.414 0 .75.335.75.75s-.336.75-.75.75zm0 4.11H7c-.414 0-.75-.336-.75-.75s.336-.75.75-.75h10c.414 0 .75.336.75.75s-.336.75-.75.75zm-5 4.11H7c-.414 0-.75-.335-.75-.75s.336-.75.75-.75h5c.414 0 .75.337.75.75s-.336.75-.75.75z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},cacf:function(e,t,n){},cdbe:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-111h2gw r-4qtqp9 r-yyyyoo r-1q142lx r-1xvli5t r-1b7u577 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M12 8.21c-2.09 0-3.79 1.7-3.79 3.79s1.7 3.79 3.79 3.79 3.79-1.7 3.79-3.79-1.7-3.79-3.79-3.79zm0 6.08c-1.262 0-2.29-1.026-2.29-2.29S10.74 9.71 12 9.71s2.29 1.026 2.29 2.29-1.028 2.29-2.29 2.29z"}),Object(c["h"])("path",{d:"M12.36 22.375h-.722c-1.183 0-2.154-.888-2.262-2.064l-.014-.147c-.025-.287-.207-.533-.472-.644-.286-.12-.582-.065-.798.115l-.116.097c-.868.725-2.253.663-3.06-.14l-.51-.51c-.836-.84-.896-2.154-.14-3.06l.098-.118c.186-.222.23-.523.122-.787-.11-.272-.358-.454-.646-.48l-.15-.014c-1.18-.107-2.067-1.08-2.067-2.262v-.722c0-1.183.888-2.154 2.064-2.262l.156-.014c.285-.025.53-.207.642-.473.11-.27.065-.573-.12-.795l-.094-.116c-.757-.908-.698-2.223.137-3.06l.512-.512c.804-.804 2.188-.865 3.06-.14l.116.098c.218.184.528.23.79.122.27-.112.452-.358.477-.643l.014-.153c.107-1.18 1.08-2.066 2.262-2.066h.722c1.183 0 2.154.888 2.262 2.064l.014.156c.025.285.206.53.472.64.277.117.58.062.794-.117l.12-.102c.867-.723 2.254-.662 3.06.14l.51.512c.836.838.896 2.153.14 3.06l-.1.118c-.188.22-.234.522-.123.788.112.27.36.45.646.478l.152.014c1.18.107 2.067 1.08 2.067 2.262v.723c0 1.183-.888 2.154-2.064 2.262l-.155.014c-.284.024-.53.205-.64.47-.113.272-.067.574.117.795l.1.12c.756.905.696 2.22-.14 3.06l-.51.51c-.807.804-2.19.864-3.06.14l-.115-.096c-.217-.183-.53-.23-.79-.122-.273.114-.455.36-.48.646l-.014.15c-.107 1.173-1.08 2.06-2.262 2.06zm-3.773-4.42c.3 0 .593.06.87.175.79.328 1.324 1.054 1.4 1.896l.014.147c.037.4.367.7.77.7h.722c.4 0 .73-.3.768-.7l.014-.148c.076-.842.61-1.567 1.392-1.892.793-.33 1.696-.182 2.333.35l.113.094c.178.148.366.18.493.18.206 0 .4-.08.546-.227l.51-.51c.284-.284.305-.73.048-1.038l-.1-.12c-.542-.65-.677-1.54-.352-2.323.326-.79 1.052-1.32 1.894-1.397l.155-.014c.397-.037.7-.367.7-.77v-.722c0-.4-.303-.73-.702-.768l-.152-.014c-.846-.078-1.57-.61-1.895-1.393-.326-.788-.19-1.678.353-2.327l.1-.118c.257-.31.236-.756-.048-1.04l-.51-.51c-.146-.147-.34-.227-.546-.227-.127 0-.315.032-.492.18l-.12.1c-.634.528-1.55.67-2.322.354-.788-.327-1.32-1.052-1.397-1.896l-.014-.155c-.035-.397-.365-.7-.767-.7h-.723c-.4 0-.73.303-.768.702l-.014.152c-.076.843-.608 1.568-1.39 1.893-.787.326-1.693.183-2.33-.35l-.118-.096c-.18-.15-.368-.18-.495-.18-.206 0-.4.08-.546.226l-.512.51c-.282.284-.303.73-.046 1.038l.1.118c.54.653.677 1.544.352 2.325-.327.788-1.052 1.32-1.895 1.397l-.156.014c-.397.037-.7.367-.7.77v.722c0 .4.303.73.702.768l.15.014c.848.078 1.573.612 1.897 1.396.325.786.19 1.675-.353 2.325l-.096.115c-.26.31-.238.756.046 1.04l.51.51c.146.147.34.227.546.227.127 0 .315-.03.492-.18l.116-.096c.406-.336.923-.524 1.453-.524z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},d077:function(e,t,n){},d0e9:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={xmlns:"http://www.w3.org/2000/svg",width:"24",height:"24",viewBox:"0 0 24 24"},i=Object(c["h"])("path",{d:"M16.67 0l2.83 2.829-9.339 9.175 9.339 9.167-2.83 2.829-12.17-11.996z"},null,-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},d674:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-13gxpu9 r-4qtqp9 r-yyyyoo r-1q142lx r-50lct3 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1srniue"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M19.75 2H4.25C3.01 2 2 3.01 2 4.25v15.5C2 20.99 3.01 22 4.25 22h15.5c1.24 0 2.25-1.01 2.25-2.25V4.25C22 3.01 20.99 2 19.75 2zM4.25 3.5h15.5c.413 0 .75.337.75.75v9.676l-3.858-3.858c-.14-.14-.33-.22-.53-.22h-.003c-.2 0-.393.08-.532.224l-4.317 4.384-1.813-1.806c-.14-.14-.33-.22-.53-.22-.193-.03-.395.08-.535.227L3.5 17.642V4.25c0-.413.337-.75.75-.75zm-.744 16.28l5.418-5.534 6.282 6.254H4.25c-.402 0-.727-.322-.744-.72zm16.244.72h-2.42l-5.007-4.987 3.792-3.85 4.385 4.384v3.703c0 .413-.337.75-.75.75z"}),Object(c["h"])("circle",{cx:"8.868",cy:"8.309",r:"1.542"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},d9d3:function(e,t,n){},db9f:function(e,t,n){},e29c:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24","aria-hidden":"true",class:"r-4qtqp9 r-yyyyoo r-1xvli5t r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1hdv0qi"},i=Object(c["h"])("g",null,[Object(c["h"])("circle",{cx:"5",cy:"12",r:"2"}),Object(c["h"])("circle",{cx:"12",cy:"12",r:"2"}),Object(c["h"])("circle",{cx:"19",cy:"12",r:"2"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},e4a1:function(e,t,n){},e796:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-4qtqp9 r-yyyyoo r-1xvli5t r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1hdv0qi"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M12 21.638h-.014C9.403 21.59 1.95 14.856 1.95 8.478c0-3.064 2.525-5.754 5.403-5.754 2.29 0 3.83 1.58 4.646 2.73.814-1.148 2.354-2.73 4.645-2.73 2.88 0 5.404 2.69 5.404 5.755 0 6.376-7.454 13.11-10.037 13.157H12zM7.354 4.225c-2.08 0-3.903 1.988-3.903 4.255 0 5.74 7.034 11.596 8.55 11.658 1.518-.062 8.55-5.917 8.55-11.658 0-2.267-1.823-4.255-3.903-4.255-2.528 0-3.94 2.936-3.952 2.965-.23.562-1.156.562-1.387 0-.014-.03-1.425-2.965-3.954-2.965z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},e984:function(e,t,n){},eaf9:function(e,t,n){},f8b4:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 75 40"},i=Object(c["h"])("rect",{width:"75",height:"6"},null,-1),a=Object(c["h"])("rect",{y:"20",width:"75",height:"6"},null,-1),o=Object(c["h"])("rect",{y:"40",width:"75",height:"6"},null,-1),u=[i,a,o];function s(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,u)}const l={};l.render=s;t["default"]=l},fdec:function(e,t,n){"use strict";n("cacf")},ff65:function(e,t,n){}});
+(function(e){function t(t){for(var c,r,o=t[0],u=t[1],s=t[2],l=0,b=[];l<o.length;l++)r=o[l],Object.prototype.hasOwnProperty.call(i,r)&&i[r]&&b.push(i[r][0]),i[r]=0;for(c in u)Object.prototype.hasOwnProperty.call(u,c)&&(e[c]=u[c]);d&&d(t);while(b.length)b.shift()();return a.push.apply(a,s||[]),n()}function n(){for(var e,t=0;t<a.length;t++){for(var n=a[t],c=!0,r=1;r<n.length;r++){var o=n[r];0!==i[o]&&(c=!1)}c&&(a.splice(t--,1),e=u(u.s=n[0]))}return e}var c={},r={app:0},i={app:0},a=[];function o(e){return u.p+"js/"+({}[e]||e)+"."+{"chunk-76301fe8":"cc56c3b1","chunk-10e0d5b4":"e80e67b6","chunk-732a3e8c":"57e36fb4","chunk-0420bcc4":"11441662","chunk-6f77c742":"f09861a7"}[e]+".js"}function u(t){if(c[t])return c[t].exports;var n=c[t]={i:t,l:!1,exports:{}};return e[t].call(n.exports,n,n.exports,u),n.l=!0,n.exports}u.e=function(e){var t=[],n={"chunk-10e0d5b4":1,"chunk-732a3e8c":1,"chunk-0420bcc4":1,"chunk-6f77c742":1};r[e]?t.push(r[e]):0!==r[e]&&n[e]&&t.push(r[e]=new Promise((function(t,n){for(var c="css/"+({}[e]||e)+"."+{"chunk-76301fe8":"31d6cfe0","chunk-10e0d5b4":"130d80ef","chunk-732a3e8c":"6334cd6b","chunk-0420bcc4":"d6bc3184","chunk-6f77c742":"8d9a3d9c"}[e]+".css",i=u.p+c,a=document.getElementsByTagName("link"),o=0;o<a.length;o++){var s=a[o],l=s.getAttribute("data-href")||s.getAttribute("href");if("stylesheet"===s.rel&&(l===c||l===i))return t()}var b=document.getElementsByTagName("style");for(o=0;o<b.length;o++){s=b[o],l=s.getAttribute("data-href");if(l===c||l===i)return t()}var d=document.createElement("link");d.rel="stylesheet",d.type="text/css",d.onload=t,d.onerror=function(t){var c=t&&t.target&&t.target.src||i,a=new Error("Loading CSS chunk "+e+" failed.\n("+c+")");a.code="CSS_CHUNK_LOAD_FAILED",a.request=c,delete r[e],d.parentNode.removeChild(d),n(a)},d.href=i;var p=document.getElementsByTagName("head")[0];p.appendChild(d)})).then((function(){r[e]=0})));var c=i[e];if(0!==c)if(c)t.push(c[2]);else{var a=new Promise((function(t,n){c=i[e]=[t,n]}));t.push(c[2]=a);var s,l=document.createElement("script");l.charset="utf-8",l.timeout=120,u.nc&&l.setAttribute("nonce",u.nc),l.src=o(e);var b=new Error;s=function(t){l.onerror=l.onload=null,clearTimeout(d);var n=i[e];if(0!==n){if(n){var c=t&&("load"===t.type?"missing":t.type),r=t&&t.target&&t.target.src;b.message="Loading chunk "+e+" failed.\n("+c+": "+r+")",b.name="ChunkLoadError",b.type=c,b.request=r,n[1](b)}i[e]=void 0}};var d=setTimeout((function(){s({type:"timeout",target:l})}),12e4);l.onerror=l.onload=s,document.head.appendChild(l)}return Promise.all(t)},u.m=e,u.c=c,u.d=function(e,t,n){u.o(e,t)||Object.defineProperty(e,t,{enumerable:!0,get:n})},u.r=function(e){"undefined"!==typeof Symbol&&Symbol.toStringTag&&Object.defineProperty(e,Symbol.toStringTag,{value:"Module"}),Object.defineProperty(e,"__esModule",{value:!0})},u.t=function(e,t){if(1&t&&(e=u(e)),8&t)return e;if(4&t&&"object"===typeof e&&e&&e.__esModule)return e;var n=Object.create(null);if(u.r(n),Object.defineProperty(n,"default",{enumerable:!0,value:e}),2&t&&"string"!=typeof e)for(var c in e)u.d(n,c,function(t){return e[t]}.bind(null,c));return n},u.n=function(e){var t=e&&e.__esModule?function(){return e["default"]}:function(){return e};return u.d(t,"a",t),t},u.o=function(e,t){return Object.prototype.hasOwnProperty.call(e,t)},u.p="/",u.oe=function(e){throw console.error(e),e};var s=window["webpackJsonp"]=window["webpackJsonp"]||[],l=s.push.bind(s);s.push=t,s=s.slice();for(var b=0;b<s.length;b++)t(s[b]);var d=l;a.push([0,"chunk-vendors"]),n()})({0:function(e,t,n){e.exports=n("56d7")},"0377":function(e,t,n){"use strict";n.d(t,"a",(function(){return r}));var c=[{id:1,name:"test",api_token:"test",followers:[{id:2}],following:[{id:2}]},{id:2,name:"test2",api_token:"test2",followers:[{id:1}],following:[{id:1}]}],r=(c[0],c[1],c[0].username,c[0].password,[{name:"#GoLang",tweetsCount:155614},{name:"#Python",tweetsCount:121353},{name:"#DevConf2022",tweetsCount:90420}])},"0a8a":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={xmlns:"http://www.w3.org/2000/svg",width:"24",height:"24",viewBox:"0 0 24 24"},i=Object(c["h"])("path",{d:"M23 20.168l-8.185-8.187 8.185-8.174-2.832-2.807-8.182 8.179-8.176-8.179-2.81 2.81 8.186 8.196-8.186 8.184 2.81 2.81 8.203-8.192 8.18 8.192z"},null,-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"0b2b":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-jwli3a r-4qtqp9 r-yyyyoo r-lwhw9o r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M21 7.337h-3.93l.372-4.272c.036-.412-.27-.775-.682-.812-.417-.03-.776.27-.812.683l-.383 4.4h-6.32l.37-4.27c.037-.413-.27-.776-.68-.813-.42-.03-.777.27-.813.683l-.382 4.4H3.782c-.414 0-.75.337-.75.75s.336.75.75.75H7.61l-.55 6.327H3c-.414 0-.75.336-.75.75s.336.75.75.75h3.93l-.372 4.272c-.036.412.27.775.682.812l.066.003c.385 0 .712-.295.746-.686l.383-4.4h6.32l-.37 4.27c-.036.413.27.776.682.813l.066.003c.385 0 .712-.295.746-.686l.382-4.4h3.957c.413 0 .75-.337.75-.75s-.337-.75-.75-.75H16.39l.55-6.327H21c.414 0 .75-.336.75-.75s-.336-.75-.75-.75zm-6.115 7.826h-6.32l.55-6.326h6.32l-.55 6.326z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"0eb3":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={xmlns:"http://www.w3.org/2000/svg",width:"24",height:"24",viewBox:"0 0 24 24"},i=Object(c["h"])("path",{d:"M18.363 8.464l1.433 1.431-12.67 12.669-7.125 1.436 1.439-7.127 12.665-12.668 1.431 1.431-12.255 12.224-.726 3.584 3.584-.723 12.224-12.257zm-.056-8.464l-2.815 2.817 5.691 5.692 2.817-2.821-5.693-5.688zm-12.318 18.718l11.313-11.316-.705-.707-11.313 11.314.705.709z"},null,-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"1f92":function(e,t,n){"use strict";n("e4a1")},2031:function(e,t,n){"use strict";n("2b5b")},"222d":function(e,t,n){"use strict";n("5f5b")},"25ac":function(e,t,n){},"2b57":function(e,t,n){var c={"./back":"d0e9","./back.vue":"d0e9","./bookmarks":"372e","./bookmarks.vue":"372e","./calendar":"a1f6","./calendar.vue":"a1f6","./close":"0a8a","./close.vue":"0a8a","./comment":"b7b3","./comment.vue":"b7b3","./editTweet":"e29c","./editTweet.vue":"e29c","./explore":"0b2b","./explore.vue":"0b2b","./gif":"ac39","./gif.vue":"ac39","./graph":"79f9","./graph.vue":"79f9","./hamburger":"f8b4","./hamburger.vue":"f8b4","./help":"7c33","./help.vue":"7c33","./home":"52d6","./home.vue":"52d6","./image":"d674","./image.vue":"d674","./left":"3bd9","./left.vue":"3bd9","./like":"e796","./like.vue":"e796","./link":"4731","./link.vue":"4731","./lists":"ca5e","./lists.vue":"ca5e","./messages":"59d3","./messages.vue":"59d3","./moments":"999a","./moments.vue":"999a","./more":"2fa1","./more.vue":"2fa1","./notifications":"63c6","./notifications.vue":"63c6","./pen":"0eb3","./pen.vue":"0eb3","./profile":"b904","./profile.vue":"b904","./retweet":"ab4d","./retweet.vue":"ab4d","./right":"3217","./right.vue":"3217","./schedule":"8a54","./schedule.vue":"8a54","./search":"50d1","./search.vue":"50d1","./settings":"cdbe","./settings.vue":"cdbe","./share":"8dfb","./share.vue":"8dfb","./smile":"af00","./smile.vue":"af00","./tick":"5c20","./tick.vue":"5c20","./topics":"c312","./topics.vue":"c312","./trash":"a5bc","./trash.vue":"a5bc","./twitter":"74a2","./twitter.vue":"74a2"};function r(e){var t=i(e);return n(t)}function i(e){if(!n.o(c,e)){var t=new Error("Cannot find module '"+e+"'");throw t.code="MODULE_NOT_FOUND",t}return c[e]}r.keys=function(){return Object.keys(c)},r.resolve=i,e.exports=r,r.id="2b57"},"2b5b":function(e,t,n){},"2d63":function(e,t,n){"use strict";n("6e60")},"2fa1":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-jwli3a r-4qtqp9 r-yyyyoo r-lwhw9o r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("circle",{cx:"17",cy:"12",r:"1.5"}),Object(c["h"])("circle",{cx:"12",cy:"12",r:"1.5"}),Object(c["h"])("circle",{cx:"7",cy:"12",r:"1.5"}),Object(c["h"])("path",{d:"M12 22.75C6.072 22.75 1.25 17.928 1.25 12S6.072 1.25 12 1.25 22.75 6.072 22.75 12 17.928 22.75 12 22.75zm0-20C6.9 2.75 2.75 6.9 2.75 12S6.9 21.25 12 21.25s9.25-4.15 9.25-9.25S17.1 2.75 12 2.75z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},3217:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={xmlns:"http://www.w3.org/2000/svg",width:"24",height:"24",viewBox:"0 0 24 24"},i=Object(c["h"])("path",{d:"M7.33 24l-2.83-2.829 9.339-9.175-9.339-9.167 2.83-2.829 12.17 11.996z"},null,-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"345e":function(e,t,n){"use strict";var c=n("7a23"),r={class:"add-tweet"},i={class:"add-tweet-profile"},a=["src"],o={class:"add-tweet-content"},u={class:"tweet-section"},s={key:0,class:"tweet-section-images"},l=["src"],b=["onClick"],d={class:"controls"},p={class:"controls-media"},h={class:"controls-submit"},f=["disabled"];function g(e,t,n,g,m,O){var j=Object(c["C"])("base-icon");return Object(c["u"])(),Object(c["g"])("div",r,[Object(c["h"])("div",i,[Object(c["h"])("img",{src:e.me.profile.pic},null,8,a)]),Object(c["h"])("div",o,[Object(c["h"])("div",u,[Object(c["K"])(Object(c["h"])("textarea",{"onUpdate:modelValue":t[0]||(t[0]=function(e){return g.tweetContent.text=e}),placeholder:"Что происходит?"},null,512),[[c["H"],g.tweetContent.text]]),g.tweetContent.imageList?(Object(c["u"])(),Object(c["g"])("div",s,[(Object(c["u"])(!0),Object(c["g"])(c["a"],null,Object(c["A"])(g.tweetContent.imageList,(function(e,t){return Object(c["u"])(),Object(c["g"])("div",{key:t,class:"image-container"},[Object(c["h"])("img",{src:e.url},null,8,l),Object(c["h"])("div",{class:"close-button",onClick:function(e){return g.deleteImage(t)}},[Object(c["k"])(j,{icon:"close"})],8,b)])})),128))])):Object(c["f"])("",!0)]),Object(c["h"])("div",d,[Object(c["h"])("div",p,[Object(c["h"])("div",{class:"controls-media-item",onClick:t[2]||(t[2]=function(t){return e.$refs.uploadImageInput.click()})},[Object(c["k"])(j,{icon:"image"}),Object(c["h"])("input",{ref:"uploadImageInput",type:"file",accept:"image/*",hidden:"",onChange:t[1]||(t[1]=function(){return g.showFiles&&g.showFiles.apply(g,arguments)})},null,544)])]),Object(c["h"])("div",h,[Object(c["h"])("button",{disabled:!g.hasTweetText(),onClick:t[3]||(t[3]=function(){return g.handleSubmit&&g.handleSubmit.apply(g,arguments)})}," Твитнуть ",8,f)])])])])}var m=n("5530"),O=n("3835"),j=n("1da1"),v=(n("96cf"),n("d3b7"),n("3ca3"),n("ddb0"),n("2b3d"),n("a434"),n("d81d"),n("159b"),n("8bac")),y=n("5502"),w=n("d4ec"),x=function e(t,n){Object(w["a"])(this,e),this.tweet_data=n.text,this.tweet_media_ids=[]},k=function e(t){Object(w["a"])(this,e),this.id=t.id,this.username=t.username,this.password=t.password,this.profile=t.profile,this.account=t.account,this.createdAt=(new Date).getTime()},C=n("7424"),M={name:"AddTweet",components:{BaseIcon:v["a"]},setup:function(e,t){var n=Object(c["z"])(o()),r=Object(y["d"])(),i=Object(c["m"])(),a=i.parent.appContext.config.globalProperties.$notification;function o(){return{text:"",imageList:[]}}function u(){return s.apply(this,arguments)}function s(){return s=Object(j["a"])(regeneratorRuntime.mark((function e(){var c,i,u,s,l;return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return c={text:n.value.text,photos:n.value.imageList},i=new x(new k(r.getters.getMe),c),e.prev=2,u=[],s=n.value.imageList.map((function(e){var t=new FormData;return t.append("file",e.file),Object(C["l"])(t)})),e.next=7,Promise.all(s);case 7:return l=e.sent,l.forEach((function(e){var t=e.data;return u.push(t.media_id)})),i.tweet_media_ids=u,e.next=12,Object(C["m"])(i);case 12:a({type:"info",message:"Твит отправлен!"}),e.next=18;break;case 15:e.prev=15,e.t0=e["catch"](2),a({type:"error",message:"Ошибка при отправке твита"});case 18:t.emit("submit-click"),n.value=o();case 20:case"end":return e.stop()}}),e,null,[[2,15]])}))),s.apply(this,arguments)}function l(){return n.value.text.length>0&&n.value.text}function b(e){var t=Object(O["a"])(e.target.files,1),c=t[0],r=URL.createObjectURL(c);n.value.imageList.push({url:r,file:c})}function d(e){n.value.imageList.splice(e,1)}return{tweetContent:n,handleSubmit:u,hasTweetText:l,showFiles:b,deleteImage:d}},computed:Object(m["a"])({},Object(y["b"])({me:"getMe"}))};n("b046");M.render=g;t["a"]=M},"372e":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-jwli3a r-4qtqp9 r-yyyyoo r-lwhw9o r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M19.9 23.5c-.157 0-.312-.05-.442-.144L12 17.928l-7.458 5.43c-.228.164-.53.19-.782.06-.25-.127-.41-.385-.41-.667V5.6c0-1.24 1.01-2.25 2.25-2.25h12.798c1.24 0 2.25 1.01 2.25 2.25v17.15c0 .282-.158.54-.41.668-.106.055-.223.082-.34.082zM12 16.25c.155 0 .31.048.44.144l6.71 4.883V5.6c0-.412-.337-.75-.75-.75H5.6c-.413 0-.75.338-.75.75v15.677l6.71-4.883c.13-.096.285-.144.44-.144z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"3bd9":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={xmlns:"http://www.w3.org/2000/svg",width:"24",height:"24",viewBox:"0 0 24 24"},i=Object(c["h"])("path",{d:"M16.67 0l2.83 2.829-9.339 9.175 9.339 9.167-2.83 2.829-12.17-11.996z"},null,-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"411d":function(e,t,n){"use strict";n("d077")},"417a":function(e,t,n){"use strict";n("25ac")},4360:function(e,t,n){"use strict";var c=n("5502"),r=n("1da1");n("96cf");function i(){return{id:"",username:"",password:"",profile:{pic:"",nickname:"",name:""}}}var a=n("7424"),o={setLoginInfo:function(e,t){var n=e.commit;n("setMe",t),n("setLoginStatus",!0)},setLogOut:function(e){var t=e.commit;t("setMe",i()),t("setLoginStatus",!1)},setMyInfo:function(e,t){return Object(r["a"])(regeneratorRuntime.mark((function n(){var c;return regeneratorRuntime.wrap((function(n){while(1)switch(n.prev=n.next){case 0:return c=e.commit,n.prev=1,n.next=4,Object(a["i"])(t);case 4:c("editProfileInfo",t),c("setEditProfileStatus",!1),n.next=11;break;case 8:n.prev=8,n.t0=n["catch"](1),console.log(n.t0);case 11:case"end":return n.stop()}}),n,null,[[1,8]])})))()},setLightbox:function(e,t){var n=e.commit;n("setLightboxState",!0),n("setLightboxImages",t)},closeLightbox:function(e){var t=e.commit;t("setLightboxState",!1),t("setLightboxImages",[])}},u={getMe:function(e){return e.me},getTweetPopupState:function(e){return e.isTweetPopupActive},getLoginStatus:function(e){return e.isLoggedIn},getLoadingStatus:function(e){return e.globalIsLoading},getActiveNotifications:function(e){return e.activeNotifications},getMyProfileId:function(e){return e.me.id},getEditProfileStatus:function(e){return e.editProfilePopup},getProfileTweetCount:function(e){return e.profileTweetCount},getLightboxState:function(e){return e.lightbox},getMobileMenuState:function(e){return e.isMobileMenuActive}},s=n("5530"),l=(n("4de4"),n("d81d"),n("b64b"),0),b={toggleTweetButton:function(e){e.isTweetPopupActive=!e.isTweetPopupActive},setLoadingStatus:function(e,t){e.globalIsLoading=t},setMe:function(e,t){e.me=t},setLoginStatus:function(e,t){e.isLoggedIn=t},addNotification:function(e,t){e.activeNotifications.push(Object(s["a"])(Object(s["a"])({},t),{},{index:l}))},deleteNotification:function(e,t){var n=e.activeNotifications;e.activeNotifications=n.filter((function(e){return e.index!=t}))},editProfileInfo:function(e,t){Object.keys(t).map((function(n){e.me.profile[n]=t[n]}))},setEditProfileStatus:function(e,t){e.editProfilePopup=t},setProfileTweetCount:function(e,t){e.profileTweetCount=t},setLightboxState:function(e,t){e.lightbox.state=t},setLightboxImages:function(e,t){e.lightbox.images=t},setMobileMenuState:function(e,t){e.isMobileMenuActive=t},setCurrentUserApiKey:function(e,t){e.currentUserApiKey=t},setIsPaginationEnabled:function(e,t){e.isPaginationEnabled=t},setPaginationLimit:function(e,t){e.paginationLimit=t}},d={me:i(),isTweetPopupActive:!1,isLoggedIn:!1,globalIsLoading:!1,activeNotifications:[],editProfilePopup:!1,profileTweetCount:0,lightbox:{state:!1,images:[]},isMobileMenuActive:!1,currentUserApiKey:"test",isPaginationEnabled:!1,paginationLimit:5};t["a"]=c["a"].createStore({state:d,mutations:b,getters:u,actions:o})},4731:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24","aria-hidden":"true",class:"r-111h2gw r-4qtqp9 r-yyyyoo r-1xvli5t r-1d4mawv r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M11.96 14.945c-.067 0-.136-.01-.203-.027-1.13-.318-2.097-.986-2.795-1.932-.832-1.125-1.176-2.508-.968-3.893s.942-2.605 2.068-3.438l3.53-2.608c2.322-1.716 5.61-1.224 7.33 1.1.83 1.127 1.175 2.51.967 3.895s-.943 2.605-2.07 3.438l-1.48 1.094c-.333.246-.804.175-1.05-.158-.246-.334-.176-.804.158-1.05l1.48-1.095c.803-.592 1.327-1.463 1.476-2.45.148-.988-.098-1.975-.69-2.778-1.225-1.656-3.572-2.01-5.23-.784l-3.53 2.608c-.802.593-1.326 1.464-1.475 2.45-.15.99.097 1.975.69 2.778.498.675 1.187 1.15 1.992 1.377.4.114.633.528.52.928-.092.33-.394.547-.722.547z"}),Object(c["h"])("path",{d:"M7.27 22.054c-1.61 0-3.197-.735-4.225-2.125-.832-1.127-1.176-2.51-.968-3.894s.943-2.605 2.07-3.438l1.478-1.094c.334-.245.805-.175 1.05.158s.177.804-.157 1.05l-1.48 1.095c-.803.593-1.326 1.464-1.475 2.45-.148.99.097 1.975.69 2.778 1.225 1.657 3.57 2.01 5.23.785l3.528-2.608c1.658-1.225 2.01-3.57.785-5.23-.498-.674-1.187-1.15-1.992-1.376-.4-.113-.633-.527-.52-.927.112-.4.528-.63.926-.522 1.13.318 2.096.986 2.794 1.932 1.717 2.324 1.224 5.612-1.1 7.33l-3.53 2.608c-.933.693-2.023 1.026-3.105 1.026z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"4f83":function(e,t,n){"use strict";n("5b0d")},"50d1":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24","aria-hidden":"true",class:"r-111h2gw r-4qtqp9 r-yyyyoo r-1xvli5t r-dnmrzs r-4wgw6l r-f727ji r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M21.53 20.47l-3.66-3.66C19.195 15.24 20 13.214 20 11c0-4.97-4.03-9-9-9s-9 4.03-9 9 4.03 9 9 9c2.215 0 4.24-.804 5.808-2.13l3.66 3.66c.147.146.34.22.53.22s.385-.073.53-.22c.295-.293.295-.767.002-1.06zM3.5 11c0-4.135 3.365-7.5 7.5-7.5s7.5 3.365 7.5 7.5-3.365 7.5-7.5 7.5-7.5-3.365-7.5-7.5z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"52d6":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M22.58 7.35L12.475 1.897c-.297-.16-.654-.16-.95 0L1.425 7.35c-.486.264-.667.87-.405 1.356.18.335.525.525.88.525.16 0 .324-.038.475-.12l.734-.396 1.59 11.25c.216 1.214 1.31 2.062 2.66 2.062h9.282c1.35 0 2.444-.848 2.662-2.088l1.588-11.225.737.398c.485.263 1.092.082 1.354-.404.263-.486.08-1.093-.404-1.355zM12 15.435c-1.795 0-3.25-1.455-3.25-3.25s1.455-3.25 3.25-3.25 3.25 1.455 3.25 3.25-1.455 3.25-3.25 3.25z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"56d7":function(e,t,n){"use strict";n.r(t);n("e260"),n("e6cf"),n("cca6"),n("a79d");var c=n("7a23");function r(e,t,n,r,i,a){var o=Object(c["C"])("DebugPanel"),u=Object(c["C"])("router-view"),s=Object(c["C"])("loading"),l=Object(c["C"])("notification");return Object(c["u"])(),Object(c["e"])(Object(c["D"])(e.getLoginStatus?"layout":"div"),null,{default:Object(c["J"])((function(){return[Object(c["k"])(o),Object(c["k"])(u),e.getLoadingStatus?(Object(c["u"])(),Object(c["e"])(s,{key:0})):Object(c["f"])("",!0),(Object(c["u"])(!0),Object(c["g"])(c["a"],null,Object(c["A"])(e.getActiveNotifications,(function(e,t){return Object(c["u"])(),Object(c["e"])(l,{key:t,index:t,data:e},null,8,["index","data"])})),128))]})),_:1})}var i=n("5530"),a=(n("f5df1"),n("b0c0"),{class:"layout"}),o={class:"layout-sidebar"},u={class:"layout-flow"},s={class:"page-header"},l={key:1,class:"profile-info"},b={key:2},d={class:"layout-for-you"},p={class:"layout-for-you-fixed"};function h(e,t,n,r,i,h){var f=Object(c["C"])("sidebar"),g=Object(c["C"])("base-icon"),m=Object(c["C"])("SearchBar"),O=Object(c["C"])("Trends"),j=Object(c["C"])("tweet-popup"),v=Object(c["C"])("Lightbox"),y=Object(c["C"])("BaseIcon");return Object(c["u"])(),Object(c["g"])("div",a,[Object(c["h"])("div",o,[Object(c["h"])("div",{class:Object(c["q"])(["layout-sidebar-fixed-container",{active:e.getMobileMenuState}])},[Object(c["k"])(f)],2)]),Object(c["h"])("div",u,[Object(c["h"])("div",s,["/"!=e.$route.path?(Object(c["u"])(),Object(c["g"])("div",{key:0,class:"back-button",onClick:t[0]||(t[0]=function(t){return e.$router.push("/")})},[Object(c["k"])(g,{icon:"back"})])):Object(c["f"])("",!0),"Profile"==e.$route.name?(Object(c["u"])(),Object(c["g"])("div",l,[Object(c["h"])("h2",null,Object(c["F"])(e.getMe.profile.name),1),Object(c["h"])("span",null,Object(c["F"])(e.getProfileTweetCount)+" твитов",1)])):(Object(c["u"])(),Object(c["g"])("h2",b,Object(c["F"])(e.$route.meta.label),1))]),Object(c["B"])(e.$slots,"default")]),Object(c["h"])("div",d,[Object(c["h"])("div",p,[Object(c["k"])(m),Object(c["k"])(O)])]),e.getTweetPopupState?(Object(c["u"])(),Object(c["e"])(j,{key:0})):Object(c["f"])("",!0),e.getLightboxState.state?(Object(c["u"])(),Object(c["e"])(v,{key:1,images:e.getLightboxState.images},null,8,["images"])):Object(c["f"])("",!0),Object(c["h"])("div",{class:"mobile-menu-toggler",onClick:t[1]||(t[1]=function(t){return e.$store.commit("setMobileMenuState",!e.getMobileMenuState)})},[Object(c["k"])(y,{icon:"hamburger"})])])}var f={class:"sidebar-nav"},g={class:"sidebar-logo"},m=Object(c["j"])(" Профиль "),O=Object(c["j"])(" Еще "),j={class:"icon"},v=Object(c["h"])("span",null,"Close",-1);function y(e,t,n,r,i,a){var o=Object(c["C"])("base-icon"),u=Object(c["C"])("router-link"),s=Object(c["C"])("sidebar-item"),l=Object(c["C"])("more-menu"),b=Object(c["C"])("profile-popup"),d=Object(c["C"])("BaseIcon");return Object(c["u"])(),Object(c["g"])("aside",null,[Object(c["h"])("div",f,[Object(c["h"])("div",g,[Object(c["k"])(u,{to:"/"},{default:Object(c["J"])((function(){return[Object(c["k"])(o,{icon:"twitter"})]})),_:1})]),(Object(c["u"])(!0),Object(c["g"])(c["a"],null,Object(c["A"])(e.ROUTES,(function(e,t){return Object(c["u"])(),Object(c["e"])(s,{key:t,icon:e.name.toLowerCase(),to:e.path,required:e.req},{default:Object(c["J"])((function(){return[Object(c["j"])(Object(c["F"])(e.label),1)]})),_:2},1032,["icon","to","required"])})),128)),Object(c["k"])(s,{icon:"profile",to:"/profile/".concat(e.me.id),required:""},{default:Object(c["J"])((function(){return[m]})),_:1},8,["to"]),Object(c["k"])(s,{icon:"more",onClick:a.toggleMenu},{default:Object(c["J"])((function(){return[O,e.isMenuOpened?(Object(c["u"])(),Object(c["e"])(l,{key:0})):Object(c["f"])("",!0)]})),_:1},8,["onClick"]),Object(c["h"])("div",{class:"sidebar-tweet-button",onClick:t[0]||(t[0]=function(t){return e.$store.commit("toggleTweetButton")})}," Твитнуть ")]),Object(c["k"])(b),Object(c["h"])("div",{class:"mobile-close-menu-button",onClick:t[1]||(t[1]=function(t){return e.$store.commit("setMobileMenuState",!1)})},[Object(c["h"])("div",j,[Object(c["k"])(d,{icon:"left"})]),v])])}var w={class:"sidebar-item"},x={class:"sidebar-item-logo"},k={class:"sidebar-item-content"};function C(e,t,n,r,i,a){var o=Object(c["C"])("base-icon");return Object(c["u"])(),Object(c["e"])(Object(c["D"])(n.required?"router-link":"div"),{to:n.required?n.to:""},{default:Object(c["J"])((function(){return[Object(c["h"])("div",w,[Object(c["h"])("div",x,[Object(c["k"])(o,{icon:n.icon,"icon-color":n.iconColor},null,8,["icon","icon-color"])]),Object(c["h"])("div",k,[Object(c["B"])(e.$slots,"default")])])]})),_:3},8,["to"])}var M=n("8bac"),z={name:"SidebarItem",components:{BaseIcon:M["a"]},props:{icon:{type:String,default:"more"},iconColor:{type:String,default:"#fff"},to:{type:String,default:""},required:{type:Boolean,default:!1}},methods:{isStringAndValid:function(e){return e&&"string"==typeof e&&e.length>0}}};n("411d");z.render=C;var q=z,L=[{name:"Home",path:"/",req:!0,label:"Главная"},{name:"Explore",path:"/explore",label:"Обзор"},{name:"Notifications",path:"/notifications",label:"Уведомления"},{name:"Messages",path:"/messages",label:"Сообщения"},{name:"Bookmarks",path:"/bookmarks",label:"Закладки"},{name:"Lists",path:"/lists",label:"Списки"}],S=[{name:"Topics",icon:"topics",label:"Темы"},{name:"Moments",icon:"moments",label:"Моменты"},{name:"Help Center",icon:"help",label:"Помощь"},{name:"Settings & privacy",icon:"settings",label:"Настройки"}],I={class:"sidebar-profile-wrapper"},P={class:"sidebar-profile-pic"},B=["src"],T={class:"sidebar-profile-items"},A={class:"profile-info"},H={class:"nickname"},R={class:"more"},V={key:0,class:"sidebar-profile-popup"},_={class:"popup-header"},F={class:"sidebar-profile-pic"},E=["src"],$={class:"sidebar-profile-items"},N={class:"profile-info"},K={class:"nickname"},U={class:"more"},D=Object(c["h"])("hr",{class:"popup-spacing"},null,-1),J={class:"popup-body"},W=Object(c["h"])("div",{class:"popup-body-item"},[Object(c["h"])("p",null,"Добавить существующую учетную запись")],-1),G=Object(c["h"])("hr",{class:"popup-spacing"},null,-1),Y=Object(c["j"])("Выйти из учетной записи ");function Q(e,t,n,r,i,a){var o=Object(c["C"])("base-icon");return Object(c["u"])(),Object(c["g"])("div",I,[Object(c["h"])("div",{class:"sidebar-profile",onClick:t[0]||(t[0]=function(){return a.toggleMenu&&a.toggleMenu.apply(a,arguments)})},[Object(c["h"])("div",P,[Object(c["h"])("img",{src:e.me.profile.pic},null,8,B)]),Object(c["h"])("div",T,[Object(c["h"])("div",A,[Object(c["h"])("p",null,Object(c["F"])(e.me.profile.name),1),Object(c["h"])("p",H,Object(c["F"])(e.me.profile.nickname),1)]),Object(c["h"])("div",R,[Object(c["k"])(o,{icon:"more"})])])]),e.isMenuOpened?(Object(c["u"])(),Object(c["g"])("div",V,[Object(c["h"])("div",_,[Object(c["h"])("div",F,[Object(c["h"])("img",{src:e.me.profile.pic},null,8,E)]),Object(c["h"])("div",$,[Object(c["h"])("div",N,[Object(c["h"])("p",null,Object(c["F"])(e.me.profile.name),1),Object(c["h"])("p",K,Object(c["F"])(e.me.profile.nickname),1)]),Object(c["h"])("div",U,[Object(c["k"])(o,{icon:"tick"})])])]),D,Object(c["h"])("div",J,[W,G,Object(c["h"])("div",{class:"popup-body-item",onClick:t[1]||(t[1]=function(){return a.handleLogOut&&a.handleLogOut.apply(a,arguments)})},[Object(c["h"])("p",null,[Y,Object(c["h"])("span",null,Object(c["F"])(e.me.profile.nickname),1)])])])])):Object(c["f"])("",!0)])}var X=n("5502"),Z={name:"ProfilePopup",components:{BaseIcon:M["a"]},data:function(){return{isMenuOpened:!1}},computed:Object(i["a"])({},Object(X["b"])({me:"getMe"})),methods:{toggleMenu:function(){this.isMenuOpened=!this.isMenuOpened},handleLogOut:function(){this.$store.dispatch("setLogOut"),this.$router.push("/login")}}};n("2031");Z.render=Q;var ee=Z,te={class:"more-menu"},ne={class:"icon"},ce={class:"content"};function re(e,t,n,r,i,a){var o=Object(c["C"])("base-icon");return Object(c["u"])(),Object(c["g"])("div",te,[(Object(c["u"])(!0),Object(c["g"])(c["a"],null,Object(c["A"])(e.moreMenuItems,(function(e){return Object(c["u"])(),Object(c["g"])("div",{key:e.name,class:"more-menu-item"},[Object(c["h"])("div",ne,[Object(c["k"])(o,{icon:e.icon},null,8,["icon"])]),Object(c["h"])("div",ce,Object(c["F"])(e.label),1)])})),128))])}var ie={name:"MoreMenu",components:{BaseIcon:M["a"]},data:function(){return{moreMenuItems:S}}};n("716d");ie.render=re;var ae=ie,oe={name:"Sidebar",components:{SidebarItem:q,BaseIcon:M["a"],MoreMenu:ae,ProfilePopup:ee},data:function(){return{ROUTES:L,isMenuOpened:!1}},computed:Object(i["a"])({},Object(X["b"])({me:"getMe"})),methods:{toggleMenu:function(){this.isMenuOpened=!this.isMenuOpened}}};n("b0cf");oe.render=y;var ue=oe,se={class:"trends"},le={class:"trends-wrapper"},be=Object(c["h"])("div",{class:"trends-header"},[Object(c["h"])("h3",null,"Тренды")],-1),de={key:0,class:"trends-body"};function pe(e,t,n,r,i,a){var o=Object(c["C"])("TrendsItem");return Object(c["u"])(),Object(c["g"])("div",se,[Object(c["h"])("div",le,[be,i.trends?(Object(c["u"])(),Object(c["g"])("div",de,[(Object(c["u"])(!0),Object(c["g"])(c["a"],null,Object(c["A"])(a.sortedTrends,(function(e,t){return Object(c["u"])(),Object(c["e"])(o,{key:t,data:e},null,8,["data"])})),128))])):Object(c["f"])("",!0)])])}var he=n("1da1"),fe=(n("96cf"),{class:"trends-item"});function ge(e,t,n,r,i,a){return Object(c["u"])(),Object(c["g"])("div",fe,[Object(c["h"])("h3",null,Object(c["F"])(n.data.name),1),Object(c["h"])("span",null,"Твитов: "+Object(c["F"])(a.normalizedTweetCount),1)])}n("d3b7"),n("25f0");var me={name:"TrendsItem",props:{data:{type:Object,default:function(){}}},computed:{normalizedTweetCount:function(){var e=this.data.tweetsCount.toString();return e.length>4?e.substring(0,e.length-3)+"K":e}}};n("fdec");me.render=ge;var Oe=me,je=n("0377"),ve={name:"Trends",components:{TrendsItem:Oe},data:function(){return{trends:[]}},computed:{sortedTrends:function(){var e=this.trends;return e.sort((function(e,t){return e.tweetsCount>t.tweetsCount?-1:1}),0),e}},mounted:function(){var e=this;return Object(he["a"])(regeneratorRuntime.mark((function t(){return regeneratorRuntime.wrap((function(t){while(1)switch(t.prev=t.next){case 0:e.trends=je["a"];case 1:case"end":return t.stop()}}),t)})))()}};n("417a");ve.render=pe;var ye=ve,we={class:"searchbar-wrapper"},xe={class:"searchbar-icon"},ke={class:"searchbar-input"};function Ce(e,t,n,r,i,a){var o=Object(c["C"])("BaseIcon");return Object(c["u"])(),Object(c["g"])("div",{class:Object(c["q"])(["searchbar",{focused:i.isFocused}])},[Object(c["h"])("div",we,[Object(c["h"])("div",xe,[Object(c["k"])(o,{icon:"search"})]),Object(c["h"])("div",ke,[Object(c["h"])("input",{type:"text",placeholder:"Поиск в Твиттере",onFocus:t[0]||(t[0]=function(){return a.toggleFocus&&a.toggleFocus.apply(a,arguments)}),onBlur:t[1]||(t[1]=function(){return a.toggleFocus&&a.toggleFocus.apply(a,arguments)})},null,32)])])],2)}var Me={name:"SearchBar",components:{BaseIcon:M["a"]},data:function(){return{isFocused:!1}},methods:{toggleFocus:function(){this.isFocused=!this.isFocused}}};n("1f92");Me.render=Ce;var ze=Me,qe={ref:"popup",class:"tweet-popup-wrapper"},Le={class:"tweet-popup-header"};function Se(e,t,n,r,i,a){var o=Object(c["C"])("base-icon"),u=Object(c["C"])("add-tweet");return Object(c["u"])(),Object(c["g"])("div",{ref:"popupWrapper",class:"tweet-popup",onClick:t[1]||(t[1]=function(){return a.handleClickOutside&&a.handleClickOutside.apply(a,arguments)})},[Object(c["h"])("div",qe,[Object(c["h"])("div",Le,[Object(c["h"])("div",{class:"close-button",onClick:t[0]||(t[0]=function(t){return e.$store.commit("toggleTweetButton")})},[Object(c["k"])(o,{icon:"close"})])]),Object(c["k"])(u,{onSubmitClick:a.handleSubmit},null,8,["onSubmitClick"])],512)],512)}var Ie=n("345e"),Pe={name:"TweetPopup",components:{AddTweet:Ie["a"],BaseIcon:M["a"]},methods:{handleClickOutside:function(e){var t={target:e.target,ref:this.$refs.popupWrapper};t.target===t.ref&&this.$store.commit("toggleTweetButton")},handleSubmit:function(){this.$store.commit("toggleTweetButton"),this.$store.commit("setMobileMenuState",!1)}}};n("8b36");Pe.render=Se;var Be=Pe,Te=(n("99af"),{class:"lightbox-wrapper"}),Ae={class:"lightbox-wrapper-item"},He=["src"],Re={key:0,class:"lightbox-controls"},Ve={key:1,class:"lightbox-current-image"};function _e(e,t,n,r,i,a){var o=Object(c["C"])("BaseIcon");return Object(c["u"])(),Object(c["g"])("div",{ref:"lightboxWrapper",class:"lightbox",onClick:t[3]||(t[3]=function(){return a.handleClickOutside&&a.handleClickOutside.apply(a,arguments)})},[Object(c["h"])("div",Te,[Object(c["h"])("div",Ae,[Object(c["h"])("img",{src:n.images[i.currentImage],alt:""},null,8,He)])]),Object(c["h"])("div",{class:"lightbox-close-icon",onClick:t[0]||(t[0]=function(t){return e.$store.dispatch("closeLightbox")})},[Object(c["k"])(o,{icon:"close"})]),a.hasMultipleImages?(Object(c["u"])(),Object(c["g"])("div",Re,[Object(c["h"])("div",{class:"lightbox-controls-left",onClick:t[1]||(t[1]=function(){return a.decreaseImageState&&a.decreaseImageState.apply(a,arguments)})},[Object(c["k"])(o,{icon:"left"})]),Object(c["h"])("div",{class:"lightbox-controls-right",onClick:t[2]||(t[2]=function(){return a.increaseImageState&&a.increaseImageState.apply(a,arguments)})},[Object(c["k"])(o,{icon:"right"})])])):Object(c["f"])("",!0),a.hasMultipleImages?(Object(c["u"])(),Object(c["g"])("div",Ve,Object(c["F"])("".concat(i.currentImage+1," / ").concat(n.images.length)),1)):Object(c["f"])("",!0)],512)}var Fe={name:"Lightbox",components:{BaseIcon:M["a"]},props:{images:{type:Array,default:function(){return[]}}},data:function(){return{currentImage:0}},computed:{hasMultipleImages:function(){return this.images.length>1}},methods:{increaseImageState:function(){if(this.currentImage==this.images.length-1)return this.currentImage=0;this.currentImage++},decreaseImageState:function(){if(0==this.currentImage)return this.currentImage=this.images.length-1;this.currentImage--},handleClickOutside:function(e){var t={target:e.target,ref:this.$refs.lightboxWrapper};t.target===t.ref&&this.$store.dispatch("closeLightbox")}}};n("4f83");Fe.render=_e;var Ee=Fe,$e={name:"Layout",components:{Sidebar:ue,TweetPopup:Be,BaseIcon:M["a"],Trends:ye,SearchBar:ze,Lightbox:Ee},computed:Object(i["a"])({},Object(X["b"])(["getMe","getTweetPopupState","getProfileTweetCount","getLightboxState","getMobileMenuState"]))};n("a144");$e.render=h;var Ne=$e,Ke={class:"loading-screen"},Ue={xmlns:"http://www.w3.org/2000/svg","xmlns:xlink":"http://www.w3.org/1999/xlink",style:{margin:"auto",background:"transparent none repeat scroll 0% 0%",display:"block","shape-rendering":"auto"},width:"50px",height:"50px",viewBox:"0 0 100 100",preserveAspectRatio:"xMidYMid"},De=Object(c["h"])("circle",{cx:"50",cy:"50",fill:"none",stroke:"#1da1f2","stroke-width":"10",r:"35","stroke-dasharray":"164.93361431346415 56.97787143782138"},[Object(c["h"])("animateTransform",{attributeName:"transform",type:"rotate",repeatCount:"indefinite",dur:"1s",values:"0 50 50;360 50 50",keyTimes:"0;1"})],-1),Je=[De];function We(e,t,n,r,i,a){return Object(c["u"])(),Object(c["g"])("div",Ke,[(Object(c["u"])(),Object(c["g"])("svg",Ue,Je))])}var Ge={name:"Loading"};n("222d");Ge.render=We;var Ye=Ge,Qe={class:"notification-wrapper"};function Xe(e,t,n,r,i,a){var o=Object(c["C"])("base-icon");return Object(c["u"])(),Object(c["e"])(c["b"],{name:"notification",mode:"in-out"},{default:Object(c["J"])((function(){return[e.isActive?(Object(c["u"])(),Object(c["g"])("div",{key:0,class:Object(c["q"])(["notification",n.data.type])},[Object(c["h"])("div",Qe,Object(c["F"])(n.data.message),1),Object(c["h"])("div",{class:"close-icon",onClick:t[0]||(t[0]=function(t){return e.isActive=!1})},[Object(c["k"])(o,{icon:"close"})])],2)):Object(c["f"])("",!0)]})),_:1})}n("a9e3");var Ze={name:"Notification",components:{BaseIcon:M["a"]},props:{data:{type:Object,default:function(){}},index:{type:Number,default:0}},data:function(){return{isActive:!1}},mounted:function(){var e=this;setTimeout((function(){return e.isActive=!0}),200),setTimeout((function(){return e.isActive=!1}),3e3),setTimeout((function(){return e.$store.commit("deleteNotification",e.index)}),3100)}};n("9ba7");Ze.render=Xe;var et=Ze,tt={key:0,class:"debug-panel"},nt={class:"debug-panel__current-key"},ct=Object(c["h"])("label",null,"api-key текущего пользователя:",-1),rt={class:"debug-panel__pagination"},it=["value"],at=Object(c["h"])("label",null,"Пагинация",-1),ot={key:0,class:"debug-panel__pagination"},ut=Object(c["h"])("label",null,"Лимит",-1),st=["value"];function lt(e,t,n,r,i,a){return i.isVisible?(Object(c["u"])(),Object(c["g"])("div",tt,[Object(c["h"])("div",nt,[ct,Object(c["h"])("label",null,Object(c["F"])(e.currentUserApiKey),1)]),Object(c["K"])(Object(c["h"])("input",{"onUpdate:modelValue":t[0]||(t[0]=function(e){return i.newApiKey=e}),type:"text"},null,512),[[c["H"],i.newApiKey]]),Object(c["h"])("button",{class:"debug-panel__set",onClick:t[1]||(t[1]=function(){return a.updateKey&&a.updateKey.apply(a,arguments)})}," Установить новый api-key "),Object(c["h"])("div",rt,[Object(c["h"])("input",{value:e.isPaginationEnabled,type:"checkbox",onInput:t[2]||(t[2]=function(){return a.onPaginationChange&&a.onPaginationChange.apply(a,arguments)})},null,40,it),at]),e.isPaginationEnabled?(Object(c["u"])(),Object(c["g"])("div",ot,[ut,Object(c["h"])("input",{value:e.paginationLimit,type:"text",onInput:t[3]||(t[3]=function(){return a.onPaginationLimitChange&&a.onPaginationLimitChange.apply(a,arguments)})},null,40,st)])):Object(c["f"])("",!0),Object(c["h"])("button",{class:"debug-panel__hide",onClick:t[4]||(t[4]=function(e){return i.isVisible=!1})}," Скрыть ")])):Object(c["f"])("",!0)}var bt={data:function(){return{isVisible:!0,newApiKey:""}},computed:Object(i["a"])({},Object(X["c"])(["currentUserApiKey","isPaginationEnabled","paginationLimit"])),methods:{updateKey:function(){this.$store.commit("setCurrentUserApiKey",this.newApiKey),this.$store.dispatch("setLogOut"),this.$router.push({path:"/login"})},onPaginationChange:function(){this.$store.commit("setIsPaginationEnabled",!this.isPaginationEnabled)},onPaginationLimitChange:function(e){this.$store.commit("setPaginationLimit",e.target.value)}}};n("be82");bt.render=lt;var dt=bt,pt={components:{Layout:Ne,Loading:Ye,Notification:et,DebugPanel:dt},data:function(){return{globalNotification:!1}},computed:Object(i["a"])({},Object(X["b"])(["getLoginStatus","getLoadingStatus","getActiveNotifications"]))};n("2d63");pt.render=r;var ht=pt,ft=(n("3ca3"),n("ddb0"),n("6c02")),gt=n("4360"),mt=[{path:"/",name:"Home",meta:{label:"Главная"},component:function(){return Promise.all([n.e("chunk-76301fe8"),n.e("chunk-732a3e8c"),n.e("chunk-0420bcc4")]).then(n.bind(null,"bb51"))}},{path:"/login",name:"Login",beforeEnter:jt,component:function(){return Promise.all([n.e("chunk-76301fe8"),n.e("chunk-10e0d5b4")]).then(n.bind(null,"a55b"))}},{path:"/profile/:profileId",name:"Profile",component:function(){return Promise.all([n.e("chunk-76301fe8"),n.e("chunk-732a3e8c"),n.e("chunk-6f77c742")]).then(n.bind(null,"c66d"))}}],Ot=Object(ft["a"])({history:Object(ft["b"])("/"),routes:mt});function jt(e,t,n){var c=gt["a"].getters.getLoginStatus;c?n(t):n()}Ot.beforeEach((function(e,t,n){gt["a"].commit("setMobileMenuState",!1);var c=gt["a"].getters.getLoginStatus;if(!1===c)"Login"!==e.name?n({path:"/login"}):n();else{var r,i,a;if("Home"===e.name&&"Profile"===(null===t||void 0===t||null===(r=t.redirectedFrom)||void 0===r?void 0:r.name))return void n({name:"Profile",params:{profileId:null===t||void 0===t||null===(i=t.redirectedFrom)||void 0===i||null===(a=i.params)||void 0===a?void 0:a.profileId}});n()}}));var vt=Ot;function yt(e){var t=e.type,n=e.message;gt["a"].commit("addNotification",{type:t,message:n})}var wt=n("6a29"),xt=(n("2116"),Object(c["d"])(ht).use(wt["a"]));xt.config.globalProperties.$notification=yt,xt.use(vt),xt.use(gt["a"]),xt.mount("#app")},"59d3":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-jwli3a r-4qtqp9 r-yyyyoo r-lwhw9o r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M19.25 3.018H4.75C3.233 3.018 2 4.252 2 5.77v12.495c0 1.518 1.233 2.753 2.75 2.753h14.5c1.517 0 2.75-1.235 2.75-2.753V5.77c0-1.518-1.233-2.752-2.75-2.752zm-14.5 1.5h14.5c.69 0 1.25.56 1.25 1.25v.714l-8.05 5.367c-.273.18-.626.182-.9-.002L3.5 6.482v-.714c0-.69.56-1.25 1.25-1.25zm14.5 14.998H4.75c-.69 0-1.25-.56-1.25-1.25V8.24l7.24 4.83c.383.256.822.384 1.26.384.44 0 .877-.128 1.26-.383l7.24-4.83v10.022c0 .69-.56 1.25-1.25 1.25z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"5b0d":function(e,t,n){},"5c20":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-13gxpu9 r-4qtqp9 r-yyyyoo r-1q142lx r-1xvli5t r-19u6a5r r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M9 20c-.264 0-.52-.104-.707-.293l-4.785-4.785c-.39-.39-.39-1.023 0-1.414s1.023-.39 1.414 0l3.946 3.945L18.075 4.41c.32-.45.94-.558 1.395-.24.45.318.56.942.24 1.394L9.817 19.577c-.17.24-.438.395-.732.42-.028.002-.057.003-.085.003z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"5f5b":function(e,t,n){},"63c6":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-jwli3a r-4qtqp9 r-yyyyoo r-lwhw9o r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M21.697 16.468c-.02-.016-2.14-1.64-2.103-6.03.02-2.532-.812-4.782-2.347-6.335C15.872 2.71 14.01 1.94 12.005 1.93h-.013c-2.004.01-3.866.78-5.242 2.174-1.534 1.553-2.368 3.802-2.346 6.334.037 4.33-2.02 5.967-2.102 6.03-.26.193-.366.53-.265.838.102.308.39.515.712.515h4.92c.102 2.31 1.997 4.16 4.33 4.16s4.226-1.85 4.327-4.16h4.922c.322 0 .61-.206.71-.514.103-.307-.003-.645-.263-.838zM12 20.478c-1.505 0-2.73-1.177-2.828-2.658h5.656c-.1 1.48-1.323 2.66-2.828 2.66zM4.38 16.32c.74-1.132 1.548-3.028 1.524-5.896-.018-2.16.644-3.982 1.913-5.267C8.91 4.05 10.397 3.437 12 3.43c1.603.008 3.087.62 4.18 1.728 1.27 1.285 1.933 3.106 1.915 5.267-.024 2.868.785 4.765 1.525 5.896H4.38z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"69b5":function(e,t,n){},"6e60":function(e,t,n){},"716d":function(e,t,n){"use strict";n("9689")},7424:function(e,t,n){"use strict";n.d(t,"h",(function(){return o})),n.d(t,"f",(function(){return s})),n.d(t,"c",(function(){return b})),n.d(t,"j",(function(){return p})),n.d(t,"d",(function(){return f})),n.d(t,"e",(function(){return m})),n.d(t,"m",(function(){return j})),n.d(t,"a",(function(){return y})),n.d(t,"k",(function(){return x})),n.d(t,"i",(function(){return C})),n.d(t,"l",(function(){return z})),n.d(t,"g",(function(){return L})),n.d(t,"b",(function(){return I}));var c=n("1da1"),r=(n("99af"),n("96cf"),n("bc3a")),i=n.n(r),a=(n("94db"),n("4360"));n("0377");function o(e,t){return u.apply(this,arguments)}function u(){return u=Object(c["a"])(regeneratorRuntime.mark((function e(t,n){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"get",path:"/api/users/me"}));case 1:case"end":return e.stop()}}),e)}))),u.apply(this,arguments)}function s(e){return l.apply(this,arguments)}function l(){return l=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"get",path:"/api/users/".concat(t)}));case 1:case"end":return e.stop()}}),e)}))),l.apply(this,arguments)}function b(e){return d.apply(this,arguments)}function d(){return d=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"post",path:"/api/users/".concat(t,"/follow")}));case 1:case"end":return e.stop()}}),e)}))),d.apply(this,arguments)}function p(e){return h.apply(this,arguments)}function h(){return h=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"delete",path:"/api/users/".concat(t,"/follow")}));case 1:case"end":return e.stop()}}),e)}))),h.apply(this,arguments)}function f(){return g.apply(this,arguments)}function g(){return g=function(){var e=[];function t(n){return B({type:"get",path:"/api/tweets?limit=100"+(n?"&before="+encodeURIComponent(n):"")}).then((function(c){var r=c&&c.data||{};return e=e.concat(r.tweets||[]),r.next_cursor?t(r.next_cursor):(r.tweets=e,c)}))}return t(null)},g.apply(this,arguments)}function m(e,t){return O.apply(this,arguments)}function O(){return O=Object(c["a"])(regeneratorRuntime.mark((function e(t,n){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"get",path:"/api/tweets?offset=".concat(t,"&limit=").concat(n)}));case 1:case"end":return e.stop()}}),e)}))),O.apply(this,arguments)}function j(e){return v.apply(this,arguments)}function v(){return v=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"post",path:"/api/tweets",body:t}));case 1:case"end":return e.stop()}}),e)}))),v.apply(this,arguments)}function y(e){return w.apply(this,arguments)}function w(){return w=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"delete",path:"/api/tweets/".concat(t)}));case 1:case"end":return e.stop()}}),e)}))),w.apply(this,arguments)}function x(e){return k.apply(this,arguments)}function k(){return k=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"patch",path:"/tweets",body:t}));case 1:case"end":return e.stop()}}),e)}))),k.apply(this,arguments)}function C(e){return M.apply(this,arguments)}function M(){return M=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"put",path:"/me",body:t}));case 1:case"end":return e.stop()}}),e)}))),M.apply(this,arguments)}function z(e){return q.apply(this,arguments)}function q(){return q=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"post",path:"/api/medias",body:t}));case 1:case"end":return e.stop()}}),e)}))),q.apply(this,arguments)}function L(e){return S.apply(this,arguments)}function S(){return S=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"post",path:"/api/tweets/".concat(t,"/likes")}));case 1:case"end":return e.stop()}}),e)}))),S.apply(this,arguments)}function I(e){return P.apply(this,arguments)}function P(){return P=Object(c["a"])(regeneratorRuntime.mark((function e(t){return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:return e.abrupt("return",B({type:"delete",path:"/api/tweets/".concat(t,"/likes")}));case 1:case"end":return e.stop()}}),e)}))),P.apply(this,arguments)}function B(e){return T.apply(this,arguments)}function T(){return T=Object(c["a"])(regeneratorRuntime.mark((function e(t){var n,c,r;return regeneratorRuntime.wrap((function(e){while(1)switch(e.prev=e.next){case 0:if(a["a"].commit("setLoadingStatus",!0),e.prev=1,i.a.defaults.baseURL="/",i.a.defaults.headers.common["api-key"]=null===(n=a["a"].state)||void 0===n?void 0:n.currentUserApiKey,!t.body){e.next=10;break}return e.next=7,i.a[t.type](t.path,t.body);case 7:return c=e.sent,a["a"].commit("setLoadingStatus",!1),e.abrupt("return",c);case 10:return e.next=12,i.a[t.type](t.path);case 12:return r=e.sent,a["a"].commit("setLoadingStatus",!1),e.abrupt("return",r);case 17:throw e.prev=17,e.t0=e["catch"](1),console.log(e.t0),a["a"].commit("setLoadingStatus",!1),new Error(e.t0);case 22:case"end":return e.stop()}}),e,null,[[1,17]])}))),T.apply(this,arguments)}},"74a2":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-jwli3a r-4qtqp9 r-yyyyoo r-16y2uox r-1q142lx r-8kz0gk r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1srniue"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M23.643 4.937c-.835.37-1.732.62-2.675.733.962-.576 1.7-1.49 2.048-2.578-.9.534-1.897.922-2.958 1.13-.85-.904-2.06-1.47-3.4-1.47-2.572 0-4.658 2.086-4.658 4.66 0 .364.042.718.12 1.06-3.873-.195-7.304-2.05-9.602-4.868-.4.69-.63 1.49-.63 2.342 0 1.616.823 3.043 2.072 3.878-.764-.025-1.482-.234-2.11-.583v.06c0 2.257 1.605 4.14 3.737 4.568-.392.106-.803.162-1.227.162-.3 0-.593-.028-.877-.082.593 1.85 2.313 3.198 4.352 3.234-1.595 1.25-3.604 1.995-5.786 1.995-.376 0-.747-.022-1.112-.065 2.062 1.323 4.51 2.093 7.14 2.093 8.57 0 13.255-7.098 13.255-13.254 0-.2-.005-.402-.014-.602.91-.658 1.7-1.477 2.323-2.41z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"79f9":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-13gxpu9 r-4qtqp9 r-yyyyoo r-1q142lx r-50lct3 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1srniue"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M20.222 9.16h-1.334c.015-.09.028-.182.028-.277V6.57c0-.98-.797-1.777-1.778-1.777H3.5V3.358c0-.414-.336-.75-.75-.75s-.75.336-.75.75V20.83c0 .415.336.75.75.75s.75-.335.75-.75v-1.434h10.556c.98 0 1.778-.797 1.778-1.777v-2.313c0-.095-.014-.187-.028-.278h4.417c.98 0 1.778-.798 1.778-1.778v-2.31c0-.983-.797-1.78-1.778-1.78zM17.14 6.293c.152 0 .277.124.277.277v2.31c0 .154-.125.28-.278.28H3.5V6.29h13.64zm-2.807 9.014v2.312c0 .153-.125.277-.278.277H3.5v-2.868h10.556c.153 0 .277.126.277.28zM20.5 13.25c0 .153-.125.277-.278.277H3.5V10.66h16.722c.153 0 .278.124.278.277v2.313z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"7c33":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-111h2gw r-4qtqp9 r-yyyyoo r-1q142lx r-1xvli5t r-1b7u577 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M12.025 22.75c-5.928 0-10.75-4.822-10.75-10.75S6.098 1.25 12.025 1.25 22.775 6.072 22.775 12s-4.822 10.75-10.75 10.75zm0-20c-5.1 0-9.25 4.15-9.25 9.25s4.15 9.25 9.25 9.25 9.25-4.15 9.25-9.25-4.15-9.25-9.25-9.25z"}),Object(c["h"])("path",{d:"M13.064 17.47c0-.616-.498-1.114-1.114-1.114-.616 0-1.114.498-1.114 1.114 0 .615.498 1.114 1.114 1.114.616 0 1.114-.5 1.114-1.114zm3.081-7.528c0-2.312-1.882-4.194-4.194-4.194-2.312 0-4.194 1.882-4.194 4.194 0 .414.336.75.75.75s.75-.336.75-.75c0-1.485 1.21-2.694 2.695-2.694 1.486 0 2.695 1.21 2.695 2.694 0 1.486-1.21 2.695-2.694 2.695-.413 0-.75.336-.75.75v1.137c0 .414.337.75.75.75s.75-.336.75-.75v-.463c1.955-.354 3.445-2.06 3.445-4.118z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"8a54":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-13gxpu9 r-4qtqp9 r-yyyyoo r-1q142lx r-50lct3 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1srniue"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M12 22.75C6.072 22.75 1.25 17.928 1.25 12S6.072 1.25 12 1.25 22.75 6.072 22.75 12 17.928 22.75 12 22.75zm0-20C6.9 2.75 2.75 6.9 2.75 12S6.9 21.25 12 21.25s9.25-4.15 9.25-9.25S17.1 2.75 12 2.75z"}),Object(c["h"])("path",{d:"M12 17.115c-1.892 0-3.633-.95-4.656-2.544-.224-.348-.123-.81.226-1.035.348-.226.812-.124 1.036.226.747 1.162 2.016 1.855 3.395 1.855s2.648-.693 3.396-1.854c.224-.35.688-.45 1.036-.225.35.224.45.688.226 1.036-1.025 1.594-2.766 2.545-4.658 2.545z"}),Object(c["h"])("circle",{cx:"14.738",cy:"9.458",r:"1.478"}),Object(c["h"])("circle",{cx:"9.262",cy:"9.458",r:"1.478"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"8b36":function(e,t,n){"use strict";n("69b5")},"8bac":function(e,t,n){"use strict";var c=n("7a23");function r(e,t,n,r,i,a){return Object(c["u"])(),Object(c["e"])(Object(c["D"])(a.iconComponent))}var i={name:"BaseIcon",props:{icon:{type:String,default:"home"}},computed:{iconComponent:function(){return n("2b57")("./".concat(this.icon)).default}}};i.render=r;t["a"]=i},"8dfb":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-4qtqp9 r-yyyyoo r-1xvli5t r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1hdv0qi"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M17.53 7.47l-5-5c-.293-.293-.768-.293-1.06 0l-5 5c-.294.293-.294.768 0 1.06s.767.294 1.06 0l3.72-3.72V15c0 .414.336.75.75.75s.75-.336.75-.75V4.81l3.72 3.72c.146.147.338.22.53.22s.384-.072.53-.22c.293-.293.293-.767 0-1.06z"}),Object(c["h"])("path",{d:"M19.708 21.944H4.292C3.028 21.944 2 20.916 2 19.652V14c0-.414.336-.75.75-.75s.75.336.75.75v5.652c0 .437.355.792.792.792h15.416c.437 0 .792-.355.792-.792V14c0-.414.336-.75.75-.75s.75.336.75.75v5.652c0 1.264-1.028 2.292-2.292 2.292z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},9689:function(e,t,n){},"999a":function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-111h2gw r-4qtqp9 r-yyyyoo r-1q142lx r-1xvli5t r-1b7u577 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M8.98 22.698c-.103 0-.205-.02-.302-.063-.31-.135-.49-.46-.44-.794l1.228-8.527H6.542c-.22 0-.43-.098-.573-.266-.144-.17-.204-.393-.167-.61L7.49 2.5c.062-.36.373-.625.74-.625h6.81c.23 0 .447.105.59.285.142.18.194.415.14.64l-1.446 6.075H19c.29 0 .553.166.678.428.124.262.087.57-.096.796L9.562 22.42c-.146.18-.362.276-.583.276zM7.43 11.812h2.903c.218 0 .425.095.567.26.142.164.206.382.175.598l-.966 6.7 7.313-8.995h-4.05c-.228 0-.445-.105-.588-.285-.142-.18-.194-.415-.14-.64l1.446-6.075H8.864L7.43 11.812z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},"9ba7":function(e,t,n){"use strict";n("e984")},a144:function(e,t,n){"use strict";n("db9f")},a1f6:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24","aria-hidden":"true",class:"r-111h2gw r-4qtqp9 r-yyyyoo r-1xvli5t r-1d4mawv r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["i"])('<g><path d="M19.708 2H4.292C3.028 2 2 3.028 2 4.292v15.416C2 20.972 3.028 22 4.292 22h15.416C20.972 22 22 20.972 22 19.708V4.292C22 3.028 20.972 2 19.708 2zm.792 17.708c0 .437-.355.792-.792.792H4.292c-.437 0-.792-.355-.792-.792V6.418c0-.437.354-.79.79-.792h15.42c.436 0 .79.355.79.79V19.71z"></path><circle cx="7.032" cy="8.75" r="1.285"></circle><circle cx="7.032" cy="13.156" r="1.285"></circle><circle cx="16.968" cy="8.75" r="1.285"></circle><circle cx="16.968" cy="13.156" r="1.285"></circle><circle cx="12" cy="8.75" r="1.285"></circle><circle cx="12" cy="13.156" r="1.285"></circle><circle cx="7.032" cy="17.486" r="1.285"></circle><circle cx="12" cy="17.486" r="1.285"></circle></g>',1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},a5bc:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24","aria-hidden":"true",class:"r-daml9f r-4qtqp9 r-yyyyoo r-1q142lx r-1xvli5t r-1b7u577 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M20.746 5.236h-3.75V4.25c0-1.24-1.01-2.25-2.25-2.25h-5.5c-1.24 0-2.25 1.01-2.25 2.25v.986h-3.75c-.414 0-.75.336-.75.75s.336.75.75.75h.368l1.583 13.262c.216 1.193 1.31 2.027 2.658 2.027h8.282c1.35 0 2.442-.834 2.664-2.072l1.577-13.217h.368c.414 0 .75-.336.75-.75s-.335-.75-.75-.75zM8.496 4.25c0-.413.337-.75.75-.75h5.5c.413 0 .75.337.75.75v.986h-7V4.25zm8.822 15.48c-.1.55-.664.795-1.18.795H7.854c-.517 0-1.083-.246-1.175-.75L5.126 6.735h13.74L17.32 19.732z"}),Object(c["h"])("path",{d:"M10 17.75c.414 0 .75-.336.75-.75v-7c0-.414-.336-.75-.75-.75s-.75.336-.75.75v7c0 .414.336.75.75.75zm4 0c.414 0 .75-.336.75-.75v-7c0-.414-.336-.75-.75-.75s-.75.336-.75.75v7c0 .414.336.75.75.75z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},ab4d:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-4qtqp9 r-yyyyoo r-1xvli5t r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1hdv0qi"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M23.77 15.67c-.292-.293-.767-.293-1.06 0l-2.22 2.22V7.65c0-2.068-1.683-3.75-3.75-3.75h-5.85c-.414 0-.75.336-.75.75s.336.75.75.75h5.85c1.24 0 2.25 1.01 2.25 2.25v10.24l-2.22-2.22c-.293-.293-.768-.293-1.06 0s-.294.768 0 1.06l3.5 3.5c.145.147.337.22.53.22s.383-.072.53-.22l3.5-3.5c.294-.292.294-.767 0-1.06zm-10.66 3.28H7.26c-1.24 0-2.25-1.01-2.25-2.25V6.46l2.22 2.22c.148.147.34.22.532.22s.384-.073.53-.22c.293-.293.293-.768 0-1.06l-3.5-3.5c-.293-.294-.768-.294-1.06 0l-3.5 3.5c-.294.292-.294.767 0 1.06s.767.293 1.06 0l2.22-2.22V16.7c0 2.068 1.683 3.75 3.75 3.75h5.85c.414 0 .75-.336.75-.75s-.337-.75-.75-.75z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},ac39:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-13gxpu9 r-4qtqp9 r-yyyyoo r-1q142lx r-50lct3 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1srniue"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M19 10.5V8.8h-4.4v6.4h1.7v-2h2v-1.7h-2v-1H19zm-7.3-1.7h1.7v6.4h-1.7V8.8zm-3.6 1.6c.4 0 .9.2 1.2.5l1.2-1C9.9 9.2 9 8.8 8.1 8.8c-1.8 0-3.2 1.4-3.2 3.2s1.4 3.2 3.2 3.2c1 0 1.8-.4 2.4-1.1v-2.5H7.7v1.2h1.2v.6c-.2.1-.5.2-.8.2-.9 0-1.6-.7-1.6-1.6 0-.8.7-1.6 1.6-1.6z"}),Object(c["h"])("path",{d:"M20.5 2.02h-17c-1.24 0-2.25 1.007-2.25 2.247v15.507c0 1.238 1.01 2.246 2.25 2.246h17c1.24 0 2.25-1.008 2.25-2.246V4.267c0-1.24-1.01-2.247-2.25-2.247zm.75 17.754c0 .41-.336.746-.75.746h-17c-.414 0-.75-.336-.75-.746V4.267c0-.412.336-.747.75-.747h17c.414 0 .75.335.75.747v15.507z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},af00:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-13gxpu9 r-4qtqp9 r-yyyyoo r-1q142lx r-50lct3 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1srniue"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M12 22.75C6.072 22.75 1.25 17.928 1.25 12S6.072 1.25 12 1.25 22.75 6.072 22.75 12 17.928 22.75 12 22.75zm0-20C6.9 2.75 2.75 6.9 2.75 12S6.9 21.25 12 21.25s9.25-4.15 9.25-9.25S17.1 2.75 12 2.75z"}),Object(c["h"])("path",{d:"M12 17.115c-1.892 0-3.633-.95-4.656-2.544-.224-.348-.123-.81.226-1.035.348-.226.812-.124 1.036.226.747 1.162 2.016 1.855 3.395 1.855s2.648-.693 3.396-1.854c.224-.35.688-.45 1.036-.225.35.224.45.688.226 1.036-1.025 1.594-2.766 2.545-4.658 2.545z"}),Object(c["h"])("circle",{cx:"14.738",cy:"9.458",r:"1.478"}),Object(c["h"])("circle",{cx:"9.262",cy:"9.458",r:"1.478"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},b046:function(e,t,n){"use strict";n("d9d3")},b0cf:function(e,t,n){"use strict";n("eaf9")},b7b3:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-4qtqp9 r-yyyyoo r-1xvli5t r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1hdv0qi"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M14.046 2.242l-4.148-.01h-.002c-4.374 0-7.8 3.427-7.8 7.802 0 4.098 3.186 7.206 7.465 7.37v3.828c0 .108.044.286.12.403.142.225.384.347.632.347.138 0 .277-.038.402-.118.264-.168 6.473-4.14 8.088-5.506 1.902-1.61 3.04-3.97 3.043-6.312v-.017c-.006-4.367-3.43-7.787-7.8-7.788zm3.787 12.972c-1.134.96-4.862 3.405-6.772 4.643V16.67c0-.414-.335-.75-.75-.75h-.396c-3.66 0-6.318-2.476-6.318-5.886 0-3.534 2.768-6.302 6.3-6.302l4.147.01h.002c3.532 0 6.3 2.766 6.302 6.296-.003 1.91-.942 3.844-2.514 5.176z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},b904:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-jwli3a r-4qtqp9 r-yyyyoo r-lwhw9o r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M12 11.816c1.355 0 2.872-.15 3.84-1.256.814-.93 1.078-2.368.806-4.392-.38-2.825-2.117-4.512-4.646-4.512S7.734 3.343 7.354 6.17c-.272 2.022-.008 3.46.806 4.39.968 1.107 2.485 1.256 3.84 1.256zM8.84 6.368c.162-1.2.787-3.212 3.16-3.212s2.998 2.013 3.16 3.212c.207 1.55.057 2.627-.45 3.205-.455.52-1.266.743-2.71.743s-2.255-.223-2.71-.743c-.507-.578-.657-1.656-.45-3.205zm11.44 12.868c-.877-3.526-4.282-5.99-8.28-5.99s-7.403 2.464-8.28 5.99c-.172.692-.028 1.4.395 1.94.408.52 1.04.82 1.733.82h12.304c.693 0 1.325-.3 1.733-.82.424-.54.567-1.247.394-1.94zm-1.576 1.016c-.126.16-.316.246-.552.246H5.848c-.235 0-.426-.085-.552-.246-.137-.174-.18-.412-.12-.654.71-2.855 3.517-4.85 6.824-4.85s6.114 1.994 6.824 4.85c.06.242.017.48-.12.654z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},be82:function(e,t,n){"use strict";n("ff65")},c312:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-111h2gw r-4qtqp9 r-yyyyoo r-1q142lx r-1xvli5t r-1b7u577 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M12.003 23.274c-.083 0-.167-.014-.248-.042-.3-.105-.502-.39-.502-.708v-4.14c-2.08-.172-4.013-1.066-5.506-2.56-3.45-3.45-3.45-9.062 0-12.51s9.062-3.45 12.512 0c3.096 3.097 3.45 8.07.82 11.565l-6.49 8.112c-.146.182-.363.282-.587.282zm0-21.05c-1.882 0-3.763.717-5.195 2.15-2.864 2.863-2.864 7.524 0 10.39 1.388 1.387 3.233 2.15 5.195 2.15.414 0 .75.337.75.75v2.72l5.142-6.425c2.17-2.885 1.876-7.014-.696-9.587-1.434-1.43-3.316-2.148-5.197-2.148z"}),Object(c["h"])("path",{d:"M15.55 8.7h-7.1c-.413 0-.75-.337-.75-.75s.337-.75.75-.75h7.1c.413 0 .75.335.75.75s-.337.75-.75.75zm-3.05 3.238H8.45c-.413 0-.75-.336-.75-.75s.337-.75.75-.75h4.05c.414 0 .75.336.75.75s-.336.75-.75.75z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},ca5e:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-jwli3a r-4qtqp9 r-yyyyoo r-lwhw9o r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M19.75 22H4.25C3.01 22 2 20.99 2 19.75V4.25C2 3.01 3.01 2 4.25 2h15.5C20.99 2 22 3.01 22 4.25v15.5c0 1.24-1.01 2.25-2.25 2.25zM4.25 3.5c-.414 0-.75.337-.75.75v15.5c0 .413.336.75.75.75h15.5c.414 0 .75-.337.75-.75V4.25c0-.413-.336-.75-.75-.75H4.25z"}),Object(c["h"])("path",{d:"M17 8.64H7c-.414 0-.75-.337-.75-.75s.336-.75.75-.75h10c.414 0 .75.335.75.75s-.336.75-.75.75zm0 4.11H7c-.414 0-.75-.336-.75-.75s.336-.75.75-.75h10c.414 0 .75.336.75.75s-.336.75-.75.75zm-5 4.11H7c-.414 0-.75-.335-.75-.75s.336-.75.75-.75h5c.414 0 .75.337.75.75s-.336.75-.75.75z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},cacf:function(e,t,n){},cdbe:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-111h2gw r-4qtqp9 r-yyyyoo r-1q142lx r-1xvli5t r-1b7u577 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M12 8.21c-2.09 0-3.79 1.7-3.79 3.79s1.7 3.79 3.79 3.79 3.79-1.7 3.79-3.79-1.7-3.79-3.79-3.79zm0 6.08c-1.262 0-2.29-1.026-2.29-2.29S10.74 9.71 12 9.71s2.29 1.026 2.29 2.29-1.028 2.29-2.29 2.29z"}),Object(c["h"])("path",{d:"M12.36 22.375h-.722c-1.183 0-2.154-.888-2.262-2.064l-.014-.147c-.025-.287-.207-.533-.472-.644-.286-.12-.582-.065-.798.115l-.116.097c-.868.725-2.253.663-3.06-.14l-.51-.51c-.836-.84-.896-2.154-.14-3.06l.098-.118c.186-.222.23-.523.122-.787-.11-.272-.358-.454-.646-.48l-.15-.014c-1.18-.107-2.067-1.08-2.067-2.262v-.722c0-1.183.888-2.154 2.064-2.262l.156-.014c.285-.025.53-.207.642-.473.11-.27.065-.573-.12-.795l-.094-.116c-.757-.908-.698-2.223.137-3.06l.512-.512c.804-.804 2.188-.865 3.06-.14l.116.098c.218.184.528.23.79.122.27-.112.452-.358.477-.643l.014-.153c.107-1.18 1.08-2.066 2.262-2.066h.722c1.183 0 2.154.888 2.262 2.064l.014.156c.025.285.206.53.472.64.277.117.58.062.794-.117l.12-.102c.867-.723 2.254-.662 3.06.14l.51.512c.836.838.896 2.153.14 3.06l-.1.118c-.188.22-.234.522-.123.788.112.27.36.45.646.478l.152.014c1.18.107 2.067 1.08 2.067 2.262v.723c0 1.183-.888 2.154-2.064 2.262l-.155.014c-.284.024-.53.205-.64.47-.113.272-.067.574.117.795l.1.12c.756.905.696 2.22-.14 3.06l-.51.51c-.807.804-2.19.864-3.06.14l-.115-.096c-.217-.183-.53-.23-.79-.122-.273.114-.455.36-.48.646l-.014.15c-.107 1.173-1.08 2.06-2.262 2.06zm-3.773-4.42c.3 0 .593.06.87.175.79.328 1.324 1.054 1.4 1.896l.014.147c.037.4.367.7.77.7h.722c.4 0 .73-.3.768-.7l.014-.148c.076-.842.61-1.567 1.392-1.892.793-.33 1.696-.182 2.333.35l.113.094c.178.148.366.18.493.18.206 0 .4-.08.546-.227l.51-.51c.284-.284.305-.73.048-1.038l-.1-.12c-.542-.65-.677-1.54-.352-2.323.326-.79 1.052-1.32 1.894-1.397l.155-.014c.397-.037.7-.367.7-.77v-.722c0-.4-.303-.73-.702-.768l-.152-.014c-.846-.078-1.57-.61-1.895-1.393-.326-.788-.19-1.678.353-2.327l.1-.118c.257-.31.236-.756-.048-1.04l-.51-.51c-.146-.147-.34-.227-.546-.227-.127 0-.315.032-.492.18l-.12.1c-.634.528-1.55.67-2.322.354-.788-.327-1.32-1.052-1.397-1.896l-.014-.155c-.035-.397-.365-.7-.767-.7h-.723c-.4 0-.73.303-.768.702l-.014.152c-.076.843-.608 1.568-1.39 1.893-.787.326-1.693.183-2.33-.35l-.118-.096c-.18-.15-.368-.18-.495-.18-.206 0-.4.08-.546.226l-.512.51c-.282.284-.303.73-.046 1.038l.1.118c.54.653.677 1.544.352 2.325-.327.788-1.052 1.32-1.895 1.397l-.156.014c-.397.037-.7.367-.7.77v.722c0 .4.303.73.702.768l.15.014c.848.078 1.573.612 1.897 1.396.325.786.19 1.675-.353 2.325l-.096.115c-.26.31-.238.756.046 1.04l.51.51c.146.147.34.227.546.227.127 0 .315-.03.492-.18l.116-.096c.406-.336.923-.524 1.453-.524z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},d077:function(e,t,n){},d0e9:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={xmlns:"http://www.w3.org/2000/svg",width:"24",height:"24",viewBox:"0 0 24 24"},i=Object(c["h"])("path",{d:"M16.67 0l2.83 2.829-9.339 9.175 9.339 9.167-2.83 2.829-12.17-11.996z"},null,-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},d674:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-13gxpu9 r-4qtqp9 r-yyyyoo r-1q142lx r-50lct3 r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1srniue"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M19.75 2H4.25C3.01 2 2 3.01 2 4.25v15.5C2 20.99 3.01 22 4.25 22h15.5c1.24 0 2.25-1.01 2.25-2.25V4.25C22 3.01 20.99 2 19.75 2zM4.25 3.5h15.5c.413 0 .75.337.75.75v9.676l-3.858-3.858c-.14-.14-.33-.22-.53-.22h-.003c-.2 0-.393.08-.532.224l-4.317 4.384-1.813-1.806c-.14-.14-.33-.22-.53-.22-.193-.03-.395.08-.535.227L3.5 17.642V4.25c0-.413.337-.75.75-.75zm-.744 16.28l5.418-5.534 6.282 6.254H4.25c-.402 0-.727-.322-.744-.72zm16.244.72h-2.42l-5.007-4.987 3.792-3.85 4.385 4.384v3.703c0 .413-.337.75-.75.75z"}),Object(c["h"])("circle",{cx:"8.868",cy:"8.309",r:"1.542"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},d9d3:function(e,t,n){},db9f:function(e,t,n){},e29c:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24","aria-hidden":"true",class:"r-4qtqp9 r-yyyyoo r-1xvli5t r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1hdv0qi"},i=Object(c["h"])("g",null,[Object(c["h"])("circle",{cx:"5",cy:"12",r:"2"}),Object(c["h"])("circle",{cx:"12",cy:"12",r:"2"}),Object(c["h"])("circle",{cx:"19",cy:"12",r:"2"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},e4a1:function(e,t,n){},e796:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 24 24",class:"r-4qtqp9 r-yyyyoo r-1xvli5t r-dnmrzs r-bnwqim r-1plcrui r-lrvibr r-1hdv0qi"},i=Object(c["h"])("g",null,[Object(c["h"])("path",{d:"M12 21.638h-.014C9.403 21.59 1.95 14.856 1.95 8.478c0-3.064 2.525-5.754 5.403-5.754 2.29 0 3.83 1.58 4.646 2.73.814-1.148 2.354-2.73 4.645-2.73 2.88 0 5.404 2.69 5.404 5.755 0 6.376-7.454 13.11-10.037 13.157H12zM7.354 4.225c-2.08 0-3.903 1.988-3.903 4.255 0 5.74 7.034 11.596 8.55 11.658 1.518-.062 8.55-5.917 8.55-11.658 0-2.267-1.823-4.255-3.903-4.255-2.528 0-3.94 2.936-3.952 2.965-.23.562-1.156.562-1.387 0-.014-.03-1.425-2.965-3.954-2.965z"})],-1),a=[i];function o(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,a)}const u={};u.render=o;t["default"]=u},e984:function(e,t,n){},eaf9:function(e,t,n){},f8b4:function(e,t,n){"use strict";n.r(t);var c=n("7a23"),r={viewBox:"0 0 75 40"},i=Object(c["h"])("rect",{width:"75",height:"6"},null,-1),a=Object(c["h"])("rect",{y:"20",width:"75",height:"6"},null,-1),o=Object(c["h"])("rect",{y:"40",width:"75",height:"6"},null,-1),u=[i,a,o];function s(e,t){return Object(c["u"])(),Object(c["g"])("svg",r,u)}const l={};l.render=s;t["default"]=l},fdec:function(e,t,n){"use strict";n("cacf")},ff65:function(e,t,n){}});
 //# sourceMappingURL=app.ee2cdef2.js.map
\ No newline at end of file
@@ -4,20 +4,46 @@ This module contains pytest fixtures.
 - Create and initialize a test database in memory for use with tests.
 - Provide a database session to interact with the test database.
 - Create an HTTP client for testing the FastAPI application, overriding the session dependency.
+- Assert budgets of SQL statements, so N+1 queries fail the tests.
 """
 
+from contextlib import contextmanager
+
+import pytest
 import pytest_asyncio
 from httpx import ASGITransport, AsyncClient
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from app.db.base_model import Base
 from app.db.db_settings import db_session as db
+from app.db.migrations import migrations_metadata
+from app.db.query_stats import instrument_engine, track_queries
 from app.main import app
 from app.routes.crud.insert_data import insert_data
+from app.services.cache import identity_cache
+from app.services.events import event_bus
+from app.services.feed_cache import feed_cache
+from app.services.media.config import media_config
+from app.services.media.gc import MediaSweeper
+from app.services.media.processing import image_processor
+from app.services.media.storage import media_storage
+from app.services.timeline import SQLTimelineStore, timeline_fanout
 
 test_db_url = "sqlite+aiosqlite:///:memory:"
 test_engine = create_async_engine(url=test_db_url, echo=False)
+instrument_engine(test_engine)
+
+
+@event.listens_for(test_engine.sync_engine, "connect")
+def enable_foreign_keys(dbapi_connection, connection_record):
+    """Make SQLite enforce foreign keys like Postgres does."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
 test_async_session = sessionmaker(
     bind=test_engine,
     class_=AsyncSession,
@@ -42,6 +68,7 @@ async def create_db():
 
     async with test_engine.begin() as con:
         await con.run_sync(Base.metadata.drop_all)
+        await con.run_sync(migrations_metadata.drop_all)
 
 
 @pytest_asyncio.fixture()
@@ -57,15 +84,88 @@ async def client(db_session):
     Create an HTTP client for testing a FastAPI application.
 
     Redefines the dependency of getting a database session to a test one.
+    Identities and feed pages cached by previous tests are dropped
+    with their database.
     """
+    identity_cache.clear()
+    await feed_cache.invalidate()
 
     async def override_get_session():
         yield db_session
 
     app.dependency_overrides[db.get_session] = override_get_session
+    app.dependency_overrides[db.get_read_session] = override_get_session
 
     async with AsyncClient(
         transport=ASGITransport(app=app),
         base_url="http://test",
     ) as client:
         yield client
+
+
+@pytest.fixture()
+def query_budget():
+    """
+    Assert the number of SQL statements executed within a block.
+
+    Usage: ``with query_budget(3): await client.get(...)``
+    """
+
+    @contextmanager
+    def budget(max_statements: int):
+        with track_queries() as stats:
+            yield stats
+        repeated = "\n".join(
+            f"{count} x {statement}" for statement, count in stats.by_sql.most_common()
+        )
+        assert stats.statements <= max_statements, (
+            f"{stats.statements} statements over the budget of {max_statements}:\n"
+            f"{repeated}"
+        )
+
+    return budget
+
+
+@pytest_asyncio.fixture()
+async def fanout_worker(create_db, monkeypatch):
+    """
+    Start the timeline fan-out worker on the test database.
+
+    Uses the SQL timeline store and treats users with more than one
+    follower as celebrities.
+    """
+    monkeypatch.setattr(timeline_fanout, "store", SQLTimelineStore())
+    monkeypatch.setattr(timeline_fanout, "session_factory", test_async_session)
+    monkeypatch.setattr(timeline_fanout, "follower_threshold", 1)
+    monkeypatch.setattr(timeline_fanout, "enabled", True)
+    await timeline_fanout.start()
+
+    yield timeline_fanout
+
+    await timeline_fanout.stop()
+
+
+@pytest_asyncio.fixture()
+async def media_dir(tmp_path, monkeypatch):
+    """Store uploaded media in a temporary directory."""
+    monkeypatch.setattr(media_config, "upload_dir", str(tmp_path))
+    yield tmp_path
+    image_processor.shutdown()
+
+
+@pytest_asyncio.fixture()
+async def media_sweeper(create_db, media_dir):
+    """Create a media sweeper of the test database and upload directory."""
+    yield MediaSweeper(
+        storage=media_storage,
+        session_factory=test_async_session,
+        config=media_config,
+    )
+
+
+@pytest_asyncio.fixture()
+async def events(create_db):
+    """Start the event bus with the in-process backend."""
+    await event_bus.start()
+    yield event_bus
+    await event_bus.stop()
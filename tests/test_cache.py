@@ -0,0 +1,74 @@
+"""
+Tests for in-process caches.
+
+This module contains tests for:
+- Expiration and eviction of cache entries
+- Invalidation of cached identities
+- Authorization through the identity cache
+"""
+
+from http import HTTPStatus
+from types import MappingProxyType
+
+from httpx import AsyncClient
+
+from app.services.cache import IdentityCache, TTLCache, UserIdentity, identity_cache
+
+API_HEADER = MappingProxyType({"api-key": "test"})
+
+
+class FakeClock:
+    """Manually advanced clock."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ttl_cache_expiration_and_eviction():
+    """Test that entries expire after the TTL and the least recently used is evicted."""
+    clock = FakeClock()
+    cache = TTLCache(max_size=2, ttl=10, clock=clock)
+    cache.set("first", 1)
+    cache.set("second", 2)
+    assert cache.get("first") == 1
+
+    cache.set("third", 3)
+    assert cache.get("second") is None
+    assert cache.get("first") == 1
+
+    clock.now = 10
+    assert cache.get("first") is None
+    assert len(cache) == 1
+
+
+def test_identity_cache_invalidation():
+    """Test invalidation of identities by API key and by user ID."""
+    cache = IdentityCache(max_size=10, ttl=60)
+    cache.set("key1", UserIdentity(id=1, name="User1"))
+    cache.set("key2", UserIdentity(id=1, name="User1"))
+    cache.set("key3", UserIdentity(id=3, name="User3"))
+
+    cache.invalidate("key3")
+    assert cache.get("key3") is None
+
+    cache.invalidate_user(1)
+    assert cache.get("key1") is None
+    assert cache.get("key2") is None
+
+
+async def test_identity_is_cached(client: AsyncClient):
+    """
+    Test that the API key is resolved once and then served from the cache.
+
+    :param client: Async test client for API interaction
+    """
+    response = await client.post("/api/tweets/1/likes", headers=API_HEADER)
+    assert response.status_code == HTTPStatus.OK
+    assert identity_cache.get("test") == UserIdentity(id=3, name="User3")
+
+    response = await client.post("/api/tweets/1/likes", headers={"api-key": "fail"})
+    assert response.status_code == HTTPStatus.NOT_FOUND
+    assert identity_cache.get("fail") is None
@@ -0,0 +1,63 @@
+"""
+Tests for database settings.
+
+This module contains tests for:
+- Reading the configuration from the environment
+- Checkout metrics of the connection pool
+"""
+
+import pytest
+from sqlalchemy import make_url, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.db.db_settings import DatabaseConfig
+from app.db.pool import InstrumentedPool
+
+
+def test_config_from_environment(monkeypatch):
+    """
+    Test that settings are read from 'DB_' variables.
+
+    :param monkeypatch: Pytest fixture for patching the environment
+    """
+    monkeypatch.setenv("DB_HOST", "db")
+    monkeypatch.setenv("DB_POOL_SIZE", "20")
+    monkeypatch.setenv("DB_STATEMENT_CACHE_SIZE", "0")
+
+    config = DatabaseConfig(_env_file=None)
+    assert config.pool_size == 20
+    assert config.echo is False
+    assert config.url.host == "db"
+    assert config.url.query["prepared_statement_cache_size"] == "0"
+
+    options = config.engine_options(config.url)
+    assert options["pool_size"] == 20
+    assert "pool_size" not in config.engine_options(make_url("sqlite+aiosqlite://"))
+
+
+async def test_pool_stats(tmp_path):
+    """
+    Test that checkouts, waits and timeouts of the pool are counted.
+
+    :param tmp_path: Pytest fixture with a temporary directory
+    """
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}",
+        poolclass=InstrumentedPool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.1,
+    )
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+        assert engine.pool.snapshot()["checked_out"] == 1
+        with pytest.raises(PoolTimeoutError):
+            await engine.connect().start()
+
+    stats = engine.pool.snapshot()
+    assert stats["checkouts"] == 1
+    assert stats["timeouts"] == 1
+    assert stats["checked_out"] == 0
+    assert stats["wait_seconds_max"] < 0.1
+    await engine.dispose()
@@ -0,0 +1,180 @@
+"""
+Tests for realtime events.
+
+This module contains tests for:
+- Delivering events to the followers of the author
+- Closing subscriptions which do not keep up
+- Changing the followed authors of subscriptions on follows
+- Publishing events from the CRUD functions
+- Encoding events as Server-Sent Events
+- Opening streams with short-lived tokens
+"""
+
+from http import HTTPStatus
+from types import MappingProxyType
+
+from httpx import AsyncClient
+
+from app.routes.api_stream import (
+    create_stream_token,
+    event_stream,
+    verify_stream_token,
+)
+from app.services.events import (
+    LIKE_CHANGED,
+    TWEET_CREATED,
+    TWEET_DELETED,
+    USER_FOLLOWED,
+    USER_UNFOLLOWED,
+    Event,
+    EventBus,
+    LocalEventBackend,
+)
+
+API_HEADER = MappingProxyType({"api-key": "test"})
+
+
+async def test_dispatch_to_followers():
+    """Test that subscriptions receive events of the followed authors only."""
+    bus = EventBus(LocalEventBackend(), queue_size=2)
+    await bus.start()
+    follower = bus.subscribe(user_id=1, author_ids=[2])
+    stranger = bus.subscribe(user_id=3, author_ids=[])
+
+    event = Event(TWEET_CREATED, tweet_id=10, author_id=2)
+    await bus.publish(event)
+    assert await follower.get(timeout=1) == event
+    assert stranger._queue.empty()
+
+    await bus.publish(Event(TWEET_CREATED, tweet_id=11, author_id=3))
+    assert (await stranger.get(timeout=1)).tweet_id == 11
+
+    for tweet_id in range(3):
+        await bus.publish(Event(TWEET_CREATED, tweet_id=tweet_id, author_id=2))
+    assert follower.overflowed
+    assert follower not in bus.subscriptions
+    assert [await follower.get(timeout=1) for _ in range(2)] == [
+        Event(TWEET_CREATED, tweet_id=1, author_id=2),
+        None,
+    ]
+
+    await bus.stop()
+    assert await stranger.get(timeout=1) is None
+    assert not bus.subscriptions
+
+
+async def test_follow_events():
+    """Test that follows change the authors of the follower's subscriptions."""
+    bus = EventBus(LocalEventBackend(), queue_size=2)
+    await bus.start()
+    follower = bus.subscribe(user_id=1, author_ids=[2])
+
+    await bus.publish(Event(USER_FOLLOWED, None, author_id=4, user_id=1))
+    await bus.publish(Event(USER_UNFOLLOWED, None, author_id=2, user_id=1))
+    assert follower.author_ids == {1, 4}
+    assert follower._queue.empty()
+
+    await bus.publish(Event(TWEET_CREATED, tweet_id=10, author_id=2))
+    await bus.publish(Event(TWEET_CREATED, tweet_id=11, author_id=4))
+    assert (await follower.get(timeout=1)).tweet_id == 11
+    assert follower._queue.empty()
+
+    await bus.stop()
+
+
+async def test_crud_follow_events(client: AsyncClient, events):
+    """
+    Test that following and unfollowing refreshes the open subscriptions.
+
+    :param client: Async test client for API interaction
+    :param events: The started event bus
+    """
+    subscription = events.subscribe(user_id=3, author_ids=[2])
+
+    await client.post("/api/users/1/follow", headers=API_HEADER)
+    assert subscription.author_ids == {1, 2, 3}
+    await client.delete("/api/users/2/follow", headers=API_HEADER)
+    assert subscription.author_ids == {1, 3}
+    events.unsubscribe(subscription)
+
+
+async def test_crud_events(client: AsyncClient, events):
+    """
+    Test that creating and deleting tweets and likes publishes events.
+
+    :param client: Async test client for API interaction
+    :param events: The started event bus
+    """
+    subscription = events.subscribe(user_id=1, author_ids=[3])
+
+    response = await client.post(
+        "/api/tweets", headers=API_HEADER, json={"tweet_data": "New tweet"}
+    )
+    tweet_id = response.json()["tweet_id"]
+    await client.post(f"/api/tweets/{tweet_id}/likes", headers=API_HEADER)
+    await client.delete(f"/api/tweets/{tweet_id}/likes", headers=API_HEADER)
+    await client.delete(f"/api/tweets/{tweet_id}", headers=API_HEADER)
+
+    received = [await subscription.get(timeout=1) for _ in range(4)]
+    assert received == [
+        Event(TWEET_CREATED, tweet_id, author_id=3),
+        Event(LIKE_CHANGED, tweet_id, author_id=3, user_id=3, like_count=1),
+        Event(LIKE_CHANGED, tweet_id, author_id=3, user_id=3, like_count=0),
+        Event(TWEET_DELETED, tweet_id, author_id=3),
+    ]
+    events.unsubscribe(subscription)
+
+
+async def test_event_stream(events):
+    """
+    Test the encoding of the stream.
+
+    :param events: The started event bus
+    """
+    stream = event_stream(user_id=1, author_ids=[2])
+    assert await stream.__anext__() == b"retry: 3000\n\n"
+
+    await events.publish(Event(TWEET_DELETED, tweet_id=5, author_id=2))
+    assert await stream.__anext__() == (
+        b"event: tweet_deleted\n"
+        b'data: {"type":"tweet_deleted","tweet_id":5,"author_id":2,'
+        b'"user_id":null,"like_count":null}\n\n'
+    )
+
+    await stream.aclose()
+    assert not events.subscriptions
+
+
+async def test_stream_unknown_user(client: AsyncClient):
+    """
+    Test that a stream is not opened for an unknown API key.
+
+    :param client: Async test client for API interaction
+    """
+    response = await client.get("/api/stream", headers={"api-key": "unknown"})
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+async def test_stream_token(client: AsyncClient, db_session):
+    """
+    Test that streams are opened with valid tokens only.
+
+    :param client: Async test client for API interaction
+    :param db_session: Database session of the test
+    """
+    response = await client.post("/api/stream/token", headers=API_HEADER)
+    assert response.status_code == HTTPStatus.OK
+    token = response.json()["token"]
+    assert "test" not in token
+    assert await verify_stream_token(db_session, token) == 3
+
+    user_id, expires, signature = token.split(".")
+    invalid_tokens = (
+        None,
+        "garbage",
+        f"1.{expires}.{signature}",
+        create_stream_token(3, "test", ttl=-1),
+    )
+    for invalid_token in invalid_tokens:
+        response = await client.get("/api/stream", params={"token": invalid_token})
+        assert response.status_code == HTTPStatus.FORBIDDEN
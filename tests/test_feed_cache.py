@@ -0,0 +1,162 @@
+"""
+Tests for the feed cache.
+
+This module contains tests for:
+- Serving cached pages and invalidating them by writes
+- Pages of workers which missed a write
+- The Redis backend against a local fake
+- Reading from the database when the backend fails
+"""
+
+from http import HTTPStatus
+from types import MappingProxyType
+
+from httpx import AsyncClient
+
+from app.routes import api_tweets
+from app.routes.crud import crud_tweets
+from app.services.feed_cache import (
+    FeedCache,
+    MemoryFeedBackend,
+    RedisFeedBackend,
+    feed_cache,
+)
+
+API_HEADER = MappingProxyType({"api-key": "test"})
+
+
+class FakeRedis:
+    """The part of the Redis client used by the feed cache."""
+
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, px=None):
+        self.values[key] = value
+
+    async def incr(self, key):
+        self.values[key] = int(self.values.get(key, 0)) + 1
+        return self.values[key]
+
+
+class BrokenRedis(FakeRedis):
+    """A Redis client whose server is down."""
+
+    async def get(self, key):
+        raise ConnectionRefusedError
+
+
+async def test_feed_cache_invalidation(client: AsyncClient):
+    """
+    Test that pages are cached until a tweet or a like changes the feed.
+
+    :param client: Async test client for API interaction
+    """
+    first = await client.get("/api/tweets", headers=API_HEADER)
+    hits, misses = feed_cache.hits, feed_cache.misses
+    assert (await client.get("/api/tweets", headers=API_HEADER)).json() == first.json()
+    assert (feed_cache.hits, feed_cache.misses) == (hits + 1, misses)
+
+    await client.post("/api/tweets/2/likes", headers=API_HEADER)
+    tweets = (await client.get("/api/tweets", headers=API_HEADER)).json()["tweets"]
+    assert tweets[1]["like_count"] == first.json()["tweets"][1]["like_count"] + 1
+    await client.delete("/api/tweets/2/likes", headers=API_HEADER)
+    assert (await client.get("/api/tweets", headers=API_HEADER)).json() == first.json()
+
+    await client.post(
+        "/api/tweets", headers=API_HEADER, json={"tweet_data": "New tweet"}
+    )
+    tweets = (await client.get("/api/tweets", headers=API_HEADER)).json()["tweets"]
+    assert tweets[0]["content"] == "New tweet"
+    assert feed_cache.misses == misses + 3
+
+
+async def test_stale_worker(client: AsyncClient, monkeypatch):
+    """
+    Test that a worker whose cache missed a write sends the current page.
+
+    Each worker has its own in-process cache, only the worker taking a write
+    invalidates it. Pages are cached under their version stamp, so the stale
+    page is not read again.
+
+    :param client: Async test client for API interaction
+    :param monkeypatch: Pytest fixture for patching attributes
+    """
+    first_worker = FeedCache(MemoryFeedBackend(max_size=10, ttl=30))
+    second_worker = FeedCache(MemoryFeedBackend(max_size=10, ttl=30))
+
+    monkeypatch.setattr(api_tweets, "feed_cache", first_worker)
+    stale = await client.get("/api/tweets", headers=API_HEADER)
+
+    monkeypatch.setattr(api_tweets, "feed_cache", second_worker)
+    monkeypatch.setattr(crud_tweets, "feed_cache", second_worker)
+    await client.post(
+        "/api/tweets", headers=API_HEADER, json={"tweet_data": "New tweet"}
+    )
+    fresh = await client.get("/api/tweets", headers=API_HEADER)
+    assert fresh.headers["ETag"] != stale.headers["ETag"]
+
+    monkeypatch.setattr(api_tweets, "feed_cache", first_worker)
+    conditional = {**API_HEADER, "If-None-Match": stale.headers["ETag"]}
+    response = await client.get("/api/tweets", headers=conditional)
+    assert response.status_code == HTTPStatus.OK
+    assert response.content == fresh.content
+    assert response.headers["ETag"] == fresh.headers["ETag"]
+
+
+async def test_not_modified_without_loading(client: AsyncClient, monkeypatch):
+    """
+    Test that a matching ETag is answered without loading the page.
+
+    :param client: Async test client for API interaction
+    :param monkeypatch: Pytest fixture for patching the feed query
+    """
+    monkeypatch.setattr(
+        api_tweets, "feed_cache", FeedCache(MemoryFeedBackend(10, 30), enabled=False)
+    )
+    etag = (await client.get("/api/tweets", headers=API_HEADER)).headers["ETag"]
+
+    async def fail(*args, **kwargs):
+        raise AssertionError("The page was loaded")
+
+    monkeypatch.setattr(api_tweets, "get_all_tweets", fail)
+    conditional = {**API_HEADER, "If-None-Match": etag}
+    response = await client.get("/api/tweets", headers=conditional)
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+
+async def test_redis_backend():
+    """Test that the Redis backend keeps pages per generation."""
+    cache = FeedCache(RedisFeedBackend(FakeRedis(), ttl=30))
+    loads = []
+
+    async def load() -> bytes:
+        loads.append(1)
+        return b"page"
+
+    assert await cache.get_or_load("20::", load) == b"page"
+    assert await cache.get_or_load("20::", load) == b"page"
+    assert len(loads) == 1
+
+    await cache.invalidate()
+    assert await cache.get_or_load("20::", load) == b"page"
+    assert len(loads) == 2
+    assert set(cache.backend.client.values) == {
+        "feed:generation",
+        "feed:0:20::",
+        "feed:1:20::",
+    }
+
+
+async def test_broken_backend():
+    """Test that pages are loaded from the database when the backend fails."""
+    cache = FeedCache(RedisFeedBackend(BrokenRedis(), ttl=30))
+
+    async def load() -> bytes:
+        return b"page"
+
+    assert await cache.get_or_load("20::", load) == b"page"
+    assert cache.misses == 0
@@ -0,0 +1,82 @@
+"""
+Tests for the synthetic data generator.
+
+This module contains tests for:
+- Generating data next to existing rows with consistent counters
+- Reproducing the same data from the same seed
+- Fanning out the generated tweets to the timelines
+"""
+
+from sqlalchemy import func, select
+
+from app.db.counters import repair_counters
+from app.db.models import Follow, Tweet, User
+from app.routes.crud.crud_tweets import get_following_tweets
+from app.routes.crud.generate_data import DataGenerator, GenerationParams, generate_data
+from app.services.timeline import SQLTimelineStore, timeline_fanout
+
+FIRST_IDS = {"users": 1, "tweets": 1}
+
+
+async def test_generate_data(db_session):
+    """
+    Test that the generated rows follow the existing ones and the counters match.
+
+    :param db_session: Session of the test database with the initial data
+    """
+    params = GenerationParams(users=200, tweets=500, batch_size=64)
+    inserted = await generate_data(db_session, params)
+
+    assert inserted["users"] == 200
+    assert inserted["tweets"] == 500
+    assert inserted["follows"] > 0
+    assert inserted["likes"] > 0
+    assert 0 < inserted["images"] < 500
+    assert await db_session.scalar(select(func.count(User.id))) == 203
+    assert await db_session.scalar(select(func.max(Tweet.id))) == 503
+
+    # Followers of the most popular user are far above the mean.
+    most_followed = await db_session.scalar(select(func.max(User.followers_count)))
+    assert most_followed > params.follows_per_user * 3
+    assert await repair_counters(db_session) == 0
+
+
+def test_same_seed_same_data():
+    """Test that a seed reproduces the generated rows."""
+    params = GenerationParams(users=50, tweets=100)
+    first = DataGenerator(params, dict(FIRST_IDS))
+    second = DataGenerator(params, dict(FIRST_IDS))
+
+    for table_name in ("follows", "tweets", "likes", "images"):
+        # Rows end with the creation and update times.
+        first_rows = [row[:-2] for row in getattr(first, table_name)()]
+        second_rows = [row[:-2] for row in getattr(second, table_name)()]
+        assert first_rows == second_rows
+
+
+async def test_generate_fanned_out(db_session, monkeypatch):
+    """
+    Test that the generated tweets are in the timelines with fan-out enabled.
+
+    :param db_session: Session of the test database with the initial data
+    :param monkeypatch: Pytest fixture for patching the fan-out settings
+    """
+    monkeypatch.setattr(timeline_fanout, "store", SQLTimelineStore())
+    monkeypatch.setattr(timeline_fanout, "enabled", True)
+    monkeypatch.setattr(timeline_fanout, "follower_threshold", 5)
+    params = GenerationParams(users=50, tweets=200, batch_size=64)
+    inserted = await generate_data(db_session, params)
+    assert inserted["timeline_entries"] > 0
+    assert await db_session.scalar(select(func.count()).where(Tweet.fanned_out))
+
+    reader_id = await db_session.scalar(
+        select(Follow.follower_id)
+        .group_by(Follow.follower_id)
+        .order_by(func.count().desc(), Follow.follower_id)
+        .limit(1)
+    )
+    materialized, _ = await get_following_tweets(db_session, reader_id, limit=50)
+    monkeypatch.setattr(timeline_fanout, "enabled", False)
+    pulled, _ = await get_following_tweets(db_session, reader_id, limit=50)
+    assert [tweet["id"] for tweet in materialized] == [tweet["id"] for tweet in pulled]
+    assert pulled
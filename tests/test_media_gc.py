@@ -0,0 +1,138 @@
+"""
+Tests for garbage collection of media.
+
+This module contains tests for:
+- Deleting images which were never attached to a tweet
+- Deleting files of deleted tweets, keeping shared files
+- Dry runs
+- Keeping files which a concurrent upload reuses
+"""
+
+import asyncio
+from datetime import timedelta
+from types import MappingProxyType
+
+from httpx import AsyncClient
+from sqlalchemy import func, select, update
+
+from app.db.base_model import utc_now
+from app.db.models import Image
+from app.routes.crud import crud_images
+
+API_HEADER = MappingProxyType({"api-key": "test"})
+
+
+async def upload(client: AsyncClient, content: bytes) -> int:
+    """Upload a file and return its media ID."""
+    response = await client.post(
+        "/api/medias",
+        headers=API_HEADER,
+        files={"file": ("image.png", content, "image/png")},
+    )
+    return response.json()["media_id"]
+
+
+def stored_files(media_dir):
+    """Return the files in the upload directory and its shards."""
+    return [path for path in media_dir.rglob("*") if path.is_file()]
+
+
+async def test_media_sweep(client: AsyncClient, db_session, media_dir, media_sweeper):
+    """
+    Test that orphaned images and files of deleted tweets are removed.
+
+    - A dry run changes nothing
+    - Orphaned images are deleted after the TTL, their files unless shared
+    - Files of a deleted tweet are deleted
+
+    :param client: Async test client for API interaction
+    :param db_session: Session of the test database
+    :param media_dir: Temporary upload directory
+    :param media_sweeper: Sweeper of the test database
+    """
+    await upload(client, b"orphan")
+    attached_id = await upload(client, b"attached")
+    await upload(client, b"attached")
+    response = await client.post(
+        "/api/tweets",
+        headers=API_HEADER,
+        json={"tweet_data": "with image", "tweet_media_ids": [attached_id]},
+    )
+    tweet_id = response.json()["tweet_id"]
+
+    assert (await media_sweeper.sweep()).orphaned_images == 0
+    await db_session.execute(
+        update(Image).values(created_at=utc_now() - timedelta(days=2))
+    )
+    await db_session.commit()
+
+    dry_run = await media_sweeper.sweep(dry_run=True)
+    assert dry_run.orphaned_images == 2
+    assert len(stored_files(media_dir)) == 2
+
+    result = await media_sweeper.sweep()
+    assert (result.orphaned_images, result.deleted_files, result.kept_files) == (
+        2,
+        1,
+        1,
+    )
+    assert len(stored_files(media_dir)) == 1
+
+    await client.delete(f"/api/tweets/{tweet_id}", headers=API_HEADER)
+    result = await media_sweeper.sweep()
+    assert (result.orphaned_images, result.deleted_files, result.kept_files) == (
+        0,
+        1,
+        0,
+    )
+    assert stored_files(media_dir) == []
+    assert media_sweeper.metrics()["deleted_files"] == 2
+
+
+async def test_sweep_during_upload(
+    client: AsyncClient, db_session, media_dir, media_sweeper, monkeypatch
+):
+    """
+    Test that a sweep does not delete a file which a concurrent upload reuses.
+
+    The upload finds an orphaned image with the same content, then the sweeper
+    deletes that image and records its file before the upload commits.
+
+    :param client: Async test client for API interaction
+    :param db_session: Session of the test database
+    :param media_dir: Temporary upload directory
+    :param media_sweeper: Sweeper of the test database
+    :param monkeypatch: Pytest fixture for patching the upload
+    """
+    await upload(client, b"shared")
+    await db_session.execute(
+        update(Image).values(created_at=utc_now() - timedelta(days=2))
+    )
+    await db_session.commit()
+
+    find_image = crud_images._find_image_by_content
+    sweeps = []
+
+    async def find_during_sweep(session, sha256):
+        known = await find_image(session, sha256)
+        sweeps.append(asyncio.create_task(media_sweeper.sweep()))
+        # Wait until the sweeper deleted the orphaned image.
+        async with media_sweeper.session_factory() as sweeper_session:
+            for _ in range(100):
+                if not await sweeper_session.scalar(select(func.count(Image.id))):
+                    break
+                await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        return known
+
+    monkeypatch.setattr(crud_images, "_find_image_by_content", find_during_sweep)
+    media_id = await upload(client, b"shared")
+
+    result = await sweeps[0]
+    assert (result.orphaned_images, result.deleted_files, result.kept_files) == (
+        1,
+        0,
+        1,
+    )
+    path = await db_session.scalar(select(Image.path).where(Image.id == media_id))
+    assert (media_dir / path.split("/", 1)[1]).is_file()
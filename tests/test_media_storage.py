@@ -0,0 +1,72 @@
+"""
+Tests for media storage backends.
+
+This module contains tests for:
+- Storing, checking and deleting files on the local disk
+- The S3 backend against a moto stand-in, including multipart uploads
+"""
+
+import pytest
+
+from app.services.media.config import MEGABYTE, MediaConfig
+from app.services.media.storage import LocalDiskStorage, S3Storage
+
+
+async def test_local_disk_storage(tmp_path):
+    """
+    Test that the local backend moves files into the upload directory.
+
+    :param tmp_path: Pytest fixture with a temporary directory
+    """
+    storage = LocalDiskStorage(
+        MediaConfig(_env_file=None, upload_dir=str(tmp_path / "images"))
+    )
+    source = tmp_path / "upload.part"
+    source.write_bytes(b"image")
+
+    await storage.store(str(source), "ab/cd/abcd.jpg")
+    assert not source.exists()
+    assert (tmp_path / "images" / "ab" / "cd" / "abcd.jpg").read_bytes() == b"image"
+    assert await storage.exists("ab/cd/abcd.jpg")
+    assert storage.url("ab/cd/abcd.jpg") == "images/ab/cd/abcd.jpg"
+
+    await storage.delete("ab/cd/abcd.jpg")
+    await storage.delete("ab/cd/abcd.jpg")
+    assert not await storage.exists("ab/cd/abcd.jpg")
+
+
+async def test_s3_storage(tmp_path):
+    """
+    Test the S3 backend with a file large enough for a multipart upload.
+
+    :param tmp_path: Pytest fixture with a temporary directory
+    """
+    pytest.importorskip("boto3")
+    moto = pytest.importorskip("moto")
+
+    config = MediaConfig(
+        _env_file=None,
+        storage_backend="s3",
+        s3_bucket="media",
+        s3_region="us-east-1",
+        s3_access_key_id="test",
+        s3_secret_access_key="test",
+        s3_multipart_threshold=5 * MEGABYTE,
+        s3_multipart_chunk_size=5 * MEGABYTE,
+    )
+    source = tmp_path / "upload.part"
+    source.write_bytes(b"x" * (6 * MEGABYTE))
+
+    with moto.mock_aws():
+        storage = S3Storage(config)
+        storage.client.create_bucket(Bucket="media")
+
+        await storage.store(str(source), "ab/cd/abcd.jpg")
+        assert await storage.exists("ab/cd/abcd.jpg")
+        head = storage.client.head_object(Bucket="media", Key="images/ab/cd/abcd.jpg")
+        assert head["ContentType"] == "image/jpeg"
+        assert head["ContentLength"] == 6 * MEGABYTE
+        assert head["ETag"].endswith('-2"')
+
+        await storage.delete("ab/cd/abcd.jpg")
+        assert not await storage.exists("ab/cd/abcd.jpg")
@@ -0,0 +1,163 @@
+"""
+Tests for the metrics of the application.
+
+This module contains tests for:
+- Metrics of HTTP requests by route and status code
+- Not recording the event stream
+- Metrics of uploads, caches and background workers
+- The Prometheus text format of histograms and collected samples
+- Serving the metrics only when they are enabled
+"""
+
+from http import HTTPStatus
+from types import MappingProxyType
+
+import pytest
+from httpx import AsyncClient
+
+from app.services.metrics import (
+    Histogram,
+    MetricsRegistry,
+    http_request_duration,
+    http_requests,
+    metrics_config,
+)
+
+API_HEADER = MappingProxyType({"api-key": "test"})
+
+
+@pytest.fixture(autouse=True)
+def metrics_enabled(monkeypatch):
+    """Serve the metrics endpoint."""
+    monkeypatch.setattr(metrics_config, "enabled", True)
+
+
+def sample(text: str, prefix: str) -> float:
+    """
+    Return the value of the first sample starting with the prefix.
+
+    :param text: Metrics in the Prometheus text format
+    :param prefix: Name and labels of the sample
+    :return: The value
+    """
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"No sample {prefix}")
+
+
+async def test_request_metrics(client: AsyncClient):
+    """
+    Test that requests are counted by their route template and status code.
+
+    :param client: Async test client for API interaction
+    """
+    route = ("GET", "/api/users/{user_id}", "200")
+    before = http_requests.values.get(route, 0)
+    for user_id in (1, 2):
+        await client.get(f"/api/users/{user_id}")
+    await client.get("/api/users/9999")
+    await client.get("/no/such/path")
+
+    response = await client.get("/metrics")
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    labels = 'method="GET",route="/api/users/{user_id}"'
+    assert sample(text, f"http_requests_total{{{labels},status=") == before + 2
+    assert f'http_requests_total{{{labels},status="404"}}' in text
+    assert 'route="unmatched",status="404"' in text
+    assert sample(text, f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}}')
+    # The scrape itself is in flight.
+    assert sample(text, "http_requests_in_flight") == 1
+
+
+async def test_stream_not_recorded(client: AsyncClient):
+    """
+    Test that the event stream is not recorded as a request.
+
+    :param client: Async test client for API interaction
+    """
+    response = await client.get("/api/stream")
+
+    assert response.status_code == HTTPStatus.FORBIDDEN
+    assert not any("/api/stream" in route for _, route, _ in http_requests.values)
+    assert not any("/api/stream" in route for _, route in http_request_duration.values)
+    text = (await client.get("/metrics")).text
+    assert "/api/stream" not in text
+    assert sample(text, "http_requests_in_flight") == 1
+
+
+async def test_component_metrics(client: AsyncClient, media_dir):
+    """
+    Test the metrics of uploads, caches and the media sweeper.
+
+    :param client: Async test client for API interaction
+    :param media_dir: Temporary upload directory
+    """
+    text = (await client.get("/metrics")).text
+    uploads = sample(text, "upload_size_bytes_count")
+    feed_hits = sample(text, 'cache_hits_total{cache="feed"}')
+
+    files = {"file": ("image.txt", b"not an image", "text/plain")}
+    await client.post("/api/medias", headers=API_HEADER, files=files)
+    for _ in range(2):
+        await client.get("/api/tweets", headers=API_HEADER)
+
+    text = (await client.get("/metrics")).text
+    assert sample(text, "upload_size_bytes_count") == uploads + 1
+    assert sample(text, 'upload_size_bytes_bucket{le="1024"}') >= 1
+    assert sample(text, 'cache_hits_total{cache="feed"}') == feed_hits + 1
+    assert 0 < sample(text, 'cache_hit_ratio{cache="feed"}') <= 1
+    assert "media_sweeper_runs_total 0" in text
+    assert "event_subscriptions 0" in text
+
+
+def test_histogram_format():
+    """Test that histogram buckets are cumulative and end with +Inf."""
+    histogram = Histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, '/a"b')
+
+    assert list(histogram.render()) == [
+        'latency_seconds_bucket{route="/a\\"b",le="0.1"} 2',
+        'latency_seconds_bucket{route="/a\\"b",le="1"} 3',
+        'latency_seconds_bucket{route="/a\\"b",le="+Inf"} 4',
+        'latency_seconds_sum{route="/a\\"b"} 3.65',
+        'latency_seconds_count{route="/a\\"b"} 4',
+    ]
+
+
+def test_collected_families():
+    """Test that samples of a family are rendered together under one header."""
+    registry = MetricsRegistry()
+    registry.add_collector(
+        lambda: [
+            ("hits_total", "counter", "Hits.", {"cache": "a"}, 1),
+            ("ratio", "gauge", "Ratio.", {"cache": "a"}, 0.5),
+            ("hits_total", "counter", "Hits.", {"cache": "b"}, 2),
+        ]
+    )
+
+    assert registry.render().splitlines() == [
+        "# HELP hits_total Hits.",
+        "# TYPE hits_total counter",
+        'hits_total{cache="a"} 1',
+        'hits_total{cache="b"} 2',
+        "# HELP ratio Ratio.",
+        "# TYPE ratio gauge",
+        'ratio{cache="a"} 0.5',
+    ]
+
+
+async def test_metrics_disabled(client: AsyncClient, monkeypatch):
+    """
+    Test that the metrics are not served unless they are enabled.
+
+    :param client: Async test client for API interaction
+    :param monkeypatch: Pytest fixture for patching the settings
+    """
+    monkeypatch.setattr(metrics_config, "enabled", False)
+    response = await client.get("/metrics")
+    assert response.status_code == HTTPStatus.NOT_FOUND
@@ -0,0 +1,95 @@
+"""
+Tests for schema migrations.
+
+This module contains tests for:
+- Upgrading a database created before the lookup indexes
+- Adding and repairing the denormalized counters
+"""
+
+import pytest
+from sqlalchemy import inspect, select, text
+from sqlalchemy.exc import IntegrityError
+
+from app.db.counters import repair_counters
+from app.db.migrations import MIGRATIONS, run_migrations
+from app.db.models import Like, Tweet, User
+
+
+async def test_migrations_upgrade_existing_database(create_db, db_session):
+    """
+    Test that migrations index an existing database.
+
+    - Duplicated likes are removed before the unique index is created
+    - Indexes declared on the models are created
+    - Applied migrations are not run again
+
+    :param create_db: Engine of the test database
+    :param db_session: Session of the test database
+    """
+    async with create_db.begin() as conn:
+        await conn.execute(text("DROP INDEX uq_likes_user_tweet"))
+        await conn.execute(text("DROP INDEX ix_tweets_created_at_id"))
+        await conn.execute(text("INSERT INTO likes (user_id, tweet_id) VALUES (1, 1)"))
+
+    applied = await run_migrations(create_db)
+    assert applied == [migration.version for migration in MIGRATIONS]
+    assert await run_migrations(create_db) == []
+
+    async with create_db.connect() as conn:
+        index_names = await conn.run_sync(
+            lambda sync_conn: {
+                index["name"]
+                for table in ("likes", "tweets")
+                for index in inspect(sync_conn).get_indexes(table)
+            },
+        )
+    assert {"uq_likes_user_tweet", "ix_tweets_created_at_id"} <= index_names
+
+    likes = (
+        (await db_session.execute(select(Like).where(Like.tweet_id == 1)))
+        .scalars()
+        .all()
+    )
+    assert len(likes) == 1
+
+    db_session.add(Like(user_id=1, tweet_id=1))
+    with pytest.raises(IntegrityError):
+        await db_session.commit()
+
+
+async def test_migrations_add_counters(create_db, db_session):
+    """
+    Test that the counters are added to an existing database and computed.
+
+    :param create_db: Engine of the test database
+    :param db_session: Session of the test database
+    """
+    async with create_db.begin() as conn:
+        await conn.execute(text("ALTER TABLE tweets DROP COLUMN like_count"))
+
+    await run_migrations(create_db)
+
+    like_counts = (
+        await db_session.execute(select(Tweet.like_count).order_by(Tweet.id))
+    ).scalars()
+    assert list(like_counts) == [1, 1, 1]
+
+
+async def test_repair_counters(create_db, db_session):
+    """
+    Test that the repair job fixes wrong counters only.
+
+    :param create_db: Engine of the test database
+    :param db_session: Session of the test database
+    """
+    async with create_db.begin() as conn:
+        await conn.execute(text("UPDATE tweets SET like_count = 5 WHERE id = 2"))
+        await conn.execute(text("UPDATE users SET followers_count = 0 WHERE id = 2"))
+
+    assert await repair_counters(db_session, batch_size=2) == 2
+    assert await repair_counters(db_session) == 0
+
+    assert await db_session.scalar(select(Tweet.like_count).where(Tweet.id == 2)) == 1
+    assert (
+        await db_session.scalar(select(User.followers_count).where(User.id == 2)) == 2
+    )
@@ -0,0 +1,131 @@
+"""
+Tests for the profiler of slow requests.
+
+This module contains tests for:
+- Access to the admin API
+- Profiling requests on the event loop and waiting for I/O
+- Keeping the latest profiles only
+- Refusing to enable the profiler where sampling is not supported
+"""
+
+import asyncio
+import threading
+import time
+from http import HTTPStatus
+from types import MappingProxyType
+
+import pytest
+from httpx import AsyncClient
+
+from app.routes import api_users
+from app.routes.api_admin import admin_config
+from app.services import profiler as profiler_module
+from app.services.profiler import ProfilerConfig, profiler
+
+ADMIN_HEADER = MappingProxyType({"admin-key": "secret"})
+
+
+@pytest.fixture()
+def profiled(tmp_path, monkeypatch):
+    """Enable the admin API and slow down the lookup of users."""
+    monkeypatch.setattr(admin_config, "api_key", "secret")
+    monkeypatch.setattr(
+        profiler,
+        "config",
+        ProfilerConfig(profile_dir=str(tmp_path), interval_ms=1, max_profiles=2),
+    )
+    get_user = api_users.get_user
+
+    async def slow_get_user(*args, **kwargs):
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+        await asyncio.sleep(0.05)
+        return await get_user(*args, **kwargs)
+
+    monkeypatch.setattr(api_users, "get_user", slow_get_user)
+    yield tmp_path
+
+
+async def test_admin_key(client: AsyncClient, monkeypatch):
+    """
+    Test that the admin API requires the configured key.
+
+    :param client: Async test client for API interaction
+    :param monkeypatch: Pytest fixture for patching attributes
+    """
+    response = await client.get("/api/admin/profiler", headers=ADMIN_HEADER)
+    assert response.status_code == HTTPStatus.FORBIDDEN
+
+    monkeypatch.setattr(admin_config, "api_key", "secret")
+    response = await client.get("/api/admin/profiler", headers={"admin-key": "fail"})
+    assert response.status_code == HTTPStatus.FORBIDDEN
+    response = await client.get("/api/admin/profiler", headers=ADMIN_HEADER)
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["enabled"] is False
+
+
+async def test_profile_slow_requests(client: AsyncClient, profiled):
+    """
+    Test profiling requests slower than the threshold.
+
+    - Fast requests and requests while disabled are not written
+    - Time on the event loop and time waiting are both sampled
+    - Only the latest profiles are kept
+
+    :param client: Async test client for API interaction
+    :param profiled: Directory of the profiles
+    """
+    await client.get("/api/users/1")
+    assert list(profiled.iterdir()) == []
+
+    settings = {"enabled": True, "slow_ms": 50}
+    response = await client.patch(
+        "/api/admin/profiler", headers=ADMIN_HEADER, json=settings
+    )
+    assert response.json()["enabled"] is True
+
+    await client.get("/api/tweets", headers={"api-key": "test"})
+    assert list(profiled.iterdir()) == []
+
+    for user_id in (1, 2, 3):
+        await client.get(f"/api/users/{user_id}")
+    profiles = (await client.get("/api/admin/profiler", headers=ADMIN_HEADER)).json()
+    assert len(profiles["profiles"]) == 2
+    assert profiles["profiles"][-1].endswith("_GET_api_users_user_id.folded")
+
+    response = await client.get(
+        f"/api/admin/profiler/profiles/{profiles['profiles'][-1]}",
+        headers=ADMIN_HEADER,
+    )
+    assert response.status_code == HTTPStatus.OK
+    stacks = [line.rsplit(" ", 1)[0].split(";") for line in response.text.splitlines()]
+    running = [stack for stack in stacks if stack[0] != "[await]"]
+    waiting = [stack for stack in stacks if stack[0] == "[await]"]
+    assert any(stack[-1].startswith("slow_get_user") for stack in running)
+    assert any(stack[-1].startswith("sleep") for stack in waiting)
+
+    response = await client.get(
+        "/api/admin/profiler/profiles/missing.folded", headers=ADMIN_HEADER
+    )
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+    profiler.stop()
+    assert "request-profiler" not in [thread.name for thread in threading.enumerate()]
+
+
+async def test_profiler_unsupported(client: AsyncClient, profiled, monkeypatch):
+    """
+    Test that the profiler is not enabled without the mapping of running tasks.
+
+    :param client: Async test client for API interaction
+    :param profiled: Directory of the profiles
+    :param monkeypatch: Pytest fixture for patching the check
+    """
+    monkeypatch.setattr(profiler_module, "sampling_supported", lambda: False)
+    response = await client.patch(
+        "/api/admin/profiler", headers=ADMIN_HEADER, json={"enabled": True}
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    response = await client.get("/api/admin/profiler", headers=ADMIN_HEADER)
+    assert response.json()["enabled"] is False
@@ -0,0 +1,136 @@
+"""
+Tests for the per-request statistics of SQL statements.
+
+This module contains tests for:
+- Budgets of SQL statements of the endpoints
+- Statistics sent as response headers in debug mode
+- Not tracking the event stream
+- Counting the fetched and changed rows
+- Reporting statements repeated within a request
+"""
+
+import logging
+from http import HTTPStatus
+from types import MappingProxyType
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import func, select, update
+
+from app.db.models import User
+from app.db.query_stats import (
+    QueryStatsConfig,
+    QueryStatsMiddleware,
+    report_n_plus_one,
+    track_queries,
+)
+from app.main import app
+from app.routes.crud.generate_data import GenerationParams, generate_data
+from app.services.cache import identity_cache
+from app.services.feed_cache import feed_cache
+
+API_HEADER = MappingProxyType({"api-key": "test"})
+
+# Statements of a request, including the lookup of the API key. They do
+# not depend on the number of rows, so a query per row fails the budget.
+BUDGETS = (
+    ("get", "/api/tweets", {}, 3),
+    ("get", "/api/tweets?feed=home", {}, 2),
+    ("get", "/api/tweets?feed=following", {}, 2),
+    ("get", "/api/users/me", {}, 2),
+    ("get", "/api/users/4", {}, 2),
+    ("post", "/api/tweets/5/likes", {}, 3),
+    ("delete", "/api/tweets/3/likes", {}, 3),
+    ("post", "/api/users/1/follow", {}, 3),
+    ("delete", "/api/users/2/follow", {}, 4),
+    ("post", "/api/tweets", {"json": {"tweet_data": "New tweet"}}, 2),
+    ("delete", "/api/tweets/3", {}, 9),
+)
+
+
+@pytest.mark.parametrize(("method", "url", "kwargs", "budget"), BUDGETS)
+async def test_query_budget(
+    client: AsyncClient, db_session, query_budget, method, url, kwargs, budget
+):
+    """
+    Test that an endpoint stays within its budget of statements.
+
+    The test user follows generated users, so the feeds and profiles
+    have many rows.
+
+    :param client: Async test client for API interaction
+    :param db_session: Session of the test database with the initial data
+    :param query_budget: Fixture asserting the number of statements
+    """
+    await generate_data(db_session, GenerationParams(users=20, tweets=40))
+    for user_id in range(4, 12):
+        await client.post(f"/api/users/{user_id}/follow", headers=API_HEADER)
+    identity_cache.clear()
+    await feed_cache.invalidate()
+
+    with query_budget(budget):
+        response = await client.request(method, url, headers=API_HEADER, **kwargs)
+
+    assert response.status_code == HTTPStatus.OK
+
+
+async def test_debug_headers(client: AsyncClient):
+    """
+    Test that the statistics are sent as headers in debug mode.
+
+    The event stream is not tracked.
+
+    :param client: Async test client for API interaction
+    """
+    debug_app = QueryStatsMiddleware(app, QueryStatsConfig(debug=True))
+    transport = ASGITransport(app=debug_app)
+    async with AsyncClient(transport=transport, base_url="http://test") as debug_client:
+        response = await debug_client.get("/api/users/1")
+        stream_response = await debug_client.get("/api/stream")
+
+    assert int(response.headers["x-db-queries"]) > 0
+    assert float(response.headers["x-db-time-ms"]) > 0
+    assert int(response.headers["x-db-rows"]) > 0
+    assert "x-db-queries" not in stream_response.headers
+
+    response = await client.get("/api/users/1")
+    assert "x-db-queries" not in response.headers
+
+
+async def test_report_n_plus_one(db_session, caplog):
+    """
+    Test that a statement repeated within a request is reported.
+
+    :param db_session: Session of the test database with the initial data
+    :param caplog: Pytest fixture capturing log records
+    """
+    with track_queries() as stats:
+        for user_id in range(1, 6):
+            await db_session.execute(select(User).where(User.id == user_id))
+
+    assert stats.statements == 5
+    with caplog.at_level(logging.WARNING):
+        report_n_plus_one(stats, "/api/users")
+    assert "Possible N+1 query in /api/users, executed 5 times" in caplog.text
+
+
+async def test_rows(db_session):
+    """
+    Test that the fetched and the changed rows are counted.
+
+    :param db_session: Session of the test database with the initial data
+    """
+    users = await db_session.scalar(select(func.count()).select_from(User))
+
+    with track_queries() as stats:
+        fetched = (await db_session.scalars(select(User))).all()
+    assert stats.rows == len(fetched) == users
+
+    with track_queries() as stats:
+        await db_session.execute(select(User).where(User.id == 1))
+    assert stats.rows == 1
+
+    with track_queries() as stats:
+        await db_session.execute(update(User).values(name=User.name))
+    assert stats.rows == users
+    await db_session.rollback()
@@ -0,0 +1,84 @@
+"""
+Tests for read replica routing.
+
+This module contains tests for:
+- Round-robin choice of replicas and their cooldown
+- Falling back to the primary
+- Reading own writes from the primary
+"""
+
+from fastapi import Request
+
+from app.db.db_settings import DatabaseConfig, DBSettings
+from app.db.routing import Replica, ReplicaRouter
+
+
+def make_request(method: str) -> Request:
+    """Build a request of the test user."""
+    return Request(
+        {"type": "http", "method": method, "headers": [(b"api-key", b"test")]}
+    )
+
+
+async def session_bind(dependency):
+    """Return the engine of the session yielded by a session dependency."""
+    session = await dependency.__anext__()
+    bind = session.bind
+    await dependency.aclose()
+    return bind
+
+
+def test_router_round_robin_and_cooldown():
+    """Test that replicas take turns and a failed one is skipped until its cooldown ends."""
+    now = [0.0]
+    first, second = Replica(None, None), Replica(None, None)
+    router = ReplicaRouter(
+        [first, second], cooldown=10, read_your_writes_window=5, clock=lambda: now[0]
+    )
+
+    assert router.candidates() == [first, second]
+    assert router.candidates() == [second, first]
+
+    router.mark_unhealthy(first)
+    assert router.candidates() == [second]
+    now[0] = 10
+    assert router.candidates() == [second, first]
+
+    router.record_write("test")
+    assert router.candidates("test") == []
+    assert router.candidates("key1") == [first, second]
+    now[0] = 15
+    assert router.candidates("test") == [second, first]
+
+
+async def test_read_session_routing(tmp_path):
+    """
+    Test that reads skip an unavailable replica and own writes are read from the primary.
+
+    :param tmp_path: Pytest fixture with a temporary directory
+    """
+    config = DatabaseConfig(
+        _env_file=None,
+        replica_urls=[
+            f"sqlite+aiosqlite:///{tmp_path / 'missing' / 'replica.db'}",
+            f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}",
+        ],
+    )
+    settings = DBSettings(
+        config=config, url=f"sqlite+aiosqlite:///{tmp_path / 'primary.db'}"
+    )
+    broken, replica = settings.router.replicas
+
+    assert (
+        await session_bind(settings.get_read_session(make_request("GET")))
+        is replica.engine
+    )
+    assert broken.unhealthy_until > 0
+
+    await session_bind(settings.get_session(make_request("POST")))
+    assert (
+        await session_bind(settings.get_read_session(make_request("GET")))
+        is settings.engine
+    )
+
+    await settings.dispose()
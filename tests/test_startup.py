@@ -0,0 +1,69 @@
+"""
+Tests for the application startup and the management commands.
+
+This module contains tests for:
+- Starting the application quickly without changing the database
+- Migrating, seeding and repairing a database from the command line
+"""
+
+import sqlite3
+import time
+
+from click.testing import CliRunner
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.cli import cli
+from app.db.db_settings import db_session as db
+from app.main import app
+
+MAX_BOOT_SECONDS = 1
+
+
+async def test_boot_time(monkeypatch):
+    """
+    Test that the application starts fast and leaves the database untouched.
+
+    :param monkeypatch: Pytest fixture for patching attributes
+    """
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    monkeypatch.setattr(db, "engine", engine)
+
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        boot_seconds = time.perf_counter() - started
+        async with engine.connect() as conn:
+            tables = await conn.run_sync(lambda c: inspect(c).get_table_names())
+
+    assert boot_seconds < MAX_BOOT_SECONDS
+    assert tables == []
+
+
+def test_cli_commands(tmp_path, monkeypatch):
+    """
+    Test the commands preparing a new database.
+
+    :param tmp_path: Pytest fixture with a temporary directory
+    :param monkeypatch: Pytest fixture for patching attributes
+    """
+    path = tmp_path / "cli.db"
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    monkeypatch.setattr(db, "engine", engine)
+    monkeypatch.setattr(
+        db,
+        "async_session",
+        sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False),
+    )
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ["migrate"])
+    assert result.exit_code == 0, result.output
+    assert runner.invoke(cli, ["migrate"]).output == "Applied migrations: none\n"
+
+    for _ in range(2):
+        assert runner.invoke(cli, ["seed"]).exit_code == 0
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT count(*) FROM users").fetchone() == (3,)
+
+    assert runner.invoke(cli, ["repair-counters"]).output == "Fixed rows: 0\n"
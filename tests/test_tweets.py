@@ -3,6 +3,13 @@ Tests for API tweets.
 
 This module contains tests for:
 - Get all tweets
+- Format of the feed
+- The feed without JSON aggregation
+- Conditional requests of the feed
+- Paginate tweets with cursors
+- Get the home timeline
+- Get the following timeline with and without fan-out
+- Keep the following timeline through follows and deleted tweets
 - Add a like
 - Delete a like
 - Create a tweet
@@ -13,6 +20,12 @@ from http import HTTPStatus
 from types import MappingProxyType
 
 from httpx import AsyncClient
+from sqlalchemy import delete
+
+from app.db.models import Tweet
+from app.db.schemas.tweet_schemas import TweetOut
+from app.routes.crud import crud_tweets
+from app.services.feed_cache import feed_cache
 
 API_HEADER = MappingProxyType({"api-key": "test"})
 
@@ -33,6 +46,223 @@ async def test_get_all_tweets(client: AsyncClient):
     assert len(data["tweets"]) == 3
 
 
+async def test_feed_format(client: AsyncClient):
+    """
+    Test that the directly encoded feed matches the response model.
+
+    :param client: Async test client for API interaction
+    """
+    response = await client.get("/api/tweets", headers=API_HEADER)
+    data = response.json()
+    TweetOut.model_validate(data)
+    assert data["tweets"][0] == {
+        "id": 3,
+        "content": "Third tweet",
+        "attachments": ["images/cosmos_3.jpeg"],
+        "thumbnails": ["images/cosmos_3.jpeg"],
+        "author": {"id": 3, "name": "User3"},
+        "likes": [{"user_id": 3, "name": "User3"}],
+        "like_count": 1,
+    }
+
+
+async def test_feed_without_json_aggregation(client: AsyncClient, monkeypatch):
+    """
+    Test that dialects without JSON aggregates get the same feed.
+
+    :param client: Async test client for API interaction
+    :param monkeypatch: Pytest fixture for patching attributes
+    """
+    aggregated = (await client.get("/api/tweets", headers=API_HEADER)).json()
+    monkeypatch.setattr(crud_tweets, "JSON_AGGREGATES", {})
+    flat = (await client.get("/api/tweets", headers=API_HEADER)).json()
+    assert flat == aggregated
+
+
+async def test_feed_etag(client: AsyncClient):
+    """
+    Test that an unchanged page is answered with 304 until a new tweet changes it.
+
+    :param client: Async test client for API interaction
+    """
+    response = await client.get("/api/tweets", headers=API_HEADER)
+    etag = response.headers["ETag"]
+    conditional = {**API_HEADER, "If-None-Match": f'"other", W/{etag}'}
+
+    response = await client.get("/api/tweets", headers=conditional)
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+    await client.post(
+        "/api/tweets", headers=API_HEADER, json={"tweet_data": "New tweet"}
+    )
+    response = await client.get("/api/tweets", headers=conditional)
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["ETag"] != etag
+
+
+async def test_tweets_pagination(client: AsyncClient):
+    """
+    Test keyset pagination of the tweet feed.
+
+    - Pages follow each other without gaps or duplicates
+    - The last page has no next cursor
+    - 'after' cursor returns newer tweets
+    - Invalid cursor is rejected
+
+    :param client: Async test client for API interaction
+    """
+    for number in range(3):
+        text = {"tweet_data": f"Paginated {number}"}
+        await client.post("/api/tweets", headers=API_HEADER, json=text)
+
+    response = await client.get("/api/tweets?limit=4", headers=API_HEADER)
+    assert response.status_code == HTTPStatus.OK
+    first_page = response.json()
+    assert [tweet["id"] for tweet in first_page["tweets"]] == [6, 5, 4, 3]
+    assert first_page["next_cursor"]
+
+    params = {"limit": 4, "before": first_page["next_cursor"]}
+    response = await client.get("/api/tweets", headers=API_HEADER, params=params)
+    second_page = response.json()
+    assert [tweet["id"] for tweet in second_page["tweets"]] == [2, 1]
+    assert second_page["next_cursor"] is None
+
+    params = {"limit": 1, "after": first_page["next_cursor"]}
+    response = await client.get("/api/tweets", headers=API_HEADER, params=params)
+    assert [tweet["id"] for tweet in response.json()["tweets"]] == [4]
+
+    params = {"before": "not-a-cursor"}
+    response = await client.get("/api/tweets", headers=API_HEADER, params=params)
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.json()["detail"]["error_message"] == "Invalid cursor"
+
+
+async def test_home_timeline(client: AsyncClient):
+    """
+    Test the home timeline.
+
+    - Only tweets of the followed users and own tweets are returned
+    - Tweets are ordered by the number of likes
+    - Cursors of the global feed are rejected
+
+    :param client: Async test client for API interaction
+    """
+    await client.post("/api/tweets/2/likes", headers={"api-key": "key1"})
+
+    params = {"feed": "home", "limit": 1}
+    response = await client.get("/api/tweets", headers=API_HEADER, params=params)
+    assert response.status_code == HTTPStatus.OK
+    first_page = response.json()
+    assert [tweet["id"] for tweet in first_page["tweets"]] == [2]
+
+    params["before"] = first_page["next_cursor"]
+    response = await client.get("/api/tweets", headers=API_HEADER, params=params)
+    second_page = response.json()
+    assert [tweet["id"] for tweet in second_page["tweets"]] == [3]
+    assert second_page["next_cursor"] is None
+
+    response = await client.get("/api/tweets?limit=1", headers=API_HEADER)
+    params["before"] = response.json()["next_cursor"]
+    response = await client.get("/api/tweets", headers=API_HEADER, params=params)
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+async def test_following_timeline(client: AsyncClient):
+    """
+    Test the following timeline read from the tweets table.
+
+    :param client: Async test client for API interaction
+    """
+    params = {"feed": "following"}
+    response = await client.get("/api/tweets", headers=API_HEADER, params=params)
+    assert response.status_code == HTTPStatus.OK
+    assert [tweet["id"] for tweet in response.json()["tweets"]] == [3, 2]
+
+
+async def test_following_timeline_fanout(client: AsyncClient, fanout_worker):
+    """
+    Test the following timeline materialized by the fan-out worker.
+
+    - Tweets of regular users are pushed to their followers
+    - Tweets of celebrities, own tweets and tweets written before fan-out
+      are pulled
+    - Deleted tweets are removed from the timelines
+
+    :param client: Async test client for API interaction
+    :param fanout_worker: Running fan-out worker
+    """
+    for api_key in ("test", "key2", "key1"):
+        text = {"tweet_data": f"Tweet of {api_key}"}
+        await client.post("/api/tweets", headers={"api-key": api_key}, json=text)
+        # The test database has a single connection, keep the worker off it
+        # while the next request runs.
+        await fanout_worker.drain()
+
+    params = {"feed": "following", "limit": 2}
+    response = await client.get("/api/tweets", headers=API_HEADER, params=params)
+    first_page = response.json()
+    assert [tweet["id"] for tweet in first_page["tweets"]] == [5, 4]
+
+    params["before"] = first_page["next_cursor"]
+    response = await client.get("/api/tweets", headers=API_HEADER, params=params)
+    assert [tweet["id"] for tweet in response.json()["tweets"]] == [3, 2]
+
+    params = {"feed": "following"}
+    user2_header = {"api-key": "key2"}
+    response = await client.get("/api/tweets", headers=user2_header, params=params)
+    assert [tweet["id"] for tweet in response.json()["tweets"]] == [6, 5, 2, 1]
+
+    await client.delete("/api/tweets/6", headers={"api-key": "key1"})
+    response = await client.get("/api/tweets", headers=user2_header, params=params)
+    assert [tweet["id"] for tweet in response.json()["tweets"]] == [5, 2, 1]
+
+
+async def test_following_timeline_fanout_changes(
+    client: AsyncClient, db_session, fanout_worker
+):
+    """
+    Test the materialized timeline through follows and deleted tweets.
+
+    - A new follower receives the fanned out tweets of the followed user
+    - Tweets stay in the timelines when their author crosses the threshold
+    - Tweets deleted without removing their entries do not shorten the page
+
+    :param client: Async test client for API interaction
+    :param db_session: Session of the test database
+    :param fanout_worker: Running fan-out worker
+    """
+    user1_header = {"api-key": "key1"}
+    user2_header = {"api-key": "key2"}
+    params = {"feed": "following"}
+
+    async def following_ids(headers, **extra):
+        response = await client.get(
+            "/api/tweets", headers=headers, params={**params, **extra}
+        )
+        return [tweet["id"] for tweet in response.json()["tweets"]]
+
+    for number in (4, 5):
+        text = {"tweet_data": f"Tweet {number}"}
+        await client.post("/api/tweets", headers=user1_header, json=text)
+        await fanout_worker.drain()
+
+    await client.post("/api/users/1/follow", headers=API_HEADER)
+    assert await following_ids(API_HEADER) == [5, 4, 3, 2, 1]
+
+    # User1 has two followers now, so the next tweet is pulled.
+    await client.post("/api/tweets", headers=user1_header, json={"tweet_data": "6"})
+    await fanout_worker.drain()
+    await client.delete("/api/users/1/follow", headers=API_HEADER)
+    assert await following_ids(user2_header) == [6, 5, 4, 2, 1]
+
+    # Another worker deleted the tweets, its timelines still have them.
+    await db_session.execute(delete(Tweet).where(Tweet.id.in_((5, 6))))
+    await db_session.commit()
+    assert await following_ids(user2_header, limit=2) == [4, 2]
+
+
 async def test_like_tweet(client: AsyncClient):
     """
     Test liking a tweet.
@@ -60,6 +290,32 @@ async def test_like_tweet(client: AsyncClient):
     assert data["detail"]["error_message"] == "Tweet with id 9999 not found"
 
 
+async def test_like_count(client: AsyncClient, monkeypatch):
+    """
+    Test that the feed shows the number of likes kept by like operations.
+
+    The feed cache keeps like counters for its TTL, so it is disabled.
+
+    :param client: Async test client for API interaction
+    :param monkeypatch: Pytest fixture for patching the cache
+    """
+    monkeypatch.setattr(feed_cache, "enabled", False)
+
+    async def like_counts():
+        response = await client.get("/api/tweets", headers=API_HEADER)
+        return {tweet["id"]: tweet["like_count"] for tweet in response.json()["tweets"]}
+
+    assert await like_counts() == {1: 1, 2: 1, 3: 1}
+
+    await client.post("/api/tweets/1/likes", headers=API_HEADER)
+    await client.post("/api/tweets/1/likes", headers=API_HEADER)
+    assert (await like_counts())[1] == 2
+
+    await client.delete("/api/tweets/3/likes", headers=API_HEADER)
+    await client.delete("/api/tweets/3/likes", headers=API_HEADER)
+    assert (await like_counts())[3] == 0
+
+
 async def test_delete_like(client: AsyncClient):
     """
     Test removing a like from a tweet.
@@ -3,23 +3,83 @@ Tests for API users.
 
 This module contains tests for:
 - Upload image
+- Resized variants of uploaded images
+- Stripping metadata of the originals without re-encoding them, also when
+  the process pool breaks
+- Deduplication of uploaded content
+- Size limit of uploads, also of the request body
+- Recording the files of a failed upload for the media sweeper
 """
 
+import hashlib
+import io
 import os
+from concurrent.futures.process import BrokenProcessPool
 from http import HTTPStatus
 from types import MappingProxyType
 
+import pytest
 from httpx import AsyncClient
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.db.models import Image, MediaDeletion
+from app.services.media.config import media_config
+from app.services.media.processing import image_processor, strip_metadata
+from app.services.media.storage import media_storage
+from app.services.media.uploads import MULTIPART_OVERHEAD
 
 API_HEADER = MappingProxyType({"api-key": "test"})
 
 
-async def test_upload_image(client: AsyncClient):
+def stored_files(media_dir):
+    """Return the files in the upload directory and its shards."""
+    return sorted(path for path in media_dir.rglob("*") if path.is_file())
+
+
+GPS_TAG = 0x8825
+
+
+ORIENTATION_TAG = 0x0112
+
+
+def jpeg_with_location(orientation: int = 1) -> bytes:
+    """Encode a JPEG image with GPS coordinates in its EXIF."""
+    pil_image = pytest.importorskip("PIL.Image")
+    image = pil_image.linear_gradient("L").resize((2000, 1000)).convert("RGB")
+    exif = image.getexif()
+    exif[GPS_TAG] = {1: "N", 2: (55.0, 45.0, 0.0)}
+    exif[ORIENTATION_TAG] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", exif=exif)
+    return buffer.getvalue()
+
+
+class BrokenExecutor:
+    """A process pool whose worker died."""
+
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool("A child process terminated abruptly")
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def png_bytes() -> bytes:
+    """Encode a small PNG image."""
+    pil_image = pytest.importorskip("PIL.Image")
+    buffer = io.BytesIO()
+    pil_image.new("RGB", (64, 32)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+async def test_upload_image(client: AsyncClient, media_dir):
     """
     Test uploading an image.
 
     Checks that the endpoint successfully accepts and processes the file
     :param client: Async test client for API interaction
+    :param media_dir: Temporary upload directory
     """
     test_image_path = os.path.join(
         os.path.dirname(__file__),
@@ -34,3 +94,250 @@ async def test_upload_image(client: AsyncClient):
         )
 
     assert response.status_code == HTTPStatus.OK
+    with open(test_image_path, "rb") as image:
+        sha256 = hashlib.sha256(image.read()).hexdigest()
+    original = media_dir / sha256[:2] / sha256[2:4] / f"{sha256}.jpg"
+    assert original.stat().st_size == os.path.getsize(test_image_path)
+
+
+async def test_upload_deduplication(client: AsyncClient, db_session, media_dir):
+    """
+    Test that uploads of the same content share one file.
+
+    :param client: Async test client for API interaction
+    :param db_session: Session of the test database
+    :param media_dir: Temporary upload directory
+    """
+    media_ids = []
+    for filename in ("first.png", "second.png"):
+        response = await client.post(
+            "/api/medias",
+            headers=API_HEADER,
+            files={"file": (filename, b"same content", "image/png")},
+        )
+        media_ids.append(response.json()["media_id"])
+
+    assert media_ids[0] != media_ids[1]
+    assert len(stored_files(media_dir)) == 1
+    paths = await db_session.execute(select(Image.path).where(Image.id.in_(media_ids)))
+    assert len(set(paths.scalars())) == 1
+
+
+async def test_image_variants(client: AsyncClient, media_dir):
+    """
+    Test that variants of an uploaded image are created and shown in the feed.
+
+    Neither the variants nor the original keep the location of the photo.
+    The pixels of the original are not re-encoded.
+
+    :param client: Async test client for API interaction
+    :param media_dir: Temporary upload directory
+    """
+    pil_image = pytest.importorskip("PIL.Image")
+    content = jpeg_with_location()
+    response = await client.post(
+        "/api/medias",
+        headers=API_HEADER,
+        files={"file": ("photo.jpg", content, "image/jpeg")},
+    )
+    media_id = response.json()["media_id"]
+    response = await client.post(
+        "/api/tweets",
+        headers=API_HEADER,
+        json={"tweet_data": "photo", "tweet_media_ids": [media_id]},
+    )
+
+    response = await client.get("/api/tweets", headers=API_HEADER)
+    tweet = response.json()["tweets"][0]
+    attachment = tweet["attachments"][0]
+    assert attachment.startswith(f"{media_config.public_prefix}/")
+    assert attachment.endswith("_medium.webp")
+    assert tweet["thumbnails"][0].endswith("_thumbnail.webp")
+
+    with pil_image.open(media_dir / attachment.split("/", 1)[1]) as medium:
+        assert medium.size == (media_config.medium_size, media_config.medium_size // 2)
+        assert not medium.getexif()
+    with pil_image.open(media_dir / tweet["thumbnails"][0].split("/", 1)[1]) as small:
+        assert small.size == (
+            media_config.thumbnail_size,
+            media_config.thumbnail_size // 2,
+        )
+    sha256 = hashlib.sha256(content).hexdigest()
+    with pil_image.open(
+        media_dir / sha256[:2] / sha256[2:4] / f"{sha256}.jpg"
+    ) as original, pil_image.open(io.BytesIO(content)) as uploaded:
+        assert original.size == (2000, 1000)
+        assert not original.getexif()
+        assert original.tobytes() == uploaded.tobytes()
+    assert len(stored_files(media_dir)) == 3
+
+
+def test_strip_keeps_orientation(tmp_path):
+    """
+    Test that a rotated JPEG keeps its orientation and pixels, but no location.
+
+    :param tmp_path: Temporary directory
+    """
+    pil_image = pytest.importorskip("PIL.Image")
+    content = jpeg_with_location(orientation=6)
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(content)
+
+    assert strip_metadata(str(path))
+    with pil_image.open(path) as stripped, pil_image.open(io.BytesIO(content)) as sent:
+        assert dict(stripped.getexif()) == {ORIENTATION_TAG: 6}
+        assert stripped.tobytes() == sent.tobytes()
+    assert not strip_metadata(str(path))
+
+
+async def test_broken_process_pool(client: AsyncClient, media_dir, monkeypatch):
+    """
+    Test that an upload survives a dead worker process and the pool is replaced.
+
+    :param client: Async test client for API interaction
+    :param media_dir: Temporary upload directory
+    :param monkeypatch: Pytest fixture for patching the processor
+    """
+    pil_image = pytest.importorskip("PIL.Image")
+    monkeypatch.setattr(image_processor, "_executor", BrokenExecutor())
+    response = await client.post(
+        "/api/medias",
+        headers=API_HEADER,
+        files={"file": ("photo.jpg", jpeg_with_location(), "image/jpeg")},
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    assert image_processor._executor is None
+    (original,) = stored_files(media_dir)
+    with pil_image.open(original) as image:
+        assert not image.getexif()
+
+    response = await client.post(
+        "/api/medias",
+        headers=API_HEADER,
+        files={"file": ("other.png", png_bytes(), "image/png")},
+    )
+    assert len(stored_files(media_dir)) == 4
+
+
+async def test_upload_too_large(client: AsyncClient, media_dir, monkeypatch):
+    """
+    Test that an upload over the size limit is rejected without leaving files.
+
+    :param client: Async test client for API interaction
+    :param media_dir: Temporary upload directory
+    :param monkeypatch: Pytest fixture for patching the settings
+    """
+    monkeypatch.setattr(media_config, "max_upload_size", 10)
+    monkeypatch.setattr(media_config, "chunk_size", 4)
+
+    response = await client.post(
+        "/api/medias",
+        headers=API_HEADER,
+        files={"file": ("big.jpg", b"x" * 11, "image/jpeg")},
+    )
+    assert response.status_code == HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+    assert response.json()["detail"]["error_message"] == "File is larger than 10 bytes"
+    assert stored_files(media_dir) == []
+
+
+async def test_upload_body_too_large(client: AsyncClient, media_dir, monkeypatch):
+    """
+    Test that a body over the size limit is rejected before it is parsed.
+
+    - A declared Content-Length is rejected before authorization
+    - A body without it is rejected while it is received
+
+    :param client: Async test client for API interaction
+    :param media_dir: Temporary upload directory
+    :param monkeypatch: Pytest fixture for patching the settings
+    """
+    monkeypatch.setattr(media_config, "max_upload_size", 10)
+    files = {"file": ("big.jpg", b"x" * 2 * MULTIPART_OVERHEAD, "image/jpeg")}
+
+    response = await client.post("/api/medias", files=files)
+    assert response.status_code == HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+    assert response.json()["detail"]["error_message"] == "File is larger than 10 bytes"
+
+    async def chunks():
+        yield (
+            b"--b\r\n"
+            b'Content-Disposition: form-data; name="file"; filename="big.jpg"\r\n'
+            b"Content-Type: image/jpeg\r\n\r\n"
+        )
+        for _ in range(4):
+            yield b"x" * MULTIPART_OVERHEAD
+        yield b"\r\n--b--\r\n"
+
+    response = await client.post(
+        "/api/medias",
+        headers={"content-type": "multipart/form-data; boundary=b"},
+        content=chunks(),
+    )
+    assert response.status_code == HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+    assert stored_files(media_dir) == []
+
+
+async def test_upload_recorded_on_failure(
+    client: AsyncClient, db_session, media_dir, media_sweeper, monkeypatch
+):
+    """
+    Test that the files of a failed upload are handed to the media sweeper.
+
+    - A failed insert and a failed storage both record the stored files
+    - The sweeper deletes them, unless an image of the same content exists
+
+    :param client: Async test client for API interaction
+    :param db_session: Session of the test database
+    :param media_dir: Temporary upload directory
+    :param media_sweeper: Media sweeper of the test database
+    :param monkeypatch: Pytest fixture for patching the session
+    """
+    commit = db_session.commit
+    failures = [SQLAlchemyError("commit failed")]
+
+    async def fail_first_commit():
+        if failures:
+            raise failures.pop()
+        await commit()
+
+    monkeypatch.setattr(db_session, "commit", fail_first_commit)
+    response = await client.post(
+        "/api/medias",
+        headers=API_HEADER,
+        files={"file": ("image.jpg", b"image", "image/jpeg")},
+    )
+    assert response.status_code == HTTPStatus.INTERNAL_SERVER_ERROR
+    assert len(stored_files(media_dir)) == 1
+    deletions = await db_session.execute(select(MediaDeletion.path))
+    assert len(deletions.scalars().all()) == 1
+
+    # The same content was uploaded again in the meantime.
+    response = await client.post(
+        "/api/medias",
+        headers=API_HEADER,
+        files={"file": ("image.jpg", b"image", "image/jpeg")},
+    )
+    assert response.status_code == HTTPStatus.OK
+    result = await media_sweeper.sweep()
+    assert (result.deleted_files, result.kept_files) == (0, 1)
+    assert len(stored_files(media_dir)) == 1
+
+    store = media_storage.store
+
+    async def fail_second_store(local_path, key):
+        if key.endswith(".webp"):
+            raise RuntimeError("storage failed")
+        await store(local_path, key)
+
+    monkeypatch.setattr(media_storage, "store", fail_second_store)
+    with pytest.raises(RuntimeError):
+        await client.post(
+            "/api/medias",
+            headers=API_HEADER,
+            files={"file": ("other.png", png_bytes(), "image/png")},
+        )
+    assert len(stored_files(media_dir)) == 2
+    result = await media_sweeper.sweep()
+    assert result.deleted_files == 1
+    assert len(stored_files(media_dir)) == 1
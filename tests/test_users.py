@@ -5,6 +5,7 @@ This module contains tests for:
 - Getting current user
 - Getting by ID
 - Subscription and unsubscription
+- Conditional requests of profiles
 """
 
 from http import HTTPStatus
@@ -129,3 +130,57 @@ async def test_unfollow_user(client: AsyncClient):
     assert response.status_code == HTTPStatus.BAD_REQUEST
     data = response.json()
     assert data["detail"]["error_message"] == "Cannot unfollow yourself"
+
+
+async def test_follow_counts(client: AsyncClient):
+    """
+    Test that profiles show the numbers of followers and followed users.
+
+    :param client: Async test client for API interaction
+    """
+
+    async def counts(user_id):
+        user = (await client.get(f"/api/users/{user_id}")).json()["user"]
+        return user["followers_count"], user["following_count"]
+
+    assert await counts(1) == (1, 1)
+    assert await counts(3) == (0, 1)
+
+    await client.post("/api/users/1/follow", headers=API_HEADER)
+    await client.post("/api/users/1/follow", headers=API_HEADER)
+    assert await counts(1) == (2, 1)
+    assert await counts(3) == (0, 2)
+
+    await client.delete("/api/users/2/follow", headers=API_HEADER)
+    assert await counts(2) == (1, 1)
+    assert await counts(3) == (0, 1)
+
+
+async def test_profile_etag(client: AsyncClient):
+    """
+    Test that an unchanged profile is answered with 304 until a follow changes it.
+
+    :param client: Async test client for API interaction
+    """
+    response = await client.get("/api/users/me", headers=API_HEADER)
+    etag = response.headers["ETag"]
+
+    response = await client.get(
+        "/api/users/me", headers={**API_HEADER, "If-None-Match": etag}
+    )
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert response.content == b""
+
+    await client.post("/api/users/1/follow", headers=API_HEADER)
+    response = await client.get(
+        "/api/users/me", headers={**API_HEADER, "If-None-Match": etag}
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["ETag"] != etag
+
+    response = await client.get("/api/users/1", headers={"If-None-Match": etag})
+    assert response.status_code == HTTPStatus.OK
+    response = await client.get(
+        "/api/users/1", headers={"If-None-Match": response.headers["ETag"]}
+    )
+    assert response.status_code == HTTPStatus.NOT_MODIFIED